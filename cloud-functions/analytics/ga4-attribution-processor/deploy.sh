@@ -2,6 +2,9 @@
 
 echo "Deploying ga4-attribution-processor..."
 
+# Copy in the shared opsos_common package (see data-sync/vendor-common.sh)
+bash ../../data-sync/vendor-common.sh . || exit 1
+
 gcloud functions deploy ga4-attribution-processor \
   --gen2 \
   --runtime=python312 \
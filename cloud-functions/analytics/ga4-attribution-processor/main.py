@@ -6,6 +6,7 @@ This Cloud Function:
 1. Reads GA4 purchase events with stripe_session_id from URL parameters
 2. Joins to payment_sessions table to get company_id/user_id
 3. Calculates first-touch attribution using GA4 traffic_source
+   (kept incrementally in user_first_touch, updated from new shards only)
 4. Creates attributed_revenue entities in BigQuery
 
 NO PRODUCT CODE CHANGES REQUIRED
@@ -17,6 +18,8 @@ from datetime import datetime, timedelta
 import logging
 import json
 import os
+from opsos_common.dirty_partitions import record_dirty_partitions
+from opsos_common.row_converter import convert_rows
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,88 @@ PROJECT_ID = "opsos-864a1"
 DATASET_ID = "marketing_ai"
 TABLE_ID = "daily_entity_metrics"
 GA4_DATASET = "analytics_301802672"
+FIRST_TOUCH_TABLE_ID = "user_first_touch"
+
+# GA4 export shards can still change for ~72h, so re-read a few days behind the watermark
+FIRST_TOUCH_OVERLAP_DAYS = 3
+
+
+def update_first_touch(bq, first_touch_days: int, rebuild: bool = False) -> int:
+    """
+    Incrementally maintain user_first_touch (one row per user_pseudo_id).
+    
+    Only shards from the table's watermark (latest first_visit_date minus a small
+    overlap) are scanned; users not seen before are inserted, and an existing user's
+    row only changes if an earlier event turns up. The first run, or rebuild=True,
+    scans first_touch_days of history. Returns bytes processed.
+    """
+    first_touch_table = f"{PROJECT_ID}.{DATASET_ID}.{FIRST_TOUCH_TABLE_ID}"
+    
+    bq.query(f"""
+    CREATE TABLE IF NOT EXISTS `{first_touch_table}` (
+      user_pseudo_id STRING NOT NULL,
+      first_event_timestamp INT64,
+      first_visit_date DATE,
+      source STRING,
+      medium STRING,
+      campaign STRING,
+      updated_at TIMESTAMP
+    )
+    CLUSTER BY user_pseudo_id
+    """).result()
+    
+    watermark = None
+    if not rebuild:
+        watermark = list(bq.query(f"SELECT MAX(first_visit_date) as watermark FROM `{first_touch_table}`").result())[0].watermark
+    
+    if watermark:
+        scan_from = watermark - timedelta(days=FIRST_TOUCH_OVERLAP_DAYS)
+    else:
+        scan_from = datetime.utcnow().date() - timedelta(days=first_touch_days)
+    
+    logger.info(f"Updating first-touch table from shards >= {scan_from} (watermark={watermark})")
+    
+    merge_query = f"""
+    MERGE `{first_touch_table}` T
+    USING (
+      SELECT 
+        user_pseudo_id,
+        ARRAY_AGG(
+          STRUCT(
+            event_timestamp,
+            traffic_source.source as source,
+            traffic_source.medium as medium,
+            traffic_source.name as campaign,
+            DATE(TIMESTAMP_MICROS(event_timestamp)) as first_visit_date
+          )
+          ORDER BY event_timestamp ASC
+          LIMIT 1
+        )[OFFSET(0)] as first_touch
+      FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
+      WHERE _TABLE_SUFFIX >= '{scan_from.strftime('%Y%m%d')}'
+        AND user_pseudo_id IS NOT NULL  -- Consent-mode events carry no ID
+      GROUP BY user_pseudo_id
+    ) S
+    ON T.user_pseudo_id = S.user_pseudo_id
+    WHEN MATCHED AND S.first_touch.event_timestamp < T.first_event_timestamp THEN
+      UPDATE SET
+        first_event_timestamp = S.first_touch.event_timestamp,
+        first_visit_date = S.first_touch.first_visit_date,
+        source = S.first_touch.source,
+        medium = S.first_touch.medium,
+        campaign = S.first_touch.campaign,
+        updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (user_pseudo_id, first_event_timestamp, first_visit_date, source, medium, campaign, updated_at)
+      VALUES (S.user_pseudo_id, S.first_touch.event_timestamp, S.first_touch.first_visit_date,
+              S.first_touch.source, S.first_touch.medium, S.first_touch.campaign, CURRENT_TIMESTAMP())
+    """
+    
+    merge_job = bq.query(merge_query)
+    merge_job.result()
+    
+    return merge_job.total_bytes_processed or 0
+
 
 @functions_framework.http
 def process_ga4_attribution(request):
@@ -40,6 +125,9 @@ def process_ga4_attribution(request):
     
     request_json = request.get_json(silent=True) or {}
     days_back = request_json.get('daysBack', 7)
+    # How far back a user's first touch is looked for when the table is (re)built
+    first_touch_days = request_json.get('firstTouchDays', 730)
+    rebuild_first_touch = request_json.get('rebuildFirstTouch', False)
     
     logger.info(f"Processing GA4 attribution for last {days_back} days")
     
@@ -79,19 +167,8 @@ def process_ga4_attribution(request):
     first_touch AS (
       SELECT 
         user_pseudo_id,
-        ARRAY_AGG(
-          STRUCT(
-            traffic_source.source as source,
-            traffic_source.medium as medium,
-            traffic_source.name as campaign,
-            DATE(TIMESTAMP_MICROS(event_timestamp)) as first_visit_date
-          )
-          ORDER BY event_timestamp ASC
-          LIMIT 1
-        )[OFFSET(0)] as first_touch
-      FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
-      WHERE _TABLE_SUFFIX >= FORMAT_DATE('%Y%m%d', DATE_SUB(CURRENT_DATE(), INTERVAL {days_back + 30} DAY))
-      GROUP BY user_pseudo_id
+        STRUCT(source, medium, campaign, first_visit_date) as first_touch
+      FROM `{PROJECT_ID}.{DATASET_ID}.{FIRST_TOUCH_TABLE_ID}`
     ),
     payment_sessions AS (
       SELECT 
@@ -181,6 +258,9 @@ def process_ga4_attribution(request):
     """
     
     try:
+        first_touch_bytes = update_first_touch(bq, first_touch_days, rebuild_first_touch)
+        logger.info(f"First-touch update scanned {first_touch_bytes / 1024 / 1024:.2f} MB")
+        
         results = []
         query_job = bq.query(attribution_query)
         
@@ -239,10 +319,16 @@ def process_ga4_attribution(request):
             
             # Insert new data
             logger.info(f"Inserting {len(results)} attributed revenue records...")
-            errors = bq.insert_rows_json(table_ref, results)
+            errors = bq.insert_rows_json(table_ref, convert_rows(bq, table_ref, results))
             if errors:
                 logger.error(f"Insert errors: {errors}")
                 return ({'error': 'Failed to insert rows', 'details': errors}, 500, headers)
+            
+            # The whole window was replaced, including days that no longer have rows
+            window_start = (datetime.utcnow().date() - timedelta(days=days_back)).isoformat()
+            record_dirty_partitions(bq, 'ytjobs', [
+                ('attributed_revenue', window_start, datetime.utcnow().date().isoformat())
+            ], 'ga4_attribution')
         
         logger.info(f"Successfully processed {len(results)} attributed revenue records")
         
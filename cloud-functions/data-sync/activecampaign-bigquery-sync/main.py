@@ -10,9 +10,17 @@ Architecture: ActiveCampaign API → Cloud Function → BigQuery
 import functions_framework
 from google.cloud import firestore, bigquery
 from datetime import datetime, timedelta, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 import logging
 import json
+import os
+import threading
+import time
 import requests
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.bq_scripts import run_script
+from opsos_common.row_converter import convert_rows, compile_row_converter
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +29,107 @@ DATASET_ID = "marketing_ai"
 TABLE_ID = "daily_entity_metrics"
 RAW_TABLE_ID = "raw_activecampaign"
 EMAIL_ACTIVITIES_TABLE = "email_activities"
+UNIQUE_SKETCH_TABLE = "email_daily_unique_sketches"
+ACTIVITY_INCREMENTS_TABLE = "email_activity_increments"
 BQ_LOCATION = "northamerica-northeast1"
 
+# ActiveCampaign allows 5 requests/second per account (shared by v1 and v3)
+AC_RATE_LIMIT_PER_SECOND = float(os.environ.get('AC_RATE_LIMIT_PER_SECOND', '5'))
+AC_MAX_CONCURRENT_REQUESTS = int(os.environ.get('AC_MAX_CONCURRENT_REQUESTS', '5'))
+# v1 report pages fetched at once per campaign list (pages are only known to end when one is short)
+AC_PAGE_WAVE_SIZE = 3
+AC_V1_PAGE_SIZE = 20
+AC_V1_MAX_PAGES = 100
 
-def ac_api_v1_request(api_url: str, api_key: str, action: str, params: dict = None, max_retries: int = 3) -> dict:
+# Campaigns sent more than this many days ago (and already checkpointed) are frozen
+DEFAULT_ACTIVITY_SETTLE_DAYS = 14
+ACTIVITY_CHECKPOINT_COLLECTION = 'activity_checkpoints'
+# Checkpoints written before activity increments were stored are ignored (campaign refetched in full)
+ACTIVITY_CHECKPOINT_VERSION = 2
+
+# Approximate unique openers/clickers: default relative error of the HLL++ sketches,
+# and how many (date, kind, email) records are buffered before loading to BigQuery
+DEFAULT_UNIQUE_ERROR = 0.01
+UNIQUE_FLUSH_RECORDS = 50000
+UNIQUE_STAGING_SCHEMA = [
+    bigquery.SchemaField('date', 'DATE'),
+    bigquery.SchemaField('kind', 'STRING'),
+    bigquery.SchemaField('email', 'STRING'),
+]
+
+# Per-campaign activity counts, keyed by the checkpoint tstamp they were fetched from
+# ('' for a full fetch), so re-applying a fetch replaces it instead of adding twice
+ACTIVITY_INCREMENT_SCHEMA = [
+    bigquery.SchemaField('campaign_id', 'STRING'),
+    bigquery.SchemaField('kind', 'STRING'),
+    bigquery.SchemaField('since_tstamp', 'STRING'),
+    bigquery.SchemaField('date', 'DATE'),
+    bigquery.SchemaField('count', 'INT64'),
+]
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every request to one account.
+    
+    On a 429 the refill rate is halved and the bucket is paused (Retry-After or 1s);
+    each successful call then recovers the rate additively up to the configured limit.
+    """
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+    
+    def throttled(self, retry_after: float = None):
+        with self.lock:
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+            self.tokens = 0
+            self.updated = time.monotonic()
+            self.paused_until = max(self.paused_until, self.updated + (retry_after or 1.0))
+        logger.warning(f"ActiveCampaign rate limited; slowing to {self.rate:.2f} req/s")
+    
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+ac_rate_limiter = TokenBucket(AC_RATE_LIMIT_PER_SECOND)
+
+# One pooled keep-alive session for all ActiveCampaign calls
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=AC_MAX_CONCURRENT_REQUESTS * AC_PAGE_WAVE_SIZE * 2))
+
+
+def retry_after_seconds(response) -> float:
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+def ac_api_v1_request(api_url: str, api_key: str, action: str, params: dict = None, max_retries: int = 5) -> dict:
     """Make a request to the ActiveCampaign v1 API (for campaign reports) with retry logic"""
-    import time
     
     url = f"{api_url}/admin/api.php"
     
@@ -43,10 +146,13 @@ def ac_api_v1_request(api_url: str, api_key: str, action: str, params: dict = No
     
     for attempt in range(max_retries):
         try:
-            # Add delay between requests to avoid rate limiting (200ms)
-            time.sleep(0.2)
+            ac_rate_limiter.acquire()
+            
+            response = http_session.get(url, headers=headers, params=request_params, timeout=30)
             
-            response = requests.get(url, headers=headers, params=request_params, timeout=30)
+            if response.status_code == 429:
+                ac_rate_limiter.throttled(retry_after_seconds(response))
+                continue
             
             if not response.ok:
                 logger.warning(f"v1 API error (attempt {attempt+1}): {response.status_code}")
@@ -55,6 +161,7 @@ def ac_api_v1_request(api_url: str, api_key: str, action: str, params: dict = No
                     continue
                 return {}
             
+            ac_rate_limiter.succeeded()
             return response.json()
         except Exception as e:
             logger.warning(f"v1 API request failed (attempt {attempt+1}): {e}")
@@ -66,44 +173,285 @@ def ac_api_v1_request(api_url: str, api_key: str, action: str, params: dict = No
     return {}
 
 
-def ac_api_v1_paginate(api_url: str, api_key: str, action: str, campaign_id: str, extra_params: dict = None) -> list:
-    """Fetch all items from a paginated v1 API report endpoint"""
+def ac_api_v1_page(api_url: str, api_key: str, action: str, campaign_id: str, page: int, extra_params: dict = None) -> list:
+    """Fetch one page of a v1 report endpoint"""
+    params = {
+        'campaignid': campaign_id,
+        'page': page,
+    }
+    if extra_params:
+        params.update(extra_params)
+    
+    data = ac_api_v1_request(api_url, api_key, action, params)
+    
+    # v1 API returns numbered keys for results (0, 1, 2, etc.)
+    return [data[key] for key in data if key.isdigit()]
+
+
+def ac_api_v1_paginate(api_url: str, api_key: str, action: str, campaign_id: str, extra_params: dict = None, start_page: int = 1) -> list:
+    """
+    Fetch all items from a paginated v1 API report endpoint, from start_page on.
+    
+    The total isn't reported, so pages are requested in small concurrent waves
+    until one comes back short (v1 API returns 20 per page).
+    """
     all_items = []
-    page = 1
+    page = start_page
     
-    while True:
-        params = {
-            'campaignid': campaign_id,
-            'page': page,
-        }
-        if extra_params:
-            params.update(extra_params)
+    with ThreadPoolExecutor(max_workers=AC_PAGE_WAVE_SIZE) as executor:
+        while page <= AC_V1_MAX_PAGES:
+            wave = list(range(page, min(page + AC_PAGE_WAVE_SIZE, AC_V1_MAX_PAGES + 1)))
+            pages = executor.map(lambda p: ac_api_v1_page(api_url, api_key, action, campaign_id, p, extra_params), wave)
+            
+            done = False
+            for items in pages:
+                if done:
+                    continue
+                all_items.extend(items)
+                if len(items) < AC_V1_PAGE_SIZE:
+                    done = True
+            
+            if done:
+                return all_items
+            page = wave[-1] + 1
+    
+    # Safety limit
+    logger.warning(f"Reached page limit for {action} campaign {campaign_id}")
+    return all_items
+
+
+def hll_precision_for_error(relative_error: float) -> int:
+    """HLL++ standard error is ~1.04/sqrt(2^p); pick the smallest p in BigQuery's 10-24 range that meets it"""
+    precision = 10
+    while precision < 24 and 1.04 / (2 ** precision) ** 0.5 > relative_error:
+        precision += 1
+    return precision
+
+
+def flush_unique_records(bq, staging_ref: str, records: list):
+    """Append buffered (date, kind, email) records to the run's staging table"""
+    if not records:
+        return
+    job_config = bigquery.LoadJobConfig(
+        schema=UNIQUE_STAGING_SCHEMA,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    bq.load_table_from_json(records, staging_ref, job_config=job_config).result()
+
+
+def merge_unique_sketches(bq, staging_ref: str, organization_id: str, precision: int) -> dict:
+    """
+    Fold the staged records into persisted per-day HLL_COUNT sketches and return
+    {date: (unique_openers, unique_clickers)} estimates for the dates touched.
+    
+    Sketches are unioned with what is already stored, so re-running a range is
+    idempotent, and weekly/monthly uniques can be rolled up with
+    HLL_COUNT.MERGE(opener_sketch) without re-reading activity.
+    """
+    sketch_table = f"{PROJECT_ID}.{DATASET_ID}.{UNIQUE_SKETCH_TABLE}"
+    
+    bq.query(f"""
+    CREATE TABLE IF NOT EXISTS `{sketch_table}` (
+      organization_id STRING NOT NULL,
+      date DATE NOT NULL,
+      opener_sketch BYTES,
+      clicker_sketch BYTES,
+      updated_at TIMESTAMP
+    )
+    PARTITION BY date
+    CLUSTER BY organization_id
+    """).result()
+    
+    bq.query(f"""
+    MERGE `{sketch_table}` T
+    USING (
+      SELECT
+        date,
+        HLL_COUNT.INIT(IF(kind = 'open', email, NULL), {precision}) as opener_sketch,
+        HLL_COUNT.INIT(IF(kind = 'click', email, NULL), {precision}) as clicker_sketch
+      FROM `{staging_ref}`
+      GROUP BY date
+    ) S
+    ON T.organization_id = '{organization_id}' AND T.date = S.date
+    WHEN MATCHED THEN
+      UPDATE SET
+        opener_sketch = (SELECT HLL_COUNT.MERGE_PARTIAL(sketch) FROM UNNEST([T.opener_sketch, S.opener_sketch]) sketch),
+        clicker_sketch = (SELECT HLL_COUNT.MERGE_PARTIAL(sketch) FROM UNNEST([T.clicker_sketch, S.clicker_sketch]) sketch),
+        updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (organization_id, date, opener_sketch, clicker_sketch, updated_at)
+      VALUES ('{organization_id}', S.date, S.opener_sketch, S.clicker_sketch, CURRENT_TIMESTAMP())
+    """).result()
+    
+    estimates = {}
+    for row in bq.query(f"""
+    SELECT
+      date,
+      IFNULL(HLL_COUNT.EXTRACT(opener_sketch), 0) as unique_openers,
+      IFNULL(HLL_COUNT.EXTRACT(clicker_sketch), 0) as unique_clickers
+    FROM `{sketch_table}`
+    WHERE organization_id = '{organization_id}'
+      AND date IN (SELECT DISTINCT date FROM `{staging_ref}`)
+    """).result():
+        estimates[row.date.isoformat()] = (row.unique_openers, row.unique_clickers)
+    
+    return estimates
+
+
+def fetch_activity_since(api_url: str, api_key: str, action: str, campaign_id: str, checkpoint: dict):
+    """
+    Fetch a campaign's open or click list from its checkpoint onwards.
+    
+    Report lists grow by appending, so we resume on the last page read before (it
+    may have been partial) and drop records at or before the checkpoint tstamp.
+    Returns (new_records, new_checkpoint).
+    """
+    checkpoint = checkpoint or {}
+    start_page = checkpoint.get('page', 1)
+    last_tstamp = checkpoint.get('tstamp', '')
+    
+    items = ac_api_v1_paginate(api_url, api_key, action, campaign_id, start_page=start_page)
+    new_items = [item for item in items if (item.get('tstamp') or '') > last_tstamp]
+    
+    return new_items, {
+        'page': start_page + max(0, (len(items) - 1) // AC_V1_PAGE_SIZE),
+        'tstamp': max([last_tstamp] + [item.get('tstamp') or '' for item in new_items]),
+    }
+
+
+def load_activity_checkpoints(connection_ref) -> dict:
+    """campaign_id -> checkpoint doc for every campaign already ingested"""
+    checkpoints = {doc.id: doc.to_dict() for doc in connection_ref.collection(ACTIVITY_CHECKPOINT_COLLECTION).stream()}
+    return {campaign_id: checkpoint for campaign_id, checkpoint in checkpoints.items()
+            if checkpoint.get('version') == ACTIVITY_CHECKPOINT_VERSION}
+
+
+def save_activity_checkpoints(db, connection_ref, checkpoints: dict):
+    """Write updated campaign checkpoints in Firestore batches of 500"""
+    items = list(checkpoints.items())
+    for i in range(0, len(items), 500):
+        batch = db.batch()
+        for campaign_id, checkpoint in items[i:i + 500]:
+            batch.set(connection_ref.collection(ACTIVITY_CHECKPOINT_COLLECTION).document(str(campaign_id)), {
+                **checkpoint,
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        batch.commit()
+
+
+def apply_activity_increments(bq, organization_id: str, fetches: list, increments: list, daily_rows: list):
+    """
+    Store this run's per-campaign activity and recompute email_daily_activity opens/clicks
+    for every date it touches, in one transaction.
+    
+    fetches: one {campaign_id, kind, since_tstamp} per successful fetch. A full fetch
+    (since_tstamp '') replaces all of that campaign's stored increments; a checkpointed
+    fetch replaces only the increment fetched from the same checkpoint. Re-running after
+    a failed checkpoint save, or refetching campaigns in full, therefore never adds the
+    same activity twice. Unique counts come from daily_rows (the HLL sketch estimates).
+    """
+    table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+    increments_table = f"{PROJECT_ID}.{DATASET_ID}.{ACTIVITY_INCREMENTS_TABLE}"
+    run_id = f"{organization_id.replace('-', '_')}_{int(datetime.utcnow().timestamp())}"
+    fetches_ref = f"{PROJECT_ID}.{DATASET_ID}.temp_ac_fetches_{run_id}"
+    increments_ref = f"{PROJECT_ID}.{DATASET_ID}.temp_ac_increments_{run_id}"
+    daily_ref = f"{PROJECT_ID}.{DATASET_ID}.temp_ac_activity_{run_id}"
+    
+    try:
+        for records, ref, schema in (
+            (fetches, fetches_ref, ACTIVITY_INCREMENT_SCHEMA[:3]),
+            (increments, increments_ref, ACTIVITY_INCREMENT_SCHEMA),
+            (daily_rows, daily_ref, bq.get_table(table_ref).schema),
+        ):
+            bq.create_table(bigquery.Table(ref, schema=schema), exists_ok=True)
+            if records:
+                job_config = bigquery.LoadJobConfig(
+                    schema=schema,
+                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                    ignore_unknown_values=True,
+                )
+                bq.load_table_from_json(records, ref, job_config=job_config).result()
         
-        data = ac_api_v1_request(api_url, api_key, action, params)
+        # Concurrent org syncs can abort the transaction; run_script re-runs it
+        run_script(bq, f"""
+        CREATE TABLE IF NOT EXISTS `{increments_table}` (
+          organization_id STRING NOT NULL,
+          campaign_id STRING NOT NULL,
+          kind STRING NOT NULL,
+          since_tstamp STRING NOT NULL,
+          date DATE NOT NULL,
+          count INT64,
+          recorded_at TIMESTAMP
+        )
+        CLUSTER BY organization_id, campaign_id;
         
-        # v1 API returns numbered keys for results (0, 1, 2, etc.)
-        items = []
-        for key in data:
-            if key.isdigit():
-                items.append(data[key])
+        -- Dates whose totals change: those of replaced increments and of new ones
+        CREATE TEMP TABLE touched_dates AS
+        SELECT DISTINCT i.date
+        FROM `{increments_table}` i
+        JOIN `{fetches_ref}` f
+          ON i.campaign_id = f.campaign_id AND i.kind = f.kind
+         AND (f.since_tstamp = '' OR i.since_tstamp = f.since_tstamp)
+        WHERE i.organization_id = '{organization_id}'
+        UNION DISTINCT
+        SELECT date FROM `{increments_ref}`;
         
-        if not items:
-            break
+        BEGIN TRANSACTION;
         
-        all_items.extend(items)
+        DELETE FROM `{increments_table}` i
+        WHERE i.organization_id = '{organization_id}'
+          AND EXISTS (
+            SELECT 1 FROM `{fetches_ref}` f
+            WHERE i.campaign_id = f.campaign_id AND i.kind = f.kind
+              AND (f.since_tstamp = '' OR i.since_tstamp = f.since_tstamp)
+          );
         
-        # v1 API returns 20 per page
-        if len(items) < 20:
-            break
+        INSERT INTO `{increments_table}` (organization_id, campaign_id, kind, since_tstamp, date, count, recorded_at)
+        SELECT '{organization_id}', campaign_id, kind, since_tstamp, date, count, CURRENT_TIMESTAMP()
+        FROM `{increments_ref}`;
         
-        page += 1
+        MERGE `{table_ref}` T
+        USING (
+          SELECT
+            d.date,
+            CONCAT('email_daily_', CAST(d.date AS STRING)) as canonical_entity_id,
+            IFNULL(totals.opens, 0) as opens,
+            IFNULL(totals.clicks, 0) as clicks,
+            r.users, r.sessions, r.source_breakdown, r.created_at, r.updated_at
+          FROM touched_dates d
+          LEFT JOIN (
+            SELECT date, SUMIF(count, kind = 'open') as opens, SUMIF(count, kind = 'click') as clicks
+            FROM `{increments_table}`
+            WHERE organization_id = '{organization_id}'
+              AND date IN (SELECT date FROM touched_dates)
+            GROUP BY date
+          ) totals USING (date)
+          LEFT JOIN `{daily_ref}` r USING (date)
+        ) S
+        ON T.organization_id = '{organization_id}'
+           AND T.canonical_entity_id = S.canonical_entity_id
+           AND T.date = S.date
+        WHEN MATCHED THEN
+          UPDATE SET
+            opens = S.opens,
+            clicks = S.clicks,
+            users = IFNULL(S.users, T.users),
+            sessions = IFNULL(S.sessions, T.sessions),
+            click_through_rate = IFNULL(SAFE_DIVIDE(S.clicks, S.opens) * 100, 0),
+            source_breakdown = IFNULL(S.source_breakdown, T.source_breakdown),
+            updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+          INSERT (organization_id, date, canonical_entity_id, entity_type, opens, clicks, users, sessions,
+                  open_rate, click_through_rate, source_breakdown, created_at, updated_at)
+          VALUES ('{organization_id}', S.date, S.canonical_entity_id, 'email_daily_activity', S.opens, S.clicks,
+                  IFNULL(S.users, 0), IFNULL(S.sessions, 0), 0, IFNULL(SAFE_DIVIDE(S.clicks, S.opens) * 100, 0),
+                  S.source_breakdown, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP());
         
-        # Safety limit
-        if page > 100:
-            logger.warning(f"Reached page limit for {action} campaign {campaign_id}")
-            break
-    
-    return all_items
+        COMMIT TRANSACTION;
+        """)
+    finally:
+        for ref in (fetches_ref, increments_ref, daily_ref):
+            bq.delete_table(ref, not_found_ok=True)
 
 
 def ac_api_request(api_url: str, api_key: str, endpoint: str, params: dict = None) -> dict:
@@ -114,13 +462,23 @@ def ac_api_request(api_url: str, api_key: str, endpoint: str, params: dict = Non
         "Content-Type": "application/json",
     }
     
-    response = requests.get(url, headers=headers, params=params)
-    
-    if not response.ok:
-        logger.error(f"ActiveCampaign API error: {response.status_code} - {response.text}")
-        return {}
+    for attempt in range(5):
+        ac_rate_limiter.acquire()
+        response = http_session.get(url, headers=headers, params=params, timeout=60)
+        
+        if response.status_code == 429:
+            ac_rate_limiter.throttled(retry_after_seconds(response))
+            continue
+        
+        if not response.ok:
+            logger.error(f"ActiveCampaign API error: {response.status_code} - {response.text}")
+            return {}
+        
+        ac_rate_limiter.succeeded()
+        return response.json()
     
-    return response.json()
+    logger.error(f"ActiveCampaign API still rate limited after retries: {endpoint}")
+    return {}
 
 
 def ac_api_paginate(api_url: str, api_key: str, endpoint: str, key: str, extra_params: dict = None) -> list:
@@ -538,9 +896,19 @@ def sync_activecampaign_to_bigquery(request):
         # ============================================
         # 4. EMAIL ACTIVITIES (v1 API - timestamped opens/clicks)
         # ============================================
-        import time
-        
         fetch_activities = request_json.get('fetch_activities', False)
+        # 'exact' keeps per-day email sets in memory; 'approx' streams them into HLL sketches in BigQuery
+        unique_mode = request_json.get('unique_mode', 'exact')
+        unique_precision = hll_precision_for_error(float(request_json.get('unique_error', DEFAULT_UNIQUE_ERROR)))
+        # Per-campaign checkpoints: only fetch activity newer than the last run,
+        # and skip checkpointed campaigns sent before the settle window entirely
+        use_checkpoints = request_json.get('use_checkpoints', True)
+        settle_days = int(request_json.get('settle_days', DEFAULT_ACTIVITY_SETTLE_DAYS))
+        activity_rows = []  # Daily activity rows whose opens/clicks are recomputed from increments
+        activity_fetches = []
+        activity_increments = []
+        activity_checkpoints = {}
+        updated_checkpoints = {}
         days_back = int(request_json.get('days_back', 30))
         start_days_back = request_json.get('start_days_back')  # Optional: for batched backfills
         
@@ -558,6 +926,18 @@ def sync_activecampaign_to_bigquery(request):
             
             activities_by_date = {}
             
+            # Full mode rewrites all activity, so it starts from fresh checkpoints
+            incremental_activity = use_checkpoints and sync_mode != 'full'
+            if incremental_activity:
+                activity_checkpoints = load_activity_checkpoints(connection_ref)
+                if unique_mode != 'approx':
+                    # Exact per-day sets from earlier runs aren't kept, so uniques must come from the sketches
+                    logger.info("Checkpointed activity sync uses approximate (HLL) unique counts")
+                    unique_mode = 'approx'
+            approx_uniques = unique_mode == 'approx'
+            unique_records = []
+            unique_staging_ref = f"{PROJECT_ID}.{DATASET_ID}.temp_ac_uniques_{organization_id.replace('-', '_')}_{int(datetime.utcnow().timestamp())}"
+            
             try:
                 # Get campaigns sent in the date range
                 all_campaigns = ac_api_paginate(api_url, api_key, 'campaigns', 'campaigns')
@@ -568,60 +948,116 @@ def sync_activecampaign_to_bigquery(request):
                 
                 logger.info(f"Found {len(recent_campaigns)} campaigns in range (of {len(all_campaigns)} total)")
                 
-                for idx, campaign in enumerate(recent_campaigns):
+                if incremental_activity:
+                    settle_cutoff = (datetime.now() - timedelta(days=settle_days)).strftime('%Y-%m-%d')
+                    frozen = [c for c in recent_campaigns
+                              if str(c.get('id')) in activity_checkpoints and (c.get('sdate') or '9999-99-99') < settle_cutoff]
+                    recent_campaigns = [c for c in recent_campaigns if c not in frozen]
+                    logger.info(f"Skipping {len(frozen)} settled campaigns (sent before {settle_cutoff})")
+                
+                def fetch_campaign_activity(campaign):
                     campaign_id = campaign.get('id')
-                    campaign_name = campaign.get('name', 'Unknown')[:40]
-                    
-                    if idx % 5 == 0:
-                        logger.info(f"Processing campaign {idx+1}/{len(recent_campaigns)}: {campaign_name}...")
-                    
-                    # Rate limit: 300ms between campaigns to avoid hitting rate limits
-                    time.sleep(0.3)
+                    checkpoint = activity_checkpoints.get(str(campaign_id), {})
+                    opens, clicks = [], []
+                    new_checkpoint = {'sdate': campaign.get('sdate'), 'open': checkpoint.get('open', {}), 'click': checkpoint.get('click', {}),
+                                      'version': ACTIVITY_CHECKPOINT_VERSION}
+                    fetched = []  # (kind, checkpoint tstamp fetched from) for each list read successfully
                     
                     # Fetch opens via v1 API
                     try:
-                        opens = ac_api_v1_paginate(api_url, api_key, 'campaign_report_open_list', campaign_id)
-                        for record in opens:
-                            tstamp = record.get('tstamp', '')
-                            if tstamp:
-                                activity_date = tstamp.split(' ')[0]
-                                if activity_date not in activities_by_date:
-                                    activities_by_date[activity_date] = {'opens': 0, 'clicks': 0, 'bounces': 0, 'unsubscribes': 0, 'unique_openers': set(), 'unique_clickers': set()}
-                                activities_by_date[activity_date]['opens'] += int(record.get('times', 1) or 1)
-                                activities_by_date[activity_date]['unique_openers'].add(record.get('email', ''))
+                        opens, new_checkpoint['open'] = fetch_activity_since(
+                            api_url, api_key, 'campaign_report_open_list', campaign_id, checkpoint.get('open'))
+                        fetched.append(('open', (checkpoint.get('open') or {}).get('tstamp', '')))
                     except Exception as e:
                         logger.warning(f"Opens error for campaign {campaign_id}: {e}")
                     
                     # Fetch clicks via v1 API
                     try:
-                        clicks = ac_api_v1_paginate(api_url, api_key, 'campaign_report_link_list', campaign_id)
-                        for record in clicks:
-                            tstamp = record.get('tstamp', '')
-                            if tstamp:
-                                activity_date = tstamp.split(' ')[0]
-                                if activity_date not in activities_by_date:
-                                    activities_by_date[activity_date] = {'opens': 0, 'clicks': 0, 'bounces': 0, 'unsubscribes': 0, 'unique_openers': set(), 'unique_clickers': set()}
-                                activities_by_date[activity_date]['clicks'] += int(record.get('times', 1) or 1)
-                                activities_by_date[activity_date]['unique_clickers'].add(record.get('email', ''))
+                        clicks, new_checkpoint['click'] = fetch_activity_since(
+                            api_url, api_key, 'campaign_report_link_list', campaign_id, checkpoint.get('click'))
+                        fetched.append(('click', (checkpoint.get('click') or {}).get('tstamp', '')))
                     except Exception as e:
                         logger.warning(f"Clicks error for campaign {campaign_id}: {e}")
+                    
+                    return campaign_id, opens, clicks, new_checkpoint, fetched
+                
+                # Campaigns are fetched concurrently; the shared token bucket keeps
+                # the combined request rate at the account limit
+                with ThreadPoolExecutor(max_workers=AC_MAX_CONCURRENT_REQUESTS) as executor:
+                    futures = [executor.submit(fetch_campaign_activity, campaign) for campaign in recent_campaigns]
+                    
+                    for idx, future in enumerate(as_completed(futures)):
+                        campaign_id, opens, clicks, new_checkpoint, fetched = future.result()
+                        if use_checkpoints:
+                            updated_checkpoints[str(campaign_id)] = new_checkpoint
+                            since_by_kind = dict(fetched)
+                            for kind, since_tstamp in fetched:
+                                activity_fetches.append({'campaign_id': str(campaign_id), 'kind': kind, 'since_tstamp': since_tstamp})
+                            campaign_counts = {}
+                        
+                        if idx % 5 == 0:
+                            logger.info(f"Processed campaign {idx+1}/{len(recent_campaigns)}...")
+                        
+                        for kind, records in (('open', opens), ('click', clicks)):
+                            for record in records:
+                                tstamp = record.get('tstamp', '')
+                                if tstamp:
+                                    activity_date = tstamp.split(' ')[0]
+                                    if activity_date not in activities_by_date:
+                                        activities_by_date[activity_date] = {'opens': 0, 'clicks': 0, 'bounces': 0, 'unsubscribes': 0, 'unique_openers': set(), 'unique_clickers': set()}
+                                    metrics = activities_by_date[activity_date]
+                                    metrics['opens' if kind == 'open' else 'clicks'] += int(record.get('times', 1) or 1)
+                                    if use_checkpoints and kind in since_by_kind:
+                                        count_key = (kind, activity_date)
+                                        campaign_counts[count_key] = campaign_counts.get(count_key, 0) + int(record.get('times', 1) or 1)
+                                    
+                                    if approx_uniques:
+                                        unique_records.append({'date': activity_date, 'kind': kind, 'email': record.get('email', '')})
+                                    else:
+                                        metrics['unique_openers' if kind == 'open' else 'unique_clickers'].add(record.get('email', ''))
+                        
+                        if use_checkpoints:
+                            for (kind, activity_date), count in campaign_counts.items():
+                                activity_increments.append({
+                                    'campaign_id': str(campaign_id), 'kind': kind,
+                                    'since_tstamp': since_by_kind[kind], 'date': activity_date, 'count': count,
+                                })
+                        
+                        # Bounded memory in approx mode: hand records to BigQuery as we go
+                        if approx_uniques and len(unique_records) >= UNIQUE_FLUSH_RECORDS:
+                            flush_unique_records(bq, unique_staging_ref, unique_records)
+                            unique_records = []
+                
+                unique_counts = {}
+                if approx_uniques:
+                    flush_unique_records(bq, unique_staging_ref, unique_records)
+                    unique_records = []
+                    if activities_by_date:
+                        unique_counts = merge_unique_sketches(bq, unique_staging_ref, organization_id, unique_precision)
+                        logger.info(f"Merged HLL unique sketches for {len(unique_counts)} days (precision={unique_precision})")
                 
                 # Create daily activity rows
                 for activity_date, metrics in activities_by_date.items():
-                    rows.append({
+                    if approx_uniques:
+                        unique_openers, unique_clickers = unique_counts.get(activity_date, (0, 0))
+                    else:
+                        unique_openers, unique_clickers = len(metrics['unique_openers']), len(metrics['unique_clickers'])
+                    
+                    (activity_rows if use_checkpoints else rows).append({
                         'organization_id': organization_id,
                         'date': activity_date,
                         'canonical_entity_id': f"email_daily_{activity_date}",
                         'entity_type': 'email_daily_activity',
                         'opens': metrics['opens'],
                         'clicks': metrics['clicks'],
-                        'users': len(metrics['unique_openers']),
-                        'sessions': len(metrics['unique_clickers']),
+                        'users': unique_openers,
+                        'sessions': unique_clickers,
                         'open_rate': 0,
                         'click_through_rate': (metrics['clicks'] / metrics['opens'] * 100) if metrics['opens'] > 0 else 0,
                         'source_breakdown': json.dumps({
-                            'unique_openers': len(metrics['unique_openers']),
-                            'unique_clickers': len(metrics['unique_clickers']),
+                            'unique_openers': unique_openers,
+                            'unique_clickers': unique_clickers,
+                            'unique_mode': unique_mode,
                         }),
                         'created_at': now_iso,
                         'updated_at': now_iso,
@@ -635,6 +1071,14 @@ def sync_activecampaign_to_bigquery(request):
                 import traceback
                 logger.error(traceback.format_exc())
                 results['email_activities'] = 0
+                # Don't advance checkpoints past activity that was never stored
+                activity_rows = []
+                activity_fetches = []
+                activity_increments = []
+                updated_checkpoints = {}
+            finally:
+                if approx_uniques:
+                    bq.delete_table(unique_staging_ref, not_found_ok=True)
         
         # ============================================
         # 5. FETCH LISTS (with pagination)
@@ -716,10 +1160,14 @@ def sync_activecampaign_to_bigquery(request):
                   AND entity_type LIKE 'email_campaign%'
                 """
                 
+                # Activity tracked by increments recomputes its own dates, so keep today's row
+                summary_types = "'contact_summary', 'deal_summary', 'email_summary', 'email_list'"
+                if not activity_fetches:
+                    summary_types += ", 'email_daily_activity'"
                 delete_summaries = f"""
                 DELETE FROM `{table_ref}`
                 WHERE organization_id = '{organization_id}'
-                  AND entity_type IN ('contact_summary', 'deal_summary', 'email_summary', 'email_list', 'email_daily_activity')
+                  AND entity_type IN ({summary_types})
                   AND date = '{today_str}'
                 """
                 
@@ -731,14 +1179,26 @@ def sync_activecampaign_to_bigquery(request):
                 except Exception as e:
                     logger.warning(f"Delete query warning: {e}")
             
-            # Insert new rows
-            errors = bq.insert_rows_json(table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
+            # Insert new rows, coerced to the table's column types
+            errors = bq.insert_rows_json(table_ref, convert_rows(bq, table_ref, rows), skip_invalid_rows=True, ignore_unknown_values=True)
             
             if errors:
                 logger.warning(f"Some rows failed: {errors[:3]}")
             else:
                 results['rows_inserted'] = len(rows)
         
+        if activity_fetches:
+            logger.info(f"Applying {len(activity_increments)} activity increments from {len(activity_fetches)} campaign lists...")
+            apply_activity_increments(bq, organization_id, activity_fetches, activity_increments, activity_rows)
+            results['rows_inserted'] += len(activity_rows)
+        
+        record_dirty_partitions(bq, organization_id, dirty_ranges(rows + activity_rows), 'activecampaign')
+        
+        # Only advance checkpoints once the activity they cover is stored
+        if updated_checkpoints:
+            save_activity_checkpoints(db, connection_ref, updated_checkpoints)
+            logger.info(f"Saved activity checkpoints for {len(updated_checkpoints)} campaigns")
+        
         # ============================================
         # 7. WRITE RAW DATA TO BIGQUERY
         # ============================================
@@ -761,8 +1221,9 @@ def sync_activecampaign_to_bigquery(request):
             # Insert raw rows in batches
             BATCH_SIZE = 500
             raw_inserted = 0
+            convert_batch = compile_row_converter(bq.get_table(raw_table_ref).schema)
             for i in range(0, len(raw_rows), BATCH_SIZE):
-                batch = raw_rows[i:i + BATCH_SIZE]
+                batch = convert_batch(raw_rows[i:i + BATCH_SIZE])
                 errors = bq.insert_rows_json(raw_table_ref, batch, skip_invalid_rows=True, ignore_unknown_values=True)
                 if not errors:
                     raw_inserted += len(batch)
@@ -4,6 +4,9 @@
 
 echo "🚀 Deploying All-Time Rollup ETL..."
 
+# Copy in the shared opsos_common package (see data-sync/vendor-common.sh)
+bash ../vendor-common.sh . || exit 1
+
 gcloud functions deploy alltime-rollup-etl \
   --gen2 \
   --runtime=python311 \
@@ -9,8 +9,15 @@ This provides structural baselines and historical context
 
 import functions_framework
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 from datetime import datetime
 import logging
+from opsos_common.dirty_partitions import read_dirty_ranges, mark_dirty_consumed, months_in_ranges
+from opsos_common.bq_scripts import run_script
+from opsos_common.rollup_state import (
+    APPLIED_METRICS, additive_terms, applied_columns_sql, drift_statement,
+    full_rebuild_due, state_tables_statement,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,27 +29,210 @@ PROJECT_ID = "opsos-864a1"
 DATASET_ID = "marketing_ai"
 
 
-def create_alltime_aggregates(organization_id: str, as_of_date: datetime = None):
+STATE_TABLE = f"{PROJECT_ID}.{DATASET_ID}.alltime_entity_state"
+APPLIED_TABLE = f"{PROJECT_ID}.{DATASET_ID}.alltime_applied_months"
+
+
+# Order statistics cannot be retracted like the additive columns; an incremental update
+# recomputes them from alltime_applied_months for every entity it touched.
+# (state column, type) pairs, stored after the additive columns
+ORDER_COLUMNS = [
+    ('first_month', 'STRING'),
+    ('last_month', 'STRING'),
+    ('sessions_min', 'INT64'),
+    ('sessions_max', 'INT64'),
+    ('revenue_min', 'FLOAT64'),
+    ('revenue_max', 'FLOAT64'),
+    ('best_month', 'STRING'),
+    ('best_month_sessions', 'INT64'),
+    ('best_month_revenue', 'FLOAT64'),
+    ('worst_month', 'STRING'),
+    ('worst_month_sessions', 'INT64'),
+    ('worst_month_revenue', 'FLOAT64'),
+    ('sessions_sketch', 'BYTES'),  # KLL_QUANTILES sketch of monthly sessions (percentiles)
+    ('first_year', 'ARRAY<STRUCT<year_month STRING, sessions INT64>>'),  # Earliest 12 months (trend)
+    ('last_year', 'ARRAY<STRUCT<year_month STRING, sessions INT64>>'),  # Latest 12 months (trend)
+]
+
+
+# Order statistics of the month rows with sign > 0, as ORDER_COLUMNS (best/worst as structs)
+ORDER_STATS = """
+      MIN(IF(sign > 0, year_month, NULL)) AS first_month,
+      MAX(IF(sign > 0, year_month, NULL)) AS last_month,
+      MIN(IF(sign > 0, sessions, NULL)) AS sessions_min,
+      MAX(IF(sign > 0, sessions, NULL)) AS sessions_max,
+      MIN(IF(sign > 0, revenue, NULL)) AS revenue_min,
+      MAX(IF(sign > 0, revenue, NULL)) AS revenue_max,
+      ARRAY_AGG(IF(sign > 0 AND sessions > 0, STRUCT(year_month, sessions, revenue), NULL) IGNORE NULLS
+                ORDER BY sessions DESC LIMIT 1)[SAFE_OFFSET(0)] AS best,
+      ARRAY_AGG(IF(sign > 0 AND sessions > 0, STRUCT(year_month, sessions, revenue), NULL) IGNORE NULLS
+                ORDER BY sessions ASC LIMIT 1)[SAFE_OFFSET(0)] AS worst,
+      KLL_QUANTILES.INIT_FLOAT64(IF(sign > 0, CAST(sessions AS FLOAT64), NULL)) AS sessions_sketch,
+      ARRAY_AGG(IF(sign > 0, STRUCT(year_month, sessions), NULL) IGNORE NULLS
+                ORDER BY year_month ASC LIMIT 12) AS first_year,
+      ARRAY_AGG(IF(sign > 0, STRUCT(year_month, sessions), NULL) IGNORE NULLS
+                ORDER BY year_month DESC LIMIT 12) AS last_year"""
+
+# Extra drift measure and condition: the stored best month against a from-scratch one
+BEST_MONTH_DRIFT = ['COUNTIF(o.best_month IS DISTINCT FROM n.best.year_month) AS best_month_mismatches']
+BEST_MONTH_MISMATCH = ['o.best_month IS DISTINCT FROM n.best.year_month']
+
+
+def month_delta_statement(reset: bool) -> str:
     """
-    Aggregate all monthly metrics into all-time metrics
-    as_of_date: The reference date (defaults to today)
+    Temp table of signed month rows: +1 for the fresh monthly_entity_metrics row of
+    every month being applied, -1 for what was previously applied for those months.
+    A reset applies the whole history onto an empty state.
+    """
+    applied_columns = ', '.join(f'a.{metric}' for metric in APPLIED_METRICS)
     
-    All-time includes all months from the first data point to the most recent complete month
+    if reset:
+        month_filter = ""
+        retracted = ""
+    else:
+        month_filter = "\n      AND m.year_month IN UNNEST(@apply_months)"
+        retracted = f"""
+    UNION ALL
+    
+    SELECT -1 AS sign, a.canonical_entity_id, a.entity_type, a.year_month, {applied_columns}
+    FROM `{APPLIED_TABLE}` a
+    WHERE a.organization_id = @org_id
+      AND a.year_month IN UNNEST(@apply_months)"""
+    
+    return f"""
+    CREATE TEMP TABLE month_delta AS
+    SELECT 1 AS sign, m.canonical_entity_id, m.entity_type, m.year_month,
+      {applied_columns_sql('m')}
+    FROM `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics` m
+    WHERE m.organization_id = @org_id{month_filter}
+      AND m.canonical_entity_id IN (
+        SELECT canonical_entity_id
+        FROM `{PROJECT_ID}.{DATASET_ID}.entity_map`
+        WHERE is_active = TRUE
+      ){retracted};
     """
-    if as_of_date is None:
-        as_of_date = datetime.now()
+
+
+def entity_delta_statement() -> str:
+    """Temp table of the signed additive delta per entity plus the order statistics of the added months"""
+    sums = ',\n      '.join(f'SUM({term}) AS {column}' for column, term in additive_terms())
+    return f"""
+    CREATE TEMP TABLE entity_delta AS
+    SELECT
+      canonical_entity_id,
+      entity_type,
+      {sums},
+      {ORDER_STATS}
+    FROM month_delta
+    GROUP BY canonical_entity_id, entity_type;
+    """
+
+
+def apply_delta_statements(reset: bool) -> str:
+    """
+    Fold entity_delta into the state and record the applied months. The additive
+    columns take the signed delta; after an incremental update the order statistics
+    of every touched entity are recomputed from its applied months.
+    """
+    columns = [column for column, _ in additive_terms()]
+    updates = ',\n        '.join(f'{column} = T.{column} + S.{column}' for column in columns)
+    insert_columns = ', '.join(columns + [column for column, _ in ORDER_COLUMNS])
+    insert_values = ', '.join(f'S.{column}' for column in columns)
+    applied_columns = ', '.join(APPLIED_METRICS)
     
-    as_of_date_str = as_of_date.strftime('%Y-%m-%d')
+    if reset:
+        clear = f"""
+    DELETE FROM `{STATE_TABLE}` WHERE organization_id = @org_id;
+    DELETE FROM `{APPLIED_TABLE}` WHERE organization_id = @org_id;
+    """
+    else:
+        clear = f"""
+    DELETE FROM `{APPLIED_TABLE}`
+    WHERE organization_id = @org_id
+      AND year_month IN UNNEST(@apply_months);
+    """
     
-    logger.info(f"Creating all-time aggregates for {organization_id} (as of {as_of_date_str})")
+    return clear + f"""
+    MERGE `{STATE_TABLE}` T
+    USING entity_delta S
+    ON T.organization_id = @org_id
+       AND T.canonical_entity_id = S.canonical_entity_id
+       AND T.entity_type = S.entity_type
+    WHEN MATCHED THEN
+      UPDATE SET
+        {updates},
+        updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (organization_id, canonical_entity_id, entity_type, {insert_columns}, rebuilt_at, updated_at)
+      VALUES (@org_id, S.canonical_entity_id, S.entity_type, {insert_values},
+              S.first_month, S.last_month,
+              S.sessions_min, S.sessions_max, S.revenue_min, S.revenue_max,
+              S.best.year_month, S.best.sessions, S.best.revenue,
+              S.worst.year_month, S.worst.sessions, S.worst.revenue,
+              S.sessions_sketch, S.first_year, S.last_year,
+              {'CURRENT_TIMESTAMP()' if reset else 'NULL'}, CURRENT_TIMESTAMP());
     
-    query = f"""
-    -- First, delete existing data for this as_of_date to allow re-processing
+    -- Entities whose months were all retracted
+    DELETE FROM `{STATE_TABLE}`
+    WHERE organization_id = @org_id
+      AND months <= 0;
+    
+    INSERT INTO `{APPLIED_TABLE}`
+      (organization_id, canonical_entity_id, entity_type, year_month, {applied_columns}, applied_at)
+    SELECT @org_id, canonical_entity_id, entity_type, year_month, {applied_columns}, CURRENT_TIMESTAMP()
+    FROM month_delta
+    WHERE sign > 0;
+    """ + ("" if reset else recompute_order_stats_statement())
+
+
+def recompute_order_stats_statement() -> str:
+    """Recompute the order statistics of every entity in entity_delta from all of its applied months"""
+    return f"""
+    MERGE `{STATE_TABLE}` T
+    USING (
+      SELECT
+        canonical_entity_id,
+        entity_type,
+        {ORDER_STATS}
+      FROM (
+        SELECT 1 AS sign, a.*
+        FROM `{APPLIED_TABLE}` a
+        JOIN (SELECT DISTINCT canonical_entity_id, entity_type FROM entity_delta)
+          USING (canonical_entity_id, entity_type)
+        WHERE a.organization_id = @org_id
+      )
+      GROUP BY canonical_entity_id, entity_type
+    ) S
+    ON T.organization_id = @org_id
+       AND T.canonical_entity_id = S.canonical_entity_id
+       AND T.entity_type = S.entity_type
+    WHEN MATCHED THEN
+      UPDATE SET
+        first_month = S.first_month,
+        last_month = S.last_month,
+        sessions_min = S.sessions_min,
+        sessions_max = S.sessions_max,
+        revenue_min = S.revenue_min,
+        revenue_max = S.revenue_max,
+        best_month = S.best.year_month,
+        best_month_sessions = S.best.sessions,
+        best_month_revenue = S.best.revenue,
+        worst_month = S.worst.year_month,
+        worst_month_sessions = S.worst.sessions,
+        worst_month_revenue = S.worst.revenue,
+        sessions_sketch = S.sessions_sketch,
+        first_year = S.first_year,
+        last_year = S.last_year;
+    """
+
+
+def snapshot_statement() -> str:
+    """Replace the as_of_date snapshot; every column is derived from the state row alone"""
+    return f"""
     DELETE FROM `{PROJECT_ID}.{DATASET_ID}.alltime_entity_metrics`
     WHERE organization_id = @org_id
       AND as_of_date = @as_of_date;
     
-    -- Then insert fresh all-time aggregates from monthly data
     INSERT INTO `{PROJECT_ID}.{DATASET_ID}.alltime_entity_metrics`
     (
       organization_id, as_of_date, first_month, last_month,
@@ -64,256 +254,167 @@ def create_alltime_aggregates(organization_id: str, as_of_date: datetime = None)
       created_at, updated_at
     )
     
-    WITH monthly_data AS (
-      SELECT 
-        m.organization_id,
-        m.year_month,
-        m.canonical_entity_id,
-        m.entity_type,
-        m.impressions, m.clicks, m.sessions, m.users, m.pageviews,
-        m.avg_session_duration, m.avg_bounce_rate, m.avg_engagement_rate,
-        m.conversions, m.conversion_rate, m.revenue, m.cost, m.profit,
-        m.avg_ctr, m.avg_cpc, m.avg_cpa, m.avg_roas, m.avg_roi,
-        m.avg_position, m.avg_search_volume,
-        m.sends, m.opens, m.open_rate, m.click_through_rate
-      FROM `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics` m
-      JOIN `{PROJECT_ID}.{DATASET_ID}.entity_map` e
-        ON m.canonical_entity_id = e.canonical_entity_id
-        AND e.is_active = TRUE
-      WHERE m.organization_id = @org_id
-    ),
-    
-    -- Calculate first 12 months vs last 12 months for trend
-    entity_months AS (
-      SELECT 
-        canonical_entity_id,
-        entity_type,
-        year_month,
-        sessions,
-        revenue,
-        ROW_NUMBER() OVER (PARTITION BY canonical_entity_id, entity_type ORDER BY year_month ASC) as month_rank_asc,
-        ROW_NUMBER() OVER (PARTITION BY canonical_entity_id, entity_type ORDER BY year_month DESC) as month_rank_desc,
-        COUNT(*) OVER (PARTITION BY canonical_entity_id, entity_type) as total_months
-      FROM monthly_data
-    ),
-    
-    -- First 12 months aggregate
-    first_12_months AS (
-      SELECT 
-        canonical_entity_id,
-        entity_type,
-        SUM(sessions) as first_year_sessions
-      FROM entity_months
-      WHERE month_rank_asc <= 12
-      GROUP BY canonical_entity_id, entity_type
-    ),
+    WITH state AS (
+      SELECT
+        *,
+        -- First 12 months vs last 12 months for trend
+        (SELECT SUM(sessions) FROM UNNEST(first_year)) AS first_year_sessions,
+        (SELECT SUM(sessions) FROM UNNEST(last_year)) AS last_year_sessions
+      FROM `{STATE_TABLE}`
+      WHERE organization_id = @org_id
+    )
     
-    -- Last 12 months aggregate  
-    last_12_months AS (
-      SELECT 
-        canonical_entity_id,
-        entity_type,
-        SUM(sessions) as last_year_sessions
-      FROM entity_months
-      WHERE month_rank_desc <= 12
-      GROUP BY canonical_entity_id, entity_type
-    ),
+    SELECT
+      @org_id, @as_of_date, s.first_month, s.last_month,
+      s.canonical_entity_id, s.entity_type,
+      s.impressions, s.clicks, s.sessions, s.users, s.pageviews,
+      
+      -- Engagement averages (duration weighted by sessions)
+      CASE
+        WHEN s.sessions > 0 THEN s.duration_x_sessions / s.sessions
+        ELSE SAFE_DIVIDE(s.avg_session_duration_sum, s.avg_session_duration_n)
+      END,
+      SAFE_DIVIDE(s.avg_bounce_rate_sum, s.avg_bounce_rate_n),
+      SAFE_DIVIDE(s.avg_engagement_rate_sum, s.avg_engagement_rate_n),
+      
+      s.conversions,
+      SAFE_DIVIDE(s.conversions, s.sessions) * 100,
+      s.revenue, s.cost, s.revenue - s.cost,
+      
+      SAFE_DIVIDE(s.avg_ctr_sum, s.avg_ctr_n),
+      SAFE_DIVIDE(s.avg_cpc_sum, s.avg_cpc_n),
+      SAFE_DIVIDE(s.avg_cpa_sum, s.avg_cpa_n),
+      SAFE_DIVIDE(s.avg_roas_sum, s.avg_roas_n),
+      SAFE_DIVIDE(s.avg_roi_sum, s.avg_roi_n),
+      SAFE_DIVIDE(s.avg_position_sum, s.avg_position_n),
+      CAST(SAFE_DIVIDE(s.avg_search_volume_sum, s.avg_search_volume_n) AS INT64),
+      
+      s.sends, s.opens,
+      SAFE_DIVIDE(s.opens, s.sends) * 100,
+      SAFE_DIVIDE(s.clicks, s.sends) * 100,
+      
+      SAFE_DIVIDE(s.sessions, s.sessions_n),
+      SAFE_DIVIDE(s.revenue, s.revenue_n),
+      SAFE_DIVIDE(s.conversions, s.conversions_n),
+      
+      -- Sample standard deviation from the count, sum and sum of squares
+      IF(s.sessions_n > 1, SQRT(GREATEST((s.sessions_sq - s.sessions * s.sessions / s.sessions_n) / (s.sessions_n - 1), 0)), NULL),
+      IF(s.revenue_n > 1, SQRT(GREATEST((s.revenue_sq - s.revenue * s.revenue / s.revenue_n) / (s.revenue_n - 1), 0)), NULL),
+      
+      s.sessions_min, s.sessions_max, s.revenue_min, s.revenue_max,
+      
+      -- Percentile bands from the mergeable sketch
+      KLL_QUANTILES.EXTRACT_POINT_FLOAT64(s.sessions_sketch, 0.1),
+      KLL_QUANTILES.EXTRACT_POINT_FLOAT64(s.sessions_sketch, 0.25),
+      KLL_QUANTILES.EXTRACT_POINT_FLOAT64(s.sessions_sketch, 0.5),
+      KLL_QUANTILES.EXTRACT_POINT_FLOAT64(s.sessions_sketch, 0.75),
+      KLL_QUANTILES.EXTRACT_POINT_FLOAT64(s.sessions_sketch, 0.9),
+      
+      s.best_month, s.best_month_sessions, s.best_month_revenue,
+      s.worst_month, s.worst_month_sessions, s.worst_month_revenue,
+      
+      CASE
+        WHEN SAFE_DIVIDE(s.last_year_sessions - s.first_year_sessions, s.first_year_sessions) > 0.1 THEN 'up'
+        WHEN SAFE_DIVIDE(s.last_year_sessions - s.first_year_sessions, s.first_year_sessions) < -0.1 THEN 'down'
+        ELSE 'stable'
+      END,
+      SAFE_DIVIDE(s.last_year_sessions - s.first_year_sessions, s.first_year_sessions) * 100,
+      
+      s.months,
+      s.months_with_sessions,
+      DATE_DIFF(
+        DATE(CONCAT(s.last_month, '-01')),
+        DATE(CONCAT(s.first_month, '-01')),
+        MONTH
+      ) + 1,
+      
+      CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP()
+    FROM state s;
+    """
+
+
+def last_rebuilt_at(organization_id: str):
+    """When this organization's all-time state was last fully rebuilt (None if never)"""
+    query = f"""
+    SELECT MAX(rebuilt_at) AS rebuilt_at
+    FROM `{STATE_TABLE}`
+    WHERE organization_id = @org_id
+    """
     
-    trends AS (
-      SELECT 
-        f.canonical_entity_id,
-        f.entity_type,
-        f.first_year_sessions,
-        l.last_year_sessions,
-        SAFE_DIVIDE(l.last_year_sessions - f.first_year_sessions, f.first_year_sessions) * 100 as trend_pct_change,
-        CASE 
-          WHEN SAFE_DIVIDE(l.last_year_sessions - f.first_year_sessions, f.first_year_sessions) > 0.1 THEN 'up'
-          WHEN SAFE_DIVIDE(l.last_year_sessions - f.first_year_sessions, f.first_year_sessions) < -0.1 THEN 'down'
-          ELSE 'stable'
-        END as trend_direction
-      FROM first_12_months f
-      JOIN last_12_months l
-        ON f.canonical_entity_id = l.canonical_entity_id
-        AND f.entity_type = l.entity_type
-    ),
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id)
+        ]
+    )
     
-    -- Find best and worst months per entity
-    ranked_months AS (
-      SELECT 
-        canonical_entity_id,
-        entity_type,
-        year_month,
-        sessions,
-        revenue,
-        ROW_NUMBER() OVER (PARTITION BY canonical_entity_id, entity_type ORDER BY sessions DESC) as best_rank,
-        ROW_NUMBER() OVER (PARTITION BY canonical_entity_id, entity_type ORDER BY sessions ASC) as worst_rank
-      FROM monthly_data
-      WHERE sessions > 0
-    ),
+    try:
+        rows = list(bq_client.query(query, job_config=job_config).result())
+    except NotFound:
+        # The first rebuild creates the state tables
+        return None
     
-    best_months AS (
-      SELECT 
-        canonical_entity_id, entity_type, 
-        year_month as best_month, 
-        sessions as best_month_sessions,
-        revenue as best_month_revenue
-      FROM ranked_months WHERE best_rank = 1
-    ),
+    return rows[0].rebuilt_at if rows else None
+
+
+def create_alltime_aggregates(organization_id: str, as_of_date: datetime = None, dirty_months: list = None) -> dict:
+    """
+    Maintain all-time metrics from additive state and write the as_of_date snapshot
+    as_of_date: The reference date (defaults to today)
+    dirty_months: Months restated upstream. None rebuilds the state from the full
+    monthly history and reports how far the stored state had drifted; otherwise
+    only those months are swapped into the state (previous total + new months).
     
-    worst_months AS (
-      SELECT 
-        canonical_entity_id, entity_type, 
-        year_month as worst_month, 
-        sessions as worst_month_sessions,
-        revenue as worst_month_revenue
-      FROM ranked_months WHERE worst_rank = 1
-    ),
+    All-time includes all months from the first data point to the most recent month
+    """
+    if as_of_date is None:
+        as_of_date = datetime.now()
     
-    -- Calculate percentiles for each entity
-    percentiles AS (
-      SELECT 
-        canonical_entity_id,
-        entity_type,
-        APPROX_QUANTILES(sessions, 100)[OFFSET(10)] as sessions_p10,
-        APPROX_QUANTILES(sessions, 100)[OFFSET(25)] as sessions_p25,
-        APPROX_QUANTILES(sessions, 100)[OFFSET(50)] as sessions_p50,
-        APPROX_QUANTILES(sessions, 100)[OFFSET(75)] as sessions_p75,
-        APPROX_QUANTILES(sessions, 100)[OFFSET(90)] as sessions_p90
-      FROM monthly_data
-      GROUP BY canonical_entity_id, entity_type
-    ),
+    as_of_date_str = as_of_date.strftime('%Y-%m-%d')
+    reset = dirty_months is None
+    check_drift = reset and last_rebuilt_at(organization_id) is not None
+    apply_months = [] if reset else sorted(set(dirty_months))
     
-    alltime_agg AS (
-      SELECT 
-        organization_id,
-        DATE(@as_of_date) as as_of_date,
-        MIN(year_month) as first_month,
-        MAX(year_month) as last_month,
-        canonical_entity_id,
-        entity_type,
-        
-        -- Traffic totals (sum of all months)
-        SUM(impressions) as impressions,
-        SUM(clicks) as clicks,
-        SUM(sessions) as sessions,
-        SUM(users) as users,
-        SUM(pageviews) as pageviews,
-        
-        -- Engagement averages (weighted by sessions)
-        CASE 
-          WHEN SUM(sessions) > 0 
-          THEN SUM(avg_session_duration * sessions) / SUM(sessions)
-          ELSE AVG(avg_session_duration)
-        END as avg_session_duration,
-        AVG(avg_bounce_rate) as avg_bounce_rate,
-        AVG(avg_engagement_rate) as avg_engagement_rate,
-        
-        -- Conversion & revenue totals
-        SUM(conversions) as conversions,
-        SAFE_DIVIDE(SUM(conversions), SUM(sessions)) * 100 as conversion_rate,
-        SUM(revenue) as revenue,
-        SUM(cost) as cost,
-        SUM(revenue) - SUM(cost) as profit,
-        
-        -- Performance averages
-        AVG(avg_ctr) as avg_ctr,
-        AVG(avg_cpc) as avg_cpc,
-        AVG(avg_cpa) as avg_cpa,
-        AVG(avg_roas) as avg_roas,
-        AVG(avg_roi) as avg_roi,
-        
-        -- SEO averages
-        AVG(avg_position) as avg_position,
-        CAST(AVG(avg_search_volume) AS INT64) as avg_search_volume,
-        
-        -- Email totals
-        SUM(sends) as sends,
-        SUM(opens) as opens,
-        SAFE_DIVIDE(SUM(opens), SUM(sends)) * 100 as open_rate,
-        SAFE_DIVIDE(SUM(clicks), SUM(sends)) * 100 as click_through_rate,
-        
-        -- Monthly averages
-        AVG(sessions) as avg_monthly_sessions,
-        AVG(revenue) as avg_monthly_revenue,
-        AVG(conversions) as avg_monthly_conversions,
-        
-        -- Variance for anomaly detection
-        STDDEV(sessions) as sessions_stddev,
-        STDDEV(revenue) as revenue_stddev,
-        MIN(sessions) as sessions_min,
-        MAX(sessions) as sessions_max,
-        MIN(revenue) as revenue_min,
-        MAX(revenue) as revenue_max,
-        
-        -- Data quality
-        COUNT(DISTINCT year_month) as total_months,
-        COUNTIF(sessions > 0) as months_with_data,
-        
-        CURRENT_TIMESTAMP() as created_at,
-        CURRENT_TIMESTAMP() as updated_at
-        
-      FROM monthly_data
-      GROUP BY organization_id, canonical_entity_id, entity_type
-    ),
+    if reset:
+        logger.info(f"Rebuilding all-time aggregates for {organization_id} (as of {as_of_date_str})")
+    else:
+        logger.info(f"Updating all-time aggregates for {organization_id} with {len(apply_months)} month(s) (as of {as_of_date_str})")
     
-    -- Calculate data span in months
-    with_span AS (
-      SELECT 
-        a.*,
-        DATE_DIFF(
-          DATE(CONCAT(a.last_month, '-01')), 
-          DATE(CONCAT(a.first_month, '-01')), 
-          MONTH
-        ) + 1 as data_span_months
-      FROM alltime_agg a
+    query = (
+        state_tables_statement(STATE_TABLE, APPLIED_TABLE, ORDER_COLUMNS)
+        + month_delta_statement(reset)
+        + entity_delta_statement()
+        + (drift_statement(STATE_TABLE, BEST_MONTH_DRIFT, BEST_MONTH_MISMATCH) if check_drift else "")
+        + "\n    BEGIN TRANSACTION;\n"
+        + apply_delta_statements(reset)
+        + snapshot_statement()
+        + "\n    COMMIT TRANSACTION;\n"
+        + ("\n    SELECT * FROM drift;\n" if check_drift else "")
     )
     
-    SELECT 
-      w.organization_id, w.as_of_date, w.first_month, w.last_month,
-      w.canonical_entity_id, w.entity_type,
-      w.impressions, w.clicks, w.sessions, w.users, w.pageviews,
-      w.avg_session_duration, w.avg_bounce_rate, w.avg_engagement_rate,
-      w.conversions, w.conversion_rate, w.revenue, w.cost, w.profit,
-      w.avg_ctr, w.avg_cpc, w.avg_cpa, w.avg_roas, w.avg_roi,
-      w.avg_position, w.avg_search_volume,
-      w.sends, w.opens, w.open_rate, w.click_through_rate,
-      w.avg_monthly_sessions, w.avg_monthly_revenue, w.avg_monthly_conversions,
-      w.sessions_stddev, w.revenue_stddev,
-      w.sessions_min, w.sessions_max, w.revenue_min, w.revenue_max,
-      p.sessions_p10, p.sessions_p25, p.sessions_p50, p.sessions_p75, p.sessions_p90,
-      b.best_month, b.best_month_sessions, b.best_month_revenue,
-      wst.worst_month, wst.worst_month_sessions, wst.worst_month_revenue,
-      t.trend_direction, t.trend_pct_change,
-      w.total_months, w.months_with_data, w.data_span_months,
-      w.created_at, w.updated_at
-    FROM with_span w
-    LEFT JOIN trends t 
-      ON w.canonical_entity_id = t.canonical_entity_id 
-      AND w.entity_type = t.entity_type
-    LEFT JOIN percentiles p
-      ON w.canonical_entity_id = p.canonical_entity_id 
-      AND w.entity_type = p.entity_type
-    LEFT JOIN best_months b 
-      ON w.canonical_entity_id = b.canonical_entity_id 
-      AND w.entity_type = b.entity_type
-    LEFT JOIN worst_months wst 
-      ON w.canonical_entity_id = wst.canonical_entity_id 
-      AND w.entity_type = wst.entity_type
-    """
-    
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
-            bigquery.ScalarQueryParameter("as_of_date", "DATE", as_of_date.date())
+            bigquery.ScalarQueryParameter("as_of_date", "DATE", as_of_date.date()),
+            bigquery.ArrayQueryParameter("apply_months", "STRING", apply_months)
         ]
     )
     
     try:
-        job = bq_client.query(query, job_config=job_config)
-        job.result()  # Wait for completion
+        # Concurrent org runs can abort the transaction; run_script re-runs it
+        rows = run_script(bq_client, query, job_config)
+        
+        drift = None
+        if check_drift and rows:
+            drift = dict(rows[0].items())
+            if drift['entities_drifted']:
+                logger.warning(f"⚠️ All-time state had drifted for {drift['entities_drifted']} entities: {drift}")
         
-        logger.info(f"✅ Successfully created all-time aggregates for {as_of_date_str}")
-        return True
+        logger.info(f"✅ Successfully {'rebuilt' if reset else 'updated'} all-time aggregates for {as_of_date_str}")
+        return {
+            'full_rebuild': reset,
+            'months_applied': apply_months,
+            'drift': drift
+        }
         
     except Exception as e:
         logger.error(f"❌ Error creating all-time aggregates: {e}")
@@ -328,9 +429,14 @@ def run_alltime_rollup(request):
     Request body:
     {
       "organizationId": "SBjucW1ztDyFYWBz7ZLE",
-      "asOfDate": "2025-01-31"  // optional, defaults to today
+      "asOfDate": "2025-01-31",  // optional, defaults to today
+      "mode": "dirty",           // optional, update incrementally from the dirty_partitions ledger
+      "fullRebuild": true        // optional, with mode=dirty: rebuild instead of updating
     }
     
+    Without mode=dirty the state is rebuilt from the full monthly history.
+    In dirty mode a full rebuild still runs every FULL_REBUILD_INTERVAL_DAYS to verify drift.
+    
     Note: All-time should be run daily to keep the snapshot current
     """
     
@@ -346,14 +452,35 @@ def run_alltime_rollup(request):
         else:
             as_of_date = datetime.now()
         
-        logger.info(f"🔄 Creating all-time aggregates for {organization_id} (as of {as_of_date.strftime('%Y-%m-%d')})")
+        result = None
         
-        create_alltime_aggregates(organization_id, as_of_date)
+        if request_json.get('mode') == 'dirty':
+            # Wait for the monthly rollup to rewrite a dirty month before consuming it
+            dirty_ids, ranges = read_dirty_ranges(bq_client, organization_id, 'alltime', after='monthly')
+            dirty_months = months_in_ranges(ranges)
+            
+            if request_json.get('fullRebuild') or full_rebuild_due(last_rebuilt_at(organization_id)):
+                logger.info(f"🔄 Rebuilding all-time state for {organization_id}")
+                result = create_alltime_aggregates(organization_id, as_of_date)
+            elif dirty_months:
+                logger.info(f"🔄 Updating all-time aggregates for {organization_id} ({len(dirty_months)} dirty month(s))")
+                result = create_alltime_aggregates(organization_id, as_of_date, dirty_months)
+            else:
+                logger.info(f"No dirty months for {organization_id}, all-time snapshot unchanged")
+            
+            mark_dirty_consumed(bq_client, organization_id, 'alltime', dirty_ids)
+        else:
+            logger.info(f"🔄 Rebuilding all-time aggregates for {organization_id} (as of {as_of_date.strftime('%Y-%m-%d')})")
+            result = create_alltime_aggregates(organization_id, as_of_date)
         
         return {
             'success': True,
             'organization_id': organization_id,
-            'as_of_date': as_of_date.strftime('%Y-%m-%d')
+            'as_of_date': as_of_date.strftime('%Y-%m-%d'),
+            'refreshed': result is not None,
+            'full_rebuild': bool(result and result['full_rebuild']),
+            'months_applied': result['months_applied'] if result else [],
+            'drift': result['drift'] if result else None
         }, 200
         
     except Exception as e:
@@ -93,6 +93,10 @@ CREATE TABLE IF NOT EXISTS `opsos-864a1.marketing_ai.alltime_entity_metrics` (
 PARTITION BY as_of_date
 CLUSTER BY organization_id, canonical_entity_id, entity_type;
 
+-- The all-time rollup's additive state (alltime_entity_state) and the monthly values
+-- folded into it (alltime_applied_months) are created by the rollup itself, from the
+-- column lists in opsos_common/rollup_state.py.
+
 -- View for all-time summary across all entities
 CREATE OR REPLACE VIEW `opsos-864a1.marketing_ai.alltime_metrics_summary` AS
 SELECT 
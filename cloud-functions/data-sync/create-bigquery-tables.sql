@@ -248,6 +248,37 @@ PARTITION BY as_of_date
 CLUSTER BY organization_id, canonical_entity_id, entity_type;
 
 
+-- =============================================================================
+-- 4. DIRTY PARTITIONS LEDGER
+-- =============================================================================
+-- Each sync appends the (entity_type, start_date, end_date) ranges it upserted
+-- into daily_entity_metrics. Rollups run with mode=dirty recompute only the
+-- weeks/months touching those ranges, append their name to consumed_by, and a
+-- row is deleted once weekly, monthly, l12m and alltime have all consumed it.
+-- Rows are written with DML (never streamed) so they can be updated at once.
+
+CREATE TABLE IF NOT EXISTS `opsos-864a1.marketing_ai.dirty_partitions` (
+  dirty_id STRING NOT NULL,
+  organization_id STRING NOT NULL,
+  entity_type STRING,
+  start_date DATE NOT NULL,
+  end_date DATE NOT NULL,
+  source STRING,                 -- sync that recorded the range
+  recorded_at TIMESTAMP NOT NULL,
+  consumed_by ARRAY<STRING>      -- rollups that have processed this range
+)
+CLUSTER BY organization_id;
+
+
+-- =============================================================================
+-- 5. L12M / ALL-TIME ADDITIVE STATE
+-- =============================================================================
+-- The L12M and all-time rollups keep per-entity additive state and the monthly
+-- values folded into it, so each run only adds/subtracts the months that changed.
+-- They create those tables themselves (l12m_entity_state, l12m_applied_months,
+-- alltime_entity_state, alltime_applied_months) from the column lists in
+-- opsos_common/rollup_state.py, which is their single definition.
+
 -- =============================================================================
 -- VIEWS
 -- =============================================================================
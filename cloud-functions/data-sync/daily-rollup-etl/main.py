@@ -7,14 +7,23 @@ Aggregates:
 3. Pages with funnel events from GA4
 4. Traffic sources from GA4
 5. Paid campaigns from GA4
+
+Each aggregation pushes its date window into the Firestore query (an ISO
+string range on the doc's date field), so cost scales with the window rather
+than the collection. This needs composite indexes on (organizationId, date)
+for the GA collections and (organizationId, sdate) / (organizationId,
+send_date) for activecampaign_campaigns.
 """
 
 import functions_framework
 from google.cloud import firestore, bigquery
 from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.row_converter import convert_rows
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,6 +35,22 @@ TABLE_ID = 'daily_entity_metrics'
 db = firestore.Client()
 bq_client = bigquery.Client()
 
+
+def stream_date_range(collection: str, org_id: str, date_field: str, start_date, end_date, fields: list):
+    """
+    Stream an org's docs whose ISO date string falls in [start_date, end_date].
+    
+    The upper bound is exclusive on the following day, so both 'YYYY-MM-DD'
+    values and full timestamps on end_date match. Only `fields` are returned.
+    """
+    return db.collection(collection)\
+        .where('organizationId', '==', org_id)\
+        .where(date_field, '>=', start_date.isoformat())\
+        .where(date_field, '<', (end_date + timedelta(days=1)).isoformat())\
+        .select(fields)\
+        .stream()
+
+
 @functions_framework.http
 def run_daily_rollup(request):
     """Aggregate Firestore data to BigQuery daily metrics"""
@@ -45,27 +70,28 @@ def run_daily_rollup(request):
         logger.info(f"🚀 Starting daily rollup for org {organization_id}")
         logger.info(f"📅 Date range: {start_date} to {end_date}")
         
-        all_rows = []
+        # Run the four aggregations in parallel:
+        # 1. Email campaigns from ActiveCampaign
+        # 2. Page metrics with device dimension
+        # 3. Page performance with funnel events
+        # 4. Traffic source entities
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            email_future = executor.submit(aggregate_email_campaigns, organization_id, start_date, end_date)
+            page_device_future = executor.submit(aggregate_page_device_metrics, organization_id, start_date, end_date)
+            page_funnel_future = executor.submit(aggregate_page_funnel_metrics, organization_id, start_date, end_date)
+            traffic_future = executor.submit(aggregate_traffic_sources, organization_id, start_date, end_date)
+            
+            email_rows = email_future.result()
+            page_device_rows = page_device_future.result()
+            page_funnel_rows = page_funnel_future.result()
+            traffic_rows = traffic_future.result()
         
-        # 1. Aggregate email campaigns from ActiveCampaign
-        email_rows = aggregate_email_campaigns(organization_id, start_date, end_date)
         logger.info(f"📧 Email campaigns: {len(email_rows)} rows")
-        all_rows.extend(email_rows)
-        
-        # 2. Aggregate page metrics with device dimension
-        page_device_rows = aggregate_page_device_metrics(organization_id, start_date, end_date)
         logger.info(f"📱 Page device metrics: {len(page_device_rows)} rows")
-        all_rows.extend(page_device_rows)
-        
-        # 3. Aggregate page performance with funnel events
-        page_funnel_rows = aggregate_page_funnel_metrics(organization_id, start_date, end_date)
         logger.info(f"🛒 Page funnel metrics: {len(page_funnel_rows)} rows")
-        all_rows.extend(page_funnel_rows)
-        
-        # 4. Create traffic source entities
-        traffic_rows = aggregate_traffic_sources(organization_id, start_date, end_date)
         logger.info(f"🚦 Traffic sources: {len(traffic_rows)} rows")
-        all_rows.extend(traffic_rows)
+        
+        all_rows = email_rows + page_device_rows + page_funnel_rows + traffic_rows
         
         # Insert to BigQuery
         if all_rows:
@@ -95,63 +121,22 @@ def aggregate_email_campaigns(org_id: str, start_date, end_date):
     rows = []
     
     try:
-        # Query from activecampaign_campaigns collection
-        docs = db.collection('activecampaign_campaigns')\
-            .where('organizationId', '==', org_id)\
-            .stream()
+        fields = ['id', 'sdate', 'send_date', 'total_amt', 'total_sends', 'uniqueopens', 'opens',
+                  'uniqueclicks', 'clicks', 'hardbounces', 'softbounces', 'unsubreasons',
+                  'unsubscribes', 'complaints']
+        
+        # Campaigns are dated by sdate, falling back to send_date when sdate is missing
+        by_sdate = stream_date_range('activecampaign_campaigns', org_id, 'sdate', start_date, end_date, fields)
+        by_send_date = stream_date_range('activecampaign_campaigns', org_id, 'send_date', start_date, end_date, fields)
         
         # Group by campaign + date
         campaigns = {}
-        for doc in docs:
-            data = doc.to_dict()
-            
-            # Parse send date
-            send_date_str = data.get('sdate', data.get('send_date'))
-            if not send_date_str:
-                continue
-            
-            try:
-                # Handle different date formats
-                if isinstance(send_date_str, str):
-                    if 'T' in send_date_str:
-                        send_date = datetime.fromisoformat(send_date_str.replace('Z', '+00:00')).date()
-                    else:
-                        send_date = datetime.strptime(send_date_str, '%Y-%m-%d').date()
-                else:
-                    continue
-                    
-                # Filter by date range
-                if send_date < start_date or send_date > end_date:
-                    continue
-                    
-            except (ValueError, AttributeError) as e:
-                logger.warning(f"Invalid date format: {send_date_str}")
-                continue
-            
-            campaign_id = data.get('id', doc.id)
-            key = f"{campaign_id}|{send_date}"
-            
-            if key not in campaigns:
-                campaigns[key] = {
-                    'organization_id': org_id,
-                    'canonical_entity_id': f"campaign_{campaign_id}",
-                    'entity_type': 'email',
-                    'date': send_date.isoformat(),
-                    'sends': 0,
-                    'opens': 0,
-                    'clicks': 0,
-                    'bounces': 0,
-                    'unsubscribes': 0,
-                    'complaints': 0
-                }
-            
-            # Aggregate metrics
-            campaigns[key]['sends'] += int(data.get('total_amt', data.get('total_sends', 0)))
-            campaigns[key]['opens'] += int(data.get('uniqueopens', data.get('opens', 0)))
-            campaigns[key]['clicks'] += int(data.get('uniqueclicks', data.get('clicks', 0)))
-            campaigns[key]['bounces'] += int(data.get('hardbounces', 0)) + int(data.get('softbounces', 0))
-            campaigns[key]['unsubscribes'] += int(data.get('unsubreasons', data.get('unsubscribes', 0)))
-            campaigns[key]['complaints'] += int(data.get('complaints', 0))
+        for doc in by_sdate:
+            accumulate_email_campaign(campaigns, org_id, doc, start_date, end_date)
+        for doc in by_send_date:
+            if doc.to_dict().get('sdate'):
+                continue  # Dated by sdate, handled (or excluded) above
+            accumulate_email_campaign(campaigns, org_id, doc, start_date, end_date)
         
         # Calculate rates
         for key, metrics in campaigns.items():
@@ -167,15 +152,68 @@ def aggregate_email_campaigns(org_id: str, start_date, end_date):
     return rows
 
 
+def accumulate_email_campaign(campaigns: dict, org_id: str, doc, start_date, end_date):
+    """Add one activecampaign_campaigns doc into the campaign + date groups"""
+    data = doc.to_dict()
+    
+    # Parse send date
+    send_date_str = data.get('sdate', data.get('send_date'))
+    if not send_date_str:
+        return
+    
+    try:
+        # Handle different date formats
+        if isinstance(send_date_str, str):
+            if 'T' in send_date_str:
+                send_date = datetime.fromisoformat(send_date_str.replace('Z', '+00:00')).date()
+            else:
+                send_date = datetime.strptime(send_date_str, '%Y-%m-%d').date()
+        else:
+            return
+            
+        # Filter by date range
+        if send_date < start_date or send_date > end_date:
+            return
+            
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"Invalid date format: {send_date_str}")
+        return
+    
+    campaign_id = data.get('id', doc.id)
+    key = f"{campaign_id}|{send_date}"
+    
+    if key not in campaigns:
+        campaigns[key] = {
+            'organization_id': org_id,
+            'canonical_entity_id': f"campaign_{campaign_id}",
+            'entity_type': 'email',
+            'date': send_date.isoformat(),
+            'sends': 0,
+            'opens': 0,
+            'clicks': 0,
+            'bounces': 0,
+            'unsubscribes': 0,
+            'complaints': 0
+        }
+    
+    # Aggregate metrics
+    campaigns[key]['sends'] += int(data.get('total_amt', data.get('total_sends', 0)))
+    campaigns[key]['opens'] += int(data.get('uniqueopens', data.get('opens', 0)))
+    campaigns[key]['clicks'] += int(data.get('uniqueclicks', data.get('clicks', 0)))
+    campaigns[key]['bounces'] += int(data.get('hardbounces', 0)) + int(data.get('softbounces', 0))
+    campaigns[key]['unsubscribes'] += int(data.get('unsubreasons', data.get('unsubscribes', 0)))
+    campaigns[key]['complaints'] += int(data.get('complaints', 0))
+
+
 def aggregate_page_device_metrics(org_id: str, start_date, end_date):
     """Aggregate GA4 device metrics by page"""
     rows = []
     
     try:
-        # Query ga_device_metrics
-        docs = db.collection('ga_device_metrics')\
-            .where('organizationId', '==', org_id)\
-            .stream()
+        # Query ga_device_metrics for the window only
+        docs = stream_date_range('ga_device_metrics', org_id, 'date', start_date, end_date, [
+            'date', 'pagePath', 'deviceCategory', 'sessions', 'screenPageViews', 'conversions', 'bounceRate',
+        ])
         
         # Group by page + date + device
         metrics_by_key = {}
@@ -241,10 +279,11 @@ def aggregate_page_funnel_metrics(org_id: str, start_date, end_date):
     rows = []
     
     try:
-        # Query ga_page_performance
-        docs = db.collection('ga_page_performance')\
-            .where('organizationId', '==', org_id)\
-            .stream()
+        # Query ga_page_performance for the window only
+        docs = stream_date_range('ga_page_performance', org_id, 'date', start_date, end_date, [
+            'date', 'pagePath', 'screenPageViews', 'addToCarts', 'checkouts', 'purchases',
+            'dwellTime', 'scrollDepth', 'engagementRate',
+        ])
         
         metrics_by_key = {}
         for doc in docs:
@@ -321,10 +360,11 @@ def aggregate_traffic_sources(org_id: str, start_date, end_date):
     rows = []
     
     try:
-        # Query ga_traffic_sources
-        docs = db.collection('ga_traffic_sources')\
-            .where('organizationId', '==', org_id)\
-            .stream()
+        # Query ga_traffic_sources for the window only
+        docs = stream_date_range('ga_traffic_sources', org_id, 'date', start_date, end_date, [
+            'date', 'source', 'medium', 'sessions', 'screenPageViews', 'conversions', 'totalRevenue',
+            'bounceRate', 'engagementRate',
+        ])
         
         metrics_by_key = {}
         for doc in docs:
@@ -430,11 +470,13 @@ def upsert_to_bigquery(rows, org_id, start_date, end_date):
     except Exception as e:
         logger.warning(f"Delete query warning: {e}")
     
-    # Insert new rows
-    errors = bq_client.insert_rows_json(table_ref, rows)
+    # Insert new rows, coerced to the table's column types
+    errors = bq_client.insert_rows_json(table_ref, convert_rows(bq_client, table_ref, rows))
     
     if errors:
         logger.error(f"❌ Errors inserting to BigQuery: {errors[:3]}")
         raise Exception(f"BigQuery insert failed: {errors}")
     else:
         logger.info(f"✅ Successfully inserted {len(rows)} rows")
+    
+    record_dirty_partitions(bq_client, org_id, dirty_ranges(rows), 'daily_rollup')
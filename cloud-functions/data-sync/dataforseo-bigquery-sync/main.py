@@ -5,17 +5,25 @@ Calls DataForSEO API directly and writes to BigQuery - NO Firestore intermediate
 Only uses Firestore for API credentials and priority page config.
 
 Architecture: DataForSEO API → Cloud Function → BigQuery
+
+Responses are cached in BigQuery (dataforseo_response_cache), keyed by endpoint
+and payload, so reruns and backfills inside the TTL don't pay for the same call twice.
 """
 
 import functions_framework
 from google.cloud import firestore, bigquery
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import os
 import requests
 import base64
 import calendar
+import hashlib
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.row_converter import convert_rows
 
 logger = logging.getLogger(__name__)
 
@@ -24,27 +32,105 @@ DATASET_ID = "marketing_ai"
 TABLE_ID = "daily_entity_metrics"
 
 DATAFORSEO_API_BASE = "https://api.dataforseo.com/v3"
+CACHE_TABLE_ID = "dataforseo_response_cache"
+
+# How long a cached response is reused. Rank history only changes monthly;
+# rankings and backlinks are refreshed at most once per nightly run.
+CACHE_TTL_HOURS = {
+    'dataforseo_labs/google/historical_rank_overview/live': 24 * 7,
+    'dataforseo_labs/google/ranked_keywords/live': 20,
+    'backlinks/summary/live': 20,
+}
+
+# Shared keep-alive session; the sync's independent endpoints are called concurrently
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=len(CACHE_TTL_HOURS)))
+
+
+def ensure_cache_table(bq):
+    bq.query(f"""
+    CREATE TABLE IF NOT EXISTS `{PROJECT_ID}.{DATASET_ID}.{CACHE_TABLE_ID}` (
+      cache_key STRING NOT NULL,
+      endpoint STRING,
+      response STRING,
+      fetched_at TIMESTAMP NOT NULL
+    )
+    PARTITION BY DATE(fetched_at)
+    CLUSTER BY cache_key
+    OPTIONS(partition_expiration_days=30)
+    """).result()
 
 
-def dataforseo_request(endpoint: str, method: str, credentials: str, body: dict = None) -> dict:
-    """Make authenticated DataForSEO API request"""
+def cache_key_for(endpoint: str, body) -> str:
+    return hashlib.sha256(f"{endpoint}|{json.dumps(body, sort_keys=True)}".encode()).hexdigest()
+
+
+def read_cached_response(bq, cache_key: str, ttl_hours: int):
+    query = f"""
+    SELECT response
+    FROM `{PROJECT_ID}.{DATASET_ID}.{CACHE_TABLE_ID}`
+    WHERE cache_key = @cache_key
+      AND fetched_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(ttl_hours)} HOUR)
+    ORDER BY fetched_at DESC
+    LIMIT 1
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("cache_key", "STRING", cache_key)]
+    )
+    for row in bq.query(query, job_config=job_config).result():
+        return json.loads(row.response)
+    return None
+
+
+def dataforseo_request(endpoint: str, method: str, credentials: str, body: dict = None, bq=None, use_cache: bool = True) -> dict:
+    """
+    Make authenticated DataForSEO API request.
+    
+    When a BigQuery client is passed, successful responses are cached by endpoint
+    and payload for CACHE_TTL_HOURS[endpoint] and served from there on reruns.
+    """
     url = f"{DATAFORSEO_API_BASE}/{endpoint}"
     
+    ttl_hours = CACHE_TTL_HOURS.get(endpoint)
+    cache_key = cache_key_for(endpoint, body)
+    if bq is not None and use_cache and ttl_hours:
+        try:
+            cached = read_cached_response(bq, cache_key, ttl_hours)
+            if cached is not None:
+                logger.info(f"DataForSEO cache hit: {endpoint}")
+                return cached
+        except Exception as e:
+            logger.warning(f"DataForSEO cache read failed: {e}")
+    
     headers = {
         'Authorization': f'Basic {credentials}',
         'Content-Type': 'application/json',
     }
     
     if method == 'POST':
-        response = requests.post(url, headers=headers, json=body)
+        response = http_session.post(url, headers=headers, json=body, timeout=120)
     else:
-        response = requests.get(url, headers=headers)
+        response = http_session.get(url, headers=headers, timeout=120)
     
     if not response.ok:
         logger.error(f"DataForSEO API error: {response.text}")
         return {}
     
-    return response.json()
+    data = response.json()
+    
+    # Only cache responses whose tasks all succeeded
+    tasks = data.get('tasks', [])
+    if bq is not None and ttl_hours and tasks and all(t.get('status_code') == 20000 for t in tasks):
+        errors = bq.insert_rows_json(f"{PROJECT_ID}.{DATASET_ID}.{CACHE_TABLE_ID}", [{
+            'cache_key': cache_key,
+            'endpoint': endpoint,
+            'response': json.dumps(data),
+            'fetched_at': datetime.utcnow().isoformat(),
+        }])
+        if errors:
+            logger.warning(f"DataForSEO cache write failed: {errors[:1]}")
+    
+    return data
 
 
 @functions_framework.http
@@ -70,6 +156,7 @@ def sync_dataforseo_to_bigquery(request):
     
     # Full resync fetches historical data, update only fetches current
     backfill_history = sync_mode == 'full' or request_json.get('backfillHistory', False)
+    use_cache = not request_json.get('forceRefresh', False)
     
     logger.info(f"Starting DataForSEO → BigQuery sync for org: {organization_id} (mode={sync_mode}, history={backfill_history})")
     
@@ -113,6 +200,59 @@ def sync_dataforseo_to_bigquery(request):
         now_iso = datetime.utcnow().isoformat()
         today_str = datetime.utcnow().date().isoformat()
         
+        try:
+            ensure_cache_table(bq)
+        except Exception as e:
+            logger.warning(f"DataForSEO cache unavailable: {e}")
+        
+        # The history, keyword and backlink endpoints are independent: issue them
+        # concurrently and consume each response in its own section below
+        executor = ThreadPoolExecutor(max_workers=len(CACHE_TTL_HOURS))
+        history_future = None
+        if backfill_history:
+            history_future = executor.submit(
+                dataforseo_request,
+                "dataforseo_labs/google/historical_rank_overview/live",
+                "POST",
+                credentials,
+                [{
+                    "target": target_domain,
+                    "location_code": 2840,  # United States
+                    "language_code": "en",
+                }],
+                bq,
+                use_cache,
+            )
+        keywords_future = executor.submit(
+            dataforseo_request,
+            "dataforseo_labs/google/ranked_keywords/live",
+            "POST",
+            credentials,
+            [{
+                "target": target_domain,
+                "location_code": 2840,
+                "language_code": "en",
+                "limit": 100,
+                "order_by": ["keyword_data.keyword_info.search_volume,desc"],
+            }],
+            bq,
+            use_cache,
+        )
+        backlinks_future = executor.submit(
+            dataforseo_request,
+            "backlinks/summary/live",
+            "POST",
+            credentials,
+            [{
+                "target": target_domain,
+                "internal_list_limit": 10,
+                "include_subdomains": True,
+            }],
+            bq,
+            use_cache,
+        )
+        executor.shutdown(wait=False)
+        
         # ============================================
         # 1. FETCH HISTORICAL RANK DATA
         # ============================================
@@ -121,16 +261,7 @@ def sync_dataforseo_to_bigquery(request):
             
             try:
                 # Get historical organic search rankings
-                history_response = dataforseo_request(
-                    "dataforseo_labs/google/historical_rank_overview/live",
-                    "POST",
-                    credentials,
-                    [{
-                        "target": target_domain,
-                        "location_code": 2840,  # United States
-                        "language_code": "en",
-                    }]
-                )
+                history_response = history_future.result()
                 
                 tasks = history_response.get('tasks', [])
                 for task in tasks:
@@ -185,18 +316,7 @@ def sync_dataforseo_to_bigquery(request):
         logger.info("Fetching keywords from DataForSEO...")
         
         try:
-            keywords_response = dataforseo_request(
-                "dataforseo_labs/google/ranked_keywords/live",
-                "POST",
-                credentials,
-                [{
-                    "target": target_domain,
-                    "location_code": 2840,
-                    "language_code": "en",
-                    "limit": 100,
-                    "order_by": ["keyword_data.keyword_info.search_volume,desc"],
-                }]
-            )
+            keywords_response = keywords_future.result()
             
             tasks = keywords_response.get('tasks', [])
             for task in tasks:
@@ -285,16 +405,7 @@ def sync_dataforseo_to_bigquery(request):
         logger.info("Fetching backlinks from DataForSEO...")
         
         try:
-            backlinks_response = dataforseo_request(
-                "backlinks/summary/live",
-                "POST",
-                credentials,
-                [{
-                    "target": target_domain,
-                    "internal_list_limit": 10,
-                    "include_subdomains": True,
-                }]
-            )
+            backlinks_response = backlinks_future.result()
             
             tasks = backlinks_response.get('tasks', [])
             if not tasks:
@@ -398,13 +509,14 @@ def sync_dataforseo_to_bigquery(request):
                 except Exception as e:
                     logger.warning(f"Delete backlinks warning: {e}")
             
-            # Insert new rows
-            errors = bq.insert_rows_json(table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
+            # Insert new rows, coerced to the table's column types
+            errors = bq.insert_rows_json(table_ref, convert_rows(bq, table_ref, rows), skip_invalid_rows=True, ignore_unknown_values=True)
             
             if errors:
                 logger.warning(f"Some rows failed: {errors[:3]}")
             else:
                 results['rows_inserted'] = len(rows)
+                record_dirty_partitions(bq, organization_id, dirty_ranges(rows), 'dataforseo')
         
         # Update connection status
         connection_ref.update({
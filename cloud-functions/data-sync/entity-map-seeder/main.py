@@ -5,7 +5,8 @@ Reads existing Firestore data and creates canonical entity mappings
 
 import functions_framework
 from google.cloud import firestore, bigquery
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 import re
 import json
 import logging
@@ -21,6 +22,24 @@ PROJECT_ID = "opsos-864a1"
 DATASET_ID = "marketing_ai"
 TABLE_ID = "entity_map"
 
+# Firestore doc per org holding the syncedAt watermark of the last successful seed
+STATE_COLLECTION = "entity_map_seeder_state"
+# Field the source syncs stamp on every write (stripe, dataforseo and activecampaign routes)
+WATERMARK_FIELD = "syncedAt"
+# Collections whose writers don't stamp syncedAt; always scanned in full
+UNSTAMPED_COLLECTIONS = {'ga_pages', 'ga_campaigns'}
+FIRESTORE_BATCH_LIMIT = 500
+
+ENTITY_MAP_SCHEMA = [
+    bigquery.SchemaField("canonical_entity_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("entity_type", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("source", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("source_entity_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("source_metadata", "JSON", mode="NULLABLE"),
+    bigquery.SchemaField("created_at", "TIMESTAMP", mode="NULLABLE"),
+    bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
+]
+
 def create_canonical_id(entity_type: str, name: str) -> str:
     """
     Create a canonical entity ID from entity type and name
@@ -40,14 +59,25 @@ def create_canonical_id(entity_type: str, name: str) -> str:
     return f"{entity_type}_{clean_name}"
 
 
-def seed_pages(organization_id: str):
+def stream_collection(collection: str, organization_id: str, since=None):
+    """
+    Stream an org's docs from a collection, limited to docs synced after `since` when
+    given (collections without syncedAt are always read in full)
+    """
+    query = db.collection(collection).where('organizationId', '==', organization_id)
+    if since and collection not in UNSTAMPED_COLLECTIONS:
+        query = query.where(WATERMARK_FIELD, '>', since)
+    return query.stream()
+
+
+def seed_pages(organization_id: str, since=None):
     """Seed page mappings from ga_pages collection"""
     logger.info(f"Seeding pages for {organization_id}")
     
     mappings = []
     
     # Read ga_pages collection
-    pages_ref = db.collection('ga_pages').where('organizationId', '==', organization_id).stream()
+    pages_ref = stream_collection('ga_pages', organization_id, since)
     
     for page_doc in pages_ref:
         page_data = page_doc.to_dict()
@@ -78,14 +108,14 @@ def seed_pages(organization_id: str):
     return mappings
 
 
-def seed_campaigns(organization_id: str):
+def seed_campaigns(organization_id: str, since=None):
     """Seed campaign mappings from ga_campaigns collection"""
     logger.info(f"Seeding campaigns for {organization_id}")
     
     mappings = []
     
     # Read ga_campaigns collection
-    campaigns_ref = db.collection('ga_campaigns').where('organizationId', '==', organization_id).stream()
+    campaigns_ref = stream_collection('ga_campaigns', organization_id, since)
     
     for campaign_doc in campaigns_ref:
         campaign_data = campaign_doc.to_dict()
@@ -116,14 +146,14 @@ def seed_campaigns(organization_id: str):
     return mappings
 
 
-def seed_keywords(organization_id: str):
+def seed_keywords(organization_id: str, since=None):
     """Seed keyword mappings from dataforseo_keywords collection"""
     logger.info(f"Seeding keywords for {organization_id}")
     
     mappings = []
     
     # Read dataforseo_keywords collection
-    keywords_ref = db.collection('dataforseo_keywords').where('organizationId', '==', organization_id).stream()
+    keywords_ref = stream_collection('dataforseo_keywords', organization_id, since)
     
     for keyword_doc in keywords_ref:
         keyword_data = keyword_doc.to_dict()
@@ -153,14 +183,14 @@ def seed_keywords(organization_id: str):
     return mappings
 
 
-def seed_products(organization_id: str):
+def seed_products(organization_id: str, since=None):
     """Seed product mappings from stripe_products collection"""
     logger.info(f"Seeding products for {organization_id}")
     
     mappings = []
     
     # Read stripe_products collection
-    products_ref = db.collection('stripe_products').where('organizationId', '==', organization_id).stream()
+    products_ref = stream_collection('stripe_products', organization_id, since)
     
     for product_doc in products_ref:
         product_data = product_doc.to_dict()
@@ -192,14 +222,14 @@ def seed_products(organization_id: str):
     return mappings
 
 
-def seed_email_campaigns(organization_id: str):
+def seed_email_campaigns(organization_id: str, since=None):
     """Seed email campaign mappings from activecampaign_campaigns collection"""
     logger.info(f"Seeding email campaigns for {organization_id}")
     
     mappings = []
     
     # Read activecampaign_campaigns collection
-    campaigns_ref = db.collection('activecampaign_campaigns').where('organizationId', '==', organization_id).stream()
+    campaigns_ref = stream_collection('activecampaign_campaigns', organization_id, since)
     
     for campaign_doc in campaigns_ref:
         campaign_data = campaign_doc.to_dict()
@@ -236,41 +266,89 @@ def seed_email_campaigns(organization_id: str):
     return mappings
 
 
+def dedupe_mappings(mappings: list) -> list:
+    """Keep one mapping per (canonical_entity_id, source, source_entity_id); later docs win"""
+    unique = {}
+    for mapping in mappings:
+        key = (mapping['canonical_entity_id'], mapping['source'], mapping['source_entity_id'])
+        unique[key] = mapping
+    return list(unique.values())
+
+
 def write_to_bigquery(mappings: list):
-    """Write entity mappings to BigQuery"""
+    """
+    Upsert entity mappings into BigQuery.
+    
+    Mappings are bulk-loaded into a staging table and MERGEd on
+    (canonical_entity_id, source, source_entity_id), so reseeding updates
+    existing rows instead of appending duplicates.
+    """
     if not mappings:
         logger.warning("No mappings to write")
         return
     
     table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+    staging_ref = f"{PROJECT_ID}.{DATASET_ID}.temp_entity_map_{int(datetime.utcnow().timestamp() * 1000)}"
     
-    # Configure job to overwrite duplicates
     job_config = bigquery.LoadJobConfig(
-        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-        schema=[
-            bigquery.SchemaField("canonical_entity_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("entity_type", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("source", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("source_entity_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("source_metadata", "JSON", mode="NULLABLE"),
-            bigquery.SchemaField("created_at", "TIMESTAMP", mode="NULLABLE"),
-            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
-        ]
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        schema=ENTITY_MAP_SCHEMA,
     )
     
     try:
         job = bq_client.load_table_from_json(
             mappings,
-            table_ref,
+            staging_ref,
             job_config=job_config
         )
         job.result()  # Wait for completion
         
-        logger.info(f"✅ Successfully wrote {len(mappings)} mappings to BigQuery")
+        merge_query = f"""
+        MERGE `{table_ref}` T
+        USING `{staging_ref}` S
+        ON T.canonical_entity_id = S.canonical_entity_id
+           AND T.source = S.source
+           AND T.source_entity_id = S.source_entity_id
+        WHEN MATCHED THEN
+            UPDATE SET
+                entity_type = S.entity_type,
+                source_metadata = S.source_metadata,
+                updated_at = S.updated_at
+        WHEN NOT MATCHED THEN
+            INSERT ROW
+        """
+        merge_job = bq_client.query(merge_query)
+        merge_job.result()
+        
+        logger.info(f"✅ Merged {len(mappings)} mappings into BigQuery ({merge_job.num_dml_affected_rows} rows affected)")
         
     except Exception as e:
         logger.error(f"❌ Error writing to BigQuery: {e}")
         raise
+    finally:
+        bq_client.delete_table(staging_ref, not_found_ok=True)
+
+
+def write_to_firestore(organization_id: str, mappings: list):
+    """Mirror mappings to the Firestore entity_map collection for real-time access"""
+    for i in range(0, len(mappings), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for mapping in mappings[i:i + FIRESTORE_BATCH_LIMIT]:
+            doc_id = f"{mapping['canonical_entity_id']}_{mapping['source']}"
+            doc_ref = db.collection('entity_map').document(doc_id)
+            batch.set(doc_ref, {
+                'organizationId': organization_id,
+                **mapping
+            })
+        batch.commit()
+
+
+def get_watermark(organization_id: str):
+    """syncedAt watermark of the last successful seed, or None to scan everything"""
+    doc = db.collection(STATE_COLLECTION).document(organization_id).get()
+    if doc.exists:
+        return doc.to_dict().get('lastSeededAt')
+    return None
 
 
 @functions_framework.http
@@ -278,9 +356,14 @@ def seed_entity_map(request):
     """
     HTTP Cloud Function to seed entity mappings
     
+    Only docs synced since the last successful seed are read, unless
+    fullRescan is set (docs without syncedAt are only picked up then).
+    ga_pages and ga_campaigns carry no syncedAt and are always read in full.
+    
     Request body:
     {
-      "organizationId": "SBjucW1ztDyFYWBz7ZLE"
+      "organizationId": "SBjucW1ztDyFYWBz7ZLE",
+      "fullRescan": false
     }
     """
     
@@ -290,39 +373,46 @@ def seed_entity_map(request):
         return {'error': 'Missing organizationId'}, 400
     
     organization_id = request_json['organizationId']
+    full_rescan = request_json.get('fullRescan', False)
     
     logger.info(f"🌱 Starting entity map seeding for {organization_id}")
     
     try:
-        # Collect all mappings
-        all_mappings = []
+        since = None if full_rescan else get_watermark(organization_id)
+        # Taken before scanning so docs updated mid-run are picked up next time
+        run_started_at = datetime.now(timezone.utc)
+        
+        if since:
+            logger.info(f"Incremental seed: docs synced after {since}")
+        
+        # Scan the five source collections concurrently
+        seeders = [seed_pages, seed_campaigns, seed_keywords, seed_products, seed_email_campaigns]
+        with ThreadPoolExecutor(max_workers=len(seeders)) as executor:
+            futures = [executor.submit(seeder, organization_id, since) for seeder in seeders]
+            all_mappings = []
+            for future in futures:
+                all_mappings.extend(future.result())
         
-        # Seed each entity type
-        all_mappings.extend(seed_pages(organization_id))
-        all_mappings.extend(seed_campaigns(organization_id))
-        all_mappings.extend(seed_keywords(organization_id))
-        all_mappings.extend(seed_products(organization_id))
-        all_mappings.extend(seed_email_campaigns(organization_id))
+        all_mappings = dedupe_mappings(all_mappings)
         
         # Write to BigQuery
         write_to_bigquery(all_mappings)
         
         # Also write to Firestore for real-time access
-        batch = db.batch()
-        for mapping in all_mappings:
-            doc_id = f"{mapping['canonical_entity_id']}_{mapping['source']}"
-            doc_ref = db.collection('entity_map').document(doc_id)
-            batch.set(doc_ref, {
-                'organizationId': organization_id,
-                **mapping
-            })
-        batch.commit()
+        write_to_firestore(organization_id, all_mappings)
+        
+        db.collection(STATE_COLLECTION).document(organization_id).set({
+            'lastSeededAt': run_started_at,
+            'lastSeedMappings': len(all_mappings),
+            'lastSeedMode': 'full' if not since else 'incremental',
+        }, merge=True)
         
         logger.info(f"✅ Entity map seeding complete!")
         
         return {
             'success': True,
             'organization_id': organization_id,
+            'mode': 'full' if not since else 'incremental',
             'total_mappings': len(all_mappings),
             'breakdown': {
                 'pages': len([m for m in all_mappings if m['entity_type'] == 'page']),
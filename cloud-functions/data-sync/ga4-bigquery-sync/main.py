@@ -11,10 +11,16 @@ import functions_framework
 from google.cloud import firestore, bigquery
 from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import os
+import threading
+import time
 import requests
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.row_converter import compile_row_converter
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +31,31 @@ TABLE_ID = "daily_entity_metrics"
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 
+GA4_PAGE_SIZE = 10000  # GA4 max per request
+
+# GA4 core quota allows 10 concurrent requests per property
+GA4_MAX_CONCURRENT_REQUESTS = int(os.environ.get('GA4_MAX_CONCURRENT_REQUESTS', 10))
+
+# Stop fanning out page requests once the property's hourly token budget gets this low
+GA4_MIN_HOURLY_TOKENS = int(os.environ.get('GA4_MIN_HOURLY_TOKENS', 2000))
+
+GA4_MAX_RETRIES = 5
+
+# Entity types written by this sync (scopes full-resync replacement)
+GA4_ENTITY_TYPES = ['website_traffic', 'traffic_source', 'page', 'google_ads_campaign', 'google_ads_adgroup']
+
+# Stop starting new full-resync windows after this long so the function returns before its
+# 540s timeout; the checkpoint lets the next invocation pick up where this one stopped
+FULL_SYNC_TIME_BUDGET_SECONDS = int(os.environ.get('FULL_SYNC_TIME_BUDGET_SECONDS', 420))
+
+# Keep-alive session shared by all GA4 calls (one TLS handshake per pooled connection)
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=GA4_MAX_CONCURRENT_REQUESTS))
+
+ga4_request_slots = threading.BoundedSemaphore(GA4_MAX_CONCURRENT_REQUESTS)
+ga4_quota_lock = threading.Lock()
+ga4_property_quota = {}  # property_id -> last propertyQuota returned by the API
+
 
 def refresh_access_token(db, organization_id: str, connection_data: dict) -> str:
     """Refresh Google OAuth access token if expired"""
@@ -75,56 +106,94 @@ def refresh_access_token(db, organization_id: str, connection_data: dict) -> str
     return new_access_token
 
 
+def ga4_page_concurrency(property_id: str) -> int:
+    """How many report pages may be fetched in parallel given the property's remaining token quota"""
+    with ga4_quota_lock:
+        quota = ga4_property_quota.get(property_id)
+    
+    if not quota:
+        return GA4_MAX_CONCURRENT_REQUESTS
+    
+    tokens_per_hour = quota.get('tokensPerHour', {})
+    remaining = int(tokens_per_hour.get('remaining', 0) or 0)
+    consumed = max(int(tokens_per_hour.get('consumed', 1) or 1), 1)
+    
+    if remaining < GA4_MIN_HOURLY_TOKENS:
+        logger.warning(f"GA4 hourly tokens low for property {property_id} ({remaining} left), fetching pages sequentially")
+        return 1
+    
+    # Each page costs roughly what the last request did
+    return max(1, min(GA4_MAX_CONCURRENT_REQUESTS, (remaining - GA4_MIN_HOURLY_TOKENS) // consumed))
+
+
 def ga4_run_report(access_token: str, property_id: str, report_request: dict) -> dict:
-    """Execute GA4 Data API runReport"""
+    """Execute GA4 Data API runReport (retries quota and transient errors with backoff)"""
     url = f"https://analyticsdata.googleapis.com/v1beta/properties/{property_id}:runReport"
+    report_request = {**report_request, 'returnPropertyQuota': True}
     
-    response = requests.post(
-        url,
-        headers={
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        },
-        json=report_request
-    )
+    for attempt in range(GA4_MAX_RETRIES):
+        with ga4_request_slots:
+            response = http_session.post(
+                url,
+                headers={
+                    'Authorization': f'Bearer {access_token}',
+                    'Content-Type': 'application/json',
+                },
+                json=report_request,
+                timeout=120,
+            )
+        
+        if response.status_code in (429, 500, 503) and attempt < GA4_MAX_RETRIES - 1:
+            delay = float(response.headers.get('Retry-After', 2 ** attempt))
+            logger.warning(f"GA4 API returned {response.status_code}, retrying in {delay}s...")
+            time.sleep(delay)
+            continue
+        break
     
     if not response.ok:
-        logger.error(f"GA4 API error: {response.text}")
-        return {}
+        # Raise rather than return an empty page: a report missing pages must not
+        # pass for a complete one and replace existing data
+        raise ValueError(f"GA4 API error {response.status_code}: {response.text}")
+    
+    data = response.json()
+    if data.get('propertyQuota'):
+        with ga4_quota_lock:
+            ga4_property_quota[property_id] = data['propertyQuota']
     
-    return response.json()
+    return data
 
 
 def ga4_run_report_paginated(access_token: str, property_id: str, report_request: dict, max_rows: int = None) -> list:
-    """Execute GA4 Data API runReport with pagination to fetch ALL rows (or up to max_rows if specified)"""
-    all_rows = []
-    offset = 0
-    limit = 10000  # GA4 max per request
+    """
+    Execute GA4 Data API runReport with pagination to fetch ALL rows (or up to max_rows if specified).
     
-    # Set initial limit
-    report_request['limit'] = limit
+    The first page reveals rowCount; the remaining offsets are then fetched concurrently.
+    """
+    limit = GA4_PAGE_SIZE
+    if max_rows:
+        limit = min(limit, max_rows)
     
-    while True:
-        if max_rows and len(all_rows) >= max_rows:
-            break
-            
-        report_request['offset'] = offset
-        
-        data = ga4_run_report(access_token, property_id, report_request)
-        rows = data.get('rows', [])
-        
-        if not rows:
-            break
-        
-        all_rows.extend(rows)
-        logger.info(f"Fetched {len(all_rows)} rows so far...")
-        
-        # Check if there are more rows
-        row_count = int(data.get('rowCount', 0))
-        if len(all_rows) >= row_count or len(rows) < limit:
-            break
-        
-        offset += limit
+    first_page = ga4_run_report(access_token, property_id, {**report_request, 'limit': limit, 'offset': 0})
+    all_rows = first_page.get('rows', [])
+    
+    row_count = int(first_page.get('rowCount', 0))
+    if max_rows:
+        row_count = min(row_count, max_rows)
+    
+    offsets = list(range(len(all_rows), row_count, limit)) if len(all_rows) == limit else []
+    
+    if offsets:
+        workers = min(len(offsets), ga4_page_concurrency(property_id))
+        logger.info(f"Fetching {len(offsets)} more pages ({row_count} rows) with {workers} workers...")
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pages = executor.map(
+                lambda offset: ga4_run_report(access_token, property_id, {**report_request, 'limit': limit, 'offset': offset}),
+                offsets,
+            )
+            # map() yields in offset order, so rows stay in report order
+            for page in pages:
+                all_rows.extend(page.get('rows', []))
     
     # Trim to max_rows if specified and exceeded
     if max_rows and len(all_rows) > max_rows:
@@ -134,6 +203,599 @@ def ga4_run_report_paginated(access_token: str, property_id: str, report_request
     return all_rows
 
 
+def build_ga4_report_requests(start_date, end_date) -> dict:
+    """Report definitions for one sync range: name -> (runReport body, max_rows)"""
+    date_ranges = [{'startDate': start_date.isoformat(), 'endDate': end_date.isoformat()}]
+    
+    return {
+        'daily': ({
+            'dateRanges': date_ranges,
+            'dimensions': [{'name': 'date'}],
+            'metrics': [
+                {'name': 'activeUsers'},
+                {'name': 'newUsers'},
+                {'name': 'sessions'},
+                {'name': 'screenPageViews'},
+                {'name': 'averageSessionDuration'},
+                {'name': 'bounceRate'},
+                {'name': 'engagedSessions'},
+                {'name': 'totalRevenue'},
+                {'name': 'conversions'},
+                {'name': 'engagementRate'},
+            ]
+        }, None),
+        # Traffic sources with date dimension for daily tracking
+        'sources': ({
+            'dateRanges': date_ranges,
+            'dimensions': [
+                {'name': 'date'},
+                {'name': 'sessionDefaultChannelGroup'},
+                {'name': 'sessionSourceMedium'},
+            ],
+            'metrics': [
+                {'name': 'sessions'},
+                {'name': 'activeUsers'},
+                {'name': 'conversions'},
+                {'name': 'totalRevenue'},
+                {'name': 'bounceRate'},
+                {'name': 'engagementRate'},
+            ],
+        }, None),
+        # Pages with date dimension for daily tracking
+        'pages': ({
+            'dateRanges': date_ranges,
+            'dimensions': [
+                {'name': 'date'},
+                {'name': 'pagePath'},
+            ],
+            'metrics': [
+                {'name': 'screenPageViews'},
+                {'name': 'activeUsers'},
+                {'name': 'sessions'},
+                {'name': 'averageSessionDuration'},
+                {'name': 'bounceRate'},
+                {'name': 'conversions'},
+                {'name': 'totalRevenue'},
+                {'name': 'engagementRate'},
+            ],
+            'orderBys': [
+                {'dimension': {'dimensionName': 'date'}, 'desc': True},
+                {'metric': {'metricName': 'screenPageViews'}, 'desc': True},
+            ],
+        }, 50000),  # Limit total rows to prevent timeout
+        # Google Ads campaign data with detailed dimensions
+        'campaigns': ({
+            'dateRanges': date_ranges,
+            'dimensions': [
+                {'name': 'date'},
+                {'name': 'sessionGoogleAdsCampaignName'},
+                {'name': 'sessionGoogleAdsCampaignId'},
+                {'name': 'sessionGoogleAdsCampaignType'},
+                {'name': 'sessionGoogleAdsAdNetworkType'},
+            ],
+            'metrics': [
+                {'name': 'sessions'},
+                {'name': 'activeUsers'},
+                {'name': 'engagedSessions'},
+                {'name': 'conversions'},
+                {'name': 'totalRevenue'},
+                {'name': 'engagementRate'},
+                {'name': 'bounceRate'},
+            ],
+            'dimensionFilter': {
+                'filter': {
+                    'fieldName': 'sessionGoogleAdsCampaignName',
+                    'stringFilter': {
+                        'matchType': 'FULL_REGEXP',
+                        'value': '.+',  # Non-empty campaign names only
+                    }
+                }
+            },
+            'orderBys': [
+                {'dimension': {'dimensionName': 'date'}, 'desc': True},
+                {'metric': {'metricName': 'sessions'}, 'desc': True},
+            ],
+        }, 10000),
+        # Google Ads ad group data
+        'adgroups': ({
+            'dateRanges': date_ranges,
+            'dimensions': [
+                {'name': 'date'},
+                {'name': 'sessionGoogleAdsCampaignName'},
+                {'name': 'sessionGoogleAdsAdGroupName'},
+                {'name': 'sessionGoogleAdsAdGroupId'},
+            ],
+            'metrics': [
+                {'name': 'sessions'},
+                {'name': 'activeUsers'},
+                {'name': 'engagedSessions'},
+                {'name': 'conversions'},
+                {'name': 'totalRevenue'},
+            ],
+            'dimensionFilter': {
+                'filter': {
+                    'fieldName': 'sessionGoogleAdsAdGroupName',
+                    'stringFilter': {
+                        'matchType': 'FULL_REGEXP',
+                        'value': '.+',  # Non-empty ad group names only
+                    }
+                }
+            },
+            'orderBys': [
+                {'dimension': {'dimensionName': 'date'}, 'desc': True},
+                {'metric': {'metricName': 'sessions'}, 'desc': True},
+            ],
+        }, 20000),
+    }
+
+
+def fetch_ga4_reports(access_token: str, property_id: str, start_date, end_date) -> dict:
+    """
+    Issue all independent reports for a date range in parallel.
+    
+    Returns name -> Future of the report's rows; calling result() re-raises
+    that report's error so callers can handle each report separately.
+    """
+    report_requests = build_ga4_report_requests(start_date, end_date)
+    executor = ThreadPoolExecutor(max_workers=len(report_requests))
+    
+    futures = {
+        name: executor.submit(ga4_run_report_paginated, access_token, property_id, report_request, max_rows)
+        for name, (report_request, max_rows) in report_requests.items()
+    }
+    executor.shutdown(wait=False)
+    
+    return futures
+
+
+def collect_ga4_rows(access_token: str, property_id: str, organization_id: str, start_date, end_date) -> tuple:
+    """
+    Fetch all GA4 reports for a date range and transform them into daily_entity_metrics rows
+    
+    Returns (rows, results, failed_entity_types). A report that failed (or failed
+    partway through parsing) contributes no rows, and its entity type is returned
+    so callers neither replace that type's data nor treat the range as complete.
+    """
+    results = {
+        'daily_records': 0,
+        'traffic_sources': 0,
+        'pages_processed': 0,
+    }
+    
+    rows = []
+    failed_entity_types = set()
+    now_iso = datetime.utcnow().isoformat()
+    
+    # All five reports are independent: issue them together over the pooled session
+    report_futures = fetch_ga4_reports(access_token, property_id, start_date, end_date)
+    
+    # ============================================
+    # 1. FETCH DAILY METRICS FROM GA4
+    # ============================================
+    logger.info("Fetching daily metrics from GA4 API...")
+    
+    try:
+        daily_rows = report_futures['daily'].result()
+        
+        for row in daily_rows:
+            results['daily_records'] += 1
+            
+            date_val = row['dimensionValues'][0]['value']
+            # Convert YYYYMMDD to YYYY-MM-DD
+            date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
+            
+            metrics = row['metricValues']
+            
+            users = int(metrics[0]['value'])
+            new_users = int(metrics[1]['value'])
+            sessions = int(metrics[2]['value'])
+            pageviews = int(metrics[3]['value'])
+            avg_session_duration = float(metrics[4]['value'])
+            bounce_rate = float(metrics[5]['value'])
+            engaged_sessions = int(metrics[6]['value'])
+            revenue = float(metrics[7]['value'])
+            conversions = int(metrics[8]['value'])
+            engagement_rate = float(metrics[9]['value'])
+            
+            # Calculate conversion_rate
+            conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
+            
+            # Calculate pages_per_session
+            pages_per_session = (pageviews / sessions) if sessions > 0 else 0
+            
+            bq_row = {
+                'organization_id': organization_id,
+                'date': date_str,
+                'canonical_entity_id': f"ga4_daily_{date_str}",
+                'entity_type': 'website_traffic',
+                
+                # Core metrics needed by detectors
+                'users': users,
+                'sessions': sessions,
+                'pageviews': pageviews,
+                'conversions': conversions,
+                'conversion_rate': conversion_rate,
+                'revenue': revenue,
+                'avg_session_duration': avg_session_duration,
+                'bounce_rate': bounce_rate,
+                'engagement_rate': engagement_rate,
+                'pages_per_session': pages_per_session,
+                'dwell_time': avg_session_duration,  # Use session duration as dwell time proxy
+                
+                'created_at': now_iso,
+                'updated_at': now_iso,
+            }
+            rows.append(bq_row)
+            
+    except Exception as e:
+        logger.error(f"Error fetching daily metrics: {e}")
+        failed_entity_types.add('website_traffic')
+    
+    # ============================================
+    # 2. FETCH TRAFFIC SOURCES BY DAY (for daily tracking)
+    # ============================================
+    logger.info("Fetching traffic sources by day from GA4 API...")
+    
+    try:
+        source_rows = report_futures['sources'].result()
+        
+        for row in source_rows:
+            results['traffic_sources'] += 1
+            
+            date_val = row['dimensionValues'][0]['value']
+            date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
+            channel = row['dimensionValues'][1]['value']
+            source_medium = row['dimensionValues'][2]['value']
+            metrics = row['metricValues']
+            
+            sessions = int(metrics[0]['value'])
+            users = int(metrics[1]['value'])
+            conversions = int(metrics[2]['value'])
+            revenue = float(metrics[3]['value'])
+            bounce_rate = float(metrics[4]['value'])
+            engagement_rate = float(metrics[5]['value'])
+            
+            # Calculate conversion_rate
+            conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
+            
+            bq_row = {
+                'organization_id': organization_id,
+                'date': date_str,
+                'canonical_entity_id': f"ga4_source_{date_str}_{channel}_{source_medium}".replace(' ', '_').replace('/', '_'),
+                'entity_type': 'traffic_source',
+                
+                # Core metrics needed by detectors
+                'sessions': sessions,
+                'users': users,
+                'conversions': conversions,
+                'conversion_rate': conversion_rate,
+                'revenue': revenue,
+                'bounce_rate': bounce_rate,
+                'engagement_rate': engagement_rate,
+                
+                'source_breakdown': json.dumps({
+                    'channel': channel,
+                    'source_medium': source_medium,
+                    'name': f"{channel} - {source_medium}",
+                }),
+                
+                'created_at': now_iso,
+                'updated_at': now_iso,
+            }
+            rows.append(bq_row)
+            
+    except Exception as e:
+        logger.error(f"Error fetching traffic sources: {e}")
+        failed_entity_types.add('traffic_source')
+    
+    # ============================================
+    # 3. FETCH TOP PAGES BY DAY (for daily tracking)
+    # ============================================
+    logger.info("Fetching top pages by day from GA4 API...")
+    
+    try:
+        pages_rows = report_futures['pages'].result()
+        
+        for row in pages_rows:
+            results['pages_processed'] += 1
+            
+            date_val = row['dimensionValues'][0]['value']
+            date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
+            page_path = row['dimensionValues'][1]['value']
+            metrics = row['metricValues']
+            
+            pageviews = int(metrics[0]['value'])
+            users = int(metrics[1]['value'])
+            sessions = int(metrics[2]['value'])
+            avg_session_duration = float(metrics[3]['value'])
+            bounce_rate = float(metrics[4]['value'])
+            conversions = int(metrics[5]['value'])
+            revenue = float(metrics[6]['value'])
+            engagement_rate = float(metrics[7]['value'])
+            
+            # Calculate conversion_rate and pages_per_session
+            conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
+            
+            bq_row = {
+                'organization_id': organization_id,
+                'date': date_str,
+                'canonical_entity_id': f"page_{date_str}_{page_path[:150]}",  # Include date in entity ID
+                'entity_type': 'page',
+                
+                # Core metrics needed by detectors
+                'pageviews': pageviews,
+                'users': users,
+                'sessions': sessions,
+                'conversions': conversions,
+                'conversion_rate': conversion_rate,
+                'revenue': revenue,
+                'avg_session_duration': avg_session_duration,
+                'bounce_rate': bounce_rate,
+                'engagement_rate': engagement_rate,
+                'dwell_time': avg_session_duration,  # Use session duration as dwell time
+                
+                # Store page path in source_breakdown JSON
+                'source_breakdown': json.dumps({
+                    'page_path': page_path,
+                }),
+                
+                'created_at': now_iso,
+                'updated_at': now_iso,
+            }
+            rows.append(bq_row)
+            
+    except Exception as e:
+        logger.error(f"Error fetching pages: {e}")
+        failed_entity_types.add('page')
+    
+    # ============================================
+    # 4. FETCH GOOGLE ADS CAMPAIGNS BY DAY
+    # ============================================
+    logger.info("Fetching Google Ads campaigns by day from GA4 API...")
+    results['google_ads_campaigns'] = 0
+    
+    try:
+        campaign_rows = report_futures['campaigns'].result()
+        
+        for row in campaign_rows:
+            date_val = row['dimensionValues'][0]['value']
+            date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
+            campaign_name = row['dimensionValues'][1]['value']
+            campaign_id = row['dimensionValues'][2]['value']
+            campaign_type = row['dimensionValues'][3]['value']
+            ad_network = row['dimensionValues'][4]['value']
+            
+            # Skip (not set) campaigns - these are not real Google Ads traffic
+            if campaign_name == '(not set)':
+                continue
+            
+            results['google_ads_campaigns'] += 1
+            
+            metrics = row['metricValues']
+            
+            sessions = int(metrics[0]['value'])
+            users = int(metrics[1]['value'])
+            engaged_sessions = int(metrics[2]['value'])
+            conversions = int(metrics[3]['value'])
+            revenue = float(metrics[4]['value'])
+            engagement_rate = float(metrics[5]['value'])
+            bounce_rate = float(metrics[6]['value'])
+            
+            # Calculate conversion_rate
+            conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
+            
+            # Create safe entity ID
+            safe_campaign_name = campaign_name[:100].replace(' ', '_').replace('/', '_').replace('-', '_')
+            
+            bq_row = {
+                'organization_id': organization_id,
+                'date': date_str,
+                'canonical_entity_id': f"gads_campaign_{date_str}_{campaign_id}_{safe_campaign_name}",
+                'entity_type': 'google_ads_campaign',
+                
+                # Core metrics
+                'sessions': sessions,
+                'users': users,
+                'conversions': conversions,
+                'conversion_rate': conversion_rate,
+                'revenue': revenue,
+                'bounce_rate': bounce_rate,
+                'engagement_rate': engagement_rate,
+                
+                # Store campaign details in source_breakdown JSON
+                'source_breakdown': json.dumps({
+                    'campaign_name': campaign_name,
+                    'campaign_id': campaign_id,
+                    'campaign_type': campaign_type,
+                    'ad_network': ad_network,
+                    'engaged_sessions': engaged_sessions,
+                }),
+                
+                'created_at': now_iso,
+                'updated_at': now_iso,
+            }
+            rows.append(bq_row)
+        
+        logger.info(f"Fetched {results['google_ads_campaigns']} Google Ads campaign rows")
+            
+    except Exception as e:
+        logger.error(f"Error fetching Google Ads campaigns: {e}")
+        failed_entity_types.add('google_ads_campaign')
+    
+    # ============================================
+    # 5. FETCH GOOGLE ADS AD GROUPS BY DAY (more granular)
+    # ============================================
+    logger.info("Fetching Google Ads ad groups by day from GA4 API...")
+    results['google_ads_adgroups'] = 0
+    
+    try:
+        adgroup_rows = report_futures['adgroups'].result()
+        
+        for row in adgroup_rows:
+            date_val = row['dimensionValues'][0]['value']
+            date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
+            campaign_name = row['dimensionValues'][1]['value']
+            adgroup_name = row['dimensionValues'][2]['value']
+            adgroup_id = row['dimensionValues'][3]['value']
+            
+            # Skip (not set) ad groups - these are not real Google Ads traffic
+            if adgroup_name == '(not set)' or campaign_name == '(not set)':
+                continue
+            
+            results['google_ads_adgroups'] += 1
+            
+            metrics = row['metricValues']
+            
+            sessions = int(metrics[0]['value'])
+            users = int(metrics[1]['value'])
+            engaged_sessions = int(metrics[2]['value'])
+            conversions = int(metrics[3]['value'])
+            revenue = float(metrics[4]['value'])
+            
+            # Calculate conversion_rate
+            conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
+            
+            # Create safe entity ID
+            safe_adgroup_name = adgroup_name[:80].replace(' ', '_').replace('/', '_').replace('-', '_')
+            
+            bq_row = {
+                'organization_id': organization_id,
+                'date': date_str,
+                'canonical_entity_id': f"gads_adgroup_{date_str}_{adgroup_id}_{safe_adgroup_name}",
+                'entity_type': 'google_ads_adgroup',
+                
+                # Core metrics
+                'sessions': sessions,
+                'users': users,
+                'conversions': conversions,
+                'conversion_rate': conversion_rate,
+                'revenue': revenue,
+                
+                # Store ad group details in source_breakdown JSON
+                'source_breakdown': json.dumps({
+                    'campaign_name': campaign_name,
+                    'adgroup_name': adgroup_name,
+                    'adgroup_id': adgroup_id,
+                    'engaged_sessions': engaged_sessions,
+                }),
+                
+                'created_at': now_iso,
+                'updated_at': now_iso,
+            }
+            rows.append(bq_row)
+        
+        logger.info(f"Fetched {results['google_ads_adgroups']} Google Ads ad group rows")
+            
+    except Exception as e:
+        logger.error(f"Error fetching Google Ads ad groups: {e}")
+        failed_entity_types.add('google_ads_adgroup')
+    
+    # Drop the rows a failed report parsed before its error
+    rows = [row for row in rows if row['entity_type'] not in failed_entity_types]
+    
+    return rows, results, failed_entity_types
+
+
+def month_windows(start_date, end_date) -> list:
+    """Split [start_date, end_date] into calendar-month windows"""
+    windows = []
+    window_start = start_date
+    
+    while window_start <= end_date:
+        next_month = (window_start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        window_end = min(next_month - timedelta(days=1), end_date)
+        windows.append((window_start, window_end))
+        window_start = next_month
+    
+    return windows
+
+
+def merge_rows_to_bigquery(bq, rows: list, organization_id: str, replace_start=None, replace_end=None) -> int:
+    """
+    Upsert rows into daily_entity_metrics through a temp table and MERGE.
+    
+    With replace_start/replace_end, target rows of the same org and entity types in that
+    date range that are missing from the new data are deleted in the same MERGE, so the
+    range is replaced atomically.
+    """
+    if not rows:
+        return 0
+    
+    table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+    temp_table_id = f"temp_ga4_sync_{organization_id.replace('-', '_')}_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+    temp_table_ref = f"{PROJECT_ID}.{DATASET_ID}.{temp_table_id}"
+    
+    target_table = bq.get_table(table_ref)
+    
+    replace_clause = ""
+    if replace_start and replace_end:
+        # Only replace entity types the window actually returned: collect_ga4_rows drops
+        # every row of a failed report, so its existing data is never wiped
+        entity_types = sorted({row['entity_type'] for row in rows})
+        if entity_types:
+            entity_type_list = ", ".join(f"'{t}'" for t in entity_types)
+            replace_clause = f"""
+            WHEN NOT MATCHED BY SOURCE
+                AND target.organization_id = '{organization_id}'
+                AND target.date BETWEEN '{replace_start.isoformat()}' AND '{replace_end.isoformat()}'
+                AND target.entity_type IN ({entity_type_list}) THEN
+                DELETE
+            """
+    
+    try:
+        # Load job rather than streaming: it either loads every row or fails, so the
+        # replace clause can never delete target rows that were dropped on the way in
+        job_config = bigquery.LoadJobConfig(
+            schema=target_table.schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            ignore_unknown_values=True,
+        )
+        staged = compile_row_converter(target_table.schema)(rows)
+        load_job = bq.load_table_from_json(staged, temp_table_ref, job_config=job_config)
+        load_job.result()
+        total_inserted = load_job.output_rows or 0
+        
+        if total_inserted != len(rows):
+            raise RuntimeError(f"Temp table load wrote {total_inserted} of {len(rows)} rows, aborting MERGE")
+        
+        merge_query = f"""
+        MERGE `{table_ref}` AS target
+        USING `{temp_table_ref}` AS source
+        ON target.organization_id = source.organization_id
+           AND target.canonical_entity_id = source.canonical_entity_id
+           AND target.date = source.date
+           AND target.entity_type = source.entity_type
+        WHEN MATCHED THEN
+            UPDATE SET
+                users = source.users,
+                sessions = source.sessions,
+                pageviews = source.pageviews,
+                conversions = source.conversions,
+                conversion_rate = source.conversion_rate,
+                revenue = source.revenue,
+                bounce_rate = source.bounce_rate,
+                avg_session_duration = source.avg_session_duration,
+                engagement_rate = source.engagement_rate,
+                pages_per_session = source.pages_per_session,
+                dwell_time = source.dwell_time,
+                source_breakdown = source.source_breakdown,
+                updated_at = source.updated_at
+        WHEN NOT MATCHED THEN
+            INSERT ROW
+        {replace_clause}
+        """
+        
+        bq.query(merge_query).result()
+        logger.info(f"MERGE completed: {total_inserted} rows processed")
+        return total_inserted
+    
+    finally:
+        try:
+            bq.delete_table(temp_table_ref, not_found_ok=True)
+        except Exception as cleanup_error:
+            logger.warning(f"Failed to clean up temp table: {cleanup_error}")
+
+
 @functions_framework.http
 def sync_ga4_to_bigquery(request):
     """Sync GA4 data directly to BigQuery"""
@@ -169,7 +831,7 @@ def sync_ga4_to_bigquery(request):
         logger.info(f"🚀 Starting GA4 → BigQuery {sync_mode.upper()} sync for org: {organization_id} ({start_date} to {end_date})")
     else:
         # Update sync: last 30 days, uses MERGE to avoid duplicates
-        # Full sync: all historical data (5 years), deletes and rewrites
+        # Full sync: all historical data (5 years), replaced month by month with resume
         if sync_mode == 'full':
             days_back = request_json.get('daysBack', 1825)  # 5 years for full resync
         else:
@@ -209,569 +871,102 @@ def sync_ga4_to_bigquery(request):
             'daily_records': 0,
             'traffic_sources': 0,
             'pages_processed': 0,
+            'google_ads_campaigns': 0,
+            'google_ads_adgroups': 0,
             'rows_inserted': 0,
+            'windows_failed': 0,
         }
         
-        rows = []
-        now_iso = datetime.utcnow().isoformat()
-        
-        # ============================================
-        # 1. FETCH DAILY METRICS FROM GA4
-        # ============================================
-        logger.info("Fetching daily metrics from GA4 API...")
-        
-        try:
-            daily_report = ga4_run_report(access_token, property_id, {
-                'dateRanges': [{'startDate': start_date.isoformat(), 'endDate': end_date.isoformat()}],
-                'dimensions': [{'name': 'date'}],
-                'metrics': [
-                    {'name': 'activeUsers'},
-                    {'name': 'newUsers'},
-                    {'name': 'sessions'},
-                    {'name': 'screenPageViews'},
-                    {'name': 'averageSessionDuration'},
-                    {'name': 'bounceRate'},
-                    {'name': 'engagedSessions'},
-                    {'name': 'totalRevenue'},
-                    {'name': 'conversions'},
-                    {'name': 'engagementRate'},
-                ]
-            })
+        if sync_mode == 'full':
+            # ============================================
+            # FULL RESYNC: month windows, each replaced via MERGE and checkpointed
+            # ============================================
+            checkpoint = {} if request_json.get('restart') else (connection_data.get('fullSyncCheckpoint') or {})
             
-            for row in daily_report.get('rows', []):
-                results['daily_records'] += 1
-                
-                date_val = row['dimensionValues'][0]['value']
-                # Convert YYYYMMDD to YYYY-MM-DD
-                date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
-                
-                metrics = row['metricValues']
-                
-                users = int(metrics[0]['value'])
-                new_users = int(metrics[1]['value'])
-                sessions = int(metrics[2]['value'])
-                pageviews = int(metrics[3]['value'])
-                avg_session_duration = float(metrics[4]['value'])
-                bounce_rate = float(metrics[5]['value'])
-                engaged_sessions = int(metrics[6]['value'])
-                revenue = float(metrics[7]['value'])
-                conversions = int(metrics[8]['value'])
-                engagement_rate = float(metrics[9]['value'])
-                
-                # Calculate conversion_rate
-                conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
-                
-                # Calculate pages_per_session
-                pages_per_session = (pageviews / sessions) if sessions > 0 else 0
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'canonical_entity_id': f"ga4_daily_{date_str}",
-                    'entity_type': 'website_traffic',
-                    
-                    # Core metrics needed by detectors
-                    'users': users,
-                    'sessions': sessions,
-                    'pageviews': pageviews,
-                    'conversions': conversions,
-                    'conversion_rate': conversion_rate,
-                    'revenue': revenue,
-                    'avg_session_duration': avg_session_duration,
-                    'bounce_rate': bounce_rate,
-                    'engagement_rate': engagement_rate,
-                    'pages_per_session': pages_per_session,
-                    'dwell_time': avg_session_duration,  # Use session duration as dwell time proxy
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(bq_row)
-                
-        except Exception as e:
-            logger.error(f"Error fetching daily metrics: {e}")
-        
-        # ============================================
-        # 2. FETCH TRAFFIC SOURCES BY DAY (for daily tracking)
-        # ============================================
-        logger.info("Fetching traffic sources by day from GA4 API...")
-        
-        try:
-            # Fetch traffic sources with date dimension for daily tracking
-            source_rows = ga4_run_report_paginated(access_token, property_id, {
-                'dateRanges': [{'startDate': start_date.isoformat(), 'endDate': end_date.isoformat()}],
-                'dimensions': [
-                    {'name': 'date'},
-                    {'name': 'sessionDefaultChannelGroup'},
-                    {'name': 'sessionSourceMedium'},
-                ],
-                'metrics': [
-                    {'name': 'sessions'},
-                    {'name': 'activeUsers'},
-                    {'name': 'conversions'},
-                    {'name': 'totalRevenue'},
-                    {'name': 'bounceRate'},
-                    {'name': 'engagementRate'},
-                ],
-            })
+            # A re-invocation without an explicit range resumes the interrupted resync
+            if checkpoint and not (explicit_start and explicit_end):
+                start_date = datetime.strptime(checkpoint['startDate'], '%Y-%m-%d').date()
+                end_date = datetime.strptime(checkpoint['endDate'], '%Y-%m-%d').date()
             
-            for row in source_rows:
-                results['traffic_sources'] += 1
-                
-                date_val = row['dimensionValues'][0]['value']
-                date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
-                channel = row['dimensionValues'][1]['value']
-                source_medium = row['dimensionValues'][2]['value']
-                metrics = row['metricValues']
-                
-                sessions = int(metrics[0]['value'])
-                users = int(metrics[1]['value'])
-                conversions = int(metrics[2]['value'])
-                revenue = float(metrics[3]['value'])
-                bounce_rate = float(metrics[4]['value'])
-                engagement_rate = float(metrics[5]['value'])
-                
-                # Calculate conversion_rate
-                conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'canonical_entity_id': f"ga4_source_{date_str}_{channel}_{source_medium}".replace(' ', '_').replace('/', '_'),
-                    'entity_type': 'traffic_source',
-                    
-                    # Core metrics needed by detectors
-                    'sessions': sessions,
-                    'users': users,
-                    'conversions': conversions,
-                    'conversion_rate': conversion_rate,
-                    'revenue': revenue,
-                    'bounce_rate': bounce_rate,
-                    'engagement_rate': engagement_rate,
-                    
-                    'source_breakdown': json.dumps({
-                        'channel': channel,
-                        'source_medium': source_medium,
-                        'name': f"{channel} - {source_medium}",
-                    }),
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(bq_row)
-                
-        except Exception as e:
-            logger.error(f"Error fetching traffic sources: {e}")
-        
-        # ============================================
-        # 3. FETCH TOP PAGES BY DAY (for daily tracking)
-        # ============================================
-        logger.info("Fetching top pages by day from GA4 API...")
-        
-        try:
-            # Fetch pages with date dimension for daily tracking
-            # Limit to top 100 pages per day to avoid massive row counts
-            pages_rows = ga4_run_report_paginated(access_token, property_id, {
-                'dateRanges': [{'startDate': start_date.isoformat(), 'endDate': end_date.isoformat()}],
-                'dimensions': [
-                    {'name': 'date'},
-                    {'name': 'pagePath'},
-                ],
-                'metrics': [
-                    {'name': 'screenPageViews'},
-                    {'name': 'activeUsers'},
-                    {'name': 'sessions'},
-                    {'name': 'averageSessionDuration'},
-                    {'name': 'bounceRate'},
-                    {'name': 'conversions'},
-                    {'name': 'totalRevenue'},
-                    {'name': 'engagementRate'},
-                ],
-                'orderBys': [
-                    {'dimension': {'dimensionName': 'date'}, 'desc': True},
-                    {'metric': {'metricName': 'screenPageViews'}, 'desc': True},
-                ],
-            }, max_rows=50000)  # Limit total rows to prevent timeout
-            
-            for row in pages_rows:
-                results['pages_processed'] += 1
-                
-                date_val = row['dimensionValues'][0]['value']
-                date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
-                page_path = row['dimensionValues'][1]['value']
-                metrics = row['metricValues']
-                
-                pageviews = int(metrics[0]['value'])
-                users = int(metrics[1]['value'])
-                sessions = int(metrics[2]['value'])
-                avg_session_duration = float(metrics[3]['value'])
-                bounce_rate = float(metrics[4]['value'])
-                conversions = int(metrics[5]['value'])
-                revenue = float(metrics[6]['value'])
-                engagement_rate = float(metrics[7]['value'])
-                
-                # Calculate conversion_rate and pages_per_session
-                conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'canonical_entity_id': f"page_{date_str}_{page_path[:150]}",  # Include date in entity ID
-                    'entity_type': 'page',
-                    
-                    # Core metrics needed by detectors
-                    'pageviews': pageviews,
-                    'users': users,
-                    'sessions': sessions,
-                    'conversions': conversions,
-                    'conversion_rate': conversion_rate,
-                    'revenue': revenue,
-                    'avg_session_duration': avg_session_duration,
-                    'bounce_rate': bounce_rate,
-                    'engagement_rate': engagement_rate,
-                    'dwell_time': avg_session_duration,  # Use session duration as dwell time
-                    
-                    # Store page path in source_breakdown JSON
-                    'source_breakdown': json.dumps({
-                        'page_path': page_path,
-                    }),
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
+            if checkpoint.get('startDate') != start_date.isoformat() or checkpoint.get('endDate') != end_date.isoformat():
+                checkpoint = {
+                    'startDate': start_date.isoformat(),
+                    'endDate': end_date.isoformat(),
+                    'completedWindows': [],
                 }
-                rows.append(bq_row)
-                
-        except Exception as e:
-            logger.error(f"Error fetching pages: {e}")
-        
-        # ============================================
-        # 4. FETCH GOOGLE ADS CAMPAIGNS BY DAY
-        # ============================================
-        logger.info("Fetching Google Ads campaigns by day from GA4 API...")
-        results['google_ads_campaigns'] = 0
-        
-        try:
-            # Fetch Google Ads campaign data with detailed dimensions
-            campaign_rows = ga4_run_report_paginated(access_token, property_id, {
-                'dateRanges': [{'startDate': start_date.isoformat(), 'endDate': end_date.isoformat()}],
-                'dimensions': [
-                    {'name': 'date'},
-                    {'name': 'sessionGoogleAdsCampaignName'},
-                    {'name': 'sessionGoogleAdsCampaignId'},
-                    {'name': 'sessionGoogleAdsCampaignType'},
-                    {'name': 'sessionGoogleAdsAdNetworkType'},
-                ],
-                'metrics': [
-                    {'name': 'sessions'},
-                    {'name': 'activeUsers'},
-                    {'name': 'engagedSessions'},
-                    {'name': 'conversions'},
-                    {'name': 'totalRevenue'},
-                    {'name': 'engagementRate'},
-                    {'name': 'bounceRate'},
-                ],
-                'dimensionFilter': {
-                    'filter': {
-                        'fieldName': 'sessionGoogleAdsCampaignName',
-                        'stringFilter': {
-                            'matchType': 'FULL_REGEXP',
-                            'value': '.+',  # Non-empty campaign names only
-                        }
-                    }
-                },
-                'orderBys': [
-                    {'dimension': {'dimensionName': 'date'}, 'desc': True},
-                    {'metric': {'metricName': 'sessions'}, 'desc': True},
-                ],
-            }, max_rows=10000)
-            
-            for row in campaign_rows:
-                date_val = row['dimensionValues'][0]['value']
-                date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
-                campaign_name = row['dimensionValues'][1]['value']
-                campaign_id = row['dimensionValues'][2]['value']
-                campaign_type = row['dimensionValues'][3]['value']
-                ad_network = row['dimensionValues'][4]['value']
-                
-                # Skip (not set) campaigns - these are not real Google Ads traffic
-                if campaign_name == '(not set)':
-                    continue
-                
-                results['google_ads_campaigns'] += 1
-                
-                metrics = row['metricValues']
-                
-                sessions = int(metrics[0]['value'])
-                users = int(metrics[1]['value'])
-                engaged_sessions = int(metrics[2]['value'])
-                conversions = int(metrics[3]['value'])
-                revenue = float(metrics[4]['value'])
-                engagement_rate = float(metrics[5]['value'])
-                bounce_rate = float(metrics[6]['value'])
-                
-                # Calculate conversion_rate
-                conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
-                
-                # Create safe entity ID
-                safe_campaign_name = campaign_name[:100].replace(' ', '_').replace('/', '_').replace('-', '_')
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'canonical_entity_id': f"gads_campaign_{date_str}_{campaign_id}_{safe_campaign_name}",
-                    'entity_type': 'google_ads_campaign',
-                    
-                    # Core metrics
-                    'sessions': sessions,
-                    'users': users,
-                    'conversions': conversions,
-                    'conversion_rate': conversion_rate,
-                    'revenue': revenue,
-                    'bounce_rate': bounce_rate,
-                    'engagement_rate': engagement_rate,
-                    
-                    # Store campaign details in source_breakdown JSON
-                    'source_breakdown': json.dumps({
-                        'campaign_name': campaign_name,
-                        'campaign_id': campaign_id,
-                        'campaign_type': campaign_type,
-                        'ad_network': ad_network,
-                        'engaged_sessions': engaged_sessions,
-                    }),
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(bq_row)
+                connection_ref.update({'fullSyncCheckpoint': checkpoint})
             
-            logger.info(f"Fetched {results['google_ads_campaigns']} Google Ads campaign rows")
-                
-        except Exception as e:
-            logger.error(f"Error fetching Google Ads campaigns: {e}")
-        
-        # ============================================
-        # 5. FETCH GOOGLE ADS AD GROUPS BY DAY (more granular)
-        # ============================================
-        logger.info("Fetching Google Ads ad groups by day from GA4 API...")
-        results['google_ads_adgroups'] = 0
-        
-        try:
-            # Fetch Google Ads ad group data
-            adgroup_rows = ga4_run_report_paginated(access_token, property_id, {
-                'dateRanges': [{'startDate': start_date.isoformat(), 'endDate': end_date.isoformat()}],
-                'dimensions': [
-                    {'name': 'date'},
-                    {'name': 'sessionGoogleAdsCampaignName'},
-                    {'name': 'sessionGoogleAdsAdGroupName'},
-                    {'name': 'sessionGoogleAdsAdGroupId'},
-                ],
-                'metrics': [
-                    {'name': 'sessions'},
-                    {'name': 'activeUsers'},
-                    {'name': 'engagedSessions'},
-                    {'name': 'conversions'},
-                    {'name': 'totalRevenue'},
-                ],
-                'dimensionFilter': {
-                    'filter': {
-                        'fieldName': 'sessionGoogleAdsAdGroupName',
-                        'stringFilter': {
-                            'matchType': 'FULL_REGEXP',
-                            'value': '.+',  # Non-empty ad group names only
-                        }
-                    }
-                },
-                'orderBys': [
-                    {'dimension': {'dimensionName': 'date'}, 'desc': True},
-                    {'metric': {'metricName': 'sessions'}, 'desc': True},
-                ],
-            }, max_rows=20000)
-            
-            for row in adgroup_rows:
-                date_val = row['dimensionValues'][0]['value']
-                date_str = f"{date_val[:4]}-{date_val[4:6]}-{date_val[6:8]}"
-                campaign_name = row['dimensionValues'][1]['value']
-                adgroup_name = row['dimensionValues'][2]['value']
-                adgroup_id = row['dimensionValues'][3]['value']
-                
-                # Skip (not set) ad groups - these are not real Google Ads traffic
-                if adgroup_name == '(not set)' or campaign_name == '(not set)':
-                    continue
-                
-                results['google_ads_adgroups'] += 1
-                
-                metrics = row['metricValues']
-                
-                sessions = int(metrics[0]['value'])
-                users = int(metrics[1]['value'])
-                engaged_sessions = int(metrics[2]['value'])
-                conversions = int(metrics[3]['value'])
-                revenue = float(metrics[4]['value'])
-                
-                # Calculate conversion_rate
-                conversion_rate = (conversions / sessions * 100) if sessions > 0 else 0
-                
-                # Create safe entity ID
-                safe_adgroup_name = adgroup_name[:80].replace(' ', '_').replace('/', '_').replace('-', '_')
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'canonical_entity_id': f"gads_adgroup_{date_str}_{adgroup_id}_{safe_adgroup_name}",
-                    'entity_type': 'google_ads_adgroup',
-                    
-                    # Core metrics
-                    'sessions': sessions,
-                    'users': users,
-                    'conversions': conversions,
-                    'conversion_rate': conversion_rate,
-                    'revenue': revenue,
-                    
-                    # Store ad group details in source_breakdown JSON
-                    'source_breakdown': json.dumps({
-                        'campaign_name': campaign_name,
-                        'adgroup_name': adgroup_name,
-                        'adgroup_id': adgroup_id,
-                        'engaged_sessions': engaged_sessions,
-                    }),
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(bq_row)
+            completed_windows = set(checkpoint.get('completedWindows', []))
+            pending_windows = [
+                window for window in month_windows(start_date, end_date)
+                if window[0].isoformat() not in completed_windows
+            ]
+            window_concurrency = max(1, int(request_json.get('windowConcurrency', 1)))
+            deadline = time.monotonic() + FULL_SYNC_TIME_BUDGET_SECONDS
             
-            logger.info(f"Fetched {results['google_ads_adgroups']} Google Ads ad group rows")
-                
-        except Exception as e:
-            logger.error(f"Error fetching Google Ads ad groups: {e}")
-        
-        # ============================================
-        # 6. WRITE DIRECTLY TO BIGQUERY (in batches)
-        # ============================================
-        if rows:
-            logger.info(f"Writing {len(rows)} rows to BigQuery ({sync_mode} mode)...")
-            
-            table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
-            
-            if sync_mode == 'full':
-                # FULL RESYNC: Delete all existing GA4 data and rewrite
-                logger.info("Full resync: Deleting existing GA4 data...")
-                delete_query = f"""
-                DELETE FROM `{table_ref}`
-                WHERE organization_id = '{organization_id}'
-                  AND entity_type IN ('website_traffic', 'traffic_source', 'page', 'google_ads_campaign', 'google_ads_adgroup')
-                  AND date >= '{start_date.isoformat()}'
-                """
-                
-                try:
-                    bq.query(delete_query).result()
-                    logger.info("Deleted existing GA4 data")
-                except Exception as e:
-                    logger.warning(f"Delete query warning: {e}")
-                
-                # Insert all rows in batches
-                BATCH_SIZE = 500
-                total_inserted = 0
-                total_errors = 0
-                
-                for i in range(0, len(rows), BATCH_SIZE):
-                    batch = rows[i:i + BATCH_SIZE]
-                    batch_num = (i // BATCH_SIZE) + 1
-                    total_batches = (len(rows) + BATCH_SIZE - 1) // BATCH_SIZE
-                    
-                    logger.info(f"Inserting batch {batch_num}/{total_batches} ({len(batch)} rows)...")
-                    
-                    try:
-                        errors = bq.insert_rows_json(table_ref, batch, skip_invalid_rows=True, ignore_unknown_values=True)
-                        
-                        if errors:
-                            total_errors += len(errors)
-                            logger.warning(f"Batch {batch_num} had {len(errors)} errors")
-                        else:
-                            total_inserted += len(batch)
-                    except Exception as e:
-                        logger.error(f"Batch {batch_num} failed: {e}")
-                        total_errors += len(batch)
-                
-                results['rows_inserted'] = total_inserted
-                if total_errors > 0:
-                    logger.warning(f"Total errors across all batches: {total_errors}")
+            logger.info(f"Full resync {start_date} to {end_date}: {len(pending_windows)} windows pending "
+                        f"({len(completed_windows)} already done), concurrency={window_concurrency}")
+            
+            def sync_window(window):
+                if time.monotonic() > deadline:
+                    return None
+                
+                window_start, window_end = window
+                logger.info(f"Syncing window {window_start} to {window_end}...")
+                
+                window_rows, window_results, failed_entity_types = collect_ga4_rows(
+                    access_token, property_id, organization_id, window_start, window_end
+                )
+                # Failed reports have no rows, so the replace clause leaves their entity types alone
+                window_results['rows_inserted'] = merge_rows_to_bigquery(bq, window_rows, organization_id, window_start, window_end)
+                record_dirty_partitions(bq, organization_id, dirty_ranges(window_rows), 'ga4')
+                
+                if failed_entity_types:
+                    # Not checkpointed: the next invocation re-syncs the whole window
+                    logger.warning(f"Window {window_start} incomplete ({', '.join(sorted(failed_entity_types))} failed); will retry")
+                    window_results['windows_failed'] = 1
+                    return window_results
+                
+                connection_ref.update({
+                    'fullSyncCheckpoint.completedWindows': firestore.ArrayUnion([window_start.isoformat()]),
+                    'updatedAt': firestore.SERVER_TIMESTAMP,
+                })
+                return window_results
             
+            windows_remaining = 0
+            with ThreadPoolExecutor(max_workers=window_concurrency) as executor:
+                for window_results in executor.map(sync_window, pending_windows):
+                    if window_results is None:
+                        windows_remaining += 1
+                        continue
+                    for key, value in window_results.items():
+                        results[key] += value
+            
+            results['windows_completed'] = len(pending_windows) - windows_remaining - results['windows_failed']
+            results['windows_remaining'] = windows_remaining
+            
+            if windows_remaining:
+                logger.info(f"Time budget reached with {windows_remaining} windows left; re-invoke to resume")
+            elif results['windows_failed']:
+                logger.warning(f"{results['windows_failed']} windows had failed reports; re-invoke to retry them")
             else:
-                # UPDATE SYNC: Use MERGE to upsert (update existing, insert new)
-                logger.info("Update sync: Using MERGE for efficient upsert...")
-                
-                # Create a temporary table with new data
-                temp_table_id = f"temp_ga4_sync_{organization_id.replace('-', '_')}_{int(datetime.utcnow().timestamp())}"
-                temp_table_ref = f"{PROJECT_ID}.{DATASET_ID}.{temp_table_id}"
-                
-                # Insert to temp table in batches
-                BATCH_SIZE = 500
-                total_inserted = 0
-                
-                # First create temp table by inserting first batch
-                for i in range(0, len(rows), BATCH_SIZE):
-                    batch = rows[i:i + BATCH_SIZE]
-                    batch_num = (i // BATCH_SIZE) + 1
-                    total_batches = (len(rows) + BATCH_SIZE - 1) // BATCH_SIZE
-                    
-                    logger.info(f"Loading batch {batch_num}/{total_batches} to temp table...")
-                    
-                    try:
-                        errors = bq.insert_rows_json(temp_table_ref, batch, skip_invalid_rows=True, ignore_unknown_values=True)
-                        if not errors:
-                            total_inserted += len(batch)
-                    except Exception as e:
-                        # If table doesn't exist, create it via query
-                        if 'Not found' in str(e) or i == 0:
-                            # Use INSERT via query to auto-create table
-                            logger.info("Creating temp table via streaming insert...")
-                            try:
-                                errors = bq.insert_rows_json(temp_table_ref, batch, skip_invalid_rows=True, ignore_unknown_values=True)
-                                if not errors:
-                                    total_inserted += len(batch)
-                            except:
-                                pass
-                
-                # Execute MERGE statement
-                merge_query = f"""
-                MERGE `{table_ref}` AS target
-                USING `{temp_table_ref}` AS source
-                ON target.organization_id = source.organization_id
-                   AND target.canonical_entity_id = source.canonical_entity_id
-                   AND target.date = source.date
-                   AND target.entity_type = source.entity_type
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        users = source.users,
-                        sessions = source.sessions,
-                        pageviews = source.pageviews,
-                        conversions = source.conversions,
-                        conversion_rate = source.conversion_rate,
-                        revenue = source.revenue,
-                        bounce_rate = source.bounce_rate,
-                        avg_session_duration = source.avg_session_duration,
-                        engagement_rate = source.engagement_rate,
-                        source_breakdown = source.source_breakdown,
-                        updated_at = source.updated_at
-                WHEN NOT MATCHED THEN
-                    INSERT ROW
-                """
-                
+                connection_ref.update({'fullSyncCheckpoint': firestore.DELETE_FIELD})
+        
+        else:
+            # ============================================
+            # UPDATE SYNC: fetch the range and MERGE (update existing, insert new)
+            # ============================================
+            rows, fetch_results, failed_entity_types = collect_ga4_rows(access_token, property_id, organization_id, start_date, end_date)
+            results.update(fetch_results)
+            results['failed_entity_types'] = sorted(failed_entity_types)
+            
+            if rows:
+                logger.info(f"Writing {len(rows)} rows to BigQuery ({sync_mode} mode)...")
                 try:
-                    bq.query(merge_query).result()
-                    results['rows_inserted'] = total_inserted
-                    logger.info(f"MERGE completed: {total_inserted} rows processed")
+                    results['rows_inserted'] = merge_rows_to_bigquery(bq, rows, organization_id)
+                    record_dirty_partitions(bq, organization_id, dirty_ranges(rows), 'ga4')
                 except Exception as e:
                     logger.error(f"MERGE failed: {e}")
-                    # Fallback: just do streaming insert (may create duplicates but better than failing)
-                    results['rows_inserted'] = total_inserted
-                
-                # Clean up temp table
-                try:
-                    bq.query(f"DROP TABLE IF EXISTS `{temp_table_ref}`").result()
-                except:
-                    pass
         
         # Update connection status
         connection_ref.update({
@@ -8,13 +8,22 @@ This provides:
 - Daily website_traffic with conversions, engagement_rate
 - Daily traffic_source breakdown
 - Daily page performance
+
+Transfer (default 'copy'): aggregates land in a staging table in the GA4
+region, are copied to US with a table copy job and MERGEd there, so rows
+never pass through the function. 'stream' keeps the old insert_rows_json path.
+
+Incremental updates consult a ledger of processed export shards and only
+re-aggregate days whose events_* / events_intraday_* shard is new or was
+modified (per INFORMATION_SCHEMA.PARTITIONS) since it was last processed.
 """
 
 import functions_framework
 from google.cloud import bigquery
 from datetime import datetime, timedelta
 import logging
-import json
+import os
+from opsos_common.dirty_partitions import record_dirty_partitions
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +33,89 @@ GA4_LOCATION = "northamerica-northeast1"
 TARGET_DATASET = "marketing_ai"  # (in US)
 TARGET_TABLE = "daily_entity_metrics"
 
+# Staging dataset in the GA4 region for the server-side transfer mode and the shard ledger
+STAGING_DATASET = "marketing_ai_ga4_staging"  # (in northamerica-northeast1)
+
+# Ledger of export shards already aggregated, with each shard's last-modified time
+LEDGER_TABLE = "ga4_processed_shards"
+
+# 'copy': aggregate into a GA4-region staging table, copy it to US and MERGE there
+# 'stream': iterate results in Python and stream insert them to US
+DEFAULT_TRANSFER_MODE = os.environ.get('GA4_TRANSFER_MODE', 'copy')
+
+
+def ensure_staging_dataset(bq_ga4):
+    """Create the GA4-region staging dataset and shard ledger if missing"""
+    staging_dataset = bigquery.Dataset(f"{PROJECT_ID}.{STAGING_DATASET}")
+    staging_dataset.location = GA4_LOCATION
+    bq_ga4.create_dataset(staging_dataset, exists_ok=True)
+    
+    ledger = bigquery.Table(f"{PROJECT_ID}.{STAGING_DATASET}.{LEDGER_TABLE}", schema=[
+        bigquery.SchemaField('organization_id', 'STRING', mode='REQUIRED'),
+        bigquery.SchemaField('table_name', 'STRING', mode='REQUIRED'),
+        bigquery.SchemaField('last_modified_time', 'TIMESTAMP'),
+        bigquery.SchemaField('processed_at', 'TIMESTAMP'),
+    ])
+    bq_ga4.create_table(ledger, exists_ok=True)
+
+
+def list_export_shards(bq_ga4, organization_id, start_date, end_date) -> list:
+    """
+    List the events_* / events_intraday_* shards for a date range with their
+    last-modified time and the last-modified time recorded when they were last processed.
+    
+    A day's completed events_YYYYMMDD shard supersedes its intraday shard.
+    """
+    ledger_table = f"{PROJECT_ID}.{STAGING_DATASET}.{LEDGER_TABLE}"
+    
+    shards_query = f"""
+    WITH shards AS (
+        SELECT
+            table_name,
+            REGEXP_EXTRACT(table_name, r'(\\d{{8}})$') as shard_date,
+            STARTS_WITH(table_name, 'events_intraday_') as is_intraday,
+            MAX(last_modified_time) as last_modified_time
+        FROM `{PROJECT_ID}.{GA4_DATASET}.INFORMATION_SCHEMA.PARTITIONS`
+        WHERE REGEXP_CONTAINS(table_name, r'^events_(intraday_)?\\d{{8}}$')
+        GROUP BY table_name
+    )
+    SELECT
+        s.table_name,
+        SUBSTR(s.table_name, LENGTH('events_') + 1) as table_suffix,
+        s.shard_date,
+        s.last_modified_time,
+        l.last_modified_time as processed_modified_time
+    FROM shards s
+    LEFT JOIN `{ledger_table}` l
+        ON l.organization_id = '{organization_id}' AND l.table_name = s.table_name
+    WHERE s.shard_date BETWEEN '{start_date.strftime('%Y%m%d')}' AND '{end_date.strftime('%Y%m%d')}'
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY s.shard_date ORDER BY s.is_intraday) = 1
+    """
+    
+    return list(bq_ga4.query(shards_query).result())
+
+
+def record_processed_shards(bq_ga4, organization_id, shards):
+    """Upsert processed shards and the last-modified time they were aggregated at into the ledger"""
+    ledger_table = f"{PROJECT_ID}.{STAGING_DATASET}.{LEDGER_TABLE}"
+    
+    shard_structs = ",\n".join(
+        f"STRUCT('{shard.table_name}' as table_name, TIMESTAMP '{shard.last_modified_time.isoformat()}' as last_modified_time)"
+        for shard in shards
+    )
+    
+    ledger_merge = f"""
+    MERGE `{ledger_table}` L
+    USING (SELECT * FROM UNNEST([{shard_structs}])) S
+    ON L.organization_id = '{organization_id}' AND L.table_name = S.table_name
+    WHEN MATCHED THEN
+      UPDATE SET last_modified_time = S.last_modified_time, processed_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (organization_id, table_name, last_modified_time, processed_at)
+      VALUES ('{organization_id}', S.table_name, S.last_modified_time, CURRENT_TIMESTAMP())
+    """
+    bq_ga4.query(ledger_merge).result()
+
 
 @functions_framework.http
 def sync_ga4_raw_to_metrics(request):
@@ -41,20 +133,28 @@ def sync_ga4_raw_to_metrics(request):
     request_json = request.get_json(silent=True) or {}
     organization_id = request_json.get('organizationId', 'SBjucW1ztDyFYWBz7ZLE')
     sync_mode = request_json.get('mode', 'update')
+    transfer_mode = request_json.get('transferMode', DEFAULT_TRANSFER_MODE)  # 'copy' or 'stream'
+    use_ledger = request_json.get('useLedger', True)
     
     # Date range support
     explicit_start = request_json.get('startDate')
     explicit_end = request_json.get('endDate')
     days_back = request_json.get('daysBack', 30 if sync_mode == 'update' else 365)
     
+    # Incremental: only aggregate shards that are new or changed since they were last processed
+    incremental = use_ledger and sync_mode == 'update' and not (explicit_start and explicit_end)
+    
     if explicit_start and explicit_end:
         start_date = datetime.strptime(explicit_start, '%Y-%m-%d').date()
         end_date = datetime.strptime(explicit_end, '%Y-%m-%d').date()
+    elif incremental:
+        end_date = datetime.utcnow().date()  # Today's events_intraday_* shard is re-aggregated as it changes
+        start_date = end_date - timedelta(days=days_back)
     else:
         end_date = datetime.utcnow().date() - timedelta(days=1)  # Yesterday (today's data may be incomplete)
         start_date = end_date - timedelta(days=days_back)
     
-    logger.info(f"🚀 Starting GA4 Raw → Metrics sync: {start_date} to {end_date} (mode={sync_mode})")
+    logger.info(f"🚀 Starting GA4 Raw → Metrics sync: {start_date} to {end_date} (mode={sync_mode}, transfer={transfer_mode})")
     
     try:
         # Two clients: one for GA4 region, one for target region
@@ -72,38 +172,170 @@ def sync_ga4_raw_to_metrics(request):
         target_table = f"{PROJECT_ID}.{TARGET_DATASET}.{TARGET_TABLE}"
         now_iso = datetime.utcnow().isoformat()
         
-        # Format dates for GA4 table suffix
-        start_suffix = start_date.strftime('%Y%m%d')
-        end_suffix = end_date.strftime('%Y%m%d')
+        if use_ledger or transfer_mode == 'copy':
+            ensure_staging_dataset(bq_ga4)
+        
+        if use_ledger:
+            # ============================================
+            # SHARD SELECTION (ledger vs INFORMATION_SCHEMA)
+            # ============================================
+            shards = list_export_shards(bq_ga4, organization_id, start_date, end_date)
+            if incremental:
+                shards = [
+                    shard for shard in shards
+                    if shard.processed_modified_time is None or shard.last_modified_time > shard.processed_modified_time
+                ]
+            
+            results['shards_processed'] = len(shards)
+            
+            if not shards:
+                logger.info("No new or changed GA4 export shards since the last run")
+                return ({
+                    'success': True,
+                    **results,
+                    'date_range': f"{start_date.isoformat()} to {end_date.isoformat()}",
+                    'message': "No new GA4 export shards to sync"
+                }, 200, headers)
+            
+            logger.info(f"Aggregating {len(shards)} GA4 export shards: {', '.join(shard.table_name for shard in shards)}")
+            
+            shard_suffixes = ", ".join(f"'{shard.table_suffix}'" for shard in shards)
+            shard_filter = f"_TABLE_SUFFIX IN ({shard_suffixes})"
+            shard_dates = ", ".join(
+                f"'{shard.shard_date[:4]}-{shard.shard_date[4:6]}-{shard.shard_date[6:8]}'" for shard in shards
+            )
+            date_filter = f"date IN ({shard_dates})"
+        else:
+            # Format dates for GA4 table suffix
+            start_suffix = start_date.strftime('%Y%m%d')
+            end_suffix = end_date.strftime('%Y%m%d')
+            shard_filter = f"_TABLE_SUFFIX BETWEEN '{start_suffix}' AND '{end_suffix}'"
+            date_filter = f"date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'"
         
         # ============================================
-        # 1. WEBSITE_TRAFFIC (daily aggregate)
+        # SINGLE PASS OVER THE GA4 EXPORT
         # ============================================
-        logger.info("Aggregating website_traffic from raw GA4...")
+        # event_params is unnested once per event into a temp table; all five
+        # aggregations (website_traffic, traffic_source, page, Google Ads
+        # aggregate, Google Ads campaigns) then read that instead of
+        # re-scanning events_* five times.
+        logger.info("Aggregating website_traffic, traffic_source, page and Google Ads metrics from raw GA4...")
         
-        website_query = f"""
+        events_statement = f"""
+        CREATE TEMP TABLE ga4_events AS
+        SELECT
+            PARSE_DATE('%Y%m%d', event_date) as date,
+            event_name,
+            user_pseudo_id,
+            CONCAT(user_pseudo_id, CAST(params.ga_session_id AS STRING)) as session_key,
+            ts_source,
+            ts_medium,
+            params.page_location,
+            params.page_title,
+            params.campaign,
+            params.channel_group,
+            params.value
+        FROM (
+            SELECT
+                event_date,
+                event_name,
+                user_pseudo_id,
+                traffic_source.source as ts_source,
+                traffic_source.medium as ts_medium,
+                (
+                    SELECT AS STRUCT
+                        MAX(IF(key = 'ga_session_id', value.int_value, NULL)) as ga_session_id,
+                        MAX(IF(key = 'page_location', value.string_value, NULL)) as page_location,
+                        MAX(IF(key = 'page_title', value.string_value, NULL)) as page_title,
+                        MAX(IF(key = 'campaign', value.string_value, NULL)) as campaign,
+                        MAX(IF(key = 'session_default_channel_group', value.string_value, NULL)) as channel_group,
+                        MAX(IF(key = 'value', COALESCE(value.double_value, CAST(value.int_value AS FLOAT64)), NULL)) as value
+                    FROM UNNEST(event_params)
+                ) as params
+            FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
+            WHERE {shard_filter}
+        );
+        """
+        
+        aggregation_query = f"""
         WITH daily_sessions AS (
             SELECT
-                PARSE_DATE('%Y%m%d', event_date) as date,
-                COUNT(DISTINCT CONCAT(user_pseudo_id, 
-                    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id'))) as sessions,
+                date,
+                COUNT(DISTINCT session_key) as sessions,
                 COUNT(DISTINCT user_pseudo_id) as users,
                 COUNTIF(event_name = 'page_view') as pageviews,
-                COUNTIF(event_name = 'first_visit') as new_users,
                 -- Conversions: count signup events
                 COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
                 -- Revenue (if e-commerce)
-                SUM(CASE WHEN event_name = 'purchase' THEN 
-                    (SELECT COALESCE(value.double_value, value.int_value) FROM UNNEST(event_params) WHERE key = 'value')
-                    ELSE 0 END) as revenue,
+                SUM(IF(event_name = 'purchase', value, 0)) as revenue,
                 -- Engagement: sessions with user_engagement event
-                COUNT(DISTINCT CASE WHEN event_name = 'user_engagement' THEN 
-                    CONCAT(user_pseudo_id, (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id'))
-                    END) as engaged_sessions
-            FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
-            WHERE _TABLE_SUFFIX BETWEEN '{start_suffix}' AND '{end_suffix}'
-            GROUP BY event_date
+                COUNT(DISTINCT IF(event_name = 'user_engagement', session_key, NULL)) as engaged_sessions
+            FROM ga4_events
+            GROUP BY date
+        ),
+        -- Sources, pages and campaigns are grouped by their sanitized entity key, not the raw
+        -- names: raw names that sanitize to the same key would give the MERGE duplicate source rows
+        source_sessions AS (
+            SELECT
+                date,
+                CONCAT(REGEXP_REPLACE(IFNULL(channel_group, 'Direct'), r'[^a-zA-Z0-9]', '_'), '_',
+                       REGEXP_REPLACE(IFNULL(ts_source, '(direct)'), r'[^a-zA-Z0-9]', '_'), '_',
+                       REGEXP_REPLACE(IFNULL(ts_medium, '(none)'), r'[^a-zA-Z0-9]', '_')) as source_key,
+                ANY_VALUE(STRUCT(
+                    IFNULL(channel_group, 'Direct') as channel,
+                    IFNULL(ts_source, '(direct)') as source,
+                    IFNULL(ts_medium, '(none)') as medium
+                )) as label,
+                COUNT(DISTINCT session_key) as sessions,
+                COUNT(DISTINCT user_pseudo_id) as users,
+                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
+                SUM(IF(event_name = 'purchase', value, 0)) as revenue
+            FROM ga4_events
+            GROUP BY date, source_key
+        ),
+        page_metrics AS (
+            SELECT
+                date,
+                SUBSTR(REGEXP_REPLACE(IFNULL(page_location, '/'), r'[^a-zA-Z0-9/]', '_'), 1, 150) as page_key,
+                ANY_VALUE(page_location) as page_url,
+                ANY_VALUE(page_title) as page_title,
+                COUNT(*) as pageviews,
+                COUNT(DISTINCT user_pseudo_id) as users,
+                COUNT(DISTINCT session_key) as sessions,
+                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions
+            FROM ga4_events
+            WHERE event_name = 'page_view'
+            GROUP BY date, page_key
+        ),
+        -- Account-level Google Ads metrics (conversions/revenue are not campaign-attributed in GA4)
+        google_ads_aggregate AS (
+            SELECT
+                date,
+                COUNT(DISTINCT session_key) as sessions,
+                COUNT(DISTINCT user_pseudo_id) as users,
+                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
+                SUM(IF(event_name = 'purchase', value, 0)) as revenue
+            FROM ga4_events
+            WHERE ts_source = 'google'
+              AND ts_medium IN ('cpc', 'ppc', 'paidsearch')
+            GROUP BY date
+        ),
+        campaign_sessions AS (
+            SELECT
+                date,
+                REGEXP_REPLACE(IFNULL(campaign, 'unknown'), r'[^a-zA-Z0-9]', '_') as campaign_key,
+                ANY_VALUE(campaign) as campaign_name,
+                COUNT(DISTINCT session_key) as sessions,
+                COUNT(DISTINCT user_pseudo_id) as users,
+                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
+                SUM(IF(event_name = 'purchase', value, 0)) as revenue
+            FROM ga4_events
+            WHERE ts_source = 'google'
+              AND ts_medium IN ('cpc', 'ppc', 'paidsearch')
+            GROUP BY date, campaign_key
         )
+        
+        -- 1. WEBSITE_TRAFFIC (daily aggregate)
         SELECT
             '{organization_id}' as organization_id,
             FORMAT_DATE('%Y-%m-%d', date) as date,
@@ -116,399 +348,247 @@ def sync_ga4_raw_to_metrics(request):
             CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END as conversion_rate,
             revenue,
             CASE WHEN sessions > 0 THEN ROUND(engaged_sessions / sessions * 100, 2) ELSE 0 END as engagement_rate,
-            CASE WHEN sessions > 0 THEN ROUND(pageviews / sessions, 2) ELSE 0 END as pages_per_session
+            CASE WHEN sessions > 0 THEN ROUND(pageviews / sessions, 2) ELSE 0 END as pages_per_session,
+            CAST(NULL AS STRING) as source_breakdown
         FROM daily_sessions
-        ORDER BY date
-        """
-        
-        # Delete existing data for the date range (in US region)
-        if sync_mode == 'full':
-            delete_query = f"""
-            DELETE FROM `{target_table}`
-            WHERE organization_id = '{organization_id}'
-              AND entity_type = 'website_traffic'
-              AND date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'
-            """
-            bq_us.query(delete_query).result()
-            logger.info("Deleted existing website_traffic data")
-        
-        # Query GA4 in its region, then stream insert to US
-        try:
-            ga4_result = bq_ga4.query(website_query).result()
-            website_rows = []
-            for row in ga4_result:
-                website_rows.append({
-                    'organization_id': row.organization_id,
-                    'date': row.date,
-                    'canonical_entity_id': row.canonical_entity_id,
-                    'entity_type': row.entity_type,
-                    'users': row.users,
-                    'sessions': row.sessions,
-                    'pageviews': row.pageviews,
-                    'conversions': row.conversions,
-                    'conversion_rate': row.conversion_rate,
-                    'revenue': row.revenue,
-                    'engagement_rate': row.engagement_rate,
-                    'pages_per_session': row.pages_per_session,
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                })
-            
-            if website_rows:
-                errors = bq_us.insert_rows_json(target_table, website_rows, skip_invalid_rows=True)
-                if errors:
-                    logger.warning(f"Website traffic insert errors: {errors[:3]}")
-                results['website_traffic_rows'] = len(website_rows)
-                logger.info(f"Inserted {len(website_rows)} website_traffic rows")
-        except Exception as e:
-            logger.error(f"Website traffic error: {e}")
         
-        # ============================================
-        # 2. TRAFFIC_SOURCE (daily by source/medium)
-        # ============================================
-        logger.info("Aggregating traffic_source from raw GA4...")
+        UNION ALL
         
-        source_query = f"""
-        WITH source_sessions AS (
-            SELECT
-                PARSE_DATE('%Y%m%d', event_date) as date,
-                IFNULL(traffic_source.source, '(direct)') as source,
-                IFNULL(traffic_source.medium, '(none)') as medium,
-                IFNULL((SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'session_default_channel_group'), 
-                       'Direct') as channel,
-                COUNT(DISTINCT CONCAT(user_pseudo_id, 
-                    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id'))) as sessions,
-                COUNT(DISTINCT user_pseudo_id) as users,
-                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
-                SUM(CASE WHEN event_name = 'purchase' THEN 
-                    (SELECT COALESCE(value.double_value, value.int_value) FROM UNNEST(event_params) WHERE key = 'value')
-                    ELSE 0 END) as revenue
-            FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
-            WHERE _TABLE_SUFFIX BETWEEN '{start_suffix}' AND '{end_suffix}'
-            GROUP BY event_date, source, medium, channel
-        )
+        -- 2. TRAFFIC_SOURCE (daily by source/medium)
         SELECT
-            '{organization_id}' as organization_id,
-            FORMAT_DATE('%Y-%m-%d', date) as date,
-            CONCAT('ga4_source_', FORMAT_DATE('%Y-%m-%d', date), '_', 
-                   REGEXP_REPLACE(channel, r'[^a-zA-Z0-9]', '_'), '_',
-                   REGEXP_REPLACE(source, r'[^a-zA-Z0-9]', '_'), '_',
-                   REGEXP_REPLACE(medium, r'[^a-zA-Z0-9]', '_')) as canonical_entity_id,
-            'traffic_source' as entity_type,
+            '{organization_id}',
+            FORMAT_DATE('%Y-%m-%d', date),
+            CONCAT('ga4_source_', FORMAT_DATE('%Y-%m-%d', date), '_', source_key),
+            'traffic_source',
             users,
             sessions,
+            NULL,
             conversions,
-            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END as conversion_rate,
+            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END,
             revenue,
-            channel,
-            source,
-            medium
+            NULL,
+            NULL,
+            TO_JSON_STRING(STRUCT(
+                label.channel,
+                CONCAT(label.source, ' / ', label.medium) as source_medium,
+                CONCAT(label.channel, ' - ', label.source, ' / ', label.medium) as name
+            ))
         FROM source_sessions
         WHERE sessions > 0
-        ORDER BY date, sessions DESC
-        """
-        
-        if sync_mode == 'full':
-            delete_source = f"""
-            DELETE FROM `{target_table}`
-            WHERE organization_id = '{organization_id}'
-              AND entity_type = 'traffic_source'
-              AND date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'
-            """
-            bq_us.query(delete_source).result()
-        
-        try:
-            ga4_result = bq_ga4.query(source_query).result()
-            source_rows = []
-            for row in ga4_result:
-                source_rows.append({
-                    'organization_id': row.organization_id,
-                    'date': row.date,
-                    'canonical_entity_id': row.canonical_entity_id,
-                    'entity_type': row.entity_type,
-                    'users': row.users,
-                    'sessions': row.sessions,
-                    'conversions': row.conversions,
-                    'conversion_rate': row.conversion_rate,
-                    'revenue': row.revenue,
-                    'source_breakdown': json.dumps({
-                        'channel': row.channel,
-                        'source_medium': f"{row.source} / {row.medium}",
-                        'name': f"{row.channel} - {row.source} / {row.medium}",
-                    }),
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                })
-            
-            if source_rows:
-                # Insert in batches
-                BATCH_SIZE = 500
-                for i in range(0, len(source_rows), BATCH_SIZE):
-                    batch = source_rows[i:i + BATCH_SIZE]
-                    errors = bq_us.insert_rows_json(target_table, batch, skip_invalid_rows=True)
-                    if errors:
-                        logger.warning(f"Traffic source batch {i//BATCH_SIZE + 1} errors: {len(errors)}")
-                
-                results['traffic_source_rows'] = len(source_rows)
-                logger.info(f"Inserted {len(source_rows)} traffic_source rows")
-        except Exception as e:
-            logger.error(f"Traffic source error: {e}")
         
-        # ============================================
-        # 3. PAGE (daily by page path)
-        # ============================================
-        logger.info("Aggregating page performance from raw GA4...")
+        UNION ALL
         
-        page_query = f"""
-        WITH page_metrics AS (
-            SELECT
-                PARSE_DATE('%Y%m%d', event_date) as date,
-                (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'page_location') as page_url,
-                (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'page_title') as page_title,
-                COUNT(*) as pageviews,
-                COUNT(DISTINCT user_pseudo_id) as users,
-                COUNT(DISTINCT CONCAT(user_pseudo_id, 
-                    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id'))) as sessions,
-                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions
-            FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
-            WHERE _TABLE_SUFFIX BETWEEN '{start_suffix}' AND '{end_suffix}'
-              AND event_name = 'page_view'
-            GROUP BY event_date, page_url, page_title
-        )
+        -- 3. PAGE (daily by page path)
         SELECT
-            '{organization_id}' as organization_id,
-            FORMAT_DATE('%Y-%m-%d', date) as date,
-            CONCAT('page_', FORMAT_DATE('%Y-%m-%d', date), '_', 
-                   SUBSTR(REGEXP_REPLACE(IFNULL(page_url, '/'), r'[^a-zA-Z0-9/]', '_'), 1, 150)) as canonical_entity_id,
-            'page' as entity_type,
-            pageviews,
+            '{organization_id}',
+            FORMAT_DATE('%Y-%m-%d', date),
+            CONCAT('page_', FORMAT_DATE('%Y-%m-%d', date), '_', page_key),
+            'page',
             users,
             sessions,
+            pageviews,
             conversions,
-            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END as conversion_rate,
-            page_url,
-            page_title
+            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END,
+            NULL,
+            NULL,
+            NULL,
+            TO_JSON_STRING(STRUCT(
+                IFNULL(SUBSTR(page_url, 1, 500), '/') as page_path,
+                IFNULL(SUBSTR(page_title, 1, 200), '') as page_title
+            ))
         FROM page_metrics
         WHERE pageviews >= 5  -- Filter low-traffic pages
-        ORDER BY date, pageviews DESC
-        """
-        
-        if sync_mode == 'full':
-            delete_pages = f"""
-            DELETE FROM `{target_table}`
-            WHERE organization_id = '{organization_id}'
-              AND entity_type = 'page'
-              AND date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'
-            """
-            bq_us.query(delete_pages).result()
         
-        try:
-            ga4_result = bq_ga4.query(page_query).result()
-            page_rows = []
-            for row in ga4_result:
-                page_rows.append({
-                    'organization_id': row.organization_id,
-                    'date': row.date,
-                    'canonical_entity_id': row.canonical_entity_id,
-                    'entity_type': row.entity_type,
-                    'pageviews': row.pageviews,
-                    'users': row.users,
-                    'sessions': row.sessions,
-                    'conversions': row.conversions,
-                    'conversion_rate': row.conversion_rate,
-                    'source_breakdown': json.dumps({
-                        'page_path': row.page_url[:500] if row.page_url else '/',
-                        'page_title': row.page_title[:200] if row.page_title else '',
-                    }),
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                })
-            
-            if page_rows:
-                # Insert in batches
-                BATCH_SIZE = 500
-                for i in range(0, len(page_rows), BATCH_SIZE):
-                    batch = page_rows[i:i + BATCH_SIZE]
-                    errors = bq_us.insert_rows_json(target_table, batch, skip_invalid_rows=True)
-                    if errors:
-                        logger.warning(f"Page batch {i//BATCH_SIZE + 1} errors: {len(errors)}")
-                
-                results['page_rows'] = len(page_rows)
-                logger.info(f"Inserted {len(page_rows)} page rows")
-        except Exception as e:
-            logger.error(f"Page error: {e}")
+        UNION ALL
         
-        # ============================================
-        # 4. GOOGLE ADS AGGREGATE (account-level conversions/revenue)
-        # ============================================
-        logger.info("Extracting Google Ads aggregate metrics from raw GA4...")
-        
-        # First, get aggregate account-level metrics (conversions/revenue are not campaign-attributed in GA4)
-        aggregate_query = f"""
-        WITH google_ads_aggregate AS (
-            SELECT
-                PARSE_DATE('%Y%m%d', event_date) as date,
-                COUNT(DISTINCT CONCAT(user_pseudo_id, 
-                    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id'))) as sessions,
-                COUNT(DISTINCT user_pseudo_id) as users,
-                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
-                SUM(CASE WHEN event_name = 'purchase' THEN 
-                    (SELECT COALESCE(value.double_value, value.int_value) FROM UNNEST(event_params) WHERE key = 'value')
-                    ELSE 0 END) as revenue
-            FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
-            WHERE _TABLE_SUFFIX BETWEEN '{start_suffix}' AND '{end_suffix}'
-              AND traffic_source.source = 'google'
-              AND traffic_source.medium IN ('cpc', 'ppc', 'paidsearch')
-            GROUP BY event_date
-        )
+        -- 4. GOOGLE ADS AGGREGATE (account-level conversions/revenue)
         SELECT
-            '{organization_id}' as organization_id,
-            FORMAT_DATE('%Y-%m-%d', date) as date,
-            CONCAT('google_ads_', FORMAT_DATE('%Y-%m-%d', date)) as canonical_entity_id,
-            'ad_account' as entity_type,
+            '{organization_id}',
+            FORMAT_DATE('%Y-%m-%d', date),
+            CONCAT('google_ads_', FORMAT_DATE('%Y-%m-%d', date)),
+            'ad_account',
             users,
             sessions,
+            NULL,
             conversions,
-            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END as conversion_rate,
-            revenue
+            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END,
+            revenue,
+            NULL,
+            NULL,
+            TO_JSON_STRING(STRUCT(
+                'Google Ads (from GA4)' as source,
+                'aggregate' as type
+            ))
         FROM google_ads_aggregate
         WHERE sessions > 0
-        ORDER BY date DESC
-        """
-        
-        if sync_mode == 'full':
-            delete_aggregate = f"""
-            DELETE FROM `{target_table}`
-            WHERE organization_id = '{organization_id}'
-              AND entity_type = 'ad_account'
-              AND canonical_entity_id LIKE 'google_ads_%'
-              AND date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'
-            """
-            bq_us.query(delete_aggregate).result()
         
-        try:
-            ga4_result = bq_ga4.query(aggregate_query).result()
-            aggregate_rows = []
-            for row in ga4_result:
-                aggregate_rows.append({
-                    'organization_id': row.organization_id,
-                    'date': row.date,
-                    'canonical_entity_id': row.canonical_entity_id,
-                    'entity_type': row.entity_type,
-                    'users': row.users,
-                    'sessions': row.sessions,
-                    'conversions': row.conversions,
-                    'conversion_rate': row.conversion_rate,
-                    'revenue': row.revenue,
-                    'source_breakdown': json.dumps({
-                        'source': 'Google Ads (from GA4)',
-                        'type': 'aggregate'
-                    }),
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                })
-            
-            if aggregate_rows:
-                errors = bq_us.insert_rows_json(target_table, aggregate_rows, skip_invalid_rows=True)
-                if errors:
-                    logger.warning(f"Google Ads aggregate insert errors: {errors[:3]}")
-                
-                results['google_ads_aggregate_rows'] = len(aggregate_rows)
-                logger.info(f"Inserted {len(aggregate_rows)} google_ads_aggregate rows")
-        except Exception as e:
-            logger.error(f"Google Ads aggregate error: {e}")
+        UNION ALL
         
-        # ============================================
-        # 5. GOOGLE ADS CAMPAIGNS (session-level only, no conversions)
-        # ============================================
-        logger.info("Extracting Google Ads campaigns from raw GA4...")
-        
-        campaign_query = f"""
-        WITH campaign_sessions AS (
-            SELECT
-                PARSE_DATE('%Y%m%d', event_date) as date,
-                (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'campaign') as campaign_name,
-                COUNT(DISTINCT CONCAT(user_pseudo_id, 
-                    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id'))) as sessions,
-                COUNT(DISTINCT user_pseudo_id) as users,
-                COUNTIF(event_name LIKE 'ads_conversion%' OR event_name = 'talent-signup') as conversions,
-                SUM(CASE WHEN event_name = 'purchase' THEN 
-                    (SELECT COALESCE(value.double_value, value.int_value) FROM UNNEST(event_params) WHERE key = 'value')
-                    ELSE 0 END) as revenue
-            FROM `{PROJECT_ID}.{GA4_DATASET}.events_*`
-            WHERE _TABLE_SUFFIX BETWEEN '{start_suffix}' AND '{end_suffix}'
-              AND traffic_source.source = 'google'
-              AND traffic_source.medium IN ('cpc', 'ppc', 'paidsearch')
-            GROUP BY event_date, campaign_name
-        )
+        -- 5. GOOGLE ADS CAMPAIGNS (session-level only, no conversions)
         SELECT
-            '{organization_id}' as organization_id,
-            FORMAT_DATE('%Y-%m-%d', date) as date,
-            CONCAT('gads_campaign_', FORMAT_DATE('%Y-%m-%d', date), '_', 
-                   REGEXP_REPLACE(IFNULL(campaign_name, 'unknown'), r'[^a-zA-Z0-9]', '_')) as canonical_entity_id,
-            'google_ads_campaign' as entity_type,
+            '{organization_id}',
+            FORMAT_DATE('%Y-%m-%d', date),
+            CONCAT('gads_campaign_', FORMAT_DATE('%Y-%m-%d', date), '_', campaign_key),
+            'google_ads_campaign',
             users,
             sessions,
+            NULL,
             conversions,
-            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END as conversion_rate,
+            CASE WHEN sessions > 0 THEN ROUND(conversions / sessions * 100, 2) ELSE 0 END,
             revenue,
-            IFNULL(campaign_name, '(not set)') as campaign_name,
-            CASE 
-                WHEN campaign_name LIKE '%PMax%' THEN 'Performance Max'
-                WHEN campaign_name LIKE '%Search%' THEN 'Search'
-                ELSE 'Other'
-            END as campaign_type
+            NULL,
+            NULL,
+            TO_JSON_STRING(STRUCT(
+                IFNULL(campaign_name, '(not set)') as campaign_name,
+                CASE 
+                    WHEN campaign_name LIKE '%PMax%' THEN 'Performance Max'
+                    WHEN campaign_name LIKE '%Search%' THEN 'Search'
+                    ELSE 'Other'
+                END as campaign_type
+            ))
         FROM campaign_sessions
         WHERE sessions > 0
-        ORDER BY date, sessions DESC
         """
         
-        if sync_mode == 'full':
-            delete_campaigns = f"""
-            DELETE FROM `{target_table}`
-            WHERE organization_id = '{organization_id}'
-              AND entity_type = 'google_ads_campaign'
-              AND date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'
+        # Result keys per entity type
+        result_keys = {
+            'website_traffic': 'website_traffic_rows',
+            'traffic_source': 'traffic_source_rows',
+            'page': 'page_rows',
+            'ad_account': 'google_ads_aggregate_rows',
+            'google_ads_campaign': 'google_ads_campaign_rows',
+        }
+        
+        def owned_rows_filter(prefix=''):
+            """Rows this sync owns in the target table for the date range"""
+            return f"""
+                {prefix}organization_id = '{organization_id}'
+                AND (
+                    {prefix}entity_type IN ('website_traffic', 'traffic_source', 'page', 'google_ads_campaign')
+                    OR ({prefix}entity_type = 'ad_account' AND {prefix}canonical_entity_id LIKE 'google_ads_%')
+                )
+                AND {prefix}{date_filter}
             """
-            bq_us.query(delete_campaigns).result()
         
-        try:
-            ga4_result = bq_ga4.query(campaign_query).result()
-            campaign_rows = []
-            for row in ga4_result:
-                campaign_rows.append({
-                    'organization_id': row.organization_id,
-                    'date': row.date,
-                    'canonical_entity_id': row.canonical_entity_id,
-                    'entity_type': row.entity_type,
-                    'users': row.users,
-                    'sessions': row.sessions,
-                    'conversions': row.conversions,
-                    'conversion_rate': row.conversion_rate,
-                    'revenue': row.revenue,
-                    'source_breakdown': json.dumps({
-                        'campaign_name': row.campaign_name,
-                        'campaign_type': row.campaign_type,
-                    }),
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                })
+        if transfer_mode == 'copy':
+            # ============================================
+            # SERVER-SIDE TRANSFER: GA4 region → US without rows passing through the function
+            # ============================================
+            run_id = f"{organization_id.replace('-', '_')}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+            staging_table_ref = f"{PROJECT_ID}.{STAGING_DATASET}.ga4_raw_metrics_{run_id}"
+            us_temp_table_ref = f"{PROJECT_ID}.{TARGET_DATASET}.temp_ga4_raw_sync_{run_id}"
             
-            if campaign_rows:
-                # Insert in batches
-                BATCH_SIZE = 500
-                for i in range(0, len(campaign_rows), BATCH_SIZE):
-                    batch = campaign_rows[i:i + BATCH_SIZE]
-                    errors = bq_us.insert_rows_json(target_table, batch, skip_invalid_rows=True)
-                    if errors:
-                        logger.warning(f"Campaign batch {i//BATCH_SIZE + 1} errors: {len(errors)}")
+            try:
+                # 1. Aggregate into a staging table next to the GA4 export
+                bq_ga4.query(events_statement + f"""
+                CREATE OR REPLACE TABLE `{staging_table_ref}`
+                OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY))  -- Leftovers expire
+                AS {aggregation_query};
+                """).result()
+                
+                # 2. Cross-region table copy into the US dataset
+                bq_us.copy_table(staging_table_ref, us_temp_table_ref).result()
+                
+                counts_query = f"""
+                SELECT entity_type, COUNT(*) as row_count
+                FROM `{us_temp_table_ref}`
+                GROUP BY entity_type
+                """
+                for row in bq_us.query(counts_query).result():
+                    results[result_keys[row.entity_type]] = row.row_count
+                
+                # 3. MERGE server-side in US (full and ledger runs also remove rows the export no longer produces)
+                delete_clause = f"""
+                WHEN NOT MATCHED BY SOURCE AND {owned_rows_filter('T.')} THEN
+                    DELETE
+                """ if sync_mode == 'full' or use_ledger else ""
                 
-                results['google_ads_campaign_rows'] = len(campaign_rows)
-                logger.info(f"Inserted {len(campaign_rows)} google_ads_campaign rows")
-        except Exception as e:
-            logger.error(f"Google Ads campaign error: {e}")
+                merge_query = f"""
+                MERGE `{target_table}` T
+                USING (
+                    SELECT * REPLACE (
+                        CAST(date AS DATE) as date,
+                        PARSE_JSON(source_breakdown) as source_breakdown
+                    )
+                    FROM `{us_temp_table_ref}`
+                ) S
+                ON T.organization_id = S.organization_id
+                   AND T.canonical_entity_id = S.canonical_entity_id
+                   AND T.date = S.date
+                   AND T.entity_type = S.entity_type
+                WHEN MATCHED THEN
+                  UPDATE SET
+                    users = S.users,
+                    sessions = S.sessions,
+                    pageviews = S.pageviews,
+                    conversions = S.conversions,
+                    conversion_rate = S.conversion_rate,
+                    revenue = S.revenue,
+                    engagement_rate = S.engagement_rate,
+                    pages_per_session = S.pages_per_session,
+                    source_breakdown = S.source_breakdown,
+                    updated_at = CURRENT_TIMESTAMP()
+                WHEN NOT MATCHED THEN
+                  INSERT (organization_id, date, canonical_entity_id, entity_type, users, sessions, pageviews, conversions, conversion_rate, revenue, engagement_rate, pages_per_session, source_breakdown, created_at, updated_at)
+                  VALUES (S.organization_id, S.date, S.canonical_entity_id, S.entity_type, S.users, S.sessions, S.pageviews, S.conversions, S.conversion_rate, S.revenue, S.engagement_rate, S.pages_per_session, S.source_breakdown, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP())
+                {delete_clause}
+                """
+                bq_us.query(merge_query).result()
+                logger.info(f"Merged {sum(results[key] for key in result_keys.values())} rows via staging table copy")
+            
+            finally:
+                for client, table_ref in ((bq_ga4, staging_table_ref), (bq_us, us_temp_table_ref)):
+                    try:
+                        client.delete_table(table_ref, not_found_ok=True)
+                    except Exception as cleanup_error:
+                        logger.warning(f"Failed to clean up {table_ref}: {cleanup_error}")
+        
+        else:
+            # Delete existing data for the date range / reprocessed shard dates (in US region)
+            if sync_mode == 'full' or use_ledger:
+                bq_us.query(f"DELETE FROM `{target_table}` WHERE {owned_rows_filter()}").result()
+                logger.info("Deleted existing GA4 raw data")
+            
+            # Run the script in the GA4 region (the final SELECT is its result), then stream insert to US
+            ga4_result = bq_ga4.query(events_statement + aggregation_query + ";").result()
+            
+            BATCH_SIZE = 500
+            batch = []
+            
+            def flush(batch):
+                errors = bq_us.insert_rows_json(target_table, batch, skip_invalid_rows=True)
+                if errors:
+                    logger.warning(f"GA4 raw insert errors: {len(errors)}")
+            
+            for row in ga4_result:
+                bq_row = {key: value for key, value in row.items() if value is not None}
+                bq_row['created_at'] = now_iso
+                bq_row['updated_at'] = now_iso
+                batch.append(bq_row)
+                results[result_keys[row.entity_type]] += 1
+                
+                if len(batch) >= BATCH_SIZE:
+                    flush(batch)
+                    batch = []
+            
+            if batch:
+                flush(batch)
+            
+            logger.info(f"Inserted {sum(results[key] for key in result_keys.values())} rows from a single pass over the GA4 export")
+        
+        # Every entity type this sync owns was rewritten for the processed dates
+        if use_ledger:
+            shard_days = sorted(shard.shard_date for shard in shards)
+            dirty_start = f"{shard_days[0][:4]}-{shard_days[0][4:6]}-{shard_days[0][6:8]}"
+            dirty_end = f"{shard_days[-1][:4]}-{shard_days[-1][4:6]}-{shard_days[-1][6:8]}"
+        else:
+            dirty_start, dirty_end = start_date.isoformat(), end_date.isoformat()
+        record_dirty_partitions(bq_us, organization_id, [
+            (entity_type, dirty_start, dirty_end) for entity_type in result_keys
+        ], 'ga4_raw')
         
-        # Results already counted during insertion
+        if use_ledger:
+            record_processed_shards(bq_ga4, organization_id, shards)
         
         logger.info(f"✅ GA4 Raw sync complete: {results}")
         
@@ -10,10 +10,16 @@ Architecture: Google Ads API → Cloud Function → BigQuery
 import functions_framework
 from google.cloud import firestore, bigquery
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import os
+import re
+import uuid
 import requests
+from opsos_common.dirty_partitions import record_dirty_partitions
+from opsos_common.row_converter import compile_row_converter
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +31,15 @@ GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 GOOGLE_ADS_API_VERSION = 'v18'
 
+# Long date ranges are split into windows that stream concurrently
+GOOGLE_ADS_WINDOW_DAYS = int(os.environ.get('GOOGLE_ADS_WINDOW_DAYS', '31'))
+GOOGLE_ADS_MAX_CONCURRENT_WINDOWS = int(os.environ.get('GOOGLE_ADS_MAX_CONCURRENT_WINDOWS', '4'))
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_STRUCTURAL_CHARS = re.compile(r'[{}\[\]"\\]')
+
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=GOOGLE_ADS_MAX_CONCURRENT_WINDOWS + 2))
+
 
 def refresh_access_token(refresh_token: str) -> str:
     """Refresh Google OAuth access token"""
@@ -44,34 +59,296 @@ def refresh_access_token(refresh_token: str) -> str:
     return response.json()['access_token']
 
 
-def execute_google_ads_query(access_token: str, developer_token: str, customer_id: str, query: str) -> list:
-    """Execute Google Ads query via searchStream"""
+def iter_search_stream_batches(response):
+    """
+    Incrementally parse a searchStream body, yielding each result batch as soon
+    as its closing brace arrives.
+
+    The body is one JSON array of batch objects. Only the batch currently being
+    received is buffered; structural characters are tracked across chunks so a
+    batch is decoded exactly once.
+    """
+    response.encoding = response.encoding or 'utf-8'
+    depth = 0
+    in_string = False
+    escaped = False
+    pieces = []
+    
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True):
+        if not chunk:
+            continue
+        
+        i = 1 if escaped else 0
+        escaped = False
+        item_from = 0 if depth > 1 else None
+        
+        while True:
+            match = JSON_STRUCTURAL_CHARS.search(chunk, i)
+            if not match:
+                break
+            ch = match.group()
+            i = match.end()
+            
+            if in_string:
+                if ch == '\\':
+                    if i >= len(chunk):
+                        escaped = True
+                        break
+                    i += 1
+                elif ch == '"':
+                    in_string = False
+                continue
+            
+            if ch == '"':
+                in_string = True
+            elif ch in '{[':
+                depth += 1
+                if depth == 2:
+                    item_from = match.start()
+            else:
+                depth -= 1
+                if depth == 1:
+                    pieces.append(chunk[item_from:i])
+                    batch = json.loads(''.join(pieces))
+                    pieces = []
+                    item_from = None
+                    if 'error' in batch:
+                        raise ValueError(f"Google Ads stream error: {batch['error'].get('message', batch['error'])}")
+                    yield batch
+        
+        if item_from is not None:
+            pieces.append(chunk[item_from:])
+
+
+def stream_google_ads_query(access_token: str, developer_token: str, customer_id: str, query: str):
+    """Execute Google Ads query via searchStream, yielding the results of each batch as it arrives"""
     url = f"https://googleads.googleapis.com/{GOOGLE_ADS_API_VERSION}/customers/{customer_id}/googleAds:searchStream"
     
-    response = requests.post(
+    with http_session.post(
         url,
         headers={
             'Authorization': f'Bearer {access_token}',
             'developer-token': developer_token,
             'Content-Type': 'application/json',
         },
-        json={'query': query}
-    )
+        json={'query': query},
+        stream=True,
+    ) as response:
+        if not response.ok:
+            raise ValueError(f"Google Ads API error ({response.status_code}): {response.text}")
+        
+        for batch in iter_search_stream_batches(response):
+            if batch.get('results'):
+                yield batch['results']
+
+
+def resolve_date_range(date_range: str) -> tuple:
+    """Turn a GAQL DURING literal into explicit (start, end) dates so it can be split into windows"""
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
     
-    if not response.ok:
-        logger.error(f"Google Ads API error: {response.text}")
-        return []
+    if date_range == 'TODAY':
+        return today, today
+    if date_range == 'YESTERDAY':
+        return yesterday, yesterday
+    if date_range == 'THIS_MONTH':
+        return today.replace(day=1), today
+    if date_range == 'LAST_MONTH':
+        last_month_end = today.replace(day=1) - timedelta(days=1)
+        return last_month_end.replace(day=1), last_month_end
     
-    data = response.json()
+    # LAST_N_DAYS literals end yesterday, matching the Google Ads definition
+    match = re.fullmatch(r'LAST_(\d+)_DAYS', date_range)
+    if match:
+        return yesterday - timedelta(days=int(match.group(1)) - 1), yesterday
     
-    # searchStream returns array of result batches
-    results = []
-    if isinstance(data, list):
-        for batch in data:
-            if 'results' in batch:
-                results.extend(batch['results'])
+    raise ValueError(f"Unsupported dateRange: {date_range}")
+
+
+def date_windows(start_date, end_date, window_days: int) -> list:
+    """Split an inclusive date range into consecutive windows of at most window_days"""
+    windows = []
+    cursor = start_date
+    while cursor <= end_date:
+        window_end = min(cursor + timedelta(days=window_days - 1), end_date)
+        windows.append((cursor, window_end))
+        cursor = window_end + timedelta(days=1)
+    return windows
+
+
+def derived_metrics(metrics: dict) -> dict:
+    """Core and calculated ad metrics shared by account and campaign rows"""
+    spend = int(metrics.get('costMicros', 0)) / 1000000
+    impressions = int(metrics.get('impressions', 0))
+    clicks = int(metrics.get('clicks', 0))
+    conversions = float(metrics.get('conversions', 0))
+    conversion_value = float(metrics.get('conversionsValue', 0))
     
-    return results
+    return {
+        # Core metrics
+        'cost': spend,  # Alias used by detectors
+        'ad_spend': spend,
+        'impressions': impressions,
+        'clicks': clicks,
+        'conversions': conversions,
+        'conversion_value': conversion_value,
+        'revenue': conversion_value,  # Alias used by detectors
+        
+        # Calculated metrics
+        'ctr': (clicks / impressions * 100) if impressions > 0 else 0,
+        'conversion_rate': (conversions / clicks * 100) if clicks > 0 else 0,
+        'cpc': (spend / clicks) if clicks > 0 else 0,
+        'cpa': (spend / conversions) if conversions > 0 else 0,
+        'roas': (conversion_value / spend) if spend > 0 else 0,
+    }
+
+
+def daily_row(row: dict, organization_id: str, now_iso: str, today_str: str) -> dict:
+    """Transform one customer-level daily result into a daily_entity_metrics row"""
+    date_str = row.get('segments', {}).get('date', today_str)
+    return {
+        'organization_id': organization_id,
+        'date': date_str,
+        'canonical_entity_id': f"google_ads_{date_str}",
+        'entity_type': 'ad_account',
+        **derived_metrics(row.get('metrics', {})),
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
+def campaign_row(row: dict, organization_id: str, now_iso: str, today_str: str) -> dict:
+    """Transform one campaign result into a daily_entity_metrics row dated today"""
+    campaign = row.get('campaign', {})
+    return {
+        'organization_id': organization_id,
+        'date': today_str,
+        'canonical_entity_id': f"campaign_{campaign.get('id', 'unknown')}",
+        'entity_type': 'campaign',
+        
+        'entity_name': campaign.get('name', 'Unknown'),
+        
+        **derived_metrics(row.get('metrics', {})),
+        
+        'source_breakdown': json.dumps({
+            'status': campaign.get('status', 'UNKNOWN'),
+            'channel_type': campaign.get('advertisingChannelType', 'UNKNOWN'),
+        }),
+        
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
+def replace_entity_rows(bq, table_ref: str, rows: list, organization_id: str, entity_type: str,
+                        start_date, end_date) -> int:
+    """
+    Replace one entity type's rows for [start_date, end_date] (start_date None: everything
+    up to end_date) with rows, in a single MERGE from a load-job staging table.
+    
+    Called only after the stream that produced rows finished, so a failed fetch never
+    deletes anything. An empty fetch also leaves existing rows alone.
+    """
+    if not rows:
+        return 0
+    
+    staging_ref = f"{table_ref}_staging_{organization_id.replace('-', '_')}_{entity_type}_{uuid.uuid4().hex[:12]}"
+    start_clause = f"AND T.date >= '{start_date.isoformat()}'" if start_date else ""
+    
+    try:
+        schema = bq.get_table(table_ref).schema
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            ignore_unknown_values=True,
+        )
+        staged = compile_row_converter(schema)(rows)
+        load_job = bq.load_table_from_json(staged, staging_ref, job_config=job_config)
+        load_job.result()
+        if (load_job.output_rows or 0) != len(rows):
+            raise RuntimeError(f"Staging load wrote {load_job.output_rows} of {len(rows)} {entity_type} rows")
+        
+        merge_query = f"""
+        MERGE `{table_ref}` T
+        USING `{staging_ref}` S
+        ON FALSE
+        WHEN NOT MATCHED BY SOURCE
+          AND T.organization_id = '{organization_id}'
+          AND T.entity_type = '{entity_type}'
+          {start_clause}
+          AND T.date <= '{end_date.isoformat()}'
+        THEN DELETE
+        WHEN NOT MATCHED THEN
+          INSERT ROW
+        """
+        bq.query(merge_query).result()
+        return len(rows)
+    
+    finally:
+        try:
+            bq.delete_table(staging_ref, not_found_ok=True)
+        except Exception as cleanup_error:
+            logger.warning(f"Failed to clean up staging table: {cleanup_error}")
+
+
+def sync_daily_window(bq, table_ref: str, access_token: str, developer_token: str, customer_id: str,
+                      organization_id: str, window: tuple, now_iso: str, today_str: str) -> tuple:
+    """
+    Stream one date window of account-level daily metrics, then replace the window's
+    ad_account rows once the stream has finished; returns (records seen, rows written)
+    """
+    window_start, window_end = window
+    daily_query = f"""
+        SELECT
+            segments.date,
+            metrics.cost_micros,
+            metrics.impressions,
+            metrics.clicks,
+            metrics.conversions,
+            metrics.conversions_value
+        FROM customer
+        WHERE segments.date BETWEEN '{window_start.isoformat()}' AND '{window_end.isoformat()}'
+        ORDER BY segments.date DESC
+    """
+    
+    rows = []
+    for batch in stream_google_ads_query(access_token, developer_token, customer_id, daily_query):
+        rows.extend(daily_row(row, organization_id, now_iso, today_str) for row in batch)
+    
+    written = replace_entity_rows(bq, table_ref, rows, organization_id, 'ad_account', window_start, window_end)
+    return len(rows), written
+
+
+def sync_campaigns(bq, table_ref: str, access_token: str, developer_token: str, customer_id: str,
+                   organization_id: str, replace_from, now_iso: str, today_str: str) -> tuple:
+    """
+    Stream the last-30-day campaign totals, then replace campaign rows from replace_from
+    (None: all dates) through today; returns (campaigns seen, rows written)
+    """
+    campaign_query = f"""
+        SELECT
+            campaign.id,
+            campaign.name,
+            campaign.status,
+            campaign.advertising_channel_type,
+            metrics.cost_micros,
+            metrics.impressions,
+            metrics.clicks,
+            metrics.conversions,
+            metrics.conversions_value
+        FROM campaign
+        WHERE segments.date DURING LAST_30_DAYS
+            AND campaign.status != 'REMOVED'
+        ORDER BY metrics.cost_micros DESC
+    """
+    
+    rows = []
+    for batch in stream_google_ads_query(access_token, developer_token, customer_id, campaign_query):
+        rows.extend(campaign_row(row, organization_id, now_iso, today_str) for row in batch)
+    
+    written = replace_entity_rows(bq, table_ref, rows, organization_id, 'campaign',
+                                  replace_from, datetime.fromisoformat(today_str).date())
+    return len(rows), written
 
 
 @functions_framework.http
@@ -101,6 +378,11 @@ def sync_google_ads_to_bigquery(request):
     else:
         date_range = request_json.get('dateRange', 'LAST_30_DAYS')  # 30 days for incremental
     
+    try:
+        range_start, range_end = resolve_date_range(date_range)
+    except ValueError as e:
+        return ({'error': str(e)}, 400, headers)
+    
     logger.info(f"Starting Google Ads → BigQuery sync for org: {organization_id} (mode={sync_mode}, range={date_range})")
     
     try:
@@ -148,219 +430,73 @@ def sync_google_ads_to_bigquery(request):
             'rows_inserted': 0,
         }
         
-        rows = []
         now_iso = datetime.utcnow().isoformat()
         today_str = datetime.utcnow().date().isoformat()
+        table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
         
-        # ============================================
-        # 1. FETCH DAILY METRICS FROM GOOGLE ADS
-        # ============================================
-        logger.info("Fetching daily metrics from Google Ads API...")
-        
-        daily_query = f"""
-            SELECT
-                segments.date,
-                metrics.cost_micros,
-                metrics.impressions,
-                metrics.clicks,
-                metrics.conversions,
-                metrics.conversions_value
-            FROM customer
-            WHERE segments.date DURING {date_range}
-            ORDER BY segments.date DESC
-        """
+        windows = date_windows(range_start, range_end, GOOGLE_ADS_WINDOW_DAYS)
+        dirty = []
         
-        try:
-            daily_data = execute_google_ads_query(access_token, developer_token, customer_id, daily_query)
-            
-            for row in daily_data:
-                results['daily_records'] += 1
-                
-                date_str = row.get('segments', {}).get('date', today_str)
-                metrics = row.get('metrics', {})
-                
-                spend = int(metrics.get('costMicros', 0)) / 1000000
-                impressions = int(metrics.get('impressions', 0))
-                clicks = int(metrics.get('clicks', 0))
-                conversions = float(metrics.get('conversions', 0))
-                conversion_value = float(metrics.get('conversionsValue', 0))
-                
-                # Calculate derived metrics
-                ctr = (clicks / impressions * 100) if impressions > 0 else 0
-                conversion_rate = (conversions / clicks * 100) if clicks > 0 else 0
-                cpc = (spend / clicks) if clicks > 0 else 0
-                cpa = (spend / conversions) if conversions > 0 else 0
-                roas = (conversion_value / spend) if spend > 0 else 0
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'canonical_entity_id': f"google_ads_{date_str}",
-                    'entity_type': 'ad_account',
-                    
-                    # Core metrics
-                    'cost': spend,  # Alias used by detectors
-                    'ad_spend': spend,
-                    'impressions': impressions,
-                    'clicks': clicks,
-                    'conversions': conversions,
-                    'conversion_value': conversion_value,
-                    'revenue': conversion_value,  # Alias used by detectors
-                    
-                    # Calculated metrics
-                    'ctr': ctr,
-                    'conversion_rate': conversion_rate,
-                    'cpc': cpc,
-                    'cpa': cpa,
-                    'roas': roas,
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(bq_row)
-                
-        except Exception as e:
-            logger.error(f"Error fetching daily metrics: {e}")
+        # Campaign rows are dated today: a full resync replaces all of them, an update the synced range
+        campaign_replace_from = None if sync_mode == 'full' else range_start
         
         # ============================================
-        # 2. FETCH CAMPAIGN DATA
+        # 1. STREAM DAILY METRICS (windowed) AND CAMPAIGNS, REPLACING EACH ONCE ITS STREAM FINISHED
         # ============================================
-        logger.info("Fetching campaigns from Google Ads API...")
-        
-        campaign_query = f"""
-            SELECT
-                campaign.id,
-                campaign.name,
-                campaign.status,
-                campaign.advertising_channel_type,
-                metrics.cost_micros,
-                metrics.impressions,
-                metrics.clicks,
-                metrics.conversions,
-                metrics.conversions_value
-            FROM campaign
-            WHERE segments.date DURING LAST_30_DAYS
-                AND campaign.status != 'REMOVED'
-            ORDER BY metrics.cost_micros DESC
-        """
-        
-        try:
-            campaign_data = execute_google_ads_query(access_token, developer_token, customer_id, campaign_query)
-            
-            for row in campaign_data:
-                results['campaigns_processed'] += 1
-                
-                campaign = row.get('campaign', {})
-                metrics = row.get('metrics', {})
-                
-                campaign_id = campaign.get('id', 'unknown')
-                campaign_name = campaign.get('name', 'Unknown')
-                
-                spend = int(metrics.get('costMicros', 0)) / 1000000
-                impressions = int(metrics.get('impressions', 0))
-                clicks = int(metrics.get('clicks', 0))
-                conversions = float(metrics.get('conversions', 0))
-                conversion_value = float(metrics.get('conversionsValue', 0))
-                
-                # Calculate derived metrics
-                ctr = (clicks / impressions * 100) if impressions > 0 else 0
-                conversion_rate = (conversions / clicks * 100) if clicks > 0 else 0
-                cpc = (spend / clicks) if clicks > 0 else 0
-                cpa = (spend / conversions) if conversions > 0 else 0
-                roas = (conversion_value / spend) if spend > 0 else 0
-                
-                bq_row = {
-                    'organization_id': organization_id,
-                    'date': today_str,
-                    'canonical_entity_id': f"campaign_{campaign_id}",
-                    'entity_type': 'campaign',
-                    
-                    'entity_name': campaign_name,
-                    
-                    # Core metrics
-                    'cost': spend,  # Alias used by detectors
-                    'ad_spend': spend,
-                    'impressions': impressions,
-                    'clicks': clicks,
-                    'conversions': conversions,
-                    'conversion_value': conversion_value,
-                    'revenue': conversion_value,  # Alias used by detectors
-                    
-                    # Calculated metrics
-                    'ctr': ctr,
-                    'conversion_rate': conversion_rate,
-                    'cpc': cpc,
-                    'cpa': cpa,
-                    'roas': roas,
-                    
-                    'source_breakdown': json.dumps({
-                        'status': campaign.get('status', 'UNKNOWN'),
-                        'channel_type': campaign.get('advertisingChannelType', 'UNKNOWN'),
-                    }),
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(bq_row)
-                
-        except Exception as e:
-            logger.error(f"Error fetching campaigns: {e}")
+        logger.info(f"Streaming Google Ads daily metrics in {len(windows)} window(s) plus campaigns (mode={sync_mode})...")
         
-        # ============================================
-        # 3. WRITE DIRECTLY TO BIGQUERY
-        # ============================================
-        if rows:
-            logger.info(f"Writing {len(rows)} rows to BigQuery (mode={sync_mode})...")
-            
-            table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+        errors = []
+        with ThreadPoolExecutor(max_workers=GOOGLE_ADS_MAX_CONCURRENT_WINDOWS) as executor:
+            window_futures = {
+                executor.submit(
+                    sync_daily_window, bq, table_ref, access_token, developer_token, customer_id,
+                    organization_id, window, now_iso, today_str,
+                ): window
+                for window in windows
+            }
+            campaign_future = executor.submit(
+                sync_campaigns, bq, table_ref, access_token, developer_token, customer_id,
+                organization_id, campaign_replace_from, now_iso, today_str,
+            )
             
-            # Get date range for deletion
-            dates = [r['date'] for r in rows]
-            min_date = min(dates) if dates else today_str
-            max_date = max(dates) if dates else today_str
-            
-            if sync_mode == 'full':
-                # FULL RESYNC: Delete ALL existing Google Ads data for this org
-                delete_query = f"""
-                DELETE FROM `{table_ref}`
-                WHERE organization_id = '{organization_id}'
-                  AND entity_type IN ('ad_account', 'campaign')
-                """
-                
+            for future, (window_start, window_end) in window_futures.items():
                 try:
-                    query_job = bq.query(delete_query)
-                    query_job.result()  # Wait for completion
-                    deleted_rows = query_job.num_dml_affected_rows
-                    logger.info(f"Deleted {deleted_rows} existing Google Ads rows for full resync")
+                    records, written = future.result()
+                    results['daily_records'] += records
+                    results['rows_inserted'] += written
+                    if written:
+                        dirty.append(('ad_account', window_start.isoformat(), window_end.isoformat()))
                 except Exception as e:
-                    logger.error(f"Delete query failed: {e}")
-                    raise
-            else:
-                # UPDATE SYNC: Delete data for EXACT date range being synced to prevent duplicates
-                delete_query = f"""
-                DELETE FROM `{table_ref}`
-                WHERE organization_id = '{organization_id}'
-                  AND entity_type IN ('ad_account', 'campaign')
-                  AND date >= '{min_date}'
-                  AND date <= '{max_date}'
-                """
-                
-                try:
-                    query_job = bq.query(delete_query)
-                    query_job.result()  # Wait for completion
-                    deleted_rows = query_job.num_dml_affected_rows
-                    logger.info(f"Deleted {deleted_rows} Google Ads rows from {min_date} to {max_date}")
-                except Exception as e:
-                    logger.error(f"Delete query failed: {e}")
-                    raise
-            
-            # Insert new rows
-            errors = bq.insert_rows_json(table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
+                    logger.error(f"Error syncing daily metrics for {window_start} to {window_end}: {e}")
+                    errors.append(f"{window_start}..{window_end}: {e}")
             
-            if errors:
-                logger.warning(f"Some rows failed: {errors[:3]}")
-            else:
-                results['rows_inserted'] = len(rows)
+            try:
+                campaigns, written = campaign_future.result()
+                results['campaigns_processed'] = campaigns
+                results['rows_inserted'] += written
+                if written:
+                    dirty.append(('campaign', today_str, today_str))
+            except Exception as e:
+                logger.error(f"Error syncing campaigns: {e}")
+                errors.append(f"campaigns: {e}")
+        
+        # A full resync also drops account rows outside the resynced range, but only
+        # once every window was replaced
+        if sync_mode == 'full' and not errors:
+            cleanup_query = f"""
+            DELETE FROM `{table_ref}`
+            WHERE organization_id = '{organization_id}'
+              AND entity_type = 'ad_account'
+              AND (date < '{range_start.isoformat()}' OR date > '{range_end.isoformat()}')
+            """
+            query_job = bq.query(cleanup_query)
+            query_job.result()
+            logger.info(f"Deleted {query_job.num_dml_affected_rows} Google Ads rows outside the resynced range")
+        
+        record_dirty_partitions(bq, organization_id, dirty, 'google_ads')
+        
+        if errors:
+            raise RuntimeError(f"{len(errors)} Google Ads fetch(es) failed, their dates were left unchanged: {'; '.join(errors)}")
         
         # Update connection status
         connection_ref.update({
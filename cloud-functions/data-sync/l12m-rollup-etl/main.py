@@ -9,9 +9,16 @@ This provides seasonality context and yearly baseline comparisons
 
 import functions_framework
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import logging
+from opsos_common.dirty_partitions import read_dirty_ranges, mark_dirty_consumed, months_in_ranges
+from opsos_common.bq_scripts import run_script
+from opsos_common.rollup_state import (
+    APPLIED_METRICS, additive_terms, applied_columns_sql, drift_statement,
+    full_rebuild_due, state_tables_statement,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,38 +30,132 @@ PROJECT_ID = "opsos-864a1"
 DATASET_ID = "marketing_ai"
 
 
-def create_l12m_aggregates(organization_id: str, as_of_date: datetime = None):
+STATE_TABLE = f"{PROJECT_ID}.{DATASET_ID}.l12m_entity_state"
+APPLIED_TABLE = f"{PROJECT_ID}.{DATASET_ID}.l12m_applied_months"
+
+
+def l12m_period(as_of_date: datetime) -> tuple:
+    """Return (start_month, end_month): the 12 complete months ending with the month before as_of_date"""
+    end_date = as_of_date.replace(day=1) - relativedelta(days=1)
+    start_date = end_date - relativedelta(months=11)
+    return start_date.strftime('%Y-%m'), end_date.strftime('%Y-%m')
+
+
+def period_months(start_month: str, end_month: str) -> list:
+    """Every YYYY-MM from start_month to end_month inclusive"""
+    month = datetime.strptime(start_month, '%Y-%m')
+    months = []
+    while month.strftime('%Y-%m') <= end_month:
+        months.append(month.strftime('%Y-%m'))
+        month += relativedelta(months=1)
+    return months
+
+
+def month_delta_statement(reset: bool) -> str:
     """
-    Aggregate monthly metrics into L12M metrics
-    as_of_date: The reference date (defaults to today)
-    
-    L12M includes the 12 complete months ending with the previous month
-    (e.g., if today is Jan 15, 2025, L12M = Feb 2024 - Jan 2025)
+    Temp table of signed month rows: +1 for the fresh monthly_entity_metrics row of
+    every month being applied, -1 for what was previously applied for the months
+    being re-applied or dropped. A reset applies onto an empty state, so there is
+    nothing to retract.
     """
-    if as_of_date is None:
-        as_of_date = datetime.now()
+    applied_columns = ', '.join(f'a.{metric}' for metric in APPLIED_METRICS)
     
-    # Calculate the 12-month period
-    # End month is the previous complete month
-    end_date = as_of_date.replace(day=1) - relativedelta(days=1)
-    end_month = end_date.strftime('%Y-%m')
+    retracted = "" if reset else f"""
+    UNION ALL
     
-    # Start month is 12 months before the end month
-    start_date = end_date - relativedelta(months=11)
-    start_month = start_date.strftime('%Y-%m')
+    SELECT -1 AS sign, a.canonical_entity_id, a.entity_type, a.year_month, {applied_columns}
+    FROM `{APPLIED_TABLE}` a
+    WHERE a.organization_id = @org_id
+      AND (a.year_month IN UNNEST(@apply_months) OR a.year_month IN UNNEST(@remove_months))"""
     
-    as_of_date_str = as_of_date.strftime('%Y-%m-%d')
+    return f"""
+    CREATE TEMP TABLE month_delta AS
+    SELECT 1 AS sign, m.canonical_entity_id, m.entity_type, m.year_month,
+      {applied_columns_sql('m')}
+    FROM `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics` m
+    WHERE m.organization_id = @org_id
+      AND m.year_month IN UNNEST(@apply_months)
+      AND m.canonical_entity_id IN (
+        SELECT canonical_entity_id
+        FROM `{PROJECT_ID}.{DATASET_ID}.entity_map`
+        WHERE is_active = TRUE
+      ){retracted};
+    """
+
+
+def entity_delta_statement() -> str:
+    """Temp table of the signed additive delta per entity"""
+    sums = ',\n      '.join(f'SUM({term}) AS {column}' for column, term in additive_terms())
+    return f"""
+    CREATE TEMP TABLE entity_delta AS
+    SELECT
+      canonical_entity_id,
+      entity_type,
+      {sums}
+    FROM month_delta
+    GROUP BY canonical_entity_id, entity_type;
+    """
+
+
+def apply_delta_statements(reset: bool) -> str:
+    """Fold entity_delta into the state and record the applied months"""
+    columns = [column for column, _ in additive_terms()]
+    updates = ',\n        '.join(f'{column} = T.{column} + S.{column}' for column in columns)
+    insert_columns = ', '.join(columns)
+    insert_values = ', '.join(f'S.{column}' for column in columns)
+    applied_columns = ', '.join(APPLIED_METRICS)
     
-    logger.info(f"Creating L12M aggregates for {organization_id}")
-    logger.info(f"  Period: {start_month} to {end_month} (as of {as_of_date_str})")
+    if reset:
+        clear = f"""
+    DELETE FROM `{STATE_TABLE}` WHERE organization_id = @org_id;
+    DELETE FROM `{APPLIED_TABLE}` WHERE organization_id = @org_id;
+    """
+    else:
+        clear = f"""
+    DELETE FROM `{APPLIED_TABLE}`
+    WHERE organization_id = @org_id
+      AND (year_month IN UNNEST(@apply_months) OR year_month IN UNNEST(@remove_months));
+    """
     
-    query = f"""
-    -- First, delete existing data for this as_of_date to allow re-processing
+    return clear + f"""
+    MERGE `{STATE_TABLE}` T
+    USING entity_delta S
+    ON T.organization_id = @org_id
+       AND T.canonical_entity_id = S.canonical_entity_id
+       AND T.entity_type = S.entity_type
+    WHEN MATCHED THEN
+      UPDATE SET
+        {updates},
+        updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (organization_id, canonical_entity_id, entity_type, {insert_columns}, rebuilt_at, updated_at)
+      VALUES (@org_id, S.canonical_entity_id, S.entity_type, {insert_values},
+              {'CURRENT_TIMESTAMP()' if reset else 'NULL'}, CURRENT_TIMESTAMP());
+    
+    -- Entities with no months left in the window
+    DELETE FROM `{STATE_TABLE}`
+    WHERE organization_id = @org_id
+      AND months <= 0;
+    
+    INSERT INTO `{APPLIED_TABLE}`
+      (organization_id, canonical_entity_id, entity_type, year_month, {applied_columns}, applied_at)
+    SELECT @org_id, canonical_entity_id, entity_type, year_month, {applied_columns}, CURRENT_TIMESTAMP()
+    FROM month_delta
+    WHERE sign > 0;
+    """
+
+
+def snapshot_statement() -> str:
+    """
+    Replace the as_of_date snapshot from the state. Sums, averages and stddevs come
+    from the additive state; best/worst months, min/max and the H1/H2 trend need the
+    order of the window's months, which l12m_applied_months holds (at most 12 per entity).
+    """
+    return f"""
     DELETE FROM `{PROJECT_ID}.{DATASET_ID}.l12m_entity_metrics`
     WHERE organization_id = @org_id
       AND as_of_date = @as_of_date;
     
-    -- Then insert fresh L12M aggregates from monthly data
     INSERT INTO `{PROJECT_ID}.{DATASET_ID}.l12m_entity_metrics`
     (
       organization_id, as_of_date, period_start_month, period_end_month,
@@ -74,203 +175,229 @@ def create_l12m_aggregates(organization_id: str, as_of_date: datetime = None):
       created_at, updated_at
     )
     
-    WITH monthly_data AS (
-      SELECT 
-        m.organization_id,
-        m.year_month,
-        m.canonical_entity_id,
-        m.entity_type,
-        m.impressions, m.clicks, m.sessions, m.users, m.pageviews,
-        m.avg_session_duration, m.avg_bounce_rate, m.avg_engagement_rate,
-        m.conversions, m.conversion_rate, m.revenue, m.cost, m.profit,
-        m.avg_ctr, m.avg_cpc, m.avg_cpa, m.avg_roas, m.avg_roi,
-        m.avg_position, m.avg_search_volume,
-        m.sends, m.opens, m.open_rate, m.click_through_rate,
+    WITH window_months AS (
+      SELECT
+        canonical_entity_id,
+        entity_type,
+        year_month,
+        sessions,
+        revenue,
         -- Flag for first half (H1) vs second half (H2) for trend calculation
-        CASE 
-          WHEN m.year_month < FORMAT_DATE('%Y-%m', DATE_ADD(DATE(@start_month || '-01'), INTERVAL 6 MONTH))
-          THEN 'H1' 
-          ELSE 'H2' 
-        END as half
-      FROM `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics` m
-      JOIN `{PROJECT_ID}.{DATASET_ID}.entity_map` e
-        ON m.canonical_entity_id = e.canonical_entity_id
-        AND e.is_active = TRUE
-      WHERE m.organization_id = @org_id
-        AND m.year_month >= @start_month
-        AND m.year_month <= @end_month
+        year_month < FORMAT_DATE('%Y-%m', DATE_ADD(DATE(@start_month || '-01'), INTERVAL 6 MONTH)) AS in_h1
+      FROM `{APPLIED_TABLE}`
+      WHERE organization_id = @org_id
     ),
     
-    -- Calculate H1 vs H2 for trend detection
-    half_aggregates AS (
-      SELECT 
+    order_stats AS (
+      SELECT
         canonical_entity_id,
         entity_type,
-        half,
-        SUM(sessions) as half_sessions,
-        SUM(revenue) as half_revenue
-      FROM monthly_data
-      GROUP BY canonical_entity_id, entity_type, half
-    ),
+        MIN(sessions) AS sessions_min,
+        MAX(sessions) AS sessions_max,
+        MIN(revenue) AS revenue_min,
+        MAX(revenue) AS revenue_max,
+        COUNTIF(in_h1) > 0 AS has_h1,
+        SUM(IF(in_h1, sessions, NULL)) AS h1_sessions,
+        SUM(IF(in_h1, NULL, sessions)) AS h2_sessions,
+        ARRAY_AGG(IF(sessions > 0, STRUCT(year_month, sessions), NULL) IGNORE NULLS
+                  ORDER BY sessions DESC LIMIT 1)[SAFE_OFFSET(0)] AS best,
+        ARRAY_AGG(IF(sessions > 0, STRUCT(year_month, sessions), NULL) IGNORE NULLS
+                  ORDER BY sessions ASC LIMIT 1)[SAFE_OFFSET(0)] AS worst
+      FROM window_months
+      GROUP BY canonical_entity_id, entity_type
+    )
     
-    trends AS (
-      SELECT 
-        h1.canonical_entity_id,
-        h1.entity_type,
-        h1.half_sessions as h1_sessions,
-        h2.half_sessions as h2_sessions,
-        SAFE_DIVIDE(h2.half_sessions - h1.half_sessions, h1.half_sessions) * 100 as trend_pct_change,
-        CASE 
-          WHEN SAFE_DIVIDE(h2.half_sessions - h1.half_sessions, h1.half_sessions) > 0.1 THEN 'up'
-          WHEN SAFE_DIVIDE(h2.half_sessions - h1.half_sessions, h1.half_sessions) < -0.1 THEN 'down'
+    SELECT
+      @org_id, @as_of_date, @start_month, @end_month,
+      s.canonical_entity_id, s.entity_type,
+      s.impressions, s.clicks, s.sessions, s.users, s.pageviews,
+      
+      -- Engagement averages (duration weighted by sessions)
+      CASE
+        WHEN s.sessions > 0 THEN s.duration_x_sessions / s.sessions
+        ELSE SAFE_DIVIDE(s.avg_session_duration_sum, s.avg_session_duration_n)
+      END,
+      SAFE_DIVIDE(s.avg_bounce_rate_sum, s.avg_bounce_rate_n),
+      SAFE_DIVIDE(s.avg_engagement_rate_sum, s.avg_engagement_rate_n),
+      
+      s.conversions,
+      SAFE_DIVIDE(s.conversions, s.sessions) * 100,
+      s.revenue, s.cost, s.revenue - s.cost,
+      
+      SAFE_DIVIDE(s.avg_ctr_sum, s.avg_ctr_n),
+      SAFE_DIVIDE(s.avg_cpc_sum, s.avg_cpc_n),
+      SAFE_DIVIDE(s.avg_cpa_sum, s.avg_cpa_n),
+      SAFE_DIVIDE(s.avg_roas_sum, s.avg_roas_n),
+      SAFE_DIVIDE(s.avg_roi_sum, s.avg_roi_n),
+      SAFE_DIVIDE(s.avg_position_sum, s.avg_position_n),
+      CAST(SAFE_DIVIDE(s.avg_search_volume_sum, s.avg_search_volume_n) AS INT64),
+      
+      s.sends, s.opens,
+      SAFE_DIVIDE(s.opens, s.sends) * 100,
+      SAFE_DIVIDE(s.clicks, s.sends) * 100,
+      
+      SAFE_DIVIDE(s.sessions, s.sessions_n),
+      SAFE_DIVIDE(s.revenue, s.revenue_n),
+      SAFE_DIVIDE(s.conversions, s.conversions_n),
+      
+      -- Sample standard deviation from the count, sum and sum of squares
+      IF(s.sessions_n > 1, SQRT(GREATEST((s.sessions_sq - s.sessions * s.sessions / s.sessions_n) / (s.sessions_n - 1), 0)), NULL),
+      IF(s.revenue_n > 1, SQRT(GREATEST((s.revenue_sq - s.revenue * s.revenue / s.revenue_n) / (s.revenue_n - 1), 0)), NULL),
+      
+      o.sessions_min, o.sessions_max, o.revenue_min, o.revenue_max,
+      
+      -- H2 vs H1 trend (entities with no H1 months have no trend)
+      IF(o.has_h1,
+        CASE
+          WHEN SAFE_DIVIDE(o.h2_sessions - o.h1_sessions, o.h1_sessions) > 0.1 THEN 'up'
+          WHEN SAFE_DIVIDE(o.h2_sessions - o.h1_sessions, o.h1_sessions) < -0.1 THEN 'down'
           ELSE 'stable'
-        END as trend_direction
-      FROM (SELECT * FROM half_aggregates WHERE half = 'H1') h1
-      FULL OUTER JOIN (SELECT * FROM half_aggregates WHERE half = 'H2') h2
-        ON h1.canonical_entity_id = h2.canonical_entity_id
-        AND h1.entity_type = h2.entity_type
-    ),
-    
-    -- Find best and worst months per entity
-    ranked_months AS (
-      SELECT 
-        canonical_entity_id,
-        entity_type,
-        year_month,
-        sessions,
-        ROW_NUMBER() OVER (PARTITION BY canonical_entity_id, entity_type ORDER BY sessions DESC) as best_rank,
-        ROW_NUMBER() OVER (PARTITION BY canonical_entity_id, entity_type ORDER BY sessions ASC) as worst_rank
-      FROM monthly_data
-      WHERE sessions > 0
-    ),
+        END,
+        NULL),
+      IF(o.has_h1, SAFE_DIVIDE(o.h2_sessions - o.h1_sessions, o.h1_sessions) * 100, NULL),
+      
+      o.best.year_month, o.best.sessions,
+      o.worst.year_month, o.worst.sessions,
+      
+      s.months,
+      CAST(s.months AS FLOAT64) / 12,
+      
+      CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP()
+    FROM `{STATE_TABLE}` s
+    LEFT JOIN order_stats o
+      ON s.canonical_entity_id = o.canonical_entity_id
+      AND s.entity_type = o.entity_type
+    WHERE s.organization_id = @org_id;
+    """
+
+
+def applied_months(organization_id: str) -> set:
+    """Months currently folded into this organization's L12M state"""
+    query = f"""
+    SELECT DISTINCT year_month
+    FROM `{APPLIED_TABLE}`
+    WHERE organization_id = @org_id
+    """
     
-    best_months AS (
-      SELECT canonical_entity_id, entity_type, year_month as best_month, sessions as best_month_sessions
-      FROM ranked_months WHERE best_rank = 1
-    ),
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id)
+        ]
+    )
     
-    worst_months AS (
-      SELECT canonical_entity_id, entity_type, year_month as worst_month, sessions as worst_month_sessions
-      FROM ranked_months WHERE worst_rank = 1
-    ),
+    return {row.year_month for row in bq_client.query(query, job_config=job_config).result()}
+
+
+def state_status(organization_id: str) -> tuple:
+    """Return (last full rebuild time, period_end_month of the latest snapshot) for this organization"""
+    query = f"""
+    SELECT
+      (SELECT MAX(rebuilt_at) FROM `{STATE_TABLE}` WHERE organization_id = @org_id) AS rebuilt_at,
+      (
+        SELECT period_end_month
+        FROM `{PROJECT_ID}.{DATASET_ID}.l12m_entity_metrics`
+        WHERE organization_id = @org_id
+        ORDER BY as_of_date DESC
+        LIMIT 1
+      ) AS period_end_month
+    """
     
-    l12m_agg AS (
-      SELECT 
-        organization_id,
-        DATE(@as_of_date) as as_of_date,
-        @start_month as period_start_month,
-        @end_month as period_end_month,
-        canonical_entity_id,
-        entity_type,
-        
-        -- Traffic totals (sum of 12 months)
-        SUM(impressions) as impressions,
-        SUM(clicks) as clicks,
-        SUM(sessions) as sessions,
-        SUM(users) as users,
-        SUM(pageviews) as pageviews,
-        
-        -- Engagement averages (weighted by sessions)
-        CASE 
-          WHEN SUM(sessions) > 0 
-          THEN SUM(avg_session_duration * sessions) / SUM(sessions)
-          ELSE AVG(avg_session_duration)
-        END as avg_session_duration,
-        AVG(avg_bounce_rate) as avg_bounce_rate,
-        AVG(avg_engagement_rate) as avg_engagement_rate,
-        
-        -- Conversion & revenue totals
-        SUM(conversions) as conversions,
-        SAFE_DIVIDE(SUM(conversions), SUM(sessions)) * 100 as conversion_rate,
-        SUM(revenue) as revenue,
-        SUM(cost) as cost,
-        SUM(revenue) - SUM(cost) as profit,
-        
-        -- Performance averages
-        AVG(avg_ctr) as avg_ctr,
-        AVG(avg_cpc) as avg_cpc,
-        AVG(avg_cpa) as avg_cpa,
-        AVG(avg_roas) as avg_roas,
-        AVG(avg_roi) as avg_roi,
-        
-        -- SEO averages
-        AVG(avg_position) as avg_position,
-        CAST(AVG(avg_search_volume) AS INT64) as avg_search_volume,
-        
-        -- Email totals
-        SUM(sends) as sends,
-        SUM(opens) as opens,
-        SAFE_DIVIDE(SUM(opens), SUM(sends)) * 100 as open_rate,
-        SAFE_DIVIDE(SUM(clicks), SUM(sends)) * 100 as click_through_rate,
-        
-        -- Monthly averages
-        AVG(sessions) as avg_monthly_sessions,
-        AVG(revenue) as avg_monthly_revenue,
-        AVG(conversions) as avg_monthly_conversions,
-        
-        -- Variance for anomaly detection
-        STDDEV(sessions) as sessions_stddev,
-        STDDEV(revenue) as revenue_stddev,
-        MIN(sessions) as sessions_min,
-        MAX(sessions) as sessions_max,
-        MIN(revenue) as revenue_min,
-        MAX(revenue) as revenue_max,
-        
-        -- Data quality
-        COUNT(DISTINCT year_month) as months_with_data,
-        CAST(COUNT(DISTINCT year_month) AS FLOAT64) / 12 as data_completeness,
-        
-        CURRENT_TIMESTAMP() as created_at,
-        CURRENT_TIMESTAMP() as updated_at
-        
-      FROM monthly_data
-      GROUP BY organization_id, canonical_entity_id, entity_type
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id)
+        ]
     )
     
-    SELECT 
-      l.organization_id, l.as_of_date, l.period_start_month, l.period_end_month,
-      l.canonical_entity_id, l.entity_type,
-      l.impressions, l.clicks, l.sessions, l.users, l.pageviews,
-      l.avg_session_duration, l.avg_bounce_rate, l.avg_engagement_rate,
-      l.conversions, l.conversion_rate, l.revenue, l.cost, l.profit,
-      l.avg_ctr, l.avg_cpc, l.avg_cpa, l.avg_roas, l.avg_roi,
-      l.avg_position, l.avg_search_volume,
-      l.sends, l.opens, l.open_rate, l.click_through_rate,
-      l.avg_monthly_sessions, l.avg_monthly_revenue, l.avg_monthly_conversions,
-      l.sessions_stddev, l.revenue_stddev,
-      l.sessions_min, l.sessions_max, l.revenue_min, l.revenue_max,
-      t.trend_direction, t.trend_pct_change,
-      b.best_month, b.best_month_sessions,
-      w.worst_month, w.worst_month_sessions,
-      l.months_with_data, l.data_completeness,
-      l.created_at, l.updated_at
-    FROM l12m_agg l
-    LEFT JOIN trends t 
-      ON l.canonical_entity_id = t.canonical_entity_id 
-      AND l.entity_type = t.entity_type
-    LEFT JOIN best_months b 
-      ON l.canonical_entity_id = b.canonical_entity_id 
-      AND l.entity_type = b.entity_type
-    LEFT JOIN worst_months w 
-      ON l.canonical_entity_id = w.canonical_entity_id 
-      AND l.entity_type = w.entity_type
+    try:
+        row = list(bq_client.query(query, job_config=job_config).result())[0]
+    except NotFound:
+        # The first rebuild creates the state tables
+        return None, None
+    
+    return row.rebuilt_at, row.period_end_month
+
+
+def create_l12m_aggregates(organization_id: str, as_of_date: datetime = None, dirty_months: list = None) -> dict:
     """
+    Maintain L12M metrics from additive state and write the as_of_date snapshot
+    as_of_date: The reference date (defaults to today)
+    dirty_months: Months restated upstream. None rebuilds the state from the 12
+    window months and reports how far the stored state had drifted; otherwise the
+    state is updated incrementally: months that left the window are subtracted,
+    months that entered it are added, and dirty months inside it are swapped.
+    
+    L12M includes the 12 complete months ending with the previous month
+    (e.g., if today is Jan 15, 2025, L12M = Feb 2024 - Jan 2025)
+    """
+    if as_of_date is None:
+        as_of_date = datetime.now()
+    
+    # The 12 complete months ending with the previous month
+    start_month, end_month = l12m_period(as_of_date)
+    window = period_months(start_month, end_month)
+    
+    as_of_date_str = as_of_date.strftime('%Y-%m-%d')
+    reset = dirty_months is None
+    
+    if reset:
+        rebuilt_at, previous_end_month = state_status(organization_id)
+        # Drift is only meaningful against a state built for the same window
+        check_drift = rebuilt_at is not None and previous_end_month == end_month
+        apply_months = window
+        remove_months = []
+    else:
+        check_drift = False
+        applied = applied_months(organization_id)
+        apply_months = sorted(
+            {month for month in dirty_months if start_month <= month <= end_month}
+            | (set(window) - applied)
+        )
+        remove_months = sorted(applied - set(window))
+    
+    logger.info(f"{'Rebuilding' if reset else 'Updating'} L12M aggregates for {organization_id}")
+    logger.info(f"  Period: {start_month} to {end_month} (as of {as_of_date_str})")
+    logger.info(f"  Applying {len(apply_months)} month(s), removing {len(remove_months)}")
+    
+    query = (
+        state_tables_statement(STATE_TABLE, APPLIED_TABLE)
+        + month_delta_statement(reset)
+        + entity_delta_statement()
+        + (drift_statement(STATE_TABLE) if check_drift else "")
+        + "\n    BEGIN TRANSACTION;\n"
+        + apply_delta_statements(reset)
+        + snapshot_statement()
+        + "\n    COMMIT TRANSACTION;\n"
+        + ("\n    SELECT * FROM drift;\n" if check_drift else "")
+    )
     
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
             bigquery.ScalarQueryParameter("as_of_date", "DATE", as_of_date.date()),
             bigquery.ScalarQueryParameter("start_month", "STRING", start_month),
-            bigquery.ScalarQueryParameter("end_month", "STRING", end_month)
+            bigquery.ScalarQueryParameter("end_month", "STRING", end_month),
+            bigquery.ArrayQueryParameter("apply_months", "STRING", apply_months),
+            bigquery.ArrayQueryParameter("remove_months", "STRING", remove_months)
         ]
     )
     
     try:
-        job = bq_client.query(query, job_config=job_config)
-        job.result()  # Wait for completion
+        # Concurrent org runs can abort the transaction; run_script re-runs it
+        rows = run_script(bq_client, query, job_config)
+        
+        drift = None
+        if check_drift and rows:
+            drift = dict(rows[0].items())
+            if drift['entities_drifted']:
+                logger.warning(f"⚠️ L12M state had drifted for {drift['entities_drifted']} entities: {drift}")
         
-        logger.info(f"✅ Successfully created L12M aggregates for {as_of_date_str}")
-        return True
+        logger.info(f"✅ Successfully {'rebuilt' if reset else 'updated'} L12M aggregates for {as_of_date_str}")
+        return {
+            'full_rebuild': reset,
+            'months_applied': apply_months,
+            'months_removed': remove_months,
+            'drift': drift
+        }
         
     except Exception as e:
         logger.error(f"❌ Error creating L12M aggregates: {e}")
@@ -285,9 +412,14 @@ def run_l12m_rollup(request):
     Request body:
     {
       "organizationId": "SBjucW1ztDyFYWBz7ZLE",
-      "asOfDate": "2025-01-31"  // optional, defaults to today
+      "asOfDate": "2025-01-31",  // optional, defaults to today
+      "mode": "dirty",           // optional, update incrementally from the dirty_partitions ledger
+      "fullRebuild": true        // optional, with mode=dirty: rebuild instead of updating
     }
     
+    Without mode=dirty the state is rebuilt from the 12 window months.
+    In dirty mode a full rebuild still runs every FULL_REBUILD_INTERVAL_DAYS to verify drift.
+    
     Note: L12M should be run daily to keep the rolling 12-month view current
     """
     
@@ -303,20 +435,41 @@ def run_l12m_rollup(request):
         else:
             as_of_date = datetime.now()
         
-        logger.info(f"🔄 Creating L12M aggregates for {organization_id} (as of {as_of_date.strftime('%Y-%m-%d')})")
-        
-        create_l12m_aggregates(organization_id, as_of_date)
+        start_month, end_month = l12m_period(as_of_date)
+        result = None
         
-        # Calculate the period for response
-        end_date = as_of_date.replace(day=1) - relativedelta(days=1)
-        end_month = end_date.strftime('%Y-%m')
-        start_date = end_date - relativedelta(months=11)
-        start_month = start_date.strftime('%Y-%m')
+        if request_json.get('mode') == 'dirty':
+            # Wait for the monthly rollup to rewrite a dirty month before consuming it
+            dirty_ids, ranges = read_dirty_ranges(bq_client, organization_id, 'l12m', after='monthly')
+            dirty_months = months_in_ranges(ranges)
+            rebuilt_at, previous_end_month = state_status(organization_id)
+            
+            window_moved = previous_end_month != end_month
+            window_dirty = any(start_month <= month <= end_month for month in dirty_months)
+            
+            if request_json.get('fullRebuild') or full_rebuild_due(rebuilt_at):
+                logger.info(f"🔄 Rebuilding L12M state for {organization_id} (as of {as_of_date.strftime('%Y-%m-%d')})")
+                result = create_l12m_aggregates(organization_id, as_of_date)
+            elif window_moved or window_dirty:
+                logger.info(f"🔄 Updating L12M aggregates for {organization_id} (as of {as_of_date.strftime('%Y-%m-%d')})")
+                result = create_l12m_aggregates(organization_id, as_of_date, dirty_months)
+            else:
+                logger.info(f"L12M window {start_month}..{end_month} unchanged for {organization_id}, skipping")
+            
+            mark_dirty_consumed(bq_client, organization_id, 'l12m', dirty_ids)
+        else:
+            logger.info(f"🔄 Rebuilding L12M aggregates for {organization_id} (as of {as_of_date.strftime('%Y-%m-%d')})")
+            result = create_l12m_aggregates(organization_id, as_of_date)
         
         return {
             'success': True,
             'organization_id': organization_id,
             'as_of_date': as_of_date.strftime('%Y-%m-%d'),
+            'refreshed': result is not None,
+            'full_rebuild': bool(result and result['full_rebuild']),
+            'months_applied': result['months_applied'] if result else [],
+            'months_removed': result['months_removed'] if result else [],
+            'drift': result['drift'] if result else None,
             'period': {
                 'start_month': start_month,
                 'end_month': end_month,
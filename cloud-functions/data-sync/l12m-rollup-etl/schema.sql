@@ -83,6 +83,10 @@ CREATE TABLE IF NOT EXISTS `opsos-864a1.marketing_ai.l12m_entity_metrics` (
 PARTITION BY as_of_date
 CLUSTER BY organization_id, canonical_entity_id, entity_type;
 
+-- The L12M rollup's additive state (l12m_entity_state) and the monthly values
+-- folded into it (l12m_applied_months) are created by the rollup itself, from the
+-- column lists in opsos_common/rollup_state.py.
+
 -- View for L12M summary across all entities
 CREATE OR REPLACE VIEW `opsos-864a1.marketing_ai.l12m_metrics_summary` AS
 SELECT 
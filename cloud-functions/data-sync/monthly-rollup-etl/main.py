@@ -8,6 +8,8 @@ from google.cloud import bigquery
 from datetime import datetime, timedelta
 import calendar
 import logging
+from opsos_common.dirty_partitions import read_dirty_ranges, mark_dirty_consumed, months_in_ranges
+from opsos_common.bq_scripts import run_script
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,64 +21,136 @@ PROJECT_ID = "opsos-864a1"
 DATASET_ID = "marketing_ai"
 
 
-def create_monthly_aggregates(organization_id: str, year_month: str):
+ENTITY_COLUMNS = [
+    'organization_id', 'year_month', 'canonical_entity_id', 'entity_type',
+    'impressions', 'clicks', 'sessions', 'users', 'pageviews',
+    'avg_session_duration', 'avg_bounce_rate', 'avg_engagement_rate',
+    'conversions', 'conversion_rate', 'revenue', 'cost', 'profit',
+    'avg_ctr', 'avg_cpc', 'avg_cpa', 'avg_roas', 'avg_roi',
+    'avg_position', 'avg_search_volume',
+    'sends', 'opens', 'open_rate', 'click_through_rate',
+    'days_in_month', 'days_with_data', 'data_completeness',
+    'mom_change_pct', 'mom_change_abs', 'is_best_month', 'is_worst_month',
+    'created_at', 'updated_at',
+]
+
+CAMPAIGN_COLUMNS = [
+    'organization_id', 'year_month', 'campaign_id', 'campaign_type', 'campaign_name', 'channel',
+    'impressions', 'clicks', 'sessions', 'conversions', 'revenue', 'cost',
+    'avg_ctr', 'avg_cpc', 'avg_cpa', 'avg_roas', 'avg_roi',
+    'sends', 'opens', 'open_rate', 'click_through_rate',
+    'days_in_month', 'days_with_data', 'data_completeness',
+    'mom_change_pct', 'mom_change_abs', 'is_best_month', 'is_worst_month',
+    'created_at', 'updated_at',
+]
+
+REVENUE_COLUMNS = [
+    'organization_id', 'year_month',
+    'total_revenue', 'new_revenue', 'recurring_revenue', 'refunds', 'refund_rate', 'net_revenue',
+    'total_conversions', 'total_transactions', 'avg_order_value', 'revenue_per_session',
+    'mrr', 'arr', 'new_subscriptions', 'churned_subscriptions', 'churn_rate',
+    'expansion_revenue', 'contraction_revenue', 'net_mrr_change',
+    'mom_revenue_change_pct', 'mom_revenue_change_abs', 'mom_mrr_change_pct', 'mom_conversions_change_pct',
+    'is_best_month', 'is_worst_month',
+    'created_at', 'updated_at',
+]
+
+FUNNEL_COLUMNS = [
+    'organization_id', 'year_month', 'channel', 'source',
+    'visits', 'signups', 'trials', 'purchases', 'total_revenue',
+    'visit_to_signup_rate', 'signup_to_trial_rate', 'trial_to_paid_rate',
+    'overall_conversion_rate', 'avg_revenue_per_visitor', 'avg_revenue_per_customer',
+    'mom_visits_change_pct', 'mom_conversion_change_pct', 'mom_revenue_change_pct',
+    'is_best_month',
+    'created_at', 'updated_at',
+]
+
+
+def replace_months_statement(table_id: str, columns: list, source_sql: str) -> str:
     """
-    Aggregate daily metrics into monthly metrics for a specific month
-    year_month format: "2025-10", "2025-11", etc.
+    MERGE that atomically swaps the org's rows for every month in @year_months
+    with the rows produced by source_sql (which is grouped by year_month).
     """
-    logger.info(f"Creating monthly aggregates for {organization_id} - {year_month}")
-    
-    # Parse year_month
-    year, month = year_month.split('-')
-    year = int(year)
-    month = int(month)
-    days_in_month = calendar.monthrange(year, month)[1]
-    
-    query = f"""
-    -- First, delete existing data for this month to allow re-processing
-    DELETE FROM `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics`
-    WHERE organization_id = @org_id
-      AND year_month = @year_month;
-    
-    -- Then insert fresh monthly aggregates
-    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics`
-    (
-      organization_id, year_month, canonical_entity_id, entity_type,
-      impressions, clicks, sessions, users, pageviews,
-      avg_session_duration, avg_bounce_rate, avg_engagement_rate,
-      conversions, conversion_rate, revenue, cost, profit,
-      avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
-      avg_position, avg_search_volume,
-      sends, opens, open_rate, click_through_rate,
-      days_in_month, days_with_data, data_completeness,
-      mom_change_pct, mom_change_abs, is_best_month, is_worst_month,
-      created_at, updated_at
+    column_list = ', '.join(columns)
+    return f"""
+    MERGE `{PROJECT_ID}.{DATASET_ID}.{table_id}` T
+    USING (
+      {source_sql}
+    ) S
+    ON FALSE
+    WHEN NOT MATCHED BY SOURCE
+      AND T.organization_id = @org_id
+      AND T.year_month IN UNNEST(@year_months)
+    THEN DELETE
+    WHEN NOT MATCHED THEN
+      INSERT ({column_list})
+      VALUES ({column_list});
+    """
+
+
+def months_job_config(organization_id: str, year_months: list) -> bigquery.QueryJobConfig:
+    """Query parameters for the rollup script: org, months and their covering date range"""
+    month_starts = [datetime.strptime(year_month, '%Y-%m').date() for year_month in year_months]
+    range_start = min(month_starts)
+    last_month = max(month_starts)
+    range_end = last_month.replace(day=calendar.monthrange(last_month.year, last_month.month)[1])
+    
+    return bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
+            bigquery.ArrayQueryParameter("year_months", "STRING", year_months),
+            bigquery.ScalarQueryParameter("range_start", "DATE", range_start),
+            bigquery.ScalarQueryParameter("range_end", "DATE", range_end)
+        ]
     )
-    
+
+
+def month_daily_statement() -> str:
+    """
+    Temp table holding the org's daily rows for the requested months, read once
+    and shared by every monthly aggregate. is_mapped marks entities active in
+    entity_map (monthly_entity_metrics only covers those).
+    """
+    return f"""
+    CREATE TEMP TABLE month_daily AS
+    SELECT 
+      m.organization_id,
+      m.canonical_entity_id,
+      m.entity_type,
+      m.date,
+      FORMAT_DATE('%Y-%m', m.date) as year_month,
+      m.impressions, m.clicks, m.sessions, m.users, m.pageviews,
+      m.avg_session_duration, m.bounce_rate, m.engagement_rate,
+      m.conversions, m.conversion_rate, m.revenue, m.cost, m.profit,
+      m.ctr, m.cpc, m.cpa, m.roas, m.roi,
+      m.position, m.search_volume,
+      m.sends, m.opens, m.open_rate, m.click_through_rate,
+      m.canonical_entity_id IN (
+        SELECT canonical_entity_id
+        FROM `{PROJECT_ID}.{DATASET_ID}.entity_map`
+        WHERE is_active = TRUE
+      ) as is_mapped
+    FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics` m
+    WHERE m.organization_id = @org_id
+      AND m.date >= @range_start
+      AND m.date <= @range_end
+      AND FORMAT_DATE('%Y-%m', m.date) IN UNNEST(@year_months);
+    """
+
+
+def entity_months_sql() -> str:
+    """monthly_entity_metrics rows for each month in month_daily"""
+    return """
     WITH daily_data AS (
-      SELECT 
-        m.organization_id,
-        m.canonical_entity_id,
-        m.entity_type,
-        m.date,
-        m.impressions, m.clicks, m.sessions, m.users, m.pageviews,
-        m.avg_session_duration, m.bounce_rate, m.engagement_rate,
-        m.conversions, m.conversion_rate, m.revenue, m.cost, m.profit,
-        m.ctr, m.cpc, m.cpa, m.roas, m.roi,
-        m.position, m.search_volume,
-        m.sends, m.opens, m.open_rate, m.click_through_rate
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics` m
-      JOIN `{PROJECT_ID}.{DATASET_ID}.entity_map` e
-        ON m.canonical_entity_id = e.canonical_entity_id
-        AND e.is_active = TRUE
-      WHERE m.organization_id = @org_id
-        AND FORMAT_DATE('%Y-%m', m.date) = @year_month
+      SELECT *
+      FROM month_daily
+      WHERE is_mapped
     ),
     
     monthly_agg AS (
       SELECT 
         organization_id,
-        @year_month as year_month,
+        year_month,
         canonical_entity_id,
         entity_type,
         
@@ -121,92 +195,33 @@ def create_monthly_aggregates(organization_id: str, year_month: str):
         SAFE_DIVIDE(SUM(clicks), SUM(sends)) * 100 as click_through_rate,
         
         -- Metadata
-        @days_in_month as days_in_month,
+        EXTRACT(DAY FROM LAST_DAY(MIN(date))) as days_in_month,
         COUNT(DISTINCT date) as days_with_data,
-        CAST(COUNT(DISTINCT date) AS FLOAT64) / @days_in_month as data_completeness,
+        CAST(COUNT(DISTINCT date) AS FLOAT64) / EXTRACT(DAY FROM LAST_DAY(MIN(date))) as data_completeness,
         
         CURRENT_TIMESTAMP() as created_at,
         CURRENT_TIMESTAMP() as updated_at
         
       FROM daily_data
-      GROUP BY organization_id, canonical_entity_id, entity_type
-    ),
-    
-    with_trends AS (
-      SELECT 
-        m.*,
-        NULL as mom_change_pct,  -- Will be calculated later via update
-        NULL as mom_change_abs,
-        FALSE as is_best_month,  -- Will be calculated later
-        FALSE as is_worst_month
-      FROM monthly_agg m
+      GROUP BY organization_id, year_month, canonical_entity_id, entity_type
     )
     
     SELECT 
-      organization_id, year_month, canonical_entity_id, entity_type,
-      impressions, clicks, sessions, users, pageviews,
-      avg_session_duration, avg_bounce_rate, avg_engagement_rate,
-      conversions, conversion_rate, revenue, cost, profit,
-      avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
-      avg_position, avg_search_volume,
-      sends, opens, open_rate, click_through_rate,
-      days_in_month, days_with_data, data_completeness,
-      mom_change_pct, mom_change_abs, is_best_month, is_worst_month,
-      created_at, updated_at
-    FROM with_trends
+      m.*,
+      NULL as mom_change_pct,  -- Will be calculated later via update
+      NULL as mom_change_abs,
+      FALSE as is_best_month,  -- Will be calculated later
+      FALSE as is_worst_month
+    FROM monthly_agg m
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
-            bigquery.ScalarQueryParameter("year_month", "STRING", year_month),
-            bigquery.ScalarQueryParameter("days_in_month", "INT64", days_in_month)
-        ]
-    )
-    
-    try:
-        job = bq_client.query(query, job_config=job_config)
-        job.result()  # Wait for completion
-        
-        logger.info(f"✅ Successfully created monthly aggregates for {year_month}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Error creating monthly aggregates for {year_month}: {e}")
-        raise
 
 
-def create_campaign_monthly_aggregates(organization_id: str, year_month: str):
+def campaign_months_sql() -> str:
     """
-    Aggregate campaign-level performance into monthly rollups
+    Campaign-level performance per month
     Covers: Google Ads campaigns, email campaigns, social campaigns
     """
-    logger.info(f"Creating campaign monthly aggregates for {organization_id} - {year_month}")
-    
-    # Parse year_month
-    year, month = year_month.split('-')
-    year = int(year)
-    month = int(month)
-    days_in_month = calendar.monthrange(year, month)[1]
-    
-    query = f"""
-    -- Delete existing data for this month
-    DELETE FROM `{PROJECT_ID}.{DATASET_ID}.monthly_campaign_metrics`
-    WHERE organization_id = @org_id
-      AND year_month = @year_month;
-    
-    -- Insert campaign monthly aggregates
-    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.monthly_campaign_metrics`
-    (
-      organization_id, year_month, campaign_id, campaign_type, campaign_name, channel,
-      impressions, clicks, sessions, conversions, revenue, cost,
-      avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
-      sends, opens, open_rate, click_through_rate,
-      days_in_month, days_with_data, data_completeness,
-      mom_change_pct, mom_change_abs, is_best_month, is_worst_month,
-      created_at, updated_at
-    )
-    
+    return """
     WITH campaign_daily AS (
       -- Get campaigns from entity metrics where entity_type = 'campaign'
       SELECT 
@@ -216,16 +231,15 @@ def create_campaign_monthly_aggregates(organization_id: str, year_month: str):
         canonical_entity_id as campaign_name,
         'paid_search' as channel, -- TODO: derive from entity metadata
         date,
+        year_month,
         impressions, clicks, sessions, conversions, revenue, cost,
         ctr, cpc, cpa, roas, roi,
         0 as sends,
         0 as opens,
         0.0 as open_rate,
         0.0 as click_through_rate
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics`
-      WHERE organization_id = @org_id
-        AND entity_type = 'campaign'
-        AND FORMAT_DATE('%Y-%m', date) = @year_month
+      FROM month_daily
+      WHERE entity_type = 'campaign'
       
       UNION ALL
       
@@ -237,22 +251,21 @@ def create_campaign_monthly_aggregates(organization_id: str, year_month: str):
         canonical_entity_id as campaign_name,
         'email' as channel,
         date,
+        year_month,
         0 as impressions, 0 as clicks, sessions, conversions, revenue, 0.0 as cost,
         0.0 as ctr, 0.0 as cpc, 0.0 as cpa, 0.0 as roas, 0.0 as roi,
         sends,
         opens,
         open_rate,
         click_through_rate
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics`
-      WHERE organization_id = @org_id
-        AND entity_type = 'email'
-        AND FORMAT_DATE('%Y-%m', date) = @year_month
+      FROM month_daily
+      WHERE entity_type = 'email'
     ),
     
     monthly_agg AS (
       SELECT 
         organization_id,
-        @year_month as year_month,
+        year_month,
         campaign_id,
         campaign_type,
         campaign_name,
@@ -280,90 +293,45 @@ def create_campaign_monthly_aggregates(organization_id: str, year_month: str):
         SAFE_DIVIDE(SUM(clicks), SUM(sends)) * 100 as click_through_rate,
         
         -- Metadata
-        @days_in_month as days_in_month,
+        EXTRACT(DAY FROM LAST_DAY(MIN(date))) as days_in_month,
         COUNT(DISTINCT date) as days_with_data,
-        CAST(COUNT(DISTINCT date) AS FLOAT64) / @days_in_month as data_completeness,
+        CAST(COUNT(DISTINCT date) AS FLOAT64) / EXTRACT(DAY FROM LAST_DAY(MIN(date))) as data_completeness,
         
         CURRENT_TIMESTAMP() as created_at,
         CURRENT_TIMESTAMP() as updated_at
         
       FROM campaign_daily
-      GROUP BY organization_id, campaign_id, campaign_type, campaign_name, channel
+      GROUP BY organization_id, year_month, campaign_id, campaign_type, campaign_name, channel
     )
     
     SELECT 
-      organization_id, year_month, campaign_id, campaign_type, campaign_name, channel,
-      impressions, clicks, sessions, conversions, revenue, cost,
-      avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
-      sends, opens, open_rate, click_through_rate,
-      days_in_month, days_with_data, data_completeness,
+      m.*,
       NULL as mom_change_pct,  -- Will be calculated later
       NULL as mom_change_abs,
       FALSE as is_best_month,
-      FALSE as is_worst_month,
-      created_at, updated_at
-    FROM monthly_agg
+      FALSE as is_worst_month
+    FROM monthly_agg m
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
-            bigquery.ScalarQueryParameter("year_month", "STRING", year_month),
-            bigquery.ScalarQueryParameter("days_in_month", "INT64", days_in_month)
-        ]
-    )
-    
-    try:
-        job = bq_client.query(query, job_config=job_config)
-        job.result()
-        logger.info(f"✅ Successfully created campaign monthly aggregates for {year_month}")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error creating campaign monthly aggregates: {e}")
-        raise
 
 
-def create_revenue_monthly_aggregates(organization_id: str, year_month: str):
-    """
-    Aggregate revenue, transactions, and subscription metrics into monthly rollups
-    """
-    logger.info(f"Creating revenue monthly aggregates for {organization_id} - {year_month}")
-    
-    query = f"""
-    -- Delete existing data for this month
-    DELETE FROM `{PROJECT_ID}.{DATASET_ID}.monthly_revenue_metrics`
-    WHERE organization_id = @org_id
-      AND year_month = @year_month;
-    
-    -- Insert revenue monthly aggregates
-    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.monthly_revenue_metrics`
-    (
-      organization_id, year_month,
-      total_revenue, new_revenue, recurring_revenue, refunds, refund_rate, net_revenue,
-      total_conversions, total_transactions, avg_order_value, revenue_per_session,
-      mrr, arr, new_subscriptions, churned_subscriptions, churn_rate,
-      expansion_revenue, contraction_revenue, net_mrr_change,
-      mom_revenue_change_pct, mom_revenue_change_abs, mom_mrr_change_pct, mom_conversions_change_pct,
-      is_best_month, is_worst_month,
-      created_at, updated_at
-    )
-    
+def revenue_months_sql() -> str:
+    """Revenue, transactions, and subscription metrics per month"""
+    return """
     WITH daily_revenue AS (
       SELECT 
         date,
+        year_month,
         SUM(revenue) as revenue,
         SUM(conversions) as conversions,
         SUM(sessions) as sessions
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics`
-      WHERE organization_id = @org_id
-        AND FORMAT_DATE('%Y-%m', date) = @year_month
-      GROUP BY date
+      FROM month_daily
+      GROUP BY date, year_month
     ),
     
     monthly_agg AS (
       SELECT 
         @org_id as organization_id,
-        @year_month as year_month,
+        year_month,
         
         -- Revenue totals (we don't have new vs recurring split yet)
         SUM(revenue) as total_revenue,
@@ -400,58 +368,25 @@ def create_revenue_monthly_aggregates(organization_id: str, year_month: str):
         CURRENT_TIMESTAMP() as created_at,
         CURRENT_TIMESTAMP() as updated_at
         
-      FROM daily_revenue
+      -- Every requested month gets a row, even without data
+      FROM UNNEST(@year_months) as year_month
+      LEFT JOIN daily_revenue USING (year_month)
+      GROUP BY year_month
     )
     
     SELECT * FROM monthly_agg
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
-            bigquery.ScalarQueryParameter("year_month", "STRING", year_month)
-        ]
-    )
-    
-    try:
-        job = bq_client.query(query, job_config=job_config)
-        job.result()
-        logger.info(f"✅ Successfully created revenue monthly aggregates for {year_month}")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error creating revenue monthly aggregates: {e}")
-        raise
 
 
-def create_funnel_monthly_aggregates(organization_id: str, year_month: str):
-    """
-    Aggregate funnel stage metrics by channel into monthly rollups
-    """
-    logger.info(f"Creating funnel monthly aggregates for {organization_id} - {year_month}")
-    
-    query = f"""
-    -- Delete existing data for this month
-    DELETE FROM `{PROJECT_ID}.{DATASET_ID}.monthly_funnel_metrics`
-    WHERE organization_id = @org_id
-      AND year_month = @year_month;
-    
-    -- Insert funnel monthly aggregates
-    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.monthly_funnel_metrics`
-    (
-      organization_id, year_month, channel, source,
-      visits, signups, trials, purchases, total_revenue,
-      visit_to_signup_rate, signup_to_trial_rate, trial_to_paid_rate,
-      overall_conversion_rate, avg_revenue_per_visitor, avg_revenue_per_customer,
-      mom_visits_change_pct, mom_conversion_change_pct, mom_revenue_change_pct,
-      is_best_month,
-      created_at, updated_at
-    )
-    
+def funnel_months_sql() -> str:
+    """Funnel stage metrics by channel per month"""
+    return """
     WITH daily_funnel AS (
       -- Aggregate by channel from entity metrics
       -- We use sessions as "visits", conversions as "purchases"
       -- TODO: When you have actual funnel events, enhance this
       SELECT 
+        year_month,
         'organic' as channel,
         'seo' as source,
         SUM(CASE WHEN entity_type = 'page' THEN sessions ELSE 0 END) as visits,
@@ -459,13 +394,13 @@ def create_funnel_monthly_aggregates(organization_id: str, year_month: str):
         NULL as trials,   -- Not available yet
         SUM(conversions) as purchases,
         SUM(revenue) as total_revenue
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics`
-      WHERE organization_id = @org_id
-        AND FORMAT_DATE('%Y-%m', date) = @year_month
+      FROM month_daily
+      GROUP BY year_month
       
       UNION ALL
       
       SELECT 
+        year_month,
         'paid' as channel,
         'paid_search' as source,
         SUM(CASE WHEN entity_type = 'campaign' THEN sessions ELSE 0 END) as visits,
@@ -473,14 +408,14 @@ def create_funnel_monthly_aggregates(organization_id: str, year_month: str):
         NULL as trials,
         SUM(conversions) as purchases,
         SUM(revenue) as total_revenue
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics`
-      WHERE organization_id = @org_id
-        AND entity_type = 'campaign'
-        AND FORMAT_DATE('%Y-%m', date) = @year_month
+      FROM month_daily
+      WHERE entity_type = 'campaign'
+      GROUP BY year_month
       
       UNION ALL
       
       SELECT 
+        year_month,
         'email' as channel,
         'email' as source,
         SUM(CASE WHEN entity_type = 'email' THEN sessions ELSE 0 END) as visits,
@@ -488,16 +423,15 @@ def create_funnel_monthly_aggregates(organization_id: str, year_month: str):
         NULL as trials,
         SUM(conversions) as purchases,
         SUM(revenue) as total_revenue
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics`
-      WHERE organization_id = @org_id
-        AND entity_type = 'email'
-        AND FORMAT_DATE('%Y-%m', date) = @year_month
+      FROM month_daily
+      WHERE entity_type = 'email'
+      GROUP BY year_month
     ),
     
     monthly_agg AS (
       SELECT 
         @org_id as organization_id,
-        @year_month as year_month,
+        year_month,
         channel,
         source,
         
@@ -528,39 +462,23 @@ def create_funnel_monthly_aggregates(organization_id: str, year_month: str):
         CURRENT_TIMESTAMP() as updated_at
         
       FROM daily_funnel
-      GROUP BY channel, source
+      GROUP BY year_month, channel, source
     )
     
     SELECT * FROM monthly_agg
     WHERE visits > 0  -- Only include channels with actual traffic
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
-            bigquery.ScalarQueryParameter("year_month", "STRING", year_month)
-        ]
-    )
-    
-    try:
-        job = bq_client.query(query, job_config=job_config)
-        job.result()
-        logger.info(f"✅ Successfully created funnel monthly aggregates for {year_month}")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error creating funnel monthly aggregates: {e}")
-        raise
 
 
-def calculate_monthly_trends(organization_id: str):
-    """
-    Calculate MoM changes and best/worst month flags across all months
-    Run after backfill to populate trend fields
+def monthly_trends_statement() -> str:
     """
-    logger.info(f"Calculating monthly trends for {organization_id}")
+    MoM changes and best/worst month flags for the org's entities.
     
-    query = f"""
-    -- Update MoM trends using window functions
+    Only the org's rows are read. Only the requested months, the month after
+    each (whose MoM baseline moved) and rows whose best/worst flag flips are
+    updated.
+    """
+    return f"""
     MERGE `{PROJECT_ID}.{DATASET_ID}.monthly_entity_metrics` T
     USING (
       WITH with_lags AS (
@@ -570,7 +488,6 @@ def calculate_monthly_trends(organization_id: str):
           canonical_entity_id,
           entity_type,
           sessions,
-          revenue,
           
           LAG(sessions, 1) OVER (
             PARTITION BY canonical_entity_id, entity_type 
@@ -603,30 +520,55 @@ def calculate_monthly_trends(organization_id: str):
       AND T.year_month = S.year_month
       AND T.canonical_entity_id = S.canonical_entity_id
       AND T.entity_type = S.entity_type
-    WHEN MATCHED THEN
+    WHEN MATCHED AND (
+      T.year_month IN UNNEST(@year_months)
+      OR FORMAT_DATE('%Y-%m', DATE_SUB(PARSE_DATE('%Y-%m', T.year_month), INTERVAL 1 MONTH)) IN UNNEST(@year_months)
+      OR T.is_best_month IS DISTINCT FROM S.is_best_month
+      OR T.is_worst_month IS DISTINCT FROM S.is_worst_month
+    ) THEN
       UPDATE SET 
         mom_change_pct = S.mom_change_pct,
         mom_change_abs = S.mom_change_abs,
         is_best_month = S.is_best_month,
         is_worst_month = S.is_worst_month,
-        updated_at = CURRENT_TIMESTAMP()
+        updated_at = CURRENT_TIMESTAMP();
+    """
+
+
+def create_monthly_rollups(organization_id: str, year_months: list):
     """
+    Rebuild all four monthly tables and entity trends for the given months
+    year_month format: "2025-10", "2025-11", etc.
     
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id)
-        ]
-    )
+    Runs as one BigQuery script: the org's daily rows for the months are read
+    once into a temp table, then every table is swapped inside a single
+    transaction, so readers never see a half-written month.
+    """
+    logger.info(f"Creating monthly rollups for {organization_id} - {', '.join(year_months)}")
+    
+    script = f"""
+    {month_daily_statement()}
+    
+    BEGIN TRANSACTION;
+    
+    {replace_months_statement('monthly_entity_metrics', ENTITY_COLUMNS, entity_months_sql())}
+    {replace_months_statement('monthly_campaign_metrics', CAMPAIGN_COLUMNS, campaign_months_sql())}
+    {replace_months_statement('monthly_revenue_metrics', REVENUE_COLUMNS, revenue_months_sql())}
+    {replace_months_statement('monthly_funnel_metrics', FUNNEL_COLUMNS, funnel_months_sql())}
+    {monthly_trends_statement()}
+    
+    COMMIT TRANSACTION;
+    """
     
     try:
-        job = bq_client.query(query, job_config=job_config)
-        result = job.result()
+        # Concurrent org runs can abort the transaction; run_script re-runs it
+        run_script(bq_client, script, months_job_config(organization_id, year_months))
         
-        logger.info(f"✅ Successfully calculated monthly trends")
+        logger.info(f"✅ Successfully created monthly rollups for {len(year_months)} month(s)")
         return True
         
     except Exception as e:
-        logger.error(f"❌ Error calculating monthly trends: {e}")
+        logger.error(f"❌ Error creating monthly rollups for {', '.join(year_months)}: {e}")
         raise
 
 
@@ -639,7 +581,9 @@ def run_monthly_rollup(request):
     {
       "organizationId": "SBjucW1ztDyFYWBz7ZLE",
       "yearMonth": "2025-10",  // optional, defaults to last month
-      "backfill": true          // optional, if true processes last 4 months
+      "backfill": true,         // optional, if true processes last 4 months + current
+      "yearMonths": ["2025-08", "2025-09"],  // optional, explicit months to backfill
+      "mode": "dirty"           // optional, recompute only months in the dirty_partitions ledger
     }
     """
     
@@ -651,38 +595,48 @@ def run_monthly_rollup(request):
     backfill = request_json.get('backfill', False)
     
     try:
-        if backfill:
-            # Process last 4 months
-            logger.info(f"🔄 Starting backfill for {organization_id} (last 4 months)")
+        if request_json.get('mode') == 'dirty':
+            dirty_ids, ranges = read_dirty_ranges(bq_client, organization_id, 'monthly')
+            months_processed = months_in_ranges(ranges)
+            
+            if months_processed:
+                logger.info(f"🔄 Recomputing {len(months_processed)} dirty month(s) for {organization_id}")
+                create_monthly_rollups(organization_id, months_processed)
+            else:
+                logger.info(f"No dirty months for {organization_id}")
+            
+            # Only consume the ledger once the months are rewritten
+            mark_dirty_consumed(bq_client, organization_id, 'monthly', dirty_ids)
+            
+            return {
+                'success': True,
+                'organization_id': organization_id,
+                'mode': 'dirty',
+                'months_processed': months_processed,
+                'total_months': len(months_processed),
+                'trends_calculated': bool(months_processed)
+            }, 200
+        
+        elif backfill:
+            # Process several months at once
+            logger.info(f"🔄 Starting backfill for {organization_id}")
             
             current_date = datetime.now()
-            months_processed = []
             
-            for i in range(4, 0, -1):  # Process 4 months ago to 1 month ago
-                target_date = current_date - timedelta(days=30 * i)
-                year_month = target_date.strftime('%Y-%m')
-                
-                # Process all 4 monthly aggregate tables
-                create_monthly_aggregates(organization_id, year_month)
-                create_campaign_monthly_aggregates(organization_id, year_month)
-                create_revenue_monthly_aggregates(organization_id, year_month)
-                create_funnel_monthly_aggregates(organization_id, year_month)
-                months_processed.append(year_month)
+            if request_json.get('yearMonths'):
+                months_processed = list(dict.fromkeys(request_json['yearMonths']))
+            else:
+                # 4 months ago to 1 month ago, plus the current (partial) month
+                months_processed = list(dict.fromkeys(
+                    (current_date - timedelta(days=30 * i)).strftime('%Y-%m')
+                    for i in range(4, -1, -1)
+                ))
             
-            # Also process current month (partial)
-            current_month = current_date.strftime('%Y-%m')
-            create_monthly_aggregates(organization_id, current_month)
-            create_campaign_monthly_aggregates(organization_id, current_month)
-            create_revenue_monthly_aggregates(organization_id, current_month)
-            create_funnel_monthly_aggregates(organization_id, current_month)
-            months_processed.append(current_month)
+            # One script: all four monthly tables plus trends for every month
+            create_monthly_rollups(organization_id, months_processed)
             
             logger.info(f"✅ Backfill complete! Processed: {', '.join(months_processed)}")
             
-            # Calculate trends across all months
-            logger.info("Calculating monthly trends...")
-            calculate_monthly_trends(organization_id)
-            
             return {
                 'success': True,
                 'organization_id': organization_id,
@@ -703,17 +657,15 @@ def run_monthly_rollup(request):
             
             logger.info(f"🔄 Processing {year_month} for {organization_id}")
             
-            # Process all 4 monthly aggregate tables
-            create_monthly_aggregates(organization_id, year_month)
-            create_campaign_monthly_aggregates(organization_id, year_month)
-            create_revenue_monthly_aggregates(organization_id, year_month)
-            create_funnel_monthly_aggregates(organization_id, year_month)
+            # Process all 4 monthly aggregate tables plus trends
+            create_monthly_rollups(organization_id, [year_month])
             
             return {
                 'success': True,
                 'organization_id': organization_id,
                 'year_month': year_month,
-                'mode': 'single_month'
+                'mode': 'single_month',
+                'trends_calculated': True
             }, 200
         
     except Exception as e:
@@ -50,6 +50,9 @@ ROLLUP_FUNCTIONS = {
 # Order matters: daily must run before weekly/monthly, monthly before L12M/all-time
 ROLLUP_ORDER = ['daily', 'weekly', 'monthly', 'l12m', 'alltime']
 
+# Rollups that recompute only the periods recorded in the dirty_partitions ledger
+DIRTY_MODE_ROLLUPS = {'weekly', 'monthly', 'l12m', 'alltime'}
+
 # Firestore collection names for each source
 CONNECTION_COLLECTIONS = [
     'ga_connections',
@@ -129,9 +132,10 @@ def trigger_rollup(rollup_type: str, organization_id: str) -> dict:
             'organizationId': organization_id
         }
         
-        # Weekly rollup: process current week
-        # Monthly rollup: process current month
-        # L12M and all-time: use current date
+        # Weekly/monthly: recompute the weeks/months the syncs marked dirty
+        # L12M and all-time: refresh only if a dirty month touches their window
+        if rollup_type in DIRTY_MODE_ROLLUPS:
+            payload['mode'] = 'dirty'
         
         response = requests.post(
             function_url,
@@ -0,0 +1,7 @@
+"""
+Code shared by the data-sync Cloud Functions
+
+Every function directory is deployed on its own (gcloud --source=.), so this
+package is copied into it by vendor-common.sh right before each deploy.
+Edit it here; the copies are ignored by git.
+"""
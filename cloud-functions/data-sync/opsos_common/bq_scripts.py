@@ -0,0 +1,46 @@
+"""
+Running BigQuery scripts that write inside a transaction
+
+The rollups run for several organizations at once (the nightly scheduler fans out
+three at a time), and each org's script swaps rows of the same tables inside
+BEGIN/COMMIT TRANSACTION. BigQuery aborts a transaction that conflicts with a
+concurrent one instead of waiting for it, so those scripts are re-run.
+"""
+
+from google.api_core.exceptions import GoogleAPICallError
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_MAX_ATTEMPTS = 5
+
+# Messages BigQuery uses when a concurrent update aborted a transaction or DML statement
+CONCURRENT_UPDATE_ERRORS = (
+    'Transaction is aborted due to concurrent update',
+    'Could not serialize access to table',
+)
+
+
+def is_concurrent_update_error(error: Exception) -> bool:
+    """Whether the error is a transaction/DML conflict that succeeds when re-run"""
+    message = str(error)
+    return any(text.lower() in message.lower() for text in CONCURRENT_UPDATE_ERRORS)
+
+
+def run_script(bq, query: str, job_config=None) -> list:
+    """
+    Run a (multi-statement) query and return the rows of its last statement.
+    A run aborted by a concurrent update is rolled back as a whole, so the full
+    script is re-submitted with jittered exponential backoff.
+    """
+    for attempt in range(SCRIPT_MAX_ATTEMPTS):
+        try:
+            return list(bq.query(query, job_config=job_config).result())
+        except GoogleAPICallError as e:
+            if not is_concurrent_update_error(e) or attempt == SCRIPT_MAX_ATTEMPTS - 1:
+                raise
+            delay = 2 ** attempt + random.uniform(0, 1)
+            logger.warning(f"Script aborted by a concurrent update, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
@@ -0,0 +1,169 @@
+"""
+dirty_partitions ledger
+
+Syncs record the (entity_type, start_date, end_date) ranges of daily_entity_metrics
+they rewrote; the weekly/monthly/L12M/all-time rollups read the ranges they have not
+consumed yet, recompute only those periods and mark the rows consumed.
+"""
+
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+from datetime import timedelta
+import logging
+import json
+
+from .bq_scripts import run_script
+
+logger = logging.getLogger(__name__)
+
+DIRTY_PARTITIONS_TABLE = "opsos-864a1.marketing_ai.dirty_partitions"
+# Rollups that consume the ledger; a row is deleted once all of them have
+DIRTY_CONSUMERS = ['weekly', 'monthly', 'l12m', 'alltime']
+
+
+def dirty_ranges(rows: list) -> list:
+    """Collapse daily_entity_metrics rows into one (entity_type, first date, last date) range per entity type"""
+    ranges = {}
+    for row in rows:
+        date_str = str(row.get('date') or '')[:10]
+        if not date_str:
+            continue
+        entity_type = row.get('entity_type') or 'unknown'
+        low, high = ranges.get(entity_type, (date_str, date_str))
+        ranges[entity_type] = (min(low, date_str), max(high, date_str))
+    return [(entity_type, low, high) for entity_type, (low, high) in ranges.items()]
+
+
+def record_dirty_partitions(bq, organization_id: str, ranges: list, source: str):
+    """
+    Append the (entity_type, start_date, end_date) ranges a sync upserted to the
+    ledger, so the rollups recompute only the periods that changed. Written with
+    DML (not streaming) so the rollups can mark rows consumed right away.
+    Failures are logged, never raised.
+    """
+    if not ranges:
+        return
+    
+    query = f"""
+    CREATE TABLE IF NOT EXISTS `{DIRTY_PARTITIONS_TABLE}` (
+      dirty_id STRING NOT NULL,
+      organization_id STRING NOT NULL,
+      entity_type STRING,
+      start_date DATE NOT NULL,
+      end_date DATE NOT NULL,
+      source STRING,
+      recorded_at TIMESTAMP NOT NULL,
+      consumed_by ARRAY<STRING>
+    )
+    CLUSTER BY organization_id;
+    
+    INSERT INTO `{DIRTY_PARTITIONS_TABLE}`
+      (dirty_id, organization_id, entity_type, start_date, end_date, source, recorded_at, consumed_by)
+    SELECT
+      GENERATE_UUID(), @org_id,
+      JSON_VALUE(r, '$[0]'), DATE(JSON_VALUE(r, '$[1]')), DATE(JSON_VALUE(r, '$[2]')),
+      @source, CURRENT_TIMESTAMP(), []
+    FROM UNNEST(JSON_QUERY_ARRAY(@ranges)) AS r
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
+            bigquery.ScalarQueryParameter("source", "STRING", source),
+            bigquery.ScalarQueryParameter("ranges", "STRING", json.dumps([[str(v) for v in r] for r in ranges])),
+        ]
+    )
+    
+    try:
+        bq.query(query, job_config=job_config).result()
+        logger.info(f"Recorded {len(ranges)} dirty range(s) for {organization_id}")
+    except Exception as e:
+        logger.warning(f"Could not record dirty partitions: {e}")
+
+
+def read_dirty_ranges(bq, organization_id: str, consumer: str, after: str = None) -> tuple:
+    """
+    Read the ledger rows this rollup has not consumed yet
+    after: only take rows that rollup has already consumed (L12M and all-time
+    read monthly_entity_metrics, so they wait for the monthly rollup)
+    
+    Returns (dirty_ids, [(start_date, end_date), ...])
+    """
+    query = f"""
+    SELECT dirty_id, start_date, end_date
+    FROM `{DIRTY_PARTITIONS_TABLE}`
+    WHERE organization_id = @org_id
+      AND @consumer NOT IN UNNEST(consumed_by)
+      AND (@after IS NULL OR @after IN UNNEST(consumed_by))
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
+            bigquery.ScalarQueryParameter("consumer", "STRING", consumer),
+            bigquery.ScalarQueryParameter("after", "STRING", after)
+        ]
+    )
+    
+    try:
+        rows = list(bq.query(query, job_config=job_config).result())
+    except NotFound:
+        # No sync has recorded anything yet
+        return [], []
+    
+    return [row.dirty_id for row in rows], [(row.start_date, row.end_date) for row in rows]
+
+
+def mark_dirty_consumed(bq, organization_id: str, consumer: str, dirty_ids: list):
+    """Mark ledger rows as consumed by this rollup and delete rows every rollup has consumed"""
+    if not dirty_ids:
+        return
+    
+    query = f"""
+    UPDATE `{DIRTY_PARTITIONS_TABLE}`
+    SET consumed_by = ARRAY_CONCAT(consumed_by, [@consumer])
+    WHERE organization_id = @org_id
+      AND dirty_id IN UNNEST(@dirty_ids);
+    
+    DELETE FROM `{DIRTY_PARTITIONS_TABLE}`
+    WHERE organization_id = @org_id
+      AND NOT EXISTS (
+        SELECT 1 FROM UNNEST(@consumers) AS c
+        WHERE c NOT IN UNNEST(consumed_by)
+      );
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
+            bigquery.ScalarQueryParameter("consumer", "STRING", consumer),
+            bigquery.ArrayQueryParameter("dirty_ids", "STRING", dirty_ids),
+            bigquery.ArrayQueryParameter("consumers", "STRING", DIRTY_CONSUMERS)
+        ]
+    )
+    
+    run_script(bq, query, job_config)
+    logger.info(f"Marked {len(dirty_ids)} dirty range(s) consumed by {consumer}")
+
+
+def months_in_ranges(ranges: list) -> list:
+    """Sorted YYYY-MM strings for every month touched by the (start_date, end_date) ranges"""
+    months = set()
+    for start_date, end_date in ranges:
+        month = start_date.replace(day=1)
+        while month <= end_date:
+            months.add(month.strftime('%Y-%m'))
+            month = (month + timedelta(days=32)).replace(day=1)
+    return sorted(months)
+
+
+def weeks_in_ranges(ranges: list) -> list:
+    """Sorted ISO week strings (YYYY-Www) for every week touched by the (start_date, end_date) ranges"""
+    weeks = set()
+    for start_date, end_date in ranges:
+        monday = start_date - timedelta(days=start_date.weekday())
+        while monday <= end_date:
+            iso_year, iso_week, _ = monday.isocalendar()
+            weeks.add(f"{iso_year}-W{iso_week:02d}")
+            monday += timedelta(weeks=1)
+    return sorted(weeks)
@@ -0,0 +1,134 @@
+"""
+Additive state shared by the L12M and all-time rollups
+
+Both keep one state row per entity (sums, non-null counts and sums of squares)
+plus the monthly values folded into it, so a run only adds or retracts the months
+that changed. The state tables are created here from the same column lists the
+rollups fold, so their schema has a single definition.
+"""
+
+from datetime import datetime, timedelta
+import os
+
+# Metrics summed across months (revenue and cost are FLOAT64, the rest INT64)
+SUM_METRICS = [
+    'impressions', 'clicks', 'sessions', 'users', 'pageviews',
+    'conversions', 'revenue', 'cost', 'sends', 'opens',
+]
+FLOAT_SUM_METRICS = {'revenue', 'cost'}
+
+# Metrics averaged across months; the state keeps a sum and a non-null count of each
+AVG_METRICS = [
+    'avg_session_duration', 'avg_bounce_rate', 'avg_engagement_rate',
+    'avg_ctr', 'avg_cpc', 'avg_cpa', 'avg_roas', 'avg_roi',
+    'avg_position', 'avg_search_volume',
+]
+
+# Per-month values as they were folded into the state (the *_applied_months tables)
+APPLIED_METRICS = SUM_METRICS + AVG_METRICS
+
+# Run a full rebuild (and report drift) at least this often in dirty mode
+FULL_REBUILD_INTERVAL_DAYS = int(os.environ.get('FULL_REBUILD_INTERVAL_DAYS', '7'))
+
+
+def applied_metric_type(metric: str) -> str:
+    return 'FLOAT64' if metric in FLOAT_SUM_METRICS or metric in AVG_METRICS else 'INT64'
+
+
+def applied_columns_sql(alias: str) -> str:
+    """The APPLIED_METRICS of a monthly_entity_metrics row, cast to their applied-table types"""
+    return ',\n      '.join(
+        f"CAST({alias}.{metric} AS {applied_metric_type(metric)}) AS {metric}"
+        for metric in APPLIED_METRICS
+    )
+
+
+def additive_terms() -> list:
+    """(state column, per-month term) pairs; each term is signed so a month can be added or retracted"""
+    terms = [
+        ('months', 'sign'),
+        ('months_with_sessions', 'sign * IF(sessions > 0, 1, 0)'),
+    ]
+    terms += [(metric, f'sign * IFNULL({metric}, 0)') for metric in SUM_METRICS]
+    terms.append(('duration_x_sessions', 'sign * IFNULL(avg_session_duration * sessions, 0)'))
+    for metric in AVG_METRICS:
+        terms.append((f'{metric}_sum', f'sign * IFNULL({metric}, 0)'))
+        terms.append((f'{metric}_n', f'sign * IF({metric} IS NULL, 0, 1)'))
+    for metric in ['sessions', 'revenue', 'conversions']:
+        terms.append((f'{metric}_n', f'sign * IF({metric} IS NULL, 0, 1)'))
+    for metric in ['sessions', 'revenue']:
+        terms.append((f'{metric}_sq', f'sign * IFNULL(CAST({metric} AS FLOAT64) * {metric}, 0)'))
+    return terms
+
+
+def additive_column_type(column: str) -> str:
+    if column in FLOAT_SUM_METRICS or column == 'duration_x_sessions' or column.endswith(('_sum', '_sq')):
+        return 'FLOAT64'
+    return 'INT64'
+
+
+def state_tables_statement(state_table: str, applied_table: str, extra_columns: list = ()) -> str:
+    """
+    CREATE TABLE IF NOT EXISTS for a rollup's state table (additive columns, then
+    extra_columns as (name, type) pairs) and its applied-months table
+    """
+    state_columns = ',\n      '.join(
+        [f'{column} {additive_column_type(column)}' for column, _ in additive_terms()]
+        + [f'{column} {column_type}' for column, column_type in extra_columns]
+    )
+    applied_columns = ',\n      '.join(f'{metric} {applied_metric_type(metric)}' for metric in APPLIED_METRICS)
+    return f"""
+    CREATE TABLE IF NOT EXISTS `{state_table}` (
+      organization_id STRING NOT NULL,
+      canonical_entity_id STRING NOT NULL,
+      entity_type STRING NOT NULL,
+      {state_columns},
+      rebuilt_at TIMESTAMP,  -- Last full rebuild (NULL for entities added since)
+      updated_at TIMESTAMP
+    )
+    CLUSTER BY organization_id, canonical_entity_id, entity_type;
+
+    CREATE TABLE IF NOT EXISTS `{applied_table}` (
+      organization_id STRING NOT NULL,
+      canonical_entity_id STRING NOT NULL,
+      entity_type STRING NOT NULL,
+      year_month STRING NOT NULL,
+      {applied_columns},
+      applied_at TIMESTAMP
+    )
+    CLUSTER BY organization_id, year_month;
+    """
+
+
+def drift_statement(state_table: str, measures: list = (), mismatches: list = ()) -> str:
+    """
+    Compare the stored state against a from-scratch entity_delta (full rebuild only)
+    measures: extra aggregate columns for the drift row
+    mismatches: extra conditions under which an entity counts as drifted
+    """
+    select = ',\n      '.join([
+        'COUNT(*) AS entities_drifted',
+        'MAX(ABS(IFNULL(o.sessions, 0) - IFNULL(n.sessions, 0))) AS max_sessions_drift',
+        'MAX(ABS(IFNULL(o.revenue, 0) - IFNULL(n.revenue, 0))) AS max_revenue_drift',
+    ] + list(measures))
+    where = '\n       OR '.join([
+        'IFNULL(o.months, 0) != IFNULL(n.months, 0)',
+        'IFNULL(o.sessions, 0) != IFNULL(n.sessions, 0)',
+        'ABS(IFNULL(o.revenue, 0) - IFNULL(n.revenue, 0)) > 0.01',
+    ] + list(mismatches))
+    return f"""
+    CREATE TEMP TABLE drift AS
+    SELECT
+      {select}
+    FROM (SELECT * FROM `{state_table}` WHERE organization_id = @org_id) o
+    FULL OUTER JOIN entity_delta n
+      USING (canonical_entity_id, entity_type)
+    WHERE {where};
+    """
+
+
+def full_rebuild_due(rebuilt_at) -> bool:
+    """A full rebuild is due if the state was never built or the last rebuild is too old"""
+    if rebuilt_at is None:
+        return True
+    return datetime.now(rebuilt_at.tzinfo) - rebuilt_at > timedelta(days=FULL_REBUILD_INTERVAL_DAYS)
@@ -0,0 +1,166 @@
+"""
+Schema-driven row conversion for BigQuery writes
+
+Rows are converted column by column with a coercion picked once per column from
+the target table's schema, instead of inspecting every value of every row.
+"""
+
+from datetime import datetime, timezone
+from decimal import Decimal
+import json
+
+
+def _plain(value):
+    """Decimal/date/datetime (also nested in dicts and lists) as JSON-friendly values"""
+    if isinstance(value, dict):
+        return {key: _plain(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _to_json(value):
+    return json.dumps(_plain(value))
+
+
+def _coerce_int(value):
+    """A malformed cell becomes None (NULL) instead of failing the whole batch"""
+    if value is None or type(value) is int:
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        number = float(value)
+        return int(number) if number.is_integer() else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _coerce_float(value):
+    """A malformed cell becomes None (NULL) instead of failing the whole batch"""
+    if value is None or type(value) is float:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Strings accepted for BOOL columns (compared case-insensitively); anything else is NULL
+TRUE_STRINGS = {'true', '1', 'yes'}
+FALSE_STRINGS = {'false', '0', 'no'}
+
+
+def _coerce_bool(value):
+    if value is None or type(value) is bool:
+        return value
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in TRUE_STRINGS:
+            return True
+        if text in FALSE_STRINGS:
+            return False
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return bool(value)
+    return None
+
+
+def _coerce_string(value):
+    if value is None or type(value) is str:
+        return value
+    if isinstance(value, (dict, list)):
+        return _to_json(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _temporal_coercer(render):
+    """
+    Coercion for a DATE/DATETIME/TIMESTAMP/TIME column. Numbers are taken as
+    epoch seconds and rendered (by render) from the UTC datetime
+    """
+    def coerce(value):
+        if value is None or type(value) is str:
+            return value
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            try:
+                return render(datetime.fromtimestamp(float(value), tz=timezone.utc))
+            except (ValueError, OverflowError, OSError):
+                return None
+        return None
+    
+    return coerce
+
+
+def _coerce_json(value):
+    """JSON columns may arrive pre-serialized; only dump values that aren't"""
+    if value is None or type(value) is str:
+        return value
+    return _to_json(value)
+
+
+# BigQuery field type -> coercion applied to every value of that column
+FIELD_COERCERS = {
+    'INTEGER': _coerce_int,
+    'INT64': _coerce_int,
+    'FLOAT': _coerce_float,
+    'FLOAT64': _coerce_float,
+    'NUMERIC': _coerce_float,
+    'BIGNUMERIC': _coerce_float,
+    'BOOLEAN': _coerce_bool,
+    'BOOL': _coerce_bool,
+    'STRING': _coerce_string,
+    'DATE': _temporal_coercer(lambda dt: dt.date().isoformat()),
+    'DATETIME': _temporal_coercer(lambda dt: dt.replace(tzinfo=None).isoformat()),
+    'TIMESTAMP': _temporal_coercer(lambda dt: dt.isoformat()),
+    'TIME': _temporal_coercer(lambda dt: dt.time().isoformat()),
+    'JSON': _coerce_json,
+}
+
+
+def compile_row_converter(schema):
+    """
+    Compile a batch converter for rows headed to a table with the given schema.
+    
+    Each column is mapped once to a coercion function based on its BigQuery
+    type, and the returned converter applies it column by column over a whole
+    batch. Columns not in the schema are dropped (the writes ignore them anyway)
+    and None values are omitted so the payload only carries populated fields.
+    """
+    columns = []
+    for field in schema:
+        coerce = FIELD_COERCERS.get(field.field_type, _plain)
+        if field.mode == 'REPEATED':
+            # BigQuery arrays cannot hold NULL, so malformed elements are dropped
+            coerce = (lambda c: lambda v: None if v is None else [x for x in map(c, v) if x is not None])(coerce)
+        columns.append((field.name, coerce))
+    
+    def convert(batch):
+        converted = [{} for _ in batch]
+        for name, coerce in columns:
+            values = [row.get(name) for row in batch]
+            if not any(v is not None for v in values):
+                continue
+            for target, value in zip(converted, map(coerce, values)):
+                if value is not None:
+                    target[name] = value
+        return converted
+    
+    return convert
+
+
+def convert_rows(bq, table_ref: str, rows: list) -> list:
+    """Convert rows to the schema of an existing table (one get_table call)"""
+    if not rows:
+        return rows
+    return compile_row_converter(bq.get_table(table_ref).schema)(rows)
@@ -9,6 +9,9 @@ PROJECT_ID="opsos-864a1"
 
 echo "🚀 Deploying $FUNCTION_NAME..."
 
+# Copy in the shared opsos_common package (see data-sync/vendor-common.sh)
+bash ../vendor-common.sh . || exit 1
+
 gcloud functions deploy $FUNCTION_NAME \
   --gen2 \
   --runtime=python311 \
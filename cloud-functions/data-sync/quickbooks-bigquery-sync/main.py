@@ -5,17 +5,28 @@ Calls QuickBooks API directly and writes to BigQuery - NO Firestore intermediate
 Only uses Firestore for OAuth credentials.
 
 Architecture: QuickBooks API → Cloud Function → BigQuery
+
+Queries are paged with STARTPOSITION/MAXRESULTS and pages are fetched concurrently.
+Update mode uses the CDC endpoint from a stored changedSince cursor and only
+recomputes the days whose invoices/bills/purchases changed; a windowed listing
+still runs when the cursor is missing, too old, or a reconciliation is due.
 """
 
 import functions_framework
 from google.cloud import firestore, bigquery
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import os
 import requests
 import base64
+import threading
+import time
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.row_converter import convert_rows
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +39,20 @@ QUICKBOOKS_CLIENT_SECRET = os.environ.get('QUICKBOOKS_CLIENT_SECRET')
 QUICKBOOKS_API_BASE = 'https://quickbooks.api.intuit.com/v3/company'
 QUICKBOOKS_TOKEN_URL = 'https://oauth.platform.intuit.com/oauth2/v1/tokens/bearer'
 
+# QuickBooks allows 10 concurrent requests per realm and 1000 results per query page;
+# the limit is shared by every entity read of a sync, not applied per entity
+QB_MAX_CONCURRENT_REQUESTS = min(10, int(os.environ.get('QB_MAX_CONCURRENT_REQUESTS', '5')))
+QB_PAGE_SIZE = 1000
+QB_MAX_RETRIES = 5
+# CDC only looks back 30 days; reconcile with a windowed listing well before that
+QB_CDC_MAX_LOOKBACK_DAYS = 29
+QB_RECONCILE_INTERVAL_DAYS = int(os.environ.get('QB_RECONCILE_INTERVAL_DAYS', '7'))
+QB_CDC_ENTITIES = ['Invoice', 'Bill', 'Purchase']
+
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=QB_MAX_CONCURRENT_REQUESTS))
+qb_request_slots = threading.BoundedSemaphore(QB_MAX_CONCURRENT_REQUESTS)
+
 
 def refresh_access_token(db, organization_id: str, connection_data: dict) -> str:
     """Refresh QuickBooks access token if expired"""
@@ -87,22 +112,162 @@ def refresh_access_token(db, organization_id: str, connection_data: dict) -> str
     return new_access_token
 
 
+def qb_get(access_token: str, url: str, params: dict = None) -> dict:
+    """
+    GET a QuickBooks API URL inside the shared request slots, retrying 429 and 5xx
+    responses with backoff; raises on any other failure
+    """
+    for attempt in range(QB_MAX_RETRIES):
+        with qb_request_slots:
+            response = http_session.get(
+                url,
+                params=params,
+                headers={
+                    'Accept': 'application/json',
+                    'Authorization': f'Bearer {access_token}',
+                },
+            )
+        
+        if (response.status_code == 429 or response.status_code >= 500) and attempt < QB_MAX_RETRIES - 1:
+            try:
+                delay = float(response.headers.get('Retry-After', ''))
+            except ValueError:
+                delay = 2 ** attempt
+            logger.warning(f"QuickBooks API returned {response.status_code}, retrying in {delay}s...")
+            time.sleep(delay)
+            continue
+        break
+    
+    if not response.ok:
+        raise ValueError(f"QuickBooks request failed ({response.status_code}): {response.text}")
+    
+    return response.json()
+
+
 def qb_query(access_token: str, realm_id: str, query: str) -> dict:
     """Execute QuickBooks query"""
     url = f"{QUICKBOOKS_API_BASE}/{realm_id}/query?query={requests.utils.quote(query)}&minorversion=65"
-    response = requests.get(
-        url,
-        headers={
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {access_token}',
-        }
+    return qb_get(access_token, url)
+
+
+def qb_query_all(access_token: str, realm_id: str, entity: str, where: str = '') -> list:
+    """
+    Read every matching entity: COUNT(*) first, then all STARTPOSITION/MAXRESULTS
+    pages concurrently (a single unpaged SELECT silently stops at the page cap).
+    Requests go through qb_request_slots; a failed page fails the whole read.
+    """
+    where_clause = f" WHERE {where}" if where else ''
+    count_data = qb_query(access_token, realm_id, f"SELECT COUNT(*) FROM {entity}{where_clause}")
+    total = int(count_data.get('QueryResponse', {}).get('totalCount', 0) or 0)
+    if total == 0:
+        return []
+    
+    def fetch_page(start_position):
+        data = qb_query(
+            access_token, realm_id,
+            f"SELECT * FROM {entity}{where_clause} STARTPOSITION {start_position} MAXRESULTS {QB_PAGE_SIZE}"
+        )
+        return data.get('QueryResponse', {}).get(entity, [])
+    
+    items = []
+    with ThreadPoolExecutor(max_workers=QB_MAX_CONCURRENT_REQUESTS) as executor:
+        for page in executor.map(fetch_page, range(1, total + 1, QB_PAGE_SIZE)):
+            items.extend(page)
+    
+    logger.info(f"Fetched {len(items)}/{total} {entity} records")
+    return items
+
+
+def qb_cdc(access_token: str, realm_id: str, entities: list, changed_since: str) -> dict:
+    """Changed (and deleted) entities since changed_since, as {entity: [records]}"""
+    data = qb_get(
+        access_token,
+        f"{QUICKBOOKS_API_BASE}/{realm_id}/cdc",
+        params={
+            'entities': ','.join(entities),
+            'changedSince': changed_since,
+            'minorversion': 65,
+        },
     )
     
-    if not response.ok:
-        logger.error(f"QuickBooks query failed: {response.text}")
-        return {}
+    changed = defaultdict(list)
+    for cdc_response in data.get('CDCResponse', []):
+        for query_response in cdc_response.get('QueryResponse', []):
+            for entity in entities:
+                changed[entity].extend(query_response.get(entity, []))
+    return changed
+
+
+def cdc_cursor_usable(connection_data: dict) -> bool:
+    """True if the stored changedSince cursor can still drive an incremental run"""
+    changed_since = connection_data.get('cdcChangedSince')
+    last_reconciled = connection_data.get('lastReconciledAt')
+    if not changed_since or not last_reconciled:
+        return False
     
-    return response.json()
+    now = datetime.now(timezone.utc)
+    if now - datetime.fromisoformat(changed_since) > timedelta(days=QB_CDC_MAX_LOOKBACK_DAYS):
+        return False
+    return now - datetime.fromisoformat(last_reconciled) < timedelta(days=QB_RECONCILE_INTERVAL_DAYS)
+
+
+def created_since(record: dict, changed_since: str) -> bool:
+    """True if the record was created after the CDC cursor (so it had no earlier TxnDate)"""
+    create_time = (record.get('MetaData') or {}).get('CreateTime')
+    if not create_time:
+        return False
+    try:
+        return datetime.fromisoformat(create_time) >= datetime.fromisoformat(changed_since)
+    except ValueError:
+        return False
+
+
+def txn_date_in(record: dict, start_date, end_date, dates: set = None):
+    """Parsed TxnDate string if the record falls in range (and in dates, when given)"""
+    txn_date_str = record.get('TxnDate', '')
+    if not txn_date_str:
+        return None
+    try:
+        txn_date = datetime.strptime(txn_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    if not (start_date <= txn_date <= end_date):
+        return None
+    if dates is not None and txn_date.isoformat() not in dates:
+        return None
+    return txn_date.isoformat()
+
+
+def aggregate_invoices(invoices: list, start_date, end_date, dates: set = None):
+    daily_revenue = defaultdict(lambda: {
+        'total_invoiced': 0,
+        'total_paid': 0,
+        'invoice_count': 0,
+    })
+    for invoice in invoices:
+        date_str = txn_date_in(invoice, start_date, end_date, dates)
+        if date_str:
+            total_amount = float(invoice.get('TotalAmt', 0))
+            balance = float(invoice.get('Balance', 0))
+            paid_amount = total_amount - balance
+            
+            daily_revenue[date_str]['total_invoiced'] += total_amount
+            daily_revenue[date_str]['total_paid'] += paid_amount
+            daily_revenue[date_str]['invoice_count'] += 1
+    return daily_revenue
+
+
+def aggregate_expenses(expenses: list, start_date, end_date, dates: set = None):
+    daily_expenses = defaultdict(lambda: {
+        'total_expenses': 0,
+        'expense_count': 0,
+    })
+    for expense in expenses:
+        date_str = txn_date_in(expense, start_date, end_date, dates)
+        if date_str:
+            daily_expenses[date_str]['total_expenses'] += float(expense.get('TotalAmt', 0))
+            daily_expenses[date_str]['expense_count'] += 1
+    return daily_expenses
 
 
 @functions_framework.http
@@ -170,97 +335,60 @@ def sync_quickbooks_to_bigquery(request):
         start_date = end_date - timedelta(days=days_back)
         today_str = end_date.isoformat()
         
-        # ============================================
-        # 1. FETCH INVOICES DIRECTLY FROM QUICKBOOKS
-        # ============================================
-        logger.info("Fetching invoices from QuickBooks API...")
-        
-        daily_revenue = defaultdict(lambda: {
-            'total_invoiced': 0,
-            'total_paid': 0,
-            'invoice_count': 0,
-        })
-        
-        try:
-            invoice_data = qb_query(access_token, realm_id, 'SELECT * FROM Invoice MAXRESULTS 1000')
-            invoices = invoice_data.get('QueryResponse', {}).get('Invoice', [])
-            
-            for invoice in invoices:
-                results['invoices_processed'] += 1
-                
-                txn_date_str = invoice.get('TxnDate', '')
-                if txn_date_str:
-                    try:
-                        txn_date = datetime.strptime(txn_date_str, '%Y-%m-%d').date()
-                        if start_date <= txn_date <= end_date:
-                            date_str = txn_date.isoformat()
-                            total_amount = float(invoice.get('TotalAmt', 0))
-                            balance = float(invoice.get('Balance', 0))
-                            paid_amount = total_amount - balance
-                            
-                            daily_revenue[date_str]['total_invoiced'] += total_amount
-                            daily_revenue[date_str]['total_paid'] += paid_amount
-                            daily_revenue[date_str]['invoice_count'] += 1
-                    except:
-                        pass
-                        
-        except Exception as e:
-            logger.error(f"Error fetching invoices: {e}")
+        # Capture the CDC cursor before reading so changes made mid-sync are picked up next time
+        sync_started_at = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
         
         # ============================================
-        # 2. FETCH EXPENSES (BILLS + PURCHASES)
+        # 0. CDC: WORK OUT WHICH DAYS CHANGED
         # ============================================
-        logger.info("Fetching expenses from QuickBooks API...")
-        
-        daily_expenses = defaultdict(lambda: {
-            'total_expenses': 0,
-            'expense_count': 0,
-        })
+        touched_dates = None  # None = recompute the whole window
+        use_cdc = (
+            sync_mode == 'update'
+            and not request_json.get('reconcile', False)
+            and cdc_cursor_usable(connection_data)
+        )
         
-        try:
-            # Fetch Bills
-            bill_data = qb_query(access_token, realm_id, 'SELECT * FROM Bill MAXRESULTS 1000')
-            bills = bill_data.get('QueryResponse', {}).get('Bill', [])
-            
-            for bill in bills:
-                results['expenses_processed'] += 1
-                txn_date_str = bill.get('TxnDate', '')
-                if txn_date_str:
-                    try:
-                        txn_date = datetime.strptime(txn_date_str, '%Y-%m-%d').date()
-                        if start_date <= txn_date <= end_date:
-                            date_str = txn_date.isoformat()
-                            total_amount = float(bill.get('TotalAmt', 0))
-                            daily_expenses[date_str]['total_expenses'] += total_amount
-                            daily_expenses[date_str]['expense_count'] += 1
-                    except:
-                        pass
+        if use_cdc:
+            changed_since = connection_data['cdcChangedSince']
+            logger.info(f"Reading QuickBooks CDC since {changed_since}...")
+            try:
+                changed = qb_cdc(access_token, realm_id, QB_CDC_ENTITIES, changed_since)
+            except Exception as e:
+                logger.warning(f"CDC unavailable, recomputing the full window: {e}")
+                changed = None
+            changed_records = [r for entity in QB_CDC_ENTITIES for r in (changed or {}).get(entity, [])]
+            results['changed_records'] = len(changed_records)
             
-            # Fetch Purchases
-            purchase_data = qb_query(access_token, realm_id, 'SELECT * FROM Purchase MAXRESULTS 1000')
-            purchases = purchase_data.get('QueryResponse', {}).get('Purchase', [])
-            
-            for purchase in purchases:
-                results['expenses_processed'] += 1
-                txn_date_str = purchase.get('TxnDate', '')
-                if txn_date_str:
-                    try:
-                        txn_date = datetime.strptime(txn_date_str, '%Y-%m-%d').date()
-                        if start_date <= txn_date <= end_date:
-                            date_str = txn_date.isoformat()
-                            total_amount = float(purchase.get('TotalAmt', 0))
-                            daily_expenses[date_str]['total_expenses'] += total_amount
-                            daily_expenses[date_str]['expense_count'] += 1
-                    except:
-                        pass
-                        
-        except Exception as e:
-            logger.error(f"Error fetching expenses: {e}")
+            if changed is None:
+                use_cdc = False
+            elif any(r.get('status') == 'Deleted' for r in changed_records):
+                # Deleted records carry no TxnDate, so fall back to the whole window
+                logger.info("CDC reported deletions; recomputing the full window")
+                use_cdc = False
+            elif not all(created_since(r, changed_since) for r in changed_records):
+                # An updated record may have moved off an earlier TxnDate, which CDC doesn't
+                # report and the daily rows don't keep, so fall back to the whole window
+                logger.info("CDC reported updates to existing records; recomputing the full window")
+                use_cdc = False
+            else:
+                touched_dates = {r['TxnDate'] for r in changed_records if r.get('TxnDate')}
+                logger.info(f"CDC: {len(changed_records)} changed records touching {len(touched_dates)} days")
+                if touched_dates:
+                    # Read just the span of changed days, however far back they are
+                    start_date = datetime.strptime(min(touched_dates), '%Y-%m-%d').date()
+                    end_date = max(end_date, datetime.strptime(max(touched_dates), '%Y-%m-%d').date())
+        
+        # Invoices/bills/purchases are only read for the window (or the touched days' span)
+        txn_where = f"TxnDate >= '{start_date.isoformat()}' AND TxnDate <= '{end_date.isoformat()}'"
+        read_transactions = touched_dates is None or bool(touched_dates)
         
         # ============================================
-        # 3. FETCH ACCOUNT BALANCES
+        # 1-3. FETCH INVOICES, EXPENSES AND ACCOUNTS CONCURRENTLY
         # ============================================
-        logger.info("Fetching accounts from QuickBooks API...")
+        logger.info("Fetching invoices, bills, purchases and accounts from QuickBooks API...")
+        
+        daily_revenue = aggregate_invoices([], start_date, end_date)
+        daily_expenses = aggregate_expenses([], start_date, end_date)
         
         account_balances = {
             'accounts_receivable': 0,
@@ -270,9 +398,25 @@ def sync_quickbooks_to_bigquery(request):
             'total_expenses': 0,
         }
         
-        try:
-            account_data = qb_query(access_token, realm_id, 'SELECT * FROM Account MAXRESULTS 1000')
-            accounts = account_data.get('QueryResponse', {}).get('Account', [])
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            if read_transactions:
+                invoices_future = executor.submit(qb_query_all, access_token, realm_id, 'Invoice', txn_where)
+                bills_future = executor.submit(qb_query_all, access_token, realm_id, 'Bill', txn_where)
+                purchases_future = executor.submit(qb_query_all, access_token, realm_id, 'Purchase', txn_where)
+            accounts_future = executor.submit(qb_query_all, access_token, realm_id, 'Account')
+            
+            # A failed read raises here and fails the sync: writing its days as
+            # empty would replace real rows with zeros
+            if read_transactions:
+                invoices = invoices_future.result()
+                results['invoices_processed'] = len(invoices)
+                daily_revenue = aggregate_invoices(invoices, start_date, end_date, touched_dates)
+                
+                expenses = bills_future.result() + purchases_future.result()
+                results['expenses_processed'] = len(expenses)
+                daily_expenses = aggregate_expenses(expenses, start_date, end_date, touched_dates)
+            
+            accounts = accounts_future.result()
             
             for account in accounts:
                 account_type = account.get('AccountType', '')
@@ -288,9 +432,6 @@ def sync_quickbooks_to_bigquery(request):
                     account_balances['total_income'] += balance
                 elif 'Expense' in account_type:
                     account_balances['total_expenses'] += balance
-                    
-        except Exception as e:
-            logger.error(f"Error fetching accounts: {e}")
         
         # ============================================
         # 4. BUILD BIGQUERY ROWS
@@ -352,6 +493,7 @@ def sync_quickbooks_to_bigquery(request):
         # ============================================
         # 5. WRITE DIRECTLY TO BIGQUERY
         # ============================================
+        write_clean = True
         if rows:
             logger.info(f"Writing {len(rows)} rows to BigQuery (mode={sync_mode})...")
             
@@ -370,6 +512,26 @@ def sync_quickbooks_to_bigquery(request):
                     logger.info("Deleted all existing QuickBooks data for full resync")
                 except Exception as e:
                     logger.warning(f"Delete query warning: {e}")
+            elif touched_dates is not None:
+                # CDC SYNC: Only replace the touched days, plus today's account snapshot
+                touched_clause = ''
+                if touched_dates:
+                    date_list = ', '.join(f"'{d}'" for d in sorted(touched_dates))
+                    touched_clause = f"OR (entity_type IN ('invoice', 'expense') AND date IN ({date_list}))"
+                delete_query = f"""
+                DELETE FROM `{table_ref}`
+                WHERE organization_id = '{organization_id}'
+                  AND (
+                    (entity_type = 'account' AND date = '{today_str}')
+                    {touched_clause}
+                  )
+                """
+                
+                try:
+                    bq.query(delete_query).result()
+                    logger.info(f"Deleted QuickBooks data for {len(touched_dates)} changed days")
+                except Exception as e:
+                    logger.warning(f"Delete query warning: {e}")
             else:
                 # UPDATE SYNC: Only delete data in the date range being synced
                 delete_query = f"""
@@ -385,16 +547,18 @@ def sync_quickbooks_to_bigquery(request):
                 except Exception as e:
                     logger.warning(f"Delete query warning: {e}")
             
-            # Insert new rows
-            errors = bq.insert_rows_json(table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
+            # Insert new rows, coerced to the table's column types
+            errors = bq.insert_rows_json(table_ref, convert_rows(bq, table_ref, rows), skip_invalid_rows=True, ignore_unknown_values=True)
             
             if errors:
                 logger.warning(f"Some rows failed: {errors[:3]}")
+                write_clean = False
             else:
                 results['rows_inserted'] = len(rows)
+                record_dirty_partitions(bq, organization_id, dirty_ranges(rows), 'quickbooks')
         
         # Update connection status
-        connection_ref.update({
+        connection_update = {
             'status': 'connected',
             'lastSyncAt': firestore.SERVER_TIMESTAMP,
             'lastSyncResults': {
@@ -403,9 +567,20 @@ def sync_quickbooks_to_bigquery(request):
                 'bigqueryRows': results['rows_inserted'],
             },
             'updatedAt': firestore.SERVER_TIMESTAMP,
-        })
+        }
+        if write_clean:
+            # Only advance the cursor past changes that were written; after failed
+            # inserts the next run reads the same changes again
+            connection_update['cdcChangedSince'] = sync_started_at
+            if not use_cdc:
+                # A windowed listing just ran, which is what CDC runs are reconciled against
+                connection_update['lastReconciledAt'] = sync_started_at
+        connection_ref.update(connection_update)
         
-        mode_label = "Full re-sync" if sync_mode == 'full' else "Incremental sync"
+        if use_cdc:
+            mode_label = "CDC sync"
+        else:
+            mode_label = "Full re-sync" if sync_mode == 'full' else "Incremental sync"
         logger.info(f"✅ QuickBooks sync complete ({mode_label}): {results}")
         
         return ({
@@ -0,0 +1,190 @@
+"""
+Reporting Periods - Shared weekly/monthly aggregation of reporting.daily_metrics
+
+Used by refresh_reporting_tables (touched periods only) and by
+scripts/rebuild-weekly-metrics.py (full rebuild), so the column lists
+cannot diverge. Columns are in reporting.weekly_metrics / monthly_metrics
+table order; rows are written with INSERT ROW, which is positional.
+"""
+
+from google.cloud import bigquery
+from datetime import timedelta
+
+# Aggregations of daily_metrics shared by the weekly and monthly tables
+PERIOD_METRIC_COLUMNS = [
+    "SUM(talent_signups) as talent_signups",
+    "SUM(company_signups) as company_signups",
+    "SUM(total_signups) as total_signups",
+    "SUM(jobs_posted) as jobs_posted",
+    "SUM(applications) as applications",
+    "ROUND(AVG(apps_per_job), 2) as apps_per_job",
+    "SUM(hires) as hires",
+    "ROUND(AVG(match_rate_pct), 2) as match_rate_pct",
+    "ROUND(AVG(app_to_hire_pct), 2) as app_to_hire_pct",
+    "SUM(revenue) as revenue",
+    "ROUND(AVG(revenue_per_talent_signup), 2) as revenue_per_talent_signup",
+    "ROUND(AVG(revenue_per_hire), 2) as revenue_per_hire",
+    "SUM(job_views) as job_views",
+    "SUM(profile_views) as profile_views",
+    "SUM(reviews) as reviews",
+    "SUM(purchases) as purchases",
+    "SUM(failed_transactions) as failed_transactions",
+    "SUM(purchasing_customers) as purchasing_customers",
+    "SUM(stripe_revenue) as stripe_revenue",
+    "ROUND(AVG(purchases_per_customer_daily), 2) as purchases_per_customer_daily",
+    "CAST(MAX(cumulative_purchases) AS INT64) as cumulative_purchases",
+    "CAST(MAX(cumulative_company_signups) AS INT64) as cumulative_company_signups",
+    "ROUND(SAFE_DIVIDE(SUM(purchases), NULLIF(SUM(company_signups), 0)) * 100, 2) as company_purchase_conversion_pct",
+    "ROUND(AVG(avg_purchases_per_company), 2) as avg_purchases_per_company",
+    "SUM(mrr) as mrr",
+    "SUM(arr) as arr",
+    "SUM(active_subscriptions) as active_subscriptions",
+    "SUM(churned_subscriptions) as churned_subscriptions",
+    "ROUND(AVG(churn_rate_pct), 2) as churn_rate_pct",
+    "SUM(sessions) as sessions",
+    "SUM(engaged_sessions) as engaged_sessions",
+    "ROUND(AVG(engagement_rate_pct), 2) as engagement_rate_pct",
+    "SUM(total_events) as total_events",
+    "ROUND(AVG(events_per_session), 2) as events_per_session",
+    "SUM(key_events) as key_events",
+    "SUM(ga4_revenue) as ga4_revenue",
+    "SUM(new_users) as new_users",
+    "SUM(organic_sessions) as organic_sessions",
+    "SUM(paid_search_sessions) as paid_search_sessions",
+    "SUM(paid_pmax_sessions) as paid_pmax_sessions",
+    "SUM(total_paid_sessions) as total_paid_sessions",
+    "SUM(direct_sessions) as direct_sessions",
+    "SUM(referral_sessions) as referral_sessions",
+    "SUM(social_sessions) as social_sessions",
+    "SUM(email_traffic_sessions) as email_traffic_sessions",
+    "SUM(video_sessions) as video_sessions",
+    "SUM(organic_engaged_sessions) as organic_engaged_sessions",
+    "SUM(paid_search_engaged_sessions) as paid_search_engaged_sessions",
+    "SUM(paid_pmax_engaged_sessions) as paid_pmax_engaged_sessions",
+    "ROUND(AVG(organic_engagement_rate), 2) as organic_engagement_rate",
+    "ROUND(AVG(paid_engagement_rate), 2) as paid_engagement_rate",
+    "ROUND(SAFE_DIVIDE(SUM(organic_sessions), NULLIF(SUM(sessions), 0)) * 100, 2) as organic_pct",
+    "ROUND(SAFE_DIVIDE(SUM(paid_search_sessions), NULLIF(SUM(sessions), 0)) * 100, 2) as paid_pct",
+    "ROUND(SAFE_DIVIDE(SUM(direct_sessions), NULLIF(SUM(sessions), 0)) * 100, 2) as direct_pct",
+    "ROUND(SAFE_DIVIDE(SUM(referral_sessions), NULLIF(SUM(sessions), 0)) * 100, 2) as referral_pct",
+    "SUM(gads_sessions) as gads_sessions",
+    "SUM(gads_users) as gads_users",
+    "SUM(gads_conversions) as gads_conversions",
+    "SUM(gads_revenue) as gads_revenue",
+    "SUM(gads_pmax_sessions) as gads_pmax_sessions",
+    "SUM(gads_pmax_conversions) as gads_pmax_conversions",
+    "SUM(gads_search_sessions) as gads_search_sessions",
+    "SUM(gads_search_conversions) as gads_search_conversions",
+    "ROUND(SAFE_DIVIDE(SUM(talent_signups), NULLIF(SUM(sessions), 0)) * 100, 2) as talent_signup_rate_pct",
+    "ROUND(SAFE_DIVIDE(SUM(company_signups), NULLIF(SUM(sessions), 0)) * 100, 2) as company_signup_rate_pct",
+    "ROUND(SAFE_DIVIDE(SUM(total_signups), NULLIF(SUM(sessions), 0)) * 100, 2) as overall_signup_rate_pct",
+    "ROUND(SAFE_DIVIDE(SUM(stripe_revenue), NULLIF(SUM(sessions), 0)), 4) as revenue_per_session",
+    "SUM(marketing_campaigns_launched) as marketing_campaigns_launched",
+    "SUM(marketing_sends) as marketing_sends",
+    "SUM(marketing_opens) as marketing_opens",
+    "SUM(marketing_clicks) as marketing_clicks",
+    "ROUND(AVG(marketing_avg_open_rate), 2) as marketing_avg_open_rate",
+    "ROUND(AVG(marketing_avg_ctr), 2) as marketing_avg_ctr",
+    "SUM(automation_campaigns_launched) as automation_campaigns_launched",
+    "SUM(automation_sends) as automation_sends",
+    "SUM(automation_opens) as automation_opens",
+    "SUM(automation_clicks) as automation_clicks",
+    "ROUND(AVG(automation_avg_open_rate), 2) as automation_avg_open_rate",
+    "ROUND(AVG(automation_avg_ctr), 2) as automation_avg_ctr",
+    "SUM(campaigns_launched) as campaigns_launched",
+    "SUM(campaign_lifetime_sends) as campaign_lifetime_sends",
+    "SUM(campaign_lifetime_opens) as campaign_lifetime_opens",
+    "SUM(campaign_lifetime_clicks) as campaign_lifetime_clicks",
+    "ROUND(AVG(campaign_avg_open_rate), 2) as campaign_avg_open_rate",
+    "ROUND(AVG(campaign_avg_ctr), 2) as campaign_avg_ctr",
+    "ROUND(AVG(campaign_click_to_open_pct), 2) as campaign_click_to_open_pct",
+    "SUM(email_contacts_total) as email_contacts_total",
+    "SUM(email_list_subscribers_total) as email_list_subscribers_total",
+    "CAST(ROUND(AVG(email_daily_opens)) AS INT64) as email_daily_opens",
+    "CAST(ROUND(AVG(email_daily_unique_openers)) AS INT64) as email_daily_unique_openers",
+    "CAST(ROUND(AVG(email_daily_clicks)) AS INT64) as email_daily_clicks",
+    "CAST(ROUND(AVG(email_daily_unique_clickers)) AS INT64) as email_daily_unique_clickers",
+    "0 as talent_signups_dod",
+    "0 as company_signups_dod",
+    "0 as applications_dod",
+    "0 as revenue_dod",
+    "0 as sessions_dod",
+    "0 as purchases_dod",
+    "0 as stripe_revenue_dod",
+    "ROUND(SUM(ad_spend), 2) as ad_spend",
+    "ROUND(SUM(ppc_revenue), 2) as ppc_revenue",
+    "SUM(ppc_purchases) as ppc_purchases",
+    "ROUND(SAFE_DIVIDE(SUM(ppc_revenue), NULLIF(SUM(ad_spend), 0)), 2) as roas",
+]
+
+WEEKLY_COLUMNS = [
+    "DATE_TRUNC(date, WEEK(MONDAY)) as week_start",
+    "CAST(EXTRACT(ISOWEEK FROM MIN(date)) AS INT64) as week_num",
+] + PERIOD_METRIC_COLUMNS
+
+MONTHLY_COLUMNS = [
+    "DATE_TRUNC(date, MONTH) as month_start",
+    "CAST(EXTRACT(MONTH FROM MIN(date)) AS INT64) as month_num",
+] + PERIOD_METRIC_COLUMNS
+
+
+def week_starts(start_date, end_date) -> list:
+    """Mondays of every week overlapping [start_date, end_date]"""
+    week = start_date - timedelta(days=start_date.weekday())
+    weeks = []
+    while week <= end_date:
+        weeks.append(week)
+        week += timedelta(days=7)
+    return weeks
+
+
+def month_starts(start_date, end_date) -> list:
+    """First days of every month overlapping [start_date, end_date]"""
+    month = start_date.replace(day=1)
+    months = []
+    while month <= end_date:
+        months.append(month)
+        month = (month + timedelta(days=32)).replace(day=1)
+    return months
+
+
+def replace_periods_sql(project_id: str, table: str, period_column: str, columns: list) -> str:
+    """
+    MERGE that re-aggregates daily_metrics for the periods in @period_starts
+    (covering @range_start..@range_end) and swaps exactly those partitions
+    of the target table; every other period is left untouched.
+    """
+    select_list = ',\n      '.join(columns)
+    return f"""
+    MERGE `{project_id}.reporting.{table}` T
+    USING (
+      SELECT
+      {select_list}
+      FROM `{project_id}.reporting.daily_metrics`
+      WHERE date >= @range_start
+        AND date <= @range_end
+      GROUP BY {period_column}
+    ) S
+    ON FALSE
+    WHEN NOT MATCHED BY SOURCE
+      AND T.{period_column} IN UNNEST(@period_starts)
+    THEN DELETE
+    WHEN NOT MATCHED THEN
+      INSERT ROW
+    """
+
+
+def replace_periods(bq, project_id: str, table: str, period_column: str, columns: list,
+                    period_starts: list, range_end) -> int:
+    """Rebuild the given periods of a reporting table; returns the number of rows written"""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("period_starts", "DATE", period_starts),
+            bigquery.ScalarQueryParameter("range_start", "DATE", min(period_starts)),
+            bigquery.ScalarQueryParameter("range_end", "DATE", range_end)
+        ]
+    )
+    
+    job = bq.query(replace_periods_sql(project_id, table, period_column, columns), job_config=job_config)
+    job.result()
+    return job.dml_stats.inserted_row_count if job.dml_stats else 0
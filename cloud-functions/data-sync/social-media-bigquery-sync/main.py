@@ -9,11 +9,17 @@ Architecture: Platform APIs → Cloud Function → BigQuery
 
 import functions_framework
 from google.cloud import firestore, bigquery
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import os
+import threading
+import time
 import requests
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.row_converter import convert_rows
 
 logger = logging.getLogger(__name__)
 
@@ -25,41 +31,100 @@ TABLE_ID = "daily_entity_metrics"
 PLATFORMS = {
     'linkedin': {
         'name': 'LinkedIn',
+        'requests_per_second': 1,
         'oauth_required_for': ['messages', 'analytics'],
         'public_metrics': ['followers', 'posts']
     },
     'twitter': {
         'name': 'Twitter/X',
+        'requests_per_second': 0.5,
         'oauth_required_for': ['messages', 'analytics'],
         'public_metrics': ['followers', 'posts', 'engagement']
     },
     'instagram': {
         'name': 'Instagram',
+        'requests_per_second': 2,
         'oauth_required_for': ['messages', 'analytics'],
         'public_metrics': ['followers', 'posts', 'engagement']
     },
     'facebook': {
         'name': 'Facebook',
+        'requests_per_second': 2,
         'oauth_required_for': ['messages', 'analytics'],
         'public_metrics': ['followers', 'posts', 'engagement']
     },
     'youtube': {
         'name': 'YouTube',
+        'requests_per_second': 5,
         'oauth_required_for': ['messages', 'analytics'],
         'public_metrics': ['subscribers', 'videos', 'views']
     },
     'tiktok': {
         'name': 'TikTok',
+        'requests_per_second': 1,
         'oauth_required_for': ['messages', 'analytics'],
         'public_metrics': ['followers', 'videos', 'likes']
     },
     'telegram': {
         'name': 'Telegram',
+        'requests_per_second': 10,
         'oauth_required_for': ['messages'],
         'public_metrics': ['subscribers', 'posts']
     }
 }
 
+SOCIAL_MAX_CONCURRENT_FETCHES = int(os.environ.get('SOCIAL_MAX_CONCURRENT_FETCHES', '8'))
+# Reruns within this window reuse the last fetched metrics instead of calling the platform again
+SOCIAL_CACHE_TTL_HOURS = int(os.environ.get('SOCIAL_CACHE_TTL_HOURS', '6'))
+REQUEST_TIMEOUT_SECONDS = 30
+
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=len(PLATFORMS), pool_maxsize=SOCIAL_MAX_CONCURRENT_FETCHES))
+
+
+class RateLimiter:
+    """Thread-safe minimum spacing between calls to one platform, shared across orgs"""
+    
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+    
+    def pause(self, seconds: float):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+rate_limiters = {
+    platform: RateLimiter(settings['requests_per_second'])
+    for platform, settings in PLATFORMS.items()
+}
+
+
+def platform_get(platform: str, url: str, **kwargs) -> requests.Response:
+    """GET through the shared session, respecting the platform's rate limit and one Retry-After on 429"""
+    limiter = rate_limiters[platform]
+    for attempt in range(2):
+        limiter.acquire()
+        response = http_session.get(url, timeout=REQUEST_TIMEOUT_SECONDS, **kwargs)
+        if response.status_code != 429 or attempt:
+            return response
+        try:
+            retry_after = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after = 1.0
+        logger.warning(f"{PLATFORMS[platform]['name']} rate limited; retrying in {retry_after}s")
+        limiter.pause(retry_after)
+    return response
+
 
 def get_credentials(db, organization_id: str, platform: str):
     """Get OAuth credentials for a platform from Firestore"""
@@ -93,7 +158,8 @@ def fetch_linkedin_metrics(credentials: dict, profile_url: str) -> dict:
         
         # Get follower count
         headers = {'Authorization': f'Bearer {access_token}'}
-        follower_response = requests.get(
+        follower_response = platform_get(
+            'linkedin',
             f'https://api.linkedin.com/v2/organizationalEntityFollowerStatistics?q=organizationalEntity&organizationalEntity=urn:li:organization:{organization_id}',
             headers=headers
         )
@@ -133,7 +199,8 @@ def fetch_twitter_metrics(credentials: dict, handle: str) -> dict:
         headers = {'Authorization': f'Bearer {bearer_token}'}
         
         # Get user metrics
-        user_response = requests.get(
+        user_response = platform_get(
+            'twitter',
             f'https://api.twitter.com/2/users/{user_id}?user.fields=public_metrics',
             headers=headers
         )
@@ -167,7 +234,8 @@ def fetch_instagram_metrics(credentials: dict, handle: str) -> dict:
         business_account_id = credentials.get('business_account_id')
         
         # Get followers
-        response = requests.get(
+        response = platform_get(
+            'instagram',
             f'https://graph.facebook.com/v18.0/{business_account_id}?fields=followers_count,media_count&access_token={access_token}'
         )
         
@@ -196,7 +264,8 @@ def fetch_youtube_metrics(credentials: dict, channel_id: str) -> dict:
         api_key = os.environ.get('YOUTUBE_API_KEY')
         if api_key:
             try:
-                response = requests.get(
+                response = platform_get(
+                    'youtube',
                     f'https://www.googleapis.com/youtube/v3/channels?part=statistics&id={channel_id}&key={api_key}'
                 )
                 if response.ok:
@@ -236,7 +305,8 @@ def fetch_telegram_metrics(credentials: dict, channel_username: str) -> dict:
         bot_token = credentials.get('bot_token')
         
         # Get channel info
-        response = requests.get(
+        response = platform_get(
+            'telegram',
             f'https://api.telegram.org/bot{bot_token}/getChat?chat_id=@{channel_username}'
         )
         
@@ -252,6 +322,98 @@ def fetch_telegram_metrics(credentials: dict, channel_username: str) -> dict:
     return metrics
 
 
+PLATFORM_FETCHERS = {
+    'linkedin': (fetch_linkedin_metrics, 'profile_url'),
+    'twitter': (fetch_twitter_metrics, 'handle'),
+    'instagram': (fetch_instagram_metrics, 'handle'),
+    'youtube': (fetch_youtube_metrics, 'channel_id'),
+    'telegram': (fetch_telegram_metrics, 'channel_username'),
+}
+
+
+def metrics_cache_ref(db, organization_id: str, platform: str):
+    return db.collection('social_media_connections').document(organization_id).collection('metrics_cache').document(platform)
+
+
+def read_cached_metrics(db, organization_id: str, platform: str, identifier: str):
+    """Return metrics fetched today for the same account within SOCIAL_CACHE_TTL_HOURS, else None"""
+    try:
+        doc = metrics_cache_ref(db, organization_id, platform).get()
+        if not doc.exists:
+            return None
+        cached = doc.to_dict()
+        fetched_at = cached.get('fetchedAt')
+        now = datetime.now(timezone.utc)
+        if (
+            cached.get('identifier') == identifier
+            and fetched_at
+            and fetched_at.date() == now.date()
+            and now - fetched_at < timedelta(hours=SOCIAL_CACHE_TTL_HOURS)
+        ):
+            return cached.get('metrics')
+    except Exception as e:
+        logger.warning(f"Metrics cache read failed for {platform}: {e}")
+    return None
+
+
+def write_cached_metrics(db, organization_id: str, platform: str, identifier: str, metrics: dict):
+    try:
+        metrics_cache_ref(db, organization_id, platform).set({
+            'identifier': identifier,
+            'metrics': metrics,
+            'fetchedAt': datetime.now(timezone.utc),
+        })
+    except Exception as e:
+        logger.warning(f"Metrics cache write failed for {platform}: {e}")
+
+
+def fetch_platform_metrics(db, organization_id: str, platform: str, platform_config: dict, use_cache: bool) -> tuple:
+    """Fetch one org's metrics for one platform, serving from the short-TTL cache when possible"""
+    fetcher, identifier_field = PLATFORM_FETCHERS[platform]
+    identifier = platform_config.get(identifier_field)
+    
+    if use_cache:
+        cached = read_cached_metrics(db, organization_id, platform, identifier)
+        if cached is not None:
+            logger.info(f"Using cached {platform} metrics for {organization_id}")
+            return cached, True
+    
+    logger.info(f"Fetching {platform} metrics for {organization_id}...")
+    credentials = get_credentials(db, organization_id, platform)
+    metrics = fetcher(credentials, identifier)
+    
+    # Only cache real results so a failed or unconfigured fetch is retried next run
+    if metrics and any(metrics.values()):
+        write_cached_metrics(db, organization_id, platform, identifier, metrics)
+    
+    return metrics, False
+
+
+def social_row(organization_id: str, platform: str, platform_config: dict, metrics: dict, now_iso: str, today_str: str) -> dict:
+    return {
+        'organization_id': organization_id,
+        'date': today_str,
+        'canonical_entity_id': f"social_{platform}_{today_str}",
+        'entity_type': 'social_channel',
+        'entity_name': f"{PLATFORMS[platform]['name']} - {platform_config.get('handle', platform_config.get('channel_id', 'unknown'))}",
+        
+        # Map metrics to standard fields
+        'users': metrics.get('followers', metrics.get('subscribers', 0)),
+        'sessions': metrics.get('posts_7d', metrics.get('videos', 0)),
+        'impressions': metrics.get('impressions_7d', 0),
+        'engagement_rate': metrics.get('engagement_rate', 0),
+        
+        'source_breakdown': json.dumps({
+            'platform': platform,
+            'platform_name': PLATFORMS[platform]['name'],
+            **metrics,
+        }),
+        
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
 @functions_framework.http
 def sync_social_media_to_bigquery(request):
     """Sync social media metrics to BigQuery"""
@@ -266,10 +428,11 @@ def sync_social_media_to_bigquery(request):
         return ('', 204, headers)
     
     request_json = request.get_json(silent=True) or {}
-    organization_id = request_json.get('organizationId', 'ytjobs')
+    organization_ids = request_json.get('organizationIds') or [request_json.get('organizationId', 'ytjobs')]
     platforms_to_sync = request_json.get('platforms', list(PLATFORMS.keys()))
+    use_cache = not request_json.get('forceRefresh', False)
     
-    logger.info(f"Starting social media sync for {organization_id}")
+    logger.info(f"Starting social media sync for {', '.join(organization_ids)}")
     
     db = firestore.Client()
     bq = bigquery.Client()
@@ -277,6 +440,7 @@ def sync_social_media_to_bigquery(request):
     results = {
         'platforms_processed': 0,
         'platforms_failed': 0,
+        'platforms_cached': 0,
         'rows_inserted': 0,
     }
     
@@ -284,92 +448,82 @@ def sync_social_media_to_bigquery(request):
     now_iso = datetime.utcnow().isoformat()
     today_str = datetime.utcnow().date().isoformat()
     
-    # Get social media config (handles, channel IDs, etc.)
-    try:
-        config_doc = db.collection('social_media_connections').document(organization_id).get()
-        if not config_doc.exists:
+    # Get social media config (handles, channel IDs, etc.) for each org
+    configs = {}
+    for organization_id in organization_ids:
+        try:
+            config_doc = db.collection('social_media_connections').document(organization_id).get()
+        except Exception as e:
+            logger.error(f"Failed to get config: {e}")
+            return ({
+                'success': False,
+                'error': f'Failed to get configuration: {e}',
+            }, 500, headers)
+        
+        if config_doc.exists:
+            configs[organization_id] = config_doc.to_dict()
+        elif len(organization_ids) == 1:
             return ({
                 'success': False,
                 'error': 'No social media configuration found. Please set up social accounts first.',
             }, 400, headers)
-        
-        config = config_doc.to_dict()
-    except Exception as e:
-        logger.error(f"Failed to get config: {e}")
-        return ({
-            'success': False,
-            'error': f'Failed to get configuration: {e}',
-        }, 500, headers)
-    
-    # Fetch metrics for each platform
-    for platform in platforms_to_sync:
-        if platform not in PLATFORMS:
-            logger.warning(f"Unknown platform: {platform}")
-            continue
-        
-        try:
-            logger.info(f"Fetching {platform} metrics...")
+        else:
+            logger.warning(f"No social media configuration for {organization_id} - skipping")
+    
+    # Fan out every enabled (org, platform) pair; rate limits are enforced per platform
+    tasks = []
+    for organization_id, config in configs.items():
+        for platform in platforms_to_sync:
+            if platform not in PLATFORMS:
+                logger.warning(f"Unknown platform: {platform}")
+                continue
             
-            credentials = get_credentials(db, organization_id, platform)
             platform_config = config.get(platform, {})
-            
             if not platform_config.get('enabled', False):
                 logger.info(f"Skipping {platform} - not enabled")
                 continue
             
-            # Fetch metrics based on platform
-            metrics = {}
-            if platform == 'linkedin':
-                metrics = fetch_linkedin_metrics(credentials, platform_config.get('profile_url'))
-            elif platform == 'twitter':
-                metrics = fetch_twitter_metrics(credentials, platform_config.get('handle'))
-            elif platform == 'instagram':
-                metrics = fetch_instagram_metrics(credentials, platform_config.get('handle'))
-            elif platform == 'youtube':
-                metrics = fetch_youtube_metrics(credentials, platform_config.get('channel_id'))
-            elif platform == 'telegram':
-                metrics = fetch_telegram_metrics(credentials, platform_config.get('channel_username'))
-            
-            if metrics:
-                row = {
-                    'organization_id': organization_id,
-                    'date': today_str,
-                    'canonical_entity_id': f"social_{platform}_{today_str}",
-                    'entity_type': 'social_channel',
-                    'entity_name': f"{PLATFORMS[platform]['name']} - {platform_config.get('handle', platform_config.get('channel_id', 'unknown'))}",
-                    
-                    # Map metrics to standard fields
-                    'users': metrics.get('followers', metrics.get('subscribers', 0)),
-                    'sessions': metrics.get('posts_7d', metrics.get('videos', 0)),
-                    'impressions': metrics.get('impressions_7d', 0),
-                    'engagement_rate': metrics.get('engagement_rate', 0),
-                    
-                    'source_breakdown': json.dumps({
-                        'platform': platform,
-                        'platform_name': PLATFORMS[platform]['name'],
-                        **metrics,
-                    }),
-                    
-                    'created_at': now_iso,
-                    'updated_at': now_iso,
-                }
-                rows.append(row)
-                results['platforms_processed'] += 1
-            else:
+            if platform not in PLATFORM_FETCHERS:
+                # No fetcher yet for this platform
                 results['platforms_failed'] += 1
+                continue
+            
+            tasks.append((organization_id, platform, platform_config))
+    
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(SOCIAL_MAX_CONCURRENT_FETCHES, len(tasks))) as executor:
+            futures = {
+                executor.submit(fetch_platform_metrics, db, organization_id, platform, platform_config, use_cache): (organization_id, platform, platform_config)
+                for organization_id, platform, platform_config in tasks
+            }
+            
+            for future in as_completed(futures):
+                organization_id, platform, platform_config = futures[future]
+                try:
+                    metrics, from_cache = future.result()
+                except Exception as e:
+                    logger.error(f"Error fetching {platform} metrics for {organization_id}: {e}")
+                    results['platforms_failed'] += 1
+                    continue
                 
-        except Exception as e:
-            logger.error(f"Error fetching {platform} metrics: {e}")
-            results['platforms_failed'] += 1
+                if metrics:
+                    rows.append(social_row(organization_id, platform, platform_config, metrics, now_iso, today_str))
+                    results['platforms_processed'] += 1
+                    if from_cache:
+                        results['platforms_cached'] += 1
+                else:
+                    results['platforms_failed'] += 1
     
     # Write to BigQuery
     if rows:
         table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+        synced_orgs = sorted({row['organization_id'] for row in rows})
+        org_list = ', '.join(f"'{org}'" for org in synced_orgs)
         
         # Delete today's social data (allow re-runs)
         delete_query = f"""
         DELETE FROM `{table_ref}`
-        WHERE organization_id = '{organization_id}'
+        WHERE organization_id IN ({org_list})
           AND entity_type = 'social_channel'
           AND date = '{today_str}'
         """
@@ -382,12 +536,16 @@ def sync_social_media_to_bigquery(request):
         
         # Insert new rows
         try:
-            errors = bq.insert_rows_json(table_ref, rows)
+            errors = bq.insert_rows_json(table_ref, convert_rows(bq, table_ref, rows))
             if errors:
                 logger.error(f"BigQuery insert errors: {errors}")
             else:
                 results['rows_inserted'] = len(rows)
                 logger.info(f"✅ Inserted {len(rows)} rows to BigQuery")
+                
+                for org_id in dict.fromkeys(row['organization_id'] for row in rows):
+                    org_rows = [row for row in rows if row['organization_id'] == org_id]
+                    record_dirty_partitions(bq, org_id, dirty_ranges(org_rows), 'social_media')
         except Exception as e:
             logger.error(f"Failed to insert rows: {e}")
             return ({
@@ -5,27 +5,143 @@ Calls Stripe API directly and writes to BigQuery - NO Firestore intermediate sto
 Only uses Firestore for OAuth credentials.
 
 Architecture: Stripe API → Cloud Function → BigQuery
+
+Update mode is event-driven: once a full listing has run, the connection stores a
+Stripe event cursor and later runs only consume events.list since that cursor,
+re-aggregating the affected days and refreshing changed subscriptions, customers
+and products. A full listing (reconciliation) still runs every
+STRIPE_RECONCILE_INTERVAL_DAYS, or whenever the cursor is missing or too old.
+
+Raw objects go to typed tables (raw_stripe_charges / _subscriptions / _customers),
+partitioned by date and clustered by org, bulk-loaded instead of streamed.
 """
 
 import functions_framework
 from google.cloud import firestore, bigquery
 from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import json
 import os
+import threading
 import stripe
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.bq_scripts import run_script
+from opsos_common.row_converter import compile_row_converter, convert_rows
 
 logger = logging.getLogger(__name__)
 
 PROJECT_ID = "opsos-864a1"
 DATASET_ID = "marketing_ai"
 TABLE_ID = "daily_entity_metrics"
-RAW_TABLE_ID = "raw_stripe"
+
+# Typed raw tables, partitioned by object date and clustered for org/status lookups
+RAW_TABLES = {
+    'charge': {
+        'table_id': 'raw_stripe_charges',
+        'id_column': 'charge_id',
+        'clustering': ['organization_id', 'status', 'customer_id'],
+        'schema': [
+            bigquery.SchemaField('organization_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('charge_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('date', 'DATE', mode='REQUIRED'),
+            bigquery.SchemaField('created', 'TIMESTAMP'),
+            bigquery.SchemaField('amount', 'INT64'),            # cents
+            bigquery.SchemaField('amount_refunded', 'INT64'),   # cents
+            bigquery.SchemaField('currency', 'STRING'),
+            bigquery.SchemaField('status', 'STRING'),
+            bigquery.SchemaField('refunded', 'BOOL'),
+            bigquery.SchemaField('customer_id', 'STRING'),
+            bigquery.SchemaField('payment_method', 'STRING'),
+            bigquery.SchemaField('description', 'STRING'),
+            bigquery.SchemaField('raw', 'JSON'),
+            bigquery.SchemaField('synced_at', 'TIMESTAMP'),
+        ],
+    },
+    'subscription': {
+        'table_id': 'raw_stripe_subscriptions',
+        'id_column': 'subscription_id',
+        'clustering': ['organization_id', 'status', 'customer_id'],
+        'schema': [
+            bigquery.SchemaField('organization_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('subscription_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('date', 'DATE', mode='REQUIRED'),
+            bigquery.SchemaField('created', 'TIMESTAMP'),
+            bigquery.SchemaField('customer_id', 'STRING'),
+            bigquery.SchemaField('status', 'STRING'),
+            bigquery.SchemaField('product_id', 'STRING'),
+            bigquery.SchemaField('product_name', 'STRING'),
+            bigquery.SchemaField('price_amount', 'FLOAT64'),
+            bigquery.SchemaField('price_interval', 'STRING'),
+            bigquery.SchemaField('mrr', 'FLOAT64'),
+            bigquery.SchemaField('current_period_start', 'TIMESTAMP'),
+            bigquery.SchemaField('current_period_end', 'TIMESTAMP'),
+            bigquery.SchemaField('cancel_at_period_end', 'BOOL'),
+            bigquery.SchemaField('canceled_at', 'TIMESTAMP'),
+            bigquery.SchemaField('ended_at', 'TIMESTAMP'),
+            bigquery.SchemaField('raw', 'JSON'),
+            bigquery.SchemaField('synced_at', 'TIMESTAMP'),
+        ],
+    },
+    'customer': {
+        'table_id': 'raw_stripe_customers',
+        'id_column': 'customer_id',
+        'clustering': ['organization_id', 'customer_id'],
+        'schema': [
+            bigquery.SchemaField('organization_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('customer_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('date', 'DATE', mode='REQUIRED'),
+            bigquery.SchemaField('created', 'TIMESTAMP'),
+            bigquery.SchemaField('email', 'STRING'),
+            bigquery.SchemaField('name', 'STRING'),
+            bigquery.SchemaField('currency', 'STRING'),
+            bigquery.SchemaField('delinquent', 'BOOL'),
+            bigquery.SchemaField('phone', 'STRING'),
+            bigquery.SchemaField('description', 'STRING'),
+            bigquery.SchemaField('raw', 'JSON'),
+            bigquery.SchemaField('synced_at', 'TIMESTAMP'),
+        ],
+    },
+}
+
+# Overflow JSON (fields without their own column) is only kept when asked for
+STRIPE_RAW_JSON_OVERFLOW = os.environ.get('STRIPE_RAW_JSON_OVERFLOW', 'false').lower() == 'true'
 
 # Get Stripe platform secret from environment
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 
+# Stripe only keeps events for 30 days; reconcile well before a cursor ages out
+STRIPE_EVENT_RETENTION_DAYS = 30
+STRIPE_RECONCILE_INTERVAL_DAYS = int(os.environ.get('STRIPE_RECONCILE_INTERVAL_DAYS', '7'))
+
+# Independent listings run in parallel; kept well under Stripe's 100 req/s (25 in test mode)
+# read limit, and the client retries 429s with backoff
+STRIPE_MAX_CONCURRENT_LISTINGS = int(os.environ.get('STRIPE_MAX_CONCURRENT_LISTINGS', '6'))
+STRIPE_MAX_NETWORK_RETRIES = 3
+# Charges are listed in created-date windows of this size so a long range pages in parallel
+STRIPE_CHARGE_WINDOW_DAYS = 30
+
+STRIPE_EVENT_TYPES = [
+    'charge.succeeded',
+    'charge.failed',
+    'charge.refunded',
+    'charge.updated',
+    'customer.created',
+    'customer.updated',
+    'customer.subscription.created',
+    'customer.subscription.updated',
+    'customer.subscription.deleted',
+    'product.created',
+    'product.updated',
+]
+
+MERGE_UPDATE_COLUMNS = [
+    'revenue', 'payment_count', 'refund_amount', 'net_revenue', 'mrr', 'arr',
+    'active_subscriptions', 'churned_subscriptions', 'churn_rate',
+    'total_customers', 'new_customers_today', 'source_breakdown', 'updated_at',
+]
+
 
 def get_stripe_client(connection_data: dict) -> stripe.StripeClient:
     """Create Stripe client from connection credentials"""
@@ -39,18 +155,652 @@ def get_stripe_client(connection_data: dict) -> stripe.StripeClient:
         # Use platform secret with connected account
         return stripe.StripeClient(
             api_key=STRIPE_SECRET_KEY,
-            stripe_account=stripe_account_id
+            stripe_account=stripe_account_id,
+            max_network_retries=STRIPE_MAX_NETWORK_RETRIES,
         )
     elif access_token:
         # Use OAuth access token
-        return stripe.StripeClient(api_key=access_token)
+        return stripe.StripeClient(api_key=access_token, max_network_retries=STRIPE_MAX_NETWORK_RETRIES)
     elif api_key:
         # Use legacy API key
-        return stripe.StripeClient(api_key=api_key)
+        return stripe.StripeClient(api_key=api_key, max_network_retries=STRIPE_MAX_NETWORK_RETRIES)
     else:
         raise ValueError("No valid Stripe credentials found")
 
 
+def new_daily_revenue():
+    return defaultdict(lambda: {
+        'total_revenue': 0,
+        'payment_count': 0,
+        'refund_amount': 0,
+        'currencies': set(),
+    })
+
+
+# Charge windows are aggregated from several threads into one daily_revenue dict
+daily_revenue_lock = threading.Lock()
+
+
+def add_charge(daily_revenue, charge, date_str: str):
+    """Accumulate one charge into its day's revenue totals (thread-safe)"""
+    with daily_revenue_lock:
+        if charge.status == 'succeeded':
+            amount = charge.amount / 100  # Convert from cents
+            daily_revenue[date_str]['total_revenue'] += amount
+            daily_revenue[date_str]['payment_count'] += 1
+            daily_revenue[date_str]['currencies'].add(charge.currency.upper())
+        
+        if charge.refunded:
+            refund_amount = charge.amount_refunded / 100
+            daily_revenue[date_str]['refund_amount'] += refund_amount
+
+
+def charge_windows(start_date, end_date, open_ended: bool) -> list:
+    """
+    Split [start_date, end_date] into created-timestamp filters of STRIPE_CHARGE_WINDOW_DAYS.
+    When open_ended, the last window has no upper bound (matches the old 'gte only' listing).
+    """
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=STRIPE_CHARGE_WINDOW_DAYS), end_date + timedelta(days=1))
+        created = {'gte': int(datetime.combine(window_start, datetime.min.time()).timestamp())}
+        if not (open_ended and window_end > end_date):
+            created['lt'] = int(datetime.combine(window_end, datetime.min.time()).timestamp())
+        windows.append(created)
+        window_start = window_end
+    return windows
+
+
+def charge_window_days(created: dict, end_date) -> set:
+    """ISO dates covered by one charge_windows() filter (open-ended windows stop at end_date)"""
+    day = datetime.fromtimestamp(created['gte']).date()
+    last = datetime.fromtimestamp(created['lt']).date() - timedelta(days=1) if 'lt' in created else end_date
+    days = set()
+    while day <= last:
+        days.add(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def fetch_charges(client, created: dict, organization_id: str, start_date, end_date, daily_revenue, now_iso: str):
+    """List one created-window of charges into daily_revenue; returns (charges_seen, raw_rows)"""
+    charges_seen = 0
+    raw_rows = []
+    
+    charges = client.charges.list(params={'limit': 100, 'created': created})
+    
+    for charge in charges.auto_paging_iter():
+        charges_seen += 1
+        
+        # Get date from charge
+        charge_date = datetime.fromtimestamp(charge.created).date()
+        date_str = charge_date.isoformat()
+        
+        # Skip if outside date range (safety check)
+        if charge_date < start_date or charge_date > end_date:
+            continue
+        
+        add_charge(daily_revenue, charge, date_str)
+        
+        # Store raw charge data
+        raw_rows.append(charge_raw_row(organization_id, charge, date_str, now_iso))
+    
+    return charges_seen, raw_rows
+
+
+def stripe_timestamp(value):
+    """Stripe epoch seconds -> ISO timestamp string for a BigQuery load"""
+    return datetime.utcfromtimestamp(value).isoformat() if value else None
+
+
+def charge_raw_row(organization_id: str, charge, date_str: str, now_iso: str) -> dict:
+    return {
+        'data_type': 'charge',
+        'organization_id': organization_id,
+        'charge_id': charge.id,
+        'date': date_str,
+        'created': stripe_timestamp(charge.created),
+        'amount': charge.amount,
+        'amount_refunded': charge.amount_refunded,
+        'currency': charge.currency,
+        'status': charge.status,
+        'refunded': charge.refunded,
+        'customer_id': charge.customer,
+        'payment_method': charge.payment_method,
+        'description': charge.description,
+        'raw': {'metadata': dict(charge.metadata) if charge.metadata else {}} if STRIPE_RAW_JSON_OVERFLOW else None,
+        'synced_at': now_iso,
+    }
+
+
+def customer_detail(customer) -> dict:
+    return {
+        'id': customer.id,
+        'email': customer.email or '',
+        'name': customer.name or '',
+        'created': datetime.fromtimestamp(customer.created).date().isoformat(),
+        'currency': customer.currency or 'usd',
+        'delinquent': customer.delinquent,
+    }
+
+
+def customer_raw_row(organization_id: str, customer, now_iso: str) -> dict:
+    return {
+        'data_type': 'customer',
+        'organization_id': organization_id,
+        'customer_id': customer.id,
+        'date': datetime.fromtimestamp(customer.created).date().isoformat(),
+        'created': stripe_timestamp(customer.created),
+        'email': customer.email,
+        'name': customer.name,
+        'currency': customer.currency,
+        'delinquent': customer.delinquent,
+        'phone': customer.phone,
+        'description': customer.description,
+        'raw': {
+            'address': dict(customer.address) if customer.address else None,
+            'metadata': dict(customer.metadata) if customer.metadata else {},
+        } if STRIPE_RAW_JSON_OVERFLOW else None,
+        'synced_at': now_iso,
+    }
+
+
+def product_detail(product) -> dict:
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description or '',
+        'active': product.active,
+        'created': datetime.fromtimestamp(product.created).date().isoformat(),
+        'default_price': product.default_price if hasattr(product, 'default_price') else None,
+        'metadata': dict(product.metadata) if product.metadata else {},
+    }
+
+
+def subscription_detail(sub) -> dict:
+    """Flatten a subscription (with items.data.price.product expanded) into a detail dict"""
+    sub_created = datetime.fromtimestamp(sub.created).date()
+    
+    # Get product info from first subscription item
+    product_id = None
+    product_name = None
+    price_amount = 0
+    price_interval = 'month'
+    
+    try:
+        items = sub.items.data if hasattr(sub.items, 'data') else []
+        if items:
+            first_item = items[0]
+            price = first_item.price
+            price_amount = (price.unit_amount or 0) / 100
+            price_interval = price.recurring.interval if price.recurring else 'month'
+            
+            if hasattr(price, 'product'):
+                if isinstance(price.product, str):
+                    product_id = price.product
+                else:
+                    product_id = price.product.id
+                    product_name = price.product.name
+    except Exception as e:
+        logger.warning(f"Error getting subscription product: {e}")
+    
+    return {
+        'id': sub.id,
+        'customer_id': sub.customer,
+        'status': sub.status,
+        'product_id': product_id,
+        'product_name': product_name,
+        'price_amount': price_amount,
+        'price_interval': price_interval,
+        'created': sub_created.isoformat(),
+        'current_period_start': datetime.fromtimestamp(sub.current_period_start).date().isoformat() if sub.current_period_start else None,
+        'current_period_end': datetime.fromtimestamp(sub.current_period_end).date().isoformat() if sub.current_period_end else None,
+        'cancel_at_period_end': sub.cancel_at_period_end,
+        'canceled_at': sub.canceled_at,
+        'ended_at': sub.ended_at,
+        'mrr': subscription_mrr(sub) if sub.status == 'active' else 0,
+        'created_ts': sub.created,
+        'current_period_start_ts': sub.current_period_start,
+        'current_period_end_ts': sub.current_period_end,
+        'metadata': dict(sub.metadata) if sub.metadata else {},
+    }
+
+
+def subscription_raw_row(organization_id: str, sub: dict, now_iso: str) -> dict:
+    return {
+        'data_type': 'subscription',
+        'organization_id': organization_id,
+        'subscription_id': sub['id'],
+        'date': sub['created'],
+        'created': stripe_timestamp(sub['created_ts']),
+        'customer_id': sub['customer_id'],
+        'status': sub['status'],
+        'product_id': sub['product_id'],
+        'product_name': sub['product_name'],
+        'price_amount': sub['price_amount'],
+        'price_interval': sub['price_interval'],
+        'mrr': sub['mrr'],
+        'current_period_start': stripe_timestamp(sub['current_period_start_ts']),
+        'current_period_end': stripe_timestamp(sub['current_period_end_ts']),
+        'cancel_at_period_end': sub['cancel_at_period_end'],
+        'canceled_at': stripe_timestamp(sub['canceled_at']),
+        'ended_at': stripe_timestamp(sub['ended_at']),
+        'raw': {'metadata': sub['metadata']} if STRIPE_RAW_JSON_OVERFLOW else None,
+        'synced_at': now_iso,
+    }
+
+
+def subscription_mrr(sub) -> float:
+    """Monthly recurring amount of one active subscription across all its items"""
+    mrr = 0
+    try:
+        items_data = sub.get('items', {}).get('data', []) if isinstance(sub, dict) else getattr(sub.items, 'data', [])
+        for item in items_data:
+            price = item.get('price', {}) if isinstance(item, dict) else item.price
+            unit_amount = (price.get('unit_amount') if isinstance(price, dict) else price.unit_amount) or 0
+            quantity = (item.get('quantity') if isinstance(item, dict) else item.quantity) or 1
+            recurring = price.get('recurring', {}) if isinstance(price, dict) else price.recurring
+            interval = (recurring.get('interval') if isinstance(recurring, dict) else getattr(recurring, 'interval', None)) if recurring else 'month'
+            
+            # Convert to monthly
+            if interval == 'year':
+                monthly_amount = (unit_amount * quantity) / 12
+            elif interval == 'week':
+                monthly_amount = (unit_amount * quantity) * 4
+            else:
+                monthly_amount = unit_amount * quantity
+            
+            mrr += monthly_amount / 100  # Convert from cents
+    except Exception as item_err:
+        logger.warning(f"Error processing subscription items: {item_err}")
+    return mrr
+
+
+def fetch_subscriptions(client):
+    """
+    List every subscription once, with products expanded, and derive both the
+    MRR summary and the per-subscription details from that single pass.
+    Returns (summary, details).
+    """
+    summary = {'mrr': 0, 'active_subscriptions': 0, 'churned_subscriptions': 0}
+    details = []
+    
+    subs = client.subscriptions.list(params={'limit': 100, 'status': 'all', 'expand': ['data.items.data.price.product']})
+    
+    for sub in subs.auto_paging_iter():
+        detail = subscription_detail(sub)
+        
+        if sub.status == 'active':
+            summary['active_subscriptions'] += 1
+            summary['mrr'] += detail['mrr']
+        elif sub.status in ['canceled', 'unpaid']:
+            summary['churned_subscriptions'] += 1
+        
+        details.append(detail)
+    
+    return summary, details
+
+
+def list_all(client_listing, params: dict) -> list:
+    """Drain one auto-paginated Stripe listing"""
+    return list(client_listing.list(params=params).auto_paging_iter())
+
+
+def revenue_rows(organization_id: str, daily_revenue, now_iso: str) -> list:
+    rows = []
+    for date_str, metrics in daily_revenue.items():
+        rows.append({
+            'organization_id': organization_id,
+            'date': date_str,
+            'canonical_entity_id': f"stripe_revenue_{date_str}",
+            'entity_type': 'revenue',
+            
+            'revenue': metrics['total_revenue'],
+            'source_breakdown': json.dumps({
+                'currencies': list(metrics['currencies']),
+                'payment_count': metrics['payment_count'],
+                'refund_amount': metrics['refund_amount'],
+                'net_revenue': metrics['total_revenue'] - metrics['refund_amount'],
+            }),
+            
+            'created_at': now_iso,
+            'updated_at': now_iso,
+        })
+    return rows
+
+
+def subscription_summary_row(organization_id: str, summary: dict, date_str: str, now_iso: str) -> dict:
+    total_mrr = summary['mrr']
+    active_subscriptions = summary['active_subscriptions']
+    churned_subscriptions = summary['churned_subscriptions']
+    return {
+        'organization_id': organization_id,
+        'date': date_str,
+        'canonical_entity_id': 'stripe_subscription_metrics',
+        'entity_type': 'subscription_summary',
+        
+        'revenue': total_mrr,  # Use revenue field for MRR
+        'source_breakdown': json.dumps({
+            'mrr': total_mrr,
+            'arr': total_mrr * 12,
+            'active_subscriptions': active_subscriptions,
+            'churned_subscriptions': churned_subscriptions,
+            'churn_rate': (churned_subscriptions / (active_subscriptions + churned_subscriptions) * 100) if (active_subscriptions + churned_subscriptions) > 0 else 0,
+        }),
+        
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
+def subscription_row(organization_id: str, sub: dict, date_str: str, now_iso: str) -> dict:
+    return {
+        'organization_id': organization_id,
+        'date': date_str,
+        'canonical_entity_id': f"stripe_sub_{sub['id']}",
+        'entity_type': 'subscription',
+        
+        'revenue': sub['price_amount'],  # Monthly price
+        'source_breakdown': json.dumps({
+            'subscription_id': sub['id'],
+            'customer_id': sub['customer_id'],
+            'status': sub['status'],
+            'product_id': sub['product_id'],
+            'product_name': sub['product_name'],
+            'price_interval': sub['price_interval'],
+            'created': sub['created'],
+            'current_period_start': sub['current_period_start'],
+            'current_period_end': sub['current_period_end'],
+            'cancel_at_period_end': sub['cancel_at_period_end'],
+        }),
+        
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
+def customer_row(organization_id: str, cust: dict, now_iso: str) -> dict:
+    return {
+        'organization_id': organization_id,
+        'date': cust['created'],  # Use customer creation date
+        'canonical_entity_id': f"stripe_customer_{cust['id']}",
+        'entity_type': 'customer',
+        
+        'source_breakdown': json.dumps({
+            'customer_id': cust['id'],
+            'email': cust['email'],
+            'name': cust['name'],
+            'currency': cust['currency'],
+            'delinquent': cust['delinquent'],
+        }),
+        
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
+def product_row(organization_id: str, prod: dict, date_str: str, now_iso: str) -> dict:
+    return {
+        'organization_id': organization_id,
+        'date': date_str,
+        'canonical_entity_id': f"stripe_product_{prod['id']}",
+        'entity_type': 'product',
+        
+        'source_breakdown': json.dumps({
+            'product_id': prod['id'],
+            'name': prod['name'],
+            'description': prod['description'],
+            'active': prod['active'],
+            'created': prod['created'],
+            'default_price': prod['default_price'],
+            'metadata': prod['metadata'],
+        }),
+        
+        'created_at': now_iso,
+        'updated_at': now_iso,
+    }
+
+
+def get_latest_event_cursor(client):
+    """Return {'id', 'created'} for the newest Stripe event, or None if there are none"""
+    events = client.events.list(params={'limit': 1})
+    for event in events.data:
+        return {'id': event.id, 'created': event.created}
+    return None
+
+
+def event_cursor_usable(connection_data: dict) -> bool:
+    """True if update mode can replay events instead of re-listing everything"""
+    cursor = connection_data.get('eventCursor')
+    last_reconciled = connection_data.get('lastReconciledAt')
+    if not cursor or not cursor.get('id') or not last_reconciled:
+        return False
+    
+    now_ts = datetime.utcnow().timestamp()
+    # Cursor must still be inside Stripe's event retention window
+    if now_ts - cursor.get('created', 0) > (STRIPE_EVENT_RETENTION_DAYS - 1) * 86400:
+        return False
+    
+    reconciled_at = datetime.fromisoformat(last_reconciled)
+    return datetime.utcnow() - reconciled_at < timedelta(days=STRIPE_RECONCILE_INTERVAL_DAYS)
+
+
+def collect_changed_objects(client, cursor: dict) -> dict:
+    """
+    Read every relevant event after the cursor and reduce it to what changed:
+    the days whose charges need re-aggregating, subscription ids to refresh, and
+    the latest snapshot of each changed customer and product.
+    """
+    changes = {
+        'events': 0,
+        'charge_days': set(),
+        'subscription_ids': set(),
+        'customers': {},
+        'products': {},
+        'cursor': cursor,
+    }
+    latest = {}  # object id -> created of the event its snapshot came from
+    
+    events = client.events.list(params={
+        'limit': 100,
+        'ending_before': cursor['id'],
+        'types': STRIPE_EVENT_TYPES,
+    })
+    
+    for event in events.auto_paging_iter():
+        changes['events'] += 1
+        if event.created >= changes['cursor']['created']:
+            changes['cursor'] = {'id': event.id, 'created': event.created}
+        
+        obj = event.data.object
+        
+        if event.type.startswith('charge.'):
+            changes['charge_days'].add(datetime.fromtimestamp(obj.created).date())
+        elif event.type.startswith('customer.subscription.'):
+            changes['subscription_ids'].add(obj.id)
+        elif event.type.startswith('customer.') or event.type.startswith('product.'):
+            bucket = changes['customers'] if event.type.startswith('customer.') else changes['products']
+            if event.created >= latest.get(obj.id, 0):
+                latest[obj.id] = event.created
+                bucket[obj.id] = obj
+    
+    return changes
+
+
+def merge_rows_to_bigquery(bq, rows: list, organization_id: str):
+    """Stage rows in a temp table with the target schema and MERGE them into daily_entity_metrics"""
+    table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+    temp_table_id = f"temp_stripe_sync_{organization_id.replace('-', '_')}_{int(datetime.utcnow().timestamp())}"
+    temp_table_ref = f"{PROJECT_ID}.{DATASET_ID}.{temp_table_id}"
+    
+    try:
+        main_table = bq.get_table(table_ref)
+        temp_table = bigquery.Table(temp_table_ref, schema=main_table.schema)
+        bq.create_table(temp_table, exists_ok=True)
+        
+        staged = compile_row_converter(main_table.schema)(rows)
+        errors = bq.insert_rows_json(temp_table_ref, staged, skip_invalid_rows=True, ignore_unknown_values=True)
+        if errors:
+            logger.warning(f"Temp table insert errors: {errors[:3]}")
+        
+        update_set = ',\n                '.join(f"{col} = S.{col}" for col in MERGE_UPDATE_COLUMNS)
+        merge_query = f"""
+        MERGE `{table_ref}` T
+        USING `{temp_table_ref}` S
+        ON T.organization_id = S.organization_id 
+           AND T.canonical_entity_id = S.canonical_entity_id 
+           AND T.date = S.date
+        WHEN MATCHED THEN
+            UPDATE SET 
+                {update_set}
+        WHEN NOT MATCHED THEN
+            INSERT ROW
+        """
+        
+        bq.query(merge_query).result()
+    finally:
+        bq.delete_table(temp_table_ref, not_found_ok=True)
+
+
+def ensure_raw_table(bq, data_type: str) -> bigquery.Table:
+    """Create the typed raw table for a Stripe object type if it doesn't exist"""
+    spec = RAW_TABLES[data_type]
+    table = bigquery.Table(f"{PROJECT_ID}.{DATASET_ID}.{spec['table_id']}", schema=spec['schema'])
+    table.time_partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field='date')
+    table.clustering_fields = spec['clustering']
+    return bq.create_table(table, exists_ok=True)
+
+
+def load_raw_rows(bq, raw_rows: list, organization_id: str, replace_scopes: dict) -> int:
+    """
+    Bulk-load raw rows into the typed raw tables (one load job per object type).
+    
+    Rows are loaded into a staging table and swapped in with one transaction that
+    deletes the same ids plus anything inside replace_scopes[data_type] (a SQL
+    condition covering what was re-listed, so objects deleted upstream disappear).
+    Returns the number of rows loaded.
+    """
+    by_type = defaultdict(list)
+    for row in raw_rows:
+        row = dict(row)
+        by_type[row.pop('data_type')].append(row)
+    
+    loaded = 0
+    run_id = int(datetime.utcnow().timestamp())
+    
+    for data_type, type_rows in by_type.items():
+        spec = RAW_TABLES[data_type]
+        table = ensure_raw_table(bq, data_type)
+        table_ref = f"{PROJECT_ID}.{DATASET_ID}.{spec['table_id']}"
+        staging_ref = f"{table_ref}_staging_{organization_id.replace('-', '_')}_{run_id}"
+        
+        try:
+            job_config = bigquery.LoadJobConfig(
+                schema=table.schema,
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            )
+            bq.load_table_from_json(type_rows, staging_ref, job_config=job_config).result()
+            
+            scope = replace_scopes.get(data_type)
+            scope_clause = f" OR ({scope})" if scope else ''
+            swap_script = f"""
+            BEGIN TRANSACTION;
+            
+            DELETE FROM `{table_ref}`
+            WHERE organization_id = '{organization_id}'
+              AND ({spec['id_column']} IN (SELECT {spec['id_column']} FROM `{staging_ref}`){scope_clause});
+            
+            INSERT INTO `{table_ref}`
+            SELECT * FROM `{staging_ref}`;
+            
+            COMMIT TRANSACTION;
+            """
+            run_script(bq, swap_script)
+            loaded += len(type_rows)
+        except Exception as e:
+            logger.warning(f"Raw {data_type} load failed: {e}")
+        finally:
+            bq.delete_table(staging_ref, not_found_ok=True)
+    
+    return loaded
+
+
+def sync_from_events(client, bq, organization_id: str, cursor: dict, results: dict) -> dict:
+    """
+    Incremental update: apply only the Stripe objects that changed since the cursor.
+    Returns the advanced cursor.
+    """
+    now_iso = datetime.utcnow().isoformat()
+    today_str = datetime.utcnow().date().isoformat()
+    
+    changes = collect_changed_objects(client, cursor)
+    results['events_processed'] = changes['events']
+    logger.info(
+        f"{changes['events']} Stripe events since cursor: {len(changes['charge_days'])} charge days, "
+        f"{len(changes['subscription_ids'])} subscriptions, {len(changes['customers'])} customers, "
+        f"{len(changes['products'])} products"
+    )
+    
+    rows = []
+    raw_rows = []
+    raw_scopes = {}
+    
+    # Re-aggregate each affected day from its full set of charges, days in parallel
+    daily_revenue = new_daily_revenue()
+    with ThreadPoolExecutor(max_workers=STRIPE_MAX_CONCURRENT_LISTINGS) as executor:
+        subscriptions_future = executor.submit(fetch_subscriptions, client) if changes['subscription_ids'] else None
+        
+        day_futures = []
+        for day in sorted(changes['charge_days']):
+            created = {
+                'gte': int(datetime.combine(day, datetime.min.time()).timestamp()),
+                'lt': int(datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()),
+            }
+            day_futures.append(executor.submit(fetch_charges, client, created, organization_id, day, day, daily_revenue, now_iso))
+        
+        for future in day_futures:
+            charges_seen, charge_raw_rows = future.result()
+            results['charges_processed'] += charges_seen
+            raw_rows.extend(charge_raw_rows)
+        
+        # Refresh changed subscriptions and the MRR snapshot they feed into
+        if subscriptions_future:
+            summary, details = subscriptions_future.result()
+            results['subscriptions_processed'] += len(details)
+            rows.append(subscription_summary_row(organization_id, summary, today_str, now_iso))
+            for detail in details:
+                if detail['id'] in changes['subscription_ids']:
+                    rows.append(subscription_row(organization_id, detail, today_str, now_iso))
+                    raw_rows.append(subscription_raw_row(organization_id, detail, now_iso))
+    
+    rows.extend(revenue_rows(organization_id, daily_revenue, now_iso))
+    if changes['charge_days']:
+        # Each affected day was fully re-listed, so replace those charge partitions
+        day_list = ', '.join(f"'{day.isoformat()}'" for day in changes['charge_days'])
+        raw_scopes['charge'] = f"date IN ({day_list})"
+    
+    for customer in changes['customers'].values():
+        results['customers_processed'] += 1
+        rows.append(customer_row(organization_id, customer_detail(customer), now_iso))
+        raw_rows.append(customer_raw_row(organization_id, customer, now_iso))
+    
+    for product in changes['products'].values():
+        results['products_processed'] += 1
+        rows.append(product_row(organization_id, product_detail(product), today_str, now_iso))
+    
+    if rows:
+        logger.info(f"Writing {len(rows)} changed rows to BigQuery...")
+        merge_rows_to_bigquery(bq, rows, organization_id)
+        results['rows_inserted'] = len(rows)
+        record_dirty_partitions(bq, organization_id, dirty_ranges(rows), 'stripe')
+    
+    if raw_rows:
+        results['raw_records_inserted'] = load_raw_rows(bq, raw_rows, organization_id, raw_scopes)
+    
+    return changes['cursor']
+
+
 @functions_framework.http
 def sync_stripe_to_bigquery(request):
     """Sync Stripe data directly to BigQuery"""
@@ -117,6 +867,52 @@ def sync_stripe_to_bigquery(request):
             'rows_inserted': 0,
         }
         
+        # Event-driven update: only replay what changed since the stored cursor.
+        # Explicit ranges and full mode always do a complete listing.
+        use_events = (
+            sync_mode == 'update'
+            and not (explicit_start and explicit_end)
+            and not request_json.get('reconcile', False)
+            and event_cursor_usable(connection_data)
+        )
+        
+        if use_events:
+            logger.info(f"Event-driven update from cursor {connection_data['eventCursor']['id']}")
+            new_cursor = sync_from_events(client, bq, organization_id, connection_data['eventCursor'], results)
+            
+            connection_ref.update({
+                'status': 'connected',
+                'eventCursor': new_cursor,
+                'lastSyncAt': firestore.SERVER_TIMESTAMP,
+                'lastSyncResults': {
+                    'charges': results['charges_processed'],
+                    'subscriptions': results['subscriptions_processed'],
+                    'customers': results['customers_processed'],
+                    'products': results['products_processed'],
+                    'events': results.get('events_processed', 0),
+                    'bigqueryRows': results['rows_inserted'],
+                },
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+            
+            logger.info(f"✅ Stripe sync complete (Event sync): {results}")
+            
+            return ({
+                'success': True,
+                'mode': 'events',
+                **results,
+                'message': f"Event sync: {results.get('events_processed', 0)} events, {results['rows_inserted']} rows to BigQuery"
+            }, 200, headers)
+        
+        # Snapshot the newest event before listing so that anything changing
+        # during the listing is replayed by the next event-driven run
+        reconcile_cursor = None
+        if not (explicit_start and explicit_end):
+            try:
+                reconcile_cursor = get_latest_event_cursor(client)
+            except Exception as e:
+                logger.warning(f"Could not read latest Stripe event: {e}")
+        
         rows = []
         raw_rows = []  # For storing raw API responses
         now_iso = datetime.utcnow().isoformat()
@@ -133,281 +929,84 @@ def sync_stripe_to_bigquery(request):
         end_timestamp = int(datetime.combine(end_date + timedelta(days=1), datetime.min.time()).timestamp())  # Include end date
         
         # ============================================
-        # 1. FETCH CHARGES DIRECTLY FROM STRIPE API
-        # ============================================
-        logger.info("Fetching charges from Stripe API...")
-        
-        daily_revenue = defaultdict(lambda: {
-            'total_revenue': 0,
-            'payment_count': 0,
-            'refund_amount': 0,
-            'currencies': set(),
-        })
-        
-        try:
-            # Paginate through all charges with date range filter
-            charge_filter = {
-                'limit': 100,
-                'created': {'gte': start_timestamp},
-            }
-            # Add end filter if explicit dates provided
-            if explicit_start and explicit_end:
-                charge_filter['created']['lt'] = end_timestamp
-            
-            charges = client.charges.list(params=charge_filter)
-            
-            for charge in charges.auto_paging_iter():
-                results['charges_processed'] += 1
-                
-                # Get date from charge
-                charge_date = datetime.fromtimestamp(charge.created).date()
-                date_str = charge_date.isoformat()
-                
-                # Skip if outside date range (safety check)
-                if charge_date < start_date or charge_date > end_date:
-                    continue
-                
-                if charge.status == 'succeeded':
-                    amount = charge.amount / 100  # Convert from cents
-                    daily_revenue[date_str]['total_revenue'] += amount
-                    daily_revenue[date_str]['payment_count'] += 1
-                    daily_revenue[date_str]['currencies'].add(charge.currency.upper())
-                
-                if charge.refunded:
-                    refund_amount = charge.amount_refunded / 100
-                    daily_revenue[date_str]['refund_amount'] += refund_amount
-                
-                # Store raw charge data
-                raw_rows.append({
-                    'organization_id': organization_id,
-                    'date': date_str,
-                    'data_type': 'charge',
-                    'api_response': json.dumps({
-                        'id': charge.id,
-                        'amount': charge.amount,
-                        'currency': charge.currency,
-                        'status': charge.status,
-                        'created': charge.created,
-                        'customer': charge.customer,
-                        'refunded': charge.refunded,
-                        'amount_refunded': charge.amount_refunded,
-                        'payment_method': charge.payment_method,
-                        'description': charge.description,
-                    }),
-                    'created_at': now_iso,
-                })
-                    
-        except Exception as e:
-            logger.error(f"Error fetching charges: {e}")
-        
-        # ============================================
-        # 2. FETCH SUBSCRIPTIONS FOR MRR
+        # 1-5. FETCH CHARGES, SUBSCRIPTIONS, CUSTOMERS AND PRODUCTS CONCURRENTLY
         # ============================================
-        logger.info("Fetching subscriptions from Stripe API...")
+        # The listings are independent, so they page in parallel; charges are
+        # additionally split into created-date windows
+        logger.info("Fetching charges, subscriptions, customers and products from Stripe API...")
         
-        total_mrr = 0
-        active_subscriptions = 0
-        churned_subscriptions = 0
-        
-        try:
-            subscriptions = client.subscriptions.list(params={'limit': 100, 'status': 'all'})
-            
-            for sub in subscriptions.auto_paging_iter():
-                results['subscriptions_processed'] += 1
-                
-                if sub.status == 'active':
-                    active_subscriptions += 1
-                    # Calculate MRR from subscription items
-                    try:
-                        items_data = sub.get('items', {}).get('data', []) if isinstance(sub, dict) else getattr(sub.items, 'data', [])
-                        for item in items_data:
-                            price = item.get('price', {}) if isinstance(item, dict) else item.price
-                            unit_amount = (price.get('unit_amount') if isinstance(price, dict) else price.unit_amount) or 0
-                            quantity = (item.get('quantity') if isinstance(item, dict) else item.quantity) or 1
-                            recurring = price.get('recurring', {}) if isinstance(price, dict) else price.recurring
-                            interval = (recurring.get('interval') if isinstance(recurring, dict) else getattr(recurring, 'interval', None)) if recurring else 'month'
-                            
-                            # Convert to monthly
-                            if interval == 'year':
-                                monthly_amount = (unit_amount * quantity) / 12
-                            elif interval == 'week':
-                                monthly_amount = (unit_amount * quantity) * 4
-                            else:
-                                monthly_amount = unit_amount * quantity
-                            
-                            total_mrr += monthly_amount / 100  # Convert from cents
-                    except Exception as item_err:
-                        logger.warning(f"Error processing subscription items: {item_err}")
-                        
-                elif sub.status in ['canceled', 'unpaid']:
-                    churned_subscriptions += 1
-                    
-        except Exception as e:
-            logger.error(f"Error fetching subscriptions: {e}")
-        
-        # ============================================
-        # 3. FETCH CUSTOMERS WITH DETAILS
-        # ============================================
-        logger.info("Fetching customers from Stripe API...")
+        daily_revenue = new_daily_revenue()
+        subscription_summary = {'mrr': 0, 'active_subscriptions': 0, 'churned_subscriptions': 0}
+        subscription_details = []
         
         total_customers = 0
         new_customers_by_day = defaultdict(int)
         customer_details = []  # Store individual customer data
         
-        try:
-            customer_filter = {
-                'limit': 100,
-                'created': {'gte': start_timestamp},
-            }
-            if explicit_start and explicit_end:
-                customer_filter['created']['lt'] = end_timestamp
-            
-            customers = client.customers.list(params=customer_filter)
-            
-            for customer in customers.auto_paging_iter():
-                results['customers_processed'] += 1
-                total_customers += 1
-                
-                customer_date = datetime.fromtimestamp(customer.created).date()
-                if customer_date < start_date or customer_date > end_date:
-                    continue
-                    
-                new_customers_by_day[customer_date.isoformat()] += 1
-                
-                # Store individual customer details
-                customer_details.append({
-                    'id': customer.id,
-                    'email': customer.email or '',
-                    'name': customer.name or '',
-                    'created': customer_date.isoformat(),
-                    'currency': customer.currency or 'usd',
-                    'delinquent': customer.delinquent,
-                })
-                
-                # Store raw customer data
-                raw_rows.append({
-                    'organization_id': organization_id,
-                    'date': customer_date.isoformat(),
-                    'data_type': 'customer',
-                    'api_response': json.dumps({
-                        'id': customer.id,
-                        'email': customer.email,
-                        'name': customer.name,
-                        'created': customer.created,
-                        'currency': customer.currency,
-                        'delinquent': customer.delinquent,
-                        'description': customer.description,
-                        'phone': customer.phone,
-                        'address': dict(customer.address) if customer.address else None,
-                        'metadata': dict(customer.metadata) if customer.metadata else {},
-                    }),
-                    'created_at': now_iso,
-                })
-                
-        except Exception as e:
-            logger.error(f"Error fetching customers: {e}")
-        
-        # ============================================
-        # 4. FETCH PRODUCTS
-        # ============================================
-        logger.info("Fetching products from Stripe API...")
-        
         products_data = []
+        failed_charge_days = set()  # Days of charge windows that failed (their totals may be partial)
         
-        try:
-            products = client.products.list(params={'limit': 100, 'active': True})
-            
-            for product in products.auto_paging_iter():
-                results['products_processed'] += 1
-                
-                products_data.append({
-                    'id': product.id,
-                    'name': product.name,
-                    'description': product.description or '',
-                    'active': product.active,
-                    'created': datetime.fromtimestamp(product.created).date().isoformat(),
-                    'default_price': product.default_price if hasattr(product, 'default_price') else None,
-                    'metadata': dict(product.metadata) if product.metadata else {},
-                })
-                
-        except Exception as e:
-            logger.error(f"Error fetching products: {e}")
-        
-        # ============================================
-        # 5. FETCH INDIVIDUAL SUBSCRIPTIONS WITH DETAILS
-        # ============================================
-        logger.info("Fetching subscription details from Stripe API...")
-        
-        subscription_details = []
+        customer_filter = {
+            'limit': 100,
+            'created': {'gte': start_timestamp},
+        }
+        if explicit_start and explicit_end:
+            customer_filter['created']['lt'] = end_timestamp
         
-        try:
-            subs = client.subscriptions.list(params={'limit': 100, 'status': 'all', 'expand': ['data.items.data.price.product']})
+        with ThreadPoolExecutor(max_workers=STRIPE_MAX_CONCURRENT_LISTINGS) as executor:
+            charge_futures = {
+                executor.submit(fetch_charges, client, created, organization_id, start_date, end_date, daily_revenue, now_iso): created
+                for created in charge_windows(start_date, end_date, open_ended=not (explicit_start and explicit_end))
+            }
+            subscriptions_future = executor.submit(fetch_subscriptions, client)
+            customers_future = executor.submit(list_all, client.customers, customer_filter)
+            products_future = executor.submit(list_all, client.products, {'limit': 100, 'active': True})
             
-            for sub in subs.auto_paging_iter():
-                sub_created = datetime.fromtimestamp(sub.created).date()
-                
-                # Get product info from first subscription item
-                product_id = None
-                product_name = None
-                price_amount = 0
-                price_interval = 'month'
-                
+            # Each window stands alone: a failed one only loses its own days
+            for future, created in charge_futures.items():
                 try:
-                    items = sub.items.data if hasattr(sub.items, 'data') else []
-                    if items:
-                        first_item = items[0]
-                        price = first_item.price
-                        price_amount = (price.unit_amount or 0) / 100
-                        price_interval = price.recurring.interval if price.recurring else 'month'
-                        
-                        if hasattr(price, 'product'):
-                            if isinstance(price.product, str):
-                                product_id = price.product
-                            else:
-                                product_id = price.product.id
-                                product_name = price.product.name
+                    charges_seen, charge_raw_rows = future.result()
+                    results['charges_processed'] += charges_seen
+                    raw_rows.extend(charge_raw_rows)
                 except Exception as e:
-                    logger.warning(f"Error getting subscription product: {e}")
-                
-                subscription_details.append({
-                    'id': sub.id,
-                    'customer_id': sub.customer,
-                    'status': sub.status,
-                    'product_id': product_id,
-                    'product_name': product_name,
-                    'price_amount': price_amount,
-                    'price_interval': price_interval,
-                    'created': sub_created.isoformat(),
-                    'current_period_start': datetime.fromtimestamp(sub.current_period_start).date().isoformat() if sub.current_period_start else None,
-                    'current_period_end': datetime.fromtimestamp(sub.current_period_end).date().isoformat() if sub.current_period_end else None,
-                    'cancel_at_period_end': sub.cancel_at_period_end,
-                })
+                    failed_charge_days |= charge_window_days(created, end_date)
+                    logger.error(f"Error fetching charges for window {created}: {e}")
+            
+            try:
+                subscription_summary, subscription_details = subscriptions_future.result()
+                results['subscriptions_processed'] = len(subscription_details)
                 
                 # Store raw subscription data
-                raw_rows.append({
-                    'organization_id': organization_id,
-                    'date': sub_created.isoformat(),
-                    'data_type': 'subscription',
-                    'api_response': json.dumps({
-                        'id': sub.id,
-                        'customer': sub.customer,
-                        'status': sub.status,
-                        'created': sub.created,
-                        'current_period_start': sub.current_period_start,
-                        'current_period_end': sub.current_period_end,
-                        'cancel_at_period_end': sub.cancel_at_period_end,
-                        'canceled_at': sub.canceled_at,
-                        'ended_at': sub.ended_at,
-                        'product_id': product_id,
-                        'product_name': product_name,
-                        'price_amount': price_amount,
-                        'price_interval': price_interval,
-                    }),
-                    'created_at': now_iso,
-                })
-                
-        except Exception as e:
-            logger.error(f"Error fetching subscription details: {e}")
+                for detail in subscription_details:
+                    raw_rows.append(subscription_raw_row(organization_id, detail, now_iso))
+            except Exception as e:
+                logger.error(f"Error fetching subscriptions: {e}")
+            
+            try:
+                for customer in customers_future.result():
+                    results['customers_processed'] += 1
+                    total_customers += 1
+                    
+                    customer_date = datetime.fromtimestamp(customer.created).date()
+                    if customer_date < start_date or customer_date > end_date:
+                        continue
+                        
+                    new_customers_by_day[customer_date.isoformat()] += 1
+                    
+                    # Store individual customer details
+                    customer_details.append(customer_detail(customer))
+                    
+                    # Store raw customer data
+                    raw_rows.append(customer_raw_row(organization_id, customer, now_iso))
+            except Exception as e:
+                logger.error(f"Error fetching customers: {e}")
+            
+            try:
+                for product in products_future.result():
+                    results['products_processed'] += 1
+                    products_data.append(product_detail(product))
+            except Exception as e:
+                logger.error(f"Error fetching products: {e}")
         
         # ============================================
         # 6. BUILD BIGQUERY ROWS
@@ -416,74 +1015,16 @@ def sync_stripe_to_bigquery(request):
         
         today_str = end_date.isoformat()
         
-        # Daily revenue rows
-        for date_str, metrics in daily_revenue.items():
-            row = {
-                'organization_id': organization_id,
-                'date': date_str,
-                'canonical_entity_id': f"stripe_revenue_{date_str}",
-                'entity_type': 'revenue',
-                
-                'revenue': metrics['total_revenue'],
-                'source_breakdown': json.dumps({
-                    'currencies': list(metrics['currencies']),
-                    'payment_count': metrics['payment_count'],
-                    'refund_amount': metrics['refund_amount'],
-                    'net_revenue': metrics['total_revenue'] - metrics['refund_amount'],
-                }),
-                
-                'created_at': now_iso,
-                'updated_at': now_iso,
-            }
-            rows.append(row)
+        # Daily revenue rows (days of a failed charge window keep their stored totals)
+        rows.extend(row for row in revenue_rows(organization_id, daily_revenue, now_iso)
+                    if row['date'] not in failed_charge_days)
         
         # Subscription aggregate metrics snapshot
-        subscription_agg_row = {
-            'organization_id': organization_id,
-            'date': today_str,
-            'canonical_entity_id': 'stripe_subscription_metrics',
-            'entity_type': 'subscription_summary',
-            
-            'revenue': total_mrr,  # Use revenue field for MRR
-            'source_breakdown': json.dumps({
-                'mrr': total_mrr,
-                'arr': total_mrr * 12,
-                'active_subscriptions': active_subscriptions,
-                'churned_subscriptions': churned_subscriptions,
-                'churn_rate': (churned_subscriptions / (active_subscriptions + churned_subscriptions) * 100) if (active_subscriptions + churned_subscriptions) > 0 else 0,
-            }),
-            
-            'created_at': now_iso,
-            'updated_at': now_iso,
-        }
-        rows.append(subscription_agg_row)
+        rows.append(subscription_summary_row(organization_id, subscription_summary, today_str, now_iso))
         
         # Individual subscription rows
         for sub in subscription_details:
-            sub_row = {
-                'organization_id': organization_id,
-                'date': today_str,
-                'canonical_entity_id': f"stripe_sub_{sub['id']}",
-                'entity_type': 'subscription',
-                
-                'revenue': sub['price_amount'],  # Monthly price
-                'source_breakdown': json.dumps({
-                    'subscription_id': sub['id'],
-                    'customer_id': sub['customer_id'],
-                    'status': sub['status'],
-                    'product_id': sub['product_id'],
-                    'product_name': sub['product_name'],
-                    'price_interval': sub['price_interval'],
-                    'created': sub['created'],
-                    'current_period_start': sub['current_period_start'],
-                    'current_period_end': sub['current_period_end'],
-                    'cancel_at_period_end': sub['cancel_at_period_end'],
-                }),
-                
-                'created_at': now_iso,
-                'updated_at': now_iso,
-            }
-            rows.append(sub_row)
+            rows.append(subscription_row(organization_id, sub, today_str, now_iso))
         
         # Customer aggregate metrics snapshot
         customer_agg_row = {
@@ -505,47 +1046,11 @@ def sync_stripe_to_bigquery(request):
         
         # Individual customer rows
         for cust in customer_details:
-            cust_row = {
-                'organization_id': organization_id,
-                'date': cust['created'],  # Use customer creation date
-                'canonical_entity_id': f"stripe_customer_{cust['id']}",
-                'entity_type': 'customer',
-                
-                'source_breakdown': json.dumps({
-                    'customer_id': cust['id'],
-                    'email': cust['email'],
-                    'name': cust['name'],
-                    'currency': cust['currency'],
-                    'delinquent': cust['delinquent'],
-                }),
-                
-                'created_at': now_iso,
-                'updated_at': now_iso,
-            }
-            rows.append(cust_row)
+            rows.append(customer_row(organization_id, cust, now_iso))
         
         # Product rows
         for prod in products_data:
-            prod_row = {
-                'organization_id': organization_id,
-                'date': today_str,
-                'canonical_entity_id': f"stripe_product_{prod['id']}",
-                'entity_type': 'product',
-                
-                'source_breakdown': json.dumps({
-                    'product_id': prod['id'],
-                    'name': prod['name'],
-                    'description': prod['description'],
-                    'active': prod['active'],
-                    'created': prod['created'],
-                    'default_price': prod['default_price'],
-                    'metadata': prod['metadata'],
-                }),
-                
-                'created_at': now_iso,
-                'updated_at': now_iso,
-            }
-            rows.append(prod_row)
+            rows.append(product_row(organization_id, prod, today_str, now_iso))
         
         # ============================================
         # 5. WRITE DIRECTLY TO BIGQUERY
@@ -555,175 +1060,61 @@ def sync_stripe_to_bigquery(request):
             
             table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
             
-            if sync_mode == 'full':
-                # FULL RESYNC: Use MERGE instead of DELETE+INSERT to prevent race conditions
-                logger.info("Full resync mode - using MERGE to prevent duplicates")
-                
-                temp_table_id = f"temp_stripe_full_sync_{organization_id.replace('-', '_')}_{int(datetime.utcnow().timestamp())}"
-                temp_table_ref = f"{PROJECT_ID}.{DATASET_ID}.{temp_table_id}"
+            try:
+                # MERGE instead of DELETE+INSERT to prevent race conditions and duplicates
+                merge_rows_to_bigquery(bq, rows, organization_id)
+                results['rows_inserted'] = len(rows)
+                logger.info(f"✅ MERGE completed: {len(rows)} rows upserted")
                 
-                try:
-                    # Get target table schema
-                    main_table = bq.get_table(table_ref)
-                    temp_schema = main_table.schema
-                    
-                    # Create temp table
-                    temp_table = bigquery.Table(temp_table_ref, schema=temp_schema)
-                    temp_table = bq.create_table(temp_table, exists_ok=True)
-                    
-                    # Insert rows into temp table
-                    errors = bq.insert_rows_json(temp_table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
-                    if errors:
-                        logger.warning(f"Temp table insert errors: {errors[:3]}")
-                    
-                    # MERGE from temp table
-                    merge_query = f"""
-                    MERGE `{table_ref}` T
-                    USING `{temp_table_ref}` S
-                    ON T.organization_id = S.organization_id 
-                       AND T.canonical_entity_id = S.canonical_entity_id 
-                       AND T.date = S.date
-                    WHEN MATCHED THEN
-                        UPDATE SET 
-                            revenue = S.revenue,
-                            payment_count = S.payment_count,
-                            refund_amount = S.refund_amount,
-                            net_revenue = S.net_revenue,
-                            mrr = S.mrr,
-                            arr = S.arr,
-                            active_subscriptions = S.active_subscriptions,
-                            churned_subscriptions = S.churned_subscriptions,
-                            churn_rate = S.churn_rate,
-                            total_customers = S.total_customers,
-                            new_customers_today = S.new_customers_today,
-                            source_breakdown = S.source_breakdown,
-                            updated_at = S.updated_at
-                    WHEN NOT MATCHED THEN
-                        INSERT ROW
-                    """
-                    
-                    bq.query(merge_query).result()
-                    results['rows_inserted'] = len(rows)
-                    logger.info(f"✅ Full MERGE completed: {len(rows)} rows upserted")
-                    
-                    # Clean up temp table
-                    bq.delete_table(temp_table_ref, not_found_ok=True)
-                    
-                except Exception as full_merge_error:
-                    logger.error(f"Full MERGE failed: {full_merge_error}")
-                    # Clean up temp table on error
-                    try:
-                        bq.delete_table(temp_table_ref, not_found_ok=True)
-                    except:
-                        pass
+            except Exception as merge_error:
+                if sync_mode == 'full':
+                    logger.error(f"Full MERGE failed: {merge_error}")
                     raise
-            else:
-                # UPDATE SYNC: Use MERGE to upsert (update existing, insert new)
-                # Create a temp table with new data, then merge
-                temp_table_id = f"temp_stripe_sync_{organization_id.replace('-', '_')}_{int(datetime.utcnow().timestamp())}"
-                temp_table_ref = f"{PROJECT_ID}.{DATASET_ID}.{temp_table_id}"
                 
+                logger.error(f"MERGE failed, falling back to delete+insert: {merge_error}")
+                # Fallback to delete+insert for the date range; revenue is only
+                # replaced when every charge window was listed
+                replaced_types = "'subscription', 'subscription_summary', 'customer', 'customer_summary', 'product'"
+                if not failed_charge_days:
+                    replaced_types = "'revenue', " + replaced_types
+                delete_query = f"""
+                DELETE FROM `{table_ref}`
+                WHERE organization_id = '{organization_id}'
+                  AND entity_type IN ({replaced_types})
+                  AND date >= '{start_date.isoformat()}'
+                """
                 try:
-                    # Insert into temp table first
-                    temp_table = bq.create_table(f"{temp_table_ref}", exists_ok=False)
-                    
-                    # Use the main table schema
-                    main_table = bq.get_table(table_ref)
-                    temp_schema = main_table.schema
-                    
-                    # Create temp table with same schema
-                    temp_table = bigquery.Table(temp_table_ref, schema=temp_schema)
-                    temp_table = bq.create_table(temp_table, exists_ok=True)
-                    
-                    # Insert rows into temp table
-                    errors = bq.insert_rows_json(temp_table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
-                    if errors:
-                        logger.warning(f"Temp table insert errors: {errors[:3]}")
-                    
-                    # MERGE from temp table
-                    merge_query = f"""
-                    MERGE `{table_ref}` T
-                    USING `{temp_table_ref}` S
-                    ON T.organization_id = S.organization_id 
-                       AND T.canonical_entity_id = S.canonical_entity_id 
-                       AND T.date = S.date
-                    WHEN MATCHED THEN
-                        UPDATE SET 
-                            revenue = S.revenue,
-                            payment_count = S.payment_count,
-                            refund_amount = S.refund_amount,
-                            net_revenue = S.net_revenue,
-                            mrr = S.mrr,
-                            arr = S.arr,
-                            active_subscriptions = S.active_subscriptions,
-                            churned_subscriptions = S.churned_subscriptions,
-                            churn_rate = S.churn_rate,
-                            total_customers = S.total_customers,
-                            new_customers_today = S.new_customers_today,
-                            source_breakdown = S.source_breakdown,
-                            updated_at = S.updated_at
-                    WHEN NOT MATCHED THEN
-                        INSERT ROW
-                    """
-                    
-                    bq.query(merge_query).result()
+                    bq.query(delete_query).result()
+                except:
+                    pass
+                
+                errors = bq.insert_rows_json(table_ref, convert_rows(bq, table_ref, rows), skip_invalid_rows=True, ignore_unknown_values=True)
+                if errors:
+                    logger.error(f"Fallback insert failed for some rows: {errors[:3]}")
+                else:
                     results['rows_inserted'] = len(rows)
-                    logger.info(f"MERGE completed: {len(rows)} rows upserted")
-                    
-                    # Clean up temp table
-                    bq.delete_table(temp_table_ref, not_found_ok=True)
-                    
-                except Exception as merge_error:
-                    logger.error(f"MERGE failed, falling back to delete+insert: {merge_error}")
-                    # Fallback to delete+insert for the date range
-                    delete_query = f"""
-                    DELETE FROM `{table_ref}`
-                    WHERE organization_id = '{organization_id}'
-                      AND entity_type IN ('revenue', 'subscription', 'subscription_summary', 'customer', 'customer_summary', 'product')
-                      AND date >= '{start_date.isoformat()}'
-                    """
-                    try:
-                        bq.query(delete_query).result()
-                    except:
-                        pass
-                    
-                    errors = bq.insert_rows_json(table_ref, rows, skip_invalid_rows=True, ignore_unknown_values=True)
-                    if not errors:
-                        results['rows_inserted'] = len(rows)
+            
+            # Only hand the days to the rollups once they were written in full
+            if results['rows_inserted']:
+                record_dirty_partitions(bq, organization_id, dirty_ranges(rows), 'stripe')
         
         # ============================================
-        # 7. WRITE RAW DATA TO BIGQUERY WITH UPSERT
+        # 7. BULK-LOAD TYPED RAW DATA TO BIGQUERY
         # ============================================
         if raw_rows:
             logger.info(f"Writing {len(raw_rows)} raw records to BigQuery...")
-            raw_table_ref = f"{PROJECT_ID}.{DATASET_ID}.{RAW_TABLE_ID}"
             
-            # ALWAYS delete existing raw data for date range to avoid duplicates
-            delete_raw_query = f"""
-            DELETE FROM `{raw_table_ref}`
-            WHERE organization_id = '{organization_id}'
-              AND date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'
-            """
-            try:
-                bq.query(delete_raw_query).result()
-                logger.info(f"Deleted existing raw data for {start_date} to {end_date}")
-            except Exception as e:
-                logger.warning(f"Raw delete warning: {e}")
-            
-            # Insert raw rows in batches
-            BATCH_SIZE = 500
-            raw_inserted = 0
-            for i in range(0, len(raw_rows), BATCH_SIZE):
-                batch = raw_rows[i:i + BATCH_SIZE]
-                errors = bq.insert_rows_json(raw_table_ref, batch, skip_invalid_rows=True, ignore_unknown_values=True)
-                if not errors:
-                    raw_inserted += len(batch)
-            
-            results['raw_records_inserted'] = raw_inserted
-            logger.info(f"Inserted {raw_inserted} raw records")
+            # Charges and customers were re-listed for the window; subscriptions are listed in full.
+            # Raw charges are only replaced by id when a charge window failed.
+            window = f"date BETWEEN '{start_date.isoformat()}' AND '{end_date.isoformat()}'"
+            replace_scopes = {'customer': window, 'subscription': 'TRUE'}
+            if not failed_charge_days:
+                replace_scopes['charge'] = window
+            results['raw_records_inserted'] = load_raw_rows(bq, raw_rows, organization_id, replace_scopes)
+            logger.info(f"Inserted {results['raw_records_inserted']} raw records")
         
         # Update connection status (minimal Firestore update)
-        connection_ref.update({
+        connection_update = {
             'status': 'connected',
             'lastSyncAt': firestore.SERVER_TIMESTAMP,
             'lastSyncResults': {
@@ -734,7 +1125,12 @@ def sync_stripe_to_bigquery(request):
                 'bigqueryRows': results['rows_inserted'],
             },
             'updatedAt': firestore.SERVER_TIMESTAMP,
-        })
+        }
+        if reconcile_cursor and not failed_charge_days:
+            # A complete listing just ran, so later updates can replay events from here
+            connection_update['eventCursor'] = reconcile_cursor
+            connection_update['lastReconciledAt'] = datetime.utcnow().isoformat()
+        connection_ref.update(connection_update)
         
         mode_label = "Full re-sync" if sync_mode == 'full' else "Incremental sync"
         logger.info(f"✅ Stripe sync complete ({mode_label}): {results}")
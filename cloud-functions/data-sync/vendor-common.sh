@@ -0,0 +1,15 @@
+#!/bin/bash
+
+# Copy the shared opsos_common package into a function directory before it is
+# deployed (each function is deployed on its own with --source=.)
+#
+# Usage: vendor-common.sh <function-dir>
+
+set -e
+
+COMMON_DIR="$(cd "$(dirname "$0")" && pwd)/opsos_common"
+TARGET_DIR="${1:-.}"
+
+rm -rf "$TARGET_DIR/opsos_common"
+mkdir -p "$TARGET_DIR/opsos_common"
+cp "$COMMON_DIR"/*.py "$TARGET_DIR/opsos_common/"
@@ -8,6 +8,7 @@ import functions_framework
 from google.cloud import bigquery
 from datetime import datetime, timedelta
 import logging
+from opsos_common.dirty_partitions import read_dirty_ranges, mark_dirty_consumed, weeks_in_ranges
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,148 +34,171 @@ def get_iso_week_dates(year: int, week: int):
     return target_monday.date(), target_sunday.date()
 
 
-def create_weekly_aggregates(organization_id: str, year_week: str):
+WEEKLY_COLUMNS = [
+    'organization_id', 'year_week', 'week_start_date', 'week_end_date',
+    'canonical_entity_id', 'entity_type',
+    'impressions', 'clicks', 'sessions', 'users', 'pageviews',
+    'avg_session_duration', 'avg_bounce_rate', 'avg_engagement_rate',
+    'conversions', 'conversion_rate', 'revenue', 'cost', 'profit',
+    'avg_ctr', 'avg_cpc', 'avg_cpa', 'avg_roas', 'avg_roi',
+    'avg_position', 'avg_search_volume',
+    'sends', 'opens', 'open_rate', 'click_through_rate',
+    'days_in_week', 'days_with_data', 'data_completeness',
+    'wow_change_pct', 'wow_change_abs', 'is_best_week', 'is_worst_week',
+    'created_at', 'updated_at',
+]
+
+
+def parse_year_week(year_week: str):
+    """Split "2025-W05" into (2025, 5)"""
+    year, week_str = year_week.split('-W')
+    return int(year), int(week_str)
+
+
+def create_weekly_aggregates(organization_id: str, year_weeks: list):
     """
-    Aggregate daily metrics into weekly metrics for a specific ISO week
+    Aggregate daily metrics into weekly metrics for one or more ISO weeks
     year_week format: "2025-W05"
+    
+    Every requested week is computed in one pass over daily_entity_metrics
+    (grouped by week) and swapped in with a single MERGE, so a backfill costs
+    one job no matter how many weeks it covers.
     """
-    logger.info(f"Creating weekly aggregates for {organization_id} - {year_week}")
+    logger.info(f"Creating weekly aggregates for {organization_id} - {', '.join(year_weeks)}")
     
-    # Parse year_week (e.g., "2025-W05")
-    year, week_str = year_week.split('-W')
-    year = int(year)
-    week = int(week_str)
+    week_bounds = [get_iso_week_dates(*parse_year_week(year_week)) for year_week in year_weeks]
+    range_start = min(start for start, _ in week_bounds)
+    range_end = max(end for _, end in week_bounds)
     
-    week_start, week_end = get_iso_week_dates(year, week)
+    column_list = ', '.join(WEEKLY_COLUMNS)
     
     query = f"""
-    -- First, delete existing data for this week to allow re-processing
-    DELETE FROM `{PROJECT_ID}.{DATASET_ID}.weekly_entity_metrics`
-    WHERE organization_id = @org_id
-      AND year_week = @year_week;
-    
-    -- Then insert fresh weekly aggregates
-    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.weekly_entity_metrics`
-    (
-      organization_id, year_week, week_start_date, week_end_date,
-      canonical_entity_id, entity_type,
-      impressions, clicks, sessions, users, pageviews,
-      avg_session_duration, avg_bounce_rate, avg_engagement_rate,
-      conversions, conversion_rate, revenue, cost, profit,
-      avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
-      avg_position, avg_search_volume,
-      sends, opens, open_rate, click_through_rate,
-      days_in_week, days_with_data, data_completeness,
-      wow_change_pct, wow_change_abs, is_best_week, is_worst_week,
-      created_at, updated_at
-    )
-    
-    WITH daily_data AS (
-      SELECT 
-        m.organization_id,
-        m.canonical_entity_id,
-        m.entity_type,
-        m.date,
-        m.impressions, m.clicks, m.sessions, m.users, m.pageviews,
-        m.avg_session_duration, m.bounce_rate, m.engagement_rate,
-        m.conversions, m.conversion_rate, m.revenue, m.cost, m.profit,
-        m.ctr, m.cpc, m.cpa, m.roas, m.roi,
-        m.position, m.search_volume,
-        m.sends, m.opens, m.open_rate, m.click_through_rate
-      FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics` m
-      JOIN `{PROJECT_ID}.{DATASET_ID}.entity_map` e
-        ON m.canonical_entity_id = e.canonical_entity_id
-        AND e.is_active = TRUE
-      WHERE m.organization_id = @org_id
-        AND m.date >= @week_start
-        AND m.date <= @week_end
-    ),
-    
-    weekly_agg AS (
+    -- Replace the requested weeks atomically: rows of those weeks not produced
+    -- by the source are deleted, fresh aggregates are inserted
+    MERGE `{PROJECT_ID}.{DATASET_ID}.weekly_entity_metrics` T
+    USING (
+      WITH daily_data AS (
+        SELECT 
+          m.organization_id,
+          m.canonical_entity_id,
+          m.entity_type,
+          m.date,
+          FORMAT_DATE('%G-W%V', m.date) as year_week,
+          m.impressions, m.clicks, m.sessions, m.users, m.pageviews,
+          m.avg_session_duration, m.bounce_rate, m.engagement_rate,
+          m.conversions, m.conversion_rate, m.revenue, m.cost, m.profit,
+          m.ctr, m.cpc, m.cpa, m.roas, m.roi,
+          m.position, m.search_volume,
+          m.sends, m.opens, m.open_rate, m.click_through_rate
+        FROM `{PROJECT_ID}.{DATASET_ID}.daily_entity_metrics` m
+        WHERE m.organization_id = @org_id
+          AND m.date >= @range_start
+          AND m.date <= @range_end
+          AND FORMAT_DATE('%G-W%V', m.date) IN UNNEST(@year_weeks)
+          -- Semi-join: an entity mapped more than once must not be counted more than once
+          AND m.canonical_entity_id IN (
+            SELECT canonical_entity_id
+            FROM `{PROJECT_ID}.{DATASET_ID}.entity_map`
+            WHERE is_active = TRUE
+          )
+      ),
+      
+      weekly_agg AS (
+        SELECT 
+          organization_id,
+          year_week,
+          DATE_TRUNC(MIN(date), ISOWEEK) as week_start_date,
+          DATE_ADD(DATE_TRUNC(MIN(date), ISOWEEK), INTERVAL 6 DAY) as week_end_date,
+          canonical_entity_id,
+          entity_type,
+          
+          -- Traffic totals
+          SUM(impressions) as impressions,
+          SUM(clicks) as clicks,
+          SUM(sessions) as sessions,
+          SUM(users) as users,
+          SUM(pageviews) as pageviews,
+          
+          -- Engagement averages (weighted by sessions where applicable)
+          CASE 
+            WHEN SUM(sessions) > 0 
+            THEN SUM(avg_session_duration * sessions) / SUM(sessions)
+            ELSE AVG(avg_session_duration)
+          END as avg_session_duration,
+          AVG(bounce_rate) as avg_bounce_rate,
+          AVG(engagement_rate) as avg_engagement_rate,
+          
+          -- Conversion & revenue totals
+          SUM(conversions) as conversions,
+          SAFE_DIVIDE(SUM(conversions), SUM(sessions)) * 100 as conversion_rate,
+          SUM(revenue) as revenue,
+          SUM(cost) as cost,
+          SUM(revenue) - SUM(cost) as profit,
+          
+          -- Performance averages
+          AVG(ctr) as avg_ctr,
+          AVG(cpc) as avg_cpc,
+          AVG(cpa) as avg_cpa,
+          AVG(roas) as avg_roas,
+          AVG(roi) as avg_roi,
+          
+          -- SEO averages
+          AVG(position) as avg_position,
+          CAST(AVG(search_volume) AS INT64) as avg_search_volume,
+          
+          -- Email totals
+          SUM(sends) as sends,
+          SUM(opens) as opens,
+          SAFE_DIVIDE(SUM(opens), SUM(sends)) * 100 as open_rate,
+          SAFE_DIVIDE(SUM(clicks), SUM(sends)) * 100 as click_through_rate,
+          
+          -- Data quality
+          7 as days_in_week,
+          COUNT(DISTINCT date) as days_with_data,
+          CAST(COUNT(DISTINCT date) AS FLOAT64) / 7 as data_completeness,
+          
+          CURRENT_TIMESTAMP() as created_at,
+          CURRENT_TIMESTAMP() as updated_at
+          
+        FROM daily_data
+        GROUP BY organization_id, year_week, canonical_entity_id, entity_type
+      )
+      
       SELECT 
-        organization_id,
-        @year_week as year_week,
-        @week_start as week_start_date,
-        @week_end as week_end_date,
-        canonical_entity_id,
-        entity_type,
-        
-        -- Traffic totals
-        SUM(impressions) as impressions,
-        SUM(clicks) as clicks,
-        SUM(sessions) as sessions,
-        SUM(users) as users,
-        SUM(pageviews) as pageviews,
-        
-        -- Engagement averages (weighted by sessions where applicable)
-        CASE 
-          WHEN SUM(sessions) > 0 
-          THEN SUM(avg_session_duration * sessions) / SUM(sessions)
-          ELSE AVG(avg_session_duration)
-        END as avg_session_duration,
-        AVG(bounce_rate) as avg_bounce_rate,
-        AVG(engagement_rate) as avg_engagement_rate,
-        
-        -- Conversion & revenue totals
-        SUM(conversions) as conversions,
-        SAFE_DIVIDE(SUM(conversions), SUM(sessions)) * 100 as conversion_rate,
-        SUM(revenue) as revenue,
-        SUM(cost) as cost,
-        SUM(revenue) - SUM(cost) as profit,
-        
-        -- Performance averages
-        AVG(ctr) as avg_ctr,
-        AVG(cpc) as avg_cpc,
-        AVG(cpa) as avg_cpa,
-        AVG(roas) as avg_roas,
-        AVG(roi) as avg_roi,
-        
-        -- SEO averages
-        AVG(position) as avg_position,
-        CAST(AVG(search_volume) AS INT64) as avg_search_volume,
-        
-        -- Email totals
-        SUM(sends) as sends,
-        SUM(opens) as opens,
-        SAFE_DIVIDE(SUM(opens), SUM(sends)) * 100 as open_rate,
-        SAFE_DIVIDE(SUM(clicks), SUM(sends)) * 100 as click_through_rate,
-        
-        -- Data quality
-        7 as days_in_week,
-        COUNT(DISTINCT date) as days_with_data,
-        CAST(COUNT(DISTINCT date) AS FLOAT64) / 7 as data_completeness,
-        
-        CURRENT_TIMESTAMP() as created_at,
-        CURRENT_TIMESTAMP() as updated_at
-        
-      FROM daily_data
-      GROUP BY organization_id, canonical_entity_id, entity_type
-    )
-    
-    SELECT 
-      organization_id, year_week, week_start_date, week_end_date,
-      canonical_entity_id, entity_type,
-      impressions, clicks, sessions, users, pageviews,
-      avg_session_duration, avg_bounce_rate, avg_engagement_rate,
-      conversions, conversion_rate, revenue, cost, profit,
-      avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
-      avg_position, avg_search_volume,
-      sends, opens, open_rate, click_through_rate,
-      days_in_week, days_with_data, data_completeness,
-      NULL as wow_change_pct,  -- Will be calculated via update
-      NULL as wow_change_abs,
-      FALSE as is_best_week,
-      FALSE as is_worst_week,
-      created_at, updated_at
-    FROM weekly_agg
+        organization_id, year_week, week_start_date, week_end_date,
+        canonical_entity_id, entity_type,
+        impressions, clicks, sessions, users, pageviews,
+        avg_session_duration, avg_bounce_rate, avg_engagement_rate,
+        conversions, conversion_rate, revenue, cost, profit,
+        avg_ctr, avg_cpc, avg_cpa, avg_roas, avg_roi,
+        avg_position, avg_search_volume,
+        sends, opens, open_rate, click_through_rate,
+        days_in_week, days_with_data, data_completeness,
+        CAST(NULL AS FLOAT64) as wow_change_pct,  -- Will be calculated via update
+        CAST(NULL AS FLOAT64) as wow_change_abs,
+        FALSE as is_best_week,
+        FALSE as is_worst_week,
+        created_at, updated_at
+      FROM weekly_agg
+    ) S
+    ON FALSE
+    WHEN NOT MATCHED BY SOURCE
+      AND T.organization_id = @org_id
+      AND T.week_start_date >= @range_start
+      AND T.week_start_date <= @range_end
+      AND T.year_week IN UNNEST(@year_weeks)
+    THEN DELETE
+    WHEN NOT MATCHED THEN
+      INSERT ({column_list})
+      VALUES ({column_list})
     """
     
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("org_id", "STRING", organization_id),
-            bigquery.ScalarQueryParameter("year_week", "STRING", year_week),
-            bigquery.ScalarQueryParameter("week_start", "DATE", week_start),
-            bigquery.ScalarQueryParameter("week_end", "DATE", week_end)
+            bigquery.ArrayQueryParameter("year_weeks", "STRING", year_weeks),
+            bigquery.ScalarQueryParameter("range_start", "DATE", range_start),
+            bigquery.ScalarQueryParameter("range_end", "DATE", range_end)
         ]
     )
     
@@ -182,11 +206,11 @@ def create_weekly_aggregates(organization_id: str, year_week: str):
         job = bq_client.query(query, job_config=job_config)
         job.result()  # Wait for completion
         
-        logger.info(f"✅ Successfully created weekly aggregates for {year_week}")
+        logger.info(f"✅ Successfully created weekly aggregates for {len(year_weeks)} week(s)")
         return True
         
     except Exception as e:
-        logger.error(f"❌ Error creating weekly aggregates for {year_week}: {e}")
+        logger.error(f"❌ Error creating weekly aggregates for {', '.join(year_weeks)}: {e}")
         raise
 
 
@@ -283,7 +307,9 @@ def run_weekly_rollup(request):
     {
       "organizationId": "SBjucW1ztDyFYWBz7ZLE",
       "yearWeek": "2025-W05",  // optional, defaults to last week
-      "backfill": true         // optional, if true processes last 8 weeks
+      "backfill": true,        // optional, if true processes last 8 weeks + current
+      "yearWeeks": ["2025-W01", "2025-W02"],  // optional, explicit weeks to backfill
+      "mode": "dirty"          // optional, recompute only weeks in the dirty_partitions ledger
     }
     """
     
@@ -295,24 +321,47 @@ def run_weekly_rollup(request):
     backfill = request_json.get('backfill', False)
     
     try:
-        if backfill:
+        if request_json.get('mode') == 'dirty':
+            dirty_ids, ranges = read_dirty_ranges(bq_client, organization_id, 'weekly')
+            weeks_processed = weeks_in_ranges(ranges)
+            
+            if weeks_processed:
+                logger.info(f"🔄 Recomputing {len(weeks_processed)} dirty week(s) for {organization_id}")
+                create_weekly_aggregates(organization_id, weeks_processed)
+                calculate_weekly_trends(organization_id)
+            else:
+                logger.info(f"No dirty weeks for {organization_id}")
+            
+            # Only consume the ledger once the weeks are rewritten
+            mark_dirty_consumed(bq_client, organization_id, 'weekly', dirty_ids)
+            
+            return {
+                'success': True,
+                'organization_id': organization_id,
+                'mode': 'dirty',
+                'weeks_processed': weeks_processed,
+                'total_weeks': len(weeks_processed),
+                'trends_calculated': bool(weeks_processed)
+            }, 200
+        
+        elif backfill:
             # Process last 8 weeks
-            logger.info(f"🔄 Starting backfill for {organization_id} (last 8 weeks)")
+            logger.info(f"🔄 Starting backfill for {organization_id}")
             
             current_date = datetime.now()
-            weeks_processed = []
             
-            for i in range(8, 0, -1):  # Process 8 weeks ago to 1 week ago
-                target_date = current_date - timedelta(weeks=i)
-                year_week = get_iso_week_string(target_date)
-                
-                create_weekly_aggregates(organization_id, year_week)
-                weeks_processed.append(year_week)
+            if request_json.get('yearWeeks'):
+                weeks_processed = list(dict.fromkeys(request_json['yearWeeks']))
+            else:
+                # 8 weeks ago to 1 week ago, plus the current (partial) week
+                weeks_processed = [
+                    get_iso_week_string(current_date - timedelta(weeks=i))
+                    for i in range(8, 0, -1)
+                ]
+                weeks_processed.append(get_iso_week_string(current_date))
             
-            # Also process current week (partial)
-            current_week = get_iso_week_string(current_date)
-            create_weekly_aggregates(organization_id, current_week)
-            weeks_processed.append(current_week)
+            # One set-based MERGE for all weeks
+            create_weekly_aggregates(organization_id, weeks_processed)
             
             logger.info(f"✅ Backfill complete! Processed: {', '.join(weeks_processed)}")
             
@@ -340,7 +389,7 @@ def run_weekly_rollup(request):
             
             logger.info(f"🔄 Processing {year_week} for {organization_id}")
             
-            create_weekly_aggregates(organization_id, year_week)
+            create_weekly_aggregates(organization_id, [year_week])
             
             return {
                 'success': True,
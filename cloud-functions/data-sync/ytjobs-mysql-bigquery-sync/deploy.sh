@@ -13,6 +13,9 @@ else
     SSH_KEY_B64=""
 fi
 
+# Copy in the shared opsos_common package (see data-sync/vendor-common.sh)
+bash ../vendor-common.sh . || exit 1
+
 gcloud functions deploy ytjobs-mysql-bigquery-sync \
   --project=opsos-864a1 \
   --gen2 \
@@ -18,6 +18,8 @@ import os
 import pymysql
 import sshtunnel
 import tempfile
+from opsos_common.dirty_partitions import dirty_ranges, record_dirty_partitions
+from opsos_common.row_converter import compile_row_converter
 
 
 def decimal_default(obj):
@@ -72,6 +74,7 @@ def sanitize_row(row_dict):
             sanitized[key] = value
     return sanitized
 
+
 logger = logging.getLogger(__name__)
 
 PROJECT_ID = "opsos-864a1"
@@ -1271,12 +1274,15 @@ def ytjobs_mysql_bigquery_sync(request):
             temp_table = bigquery.Table(temp_table_ref, schema=temp_schema)
             temp_table = bq.create_table(temp_table, exists_ok=True)
             
+            # Coercions are resolved once per column from the target schema
+            convert_batch = compile_row_converter(temp_schema)
+            
             try:
                 # Insert rows into temp table in batches
                 BATCH_SIZE = 500
                 inserted = 0
                 for i in range(0, len(rows), BATCH_SIZE):
-                    batch = [sanitize_row(row) for row in rows[i:i + BATCH_SIZE]]
+                    batch = convert_batch(rows[i:i + BATCH_SIZE])
                     errors = bq.insert_rows_json(temp_table_ref, batch, skip_invalid_rows=True, ignore_unknown_values=True)
                     if errors:
                         logger.warning(f"Temp table insert errors: {errors[:3]}")
@@ -1310,6 +1316,8 @@ def ytjobs_mysql_bigquery_sync(request):
                 merge_result = bq.query(merge_query).result()
                 logger.info(f"✅ MERGE complete - upserted {inserted} rows (preventing duplicates)")
                 
+                record_dirty_partitions(bq, organization_id, dirty_ranges(rows), 'ytjobs_mysql')
+                
             finally:
                 # Clean up temp table
                 try: